@@ -0,0 +1,3 @@
+# Benchmark suite of the hot paths of mrh. See harness.py for the timing
+# protocol and cases.py for the cases, and run
+#   python -m mrh.benchmarks --help
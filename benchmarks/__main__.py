@@ -0,0 +1,59 @@
+import sys, argparse
+from mrh.benchmarks import harness, cases
+from mrh.benchmarks.systems import SIZES
+
+# Command-line interface of the benchmark suite:
+#
+#   python -m mrh.benchmarks list
+#   python -m mrh.benchmarks run [case patterns] [--size small medium large]
+#       [--repeat 3] [--history benchmark_history.json] [--label LABEL]
+#   python -m mrh.benchmarks compare [--base -2] [--new -1]
+#       [--threshold 0.1] [--history benchmark_history.json]
+#
+# "compare" exits with status 1 if any case got slower by more than the
+# threshold, so it can gate an upgrade in a script.
+
+HISTORY = 'benchmark_history.json'
+
+def main (argv=None):
+    parser = argparse.ArgumentParser (prog='python -m mrh.benchmarks')
+    sub = parser.add_subparsers (dest='command', required=True)
+    sub.add_parser ('list', help='list the cases')
+    p = sub.add_parser ('run', help='run cases and append to the history')
+    p.add_argument ('cases', nargs='*',
+                    help='shell-style patterns of case names (default: all)')
+    p.add_argument ('--size', nargs='+', default=['small',], choices=SIZES)
+    p.add_argument ('--repeat', type=int, default=3)
+    p.add_argument ('--history', default=HISTORY)
+    p.add_argument ('--label', default=None)
+    p.add_argument ('--timeout', type=float, default=None,
+                    help='seconds per case, setup included')
+    p = sub.add_parser ('compare', help='compare two runs of the history')
+    p.add_argument ('--base', default='-2', help='index or label')
+    p.add_argument ('--new', default='-1', help='index or label')
+    p.add_argument ('--threshold', type=float, default=0.1)
+    p.add_argument ('--history', default=HISTORY)
+    p = sub.add_parser ('worker')
+    p.add_argument ('case')
+    p.add_argument ('size')
+    p.add_argument ('--repeat', type=int, default=3)
+    p.add_argument ('--outfile', required=True)
+    args = parser.parse_args (argv)
+
+    if args.command == 'list':
+        for name in harness.CASES: print (name)
+    elif args.command == 'run':
+        names = harness.select (args.cases)
+        if not len (names): parser.error ('no case matches {}'.format (args.cases))
+        harness.run_suite (names, args.size, repeat=args.repeat,
+                           history=args.history, label=args.label,
+                           timeout=args.timeout)
+    elif args.command == 'compare':
+        return int (harness.compare (args.history, base=args.base,
+                                     new=args.new, threshold=args.threshold) > 0)
+    elif args.command == 'worker':
+        harness.worker (args.case, args.size, args.repeat, args.outfile)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit (main ())
@@ -0,0 +1,217 @@
+import numpy as np
+from itertools import permutations
+from mrh.benchmarks import systems
+from mrh.benchmarks.harness import register
+
+# Benchmark cases of the hot paths of MC-PDFT, LASSCF/LASSI, the CSF solver
+# and DMET. See harness.py for the protocol. The FLOP estimates count only
+# the leading-order matrix-multiply work of each kernel, not the evaluation
+# of AOs or of the functional; they are meant for comparing rates
+# (GFLOP/s) between sizes and machines, not as exact operation counts.
+# Modules are imported inside the cases, so that a case whose dependencies
+# are missing or broken records an error without affecting the others.
+
+def _nderiv (deriv):
+    return (1,4,10)[deriv]
+
+def _pdft_setup (size, otxc='tPBE'):
+    '''CASCI-based MC-PDFT: the cost of the PDFT kernels doesn't depend on
+    whether the orbitals are optimized'''
+    from mrh.my_pyscf import mcpdft
+    mol, ncas, nelecas = systems.pdft_system (size)
+    mf = systems.rhf (mol)
+    mc = mcpdft.CASCI (mf, otxc, ncas, nelecas).run ()
+    ot = mc.otfnal
+    casdm1s = np.asarray (mc.fcisolver.make_rdm1s (mc.ci, ncas, nelecas))
+    casdm2 = mc.fcisolver.make_rdm2 (mc.ci, ncas, nelecas)
+    nao, nmo = mc.mo_coeff.shape
+    dims = {'natm': mol.natm, 'nao': nao, 'nmo': nmo, 'ncore': mc.ncore,
+            'ncas': ncas, 'ngrids': int (ot.grids.weights.size),
+            'dens_deriv': ot.dens_deriv, 'Pi_deriv': ot.Pi_deriv}
+    return mc, casdm1s, casdm2, dims
+
+@register ('mcpdft.energy_ot')
+def energy_ot (size):
+    from mrh.my_pyscf.mcpdft import otfnal
+    mc, casdm1s, casdm2, dims = _pdft_setup (size)
+    def fn ():
+        otfnal.energy_ot (mc.otfnal, casdm1s, casdm2, mc.mo_coeff, mc.ncore,
+                          max_memory=mc.max_memory)
+    nao, ncas, ngrids = dims['nao'], dims['ncas'], dims['ngrids']
+    nd = _nderiv (dims['dens_deriv'])
+    # rho of two spins, active orbitals, on-top pair density
+    flops = ngrids * (4*nao*nao + 2*nd*nao*ncas + 2*nd*ncas**4)
+    return fn, dims, flops
+
+@register ('mcpdft.get_ontop_pair_density')
+def get_ontop_pair_density (size, max_mb=500):
+    '''Only get_ontop_pair_density is timed; AOs and densities of at most
+    max_mb MB of grid blocks are evaluated in the setup'''
+    from mrh.my_pyscf.mcpdft import _dms
+    from mrh.my_pyscf.mcpdft.otpd import get_ontop_pair_density
+    mc, casdm1s, casdm2, dims = _pdft_setup (size)
+    ot, mol = mc.otfnal, mc.mol
+    ni, xctype, deriv = ot._numint, ot.xctype, ot.dens_deriv
+    ncore, ncas, nao = mc.ncore, mc.ncas, dims['nao']
+    mo_cas = mc.mo_coeff[:,ncore:ncore+ncas]
+    cascm2 = _dms.dm2_cumulant (casdm2, casdm1s)
+    dm1s = _dms.casdm1s_to_dm1s (mc, casdm1s)
+    make_rho = [ni._gen_rho_evaluator (mol, dm, 1) for dm in dm1s]
+    blocks, nbytes, ngrids = [], 0, 0
+    for ao, mask, weight, coords in ni.block_loop (mol, ot.grids, nao, deriv,
+            mc.max_memory):
+        rho = np.asarray ([m[0] (0, ao, mask, xctype) for m in make_rho])
+        blocks.append ((rho, ao.copy (), mask.copy ()))
+        nbytes += ao.nbytes + rho.nbytes
+        ngrids += weight.size
+        if nbytes > max_mb*1e6: break
+    dims['ngrids'] = ngrids
+    def fn ():
+        for rho, ao, mask in blocks:
+            get_ontop_pair_density (ot, rho, ao, cascm2, mo_cas, deriv, mask)
+    nd = _nderiv (deriv)
+    flops = ngrids * (2*nd*nao*ncas + 2*nd*ncas**4)
+    return fn, dims, flops
+
+@register ('mcpdft.pdft_veff')
+def pdft_veff_kernel (size):
+    from mrh.my_pyscf.mcpdft import pdft_veff, _dms
+    mc, casdm1s, casdm2, dims = _pdft_setup (size)
+    dm1s = _dms.casdm1s_to_dm1s (mc, casdm1s)
+    cascm2 = _dms.dm2_cumulant (casdm2, casdm1s)
+    def fn ():
+        pdft_veff.kernel (mc.otfnal, dm1s, cascm2, mc.mo_coeff, mc.ncore,
+                          mc.ncas, max_memory=mc.max_memory)
+    nao, nmo, ncas, ngrids = dims['nao'], dims['nmo'], dims['ncas'], dims['ngrids']
+    nd = _nderiv (dims['dens_deriv'])
+    # rho, veff1, MO values, ppaa
+    flops = ngrids * (4*nao*nao + 2*nd*nao*nao + 2*nd*nao*nmo
+                      + 2*nmo*nmo*ncas*ncas)
+    return fn, dims, flops
+
+@register ('grad.mcpdft_HellmanFeynman_grad')
+def mcpdft_HellmanFeynman_grad (size):
+    from pyscf import mcscf
+    from mrh.my_pyscf.grad.mcpdft import mcpdft_HellmanFeynman_grad
+    mc, casdm1s, casdm2, dims = _pdft_setup (size)
+    veff1, veff2 = mc.get_pdft_veff (incl_coul=True, paaa_only=True)
+    fcasscf = mcscf.CASSCF (mc._scf, mc.ncas, mc.nelecas)
+    fcasscf.mo_coeff, fcasscf.ci = mc.mo_coeff, mc.ci
+    mf_grad = mc._scf.nuc_grad_method ()
+    def fn ():
+        mcpdft_HellmanFeynman_grad (fcasscf, mc.otfnal, veff1, veff2,
+            mo_coeff=mc.mo_coeff, ci=mc.ci, mf_grad=mf_grad)
+    nao, ncas, ngrids = dims['nao'], dims['ncas'], dims['ngrids']
+    nocc = dims['ncore'] + ncas
+    nd = _nderiv (dims['dens_deriv'])
+    # Three Cartesian components of the 1- and 2-body potential terms
+    flops = 3 * ngrids * 2*nd*nao*(nao + nocc + ncas*ncas)
+    return fn, dims, flops
+
+def _las_setup (nfrag):
+    '''Chain of nfrag H4 fragments, each with a CAS(4,4)'''
+    from mrh.my_pyscf.mcscf.lasscf_sync_o0 import LASSCF
+    mol = systems.h_chain (4*nfrag)
+    mf = systems.rhf (mol)
+    las = LASSCF (mf, [4,]*nfrag, [4,]*nfrag)
+    frags = [list (range (4*i, 4*(i+1))) for i in range (nfrag)]
+    mo = las.localize_init_guess (frags, mf.mo_coeff)
+    dims = {'nfrag': nfrag, 'nao': mol.nao_nr (), 'ncas': las.ncas}
+    return las, mo, dims
+
+@register ('lasscf.lasci_sync')
+def lasci_sync_kernel (size, ncycle=5):
+    '''ncycle macrocycles of lasci_sync.kernel (via LASSCF.kernel); the
+    convergence threshold is set so that all of them run'''
+    las, mo, dims = _las_setup (systems.las_nfrag[size])
+    ci0 = systems.random_las_ci (las)
+    las.max_cycle_macro = ncycle
+    las.conv_tol_grad = 1e-12
+    dims['macrocycles'] = ncycle
+    def fn ():
+        las.kernel (mo.copy (), ci0=[[c.copy () for c in ci_r] for ci_r in ci0])
+    return fn, dims, None
+
+def _lassi_setup (size):
+    '''Reference state and all spin flips between pairs of fragments'''
+    from mrh.my_pyscf.mcscf import lassi
+    nfrag = systems.las_nfrag[size]
+    las, mo, dims = _las_setup (nfrag)
+    spins = [[0,]*nfrag]
+    for i, j in permutations (range (nfrag), 2):
+        spins.append ([0,]*nfrag)
+        spins[-1][i], spins[-1][j] = 2, -2
+    smults = [[abs (s)+1 for s in spins_r] for spins_r in spins]
+    nroots = len (spins)
+    las.state_average_(weights=[1.0/nroots,]*nroots, spins=spins,
+                       smults=smults)
+    las.mo_coeff = mo
+    ci = systems.random_las_ci (las)
+    e0, h1, h2 = lassi.ham_2q (las, mo)
+    idx_root = np.ones (nroots, dtype=bool)
+    dims['nroots'] = nroots
+    return las, ci, h1, h2, idx_root, dims
+
+@register ('lassi.op_o1.ham')
+def lassi_ham (size):
+    from mrh.my_pyscf.mcscf import lassi_op_o1
+    las, ci, h1, h2, idx_root, dims = _lassi_setup (size)
+    def fn ():
+        lassi_op_o1.ham (las, h1, h2, ci, idx_root)
+    return fn, dims, None
+
+@register ('lassi.op_o1.make_stdm12s')
+def lassi_make_stdm12s (size):
+    from mrh.my_pyscf.mcscf import lassi_op_o1
+    las, ci, h1, h2, idx_root, dims = _lassi_setup (size)
+    def fn ():
+        lassi_op_o1.make_stdm12s (las, ci, idx_root)
+    return fn, dims, None
+
+def _csf_setup (size):
+    from mrh.my_pyscf.fci import csf_solver
+    norb, nelec = systems.csf_space[size]
+    h1, h2 = systems.random_eris (norb)
+    fci = csf_solver (None, smult=1)
+    hdiag_det = fci.make_hdiag (h1, h2, norb, nelec)
+    hdiag_csf = fci.make_hdiag_csf (h1, h2, norb, nelec, hdiag_det=hdiag_det)
+    dims = {'norb': norb, 'nelec': nelec, 'ndet': int (hdiag_det.size),
+            'ncsf': int (hdiag_csf.size)}
+    return fci, h1, h2, norb, nelec, hdiag_det, hdiag_csf, dims
+
+@register ('csf.make_hdiag_csf')
+def make_hdiag_csf (size):
+    fci, h1, h2, norb, nelec, hdiag_det, hdiag_csf, dims = _csf_setup (size)
+    def fn ():
+        fci.make_hdiag_csf (h1, h2, norb, nelec, hdiag_det=hdiag_det)
+    return fn, dims, None
+
+@register ('csf.pspace')
+def pspace (size):
+    fci, h1, h2, norb, nelec, hdiag_det, hdiag_csf, dims = _csf_setup (size)
+    dims['npsp'] = fci.pspace_size
+    def fn ():
+        fci.pspace (h1, h2, norb, nelec, hdiag_det=hdiag_det,
+                    hdiag_csf=hdiag_csf, npsp=fci.pspace_size)
+    return fn, dims, None
+
+@register ('dmet.doselfconsistent')
+def dmet_doselfconsistent (size):
+    '''Chain of H2 fragments with FCI impurity solvers. The DMET object
+    keeps its correlation potential, so the localized integrals and the
+    fragments are rebuilt, and timed, in every call.'''
+    from mrh.my_dmet import localintegrals, dmet
+    from mrh.my_dmet.fragments import make_fragment_atom_list
+    nfrag = systems.dmet_nfrag[size]
+    mol = systems.h_chain (2*nfrag)
+    mf = systems.rhf (mol)
+    def fn ():
+        ints = localintegrals.localintegrals (mf, range (mol.nao_nr ()),
+                                              'meta_lowdin')
+        frags = [make_fragment_atom_list (ints, [2*i, 2*i+1], 'FCI',
+                                          name='H2_{}'.format (i))
+                 for i in range (nfrag)]
+        dmet (ints, frags, calcname='bench_dmet',
+              num_mf_stab_checks=0).doselfconsistent ()
+    dims = {'nfrag': nfrag, 'nao': mol.nao_nr ()}
+    return fn, dims, None
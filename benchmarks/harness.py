@@ -0,0 +1,260 @@
+import os, sys, gc, json, time, platform, resource, subprocess, tempfile
+import datetime, contextlib, traceback, fnmatch
+import numpy as np
+
+# Timing harness of the benchmark suite
+#
+# A case is a function which takes a size ('small', 'medium', 'large') and
+# does all the setup (SCF, integrals, grids, ...) needed to return
+#
+#   fn : callable with no arguments; the part that is timed
+#   dims : dict of problem dimensions to record (nao, ngrids, ...)
+#   flops : float or None; leading-order estimate of the floating-point
+#       operations in one call of fn, so that runs on different machines
+#       or of different sizes can be compared as GFLOP/s
+#
+# Every (case, size) runs in its own Python process, so that the peak
+# resident set size belongs to that case alone and no cache is shared
+# between cases. The process works in a scratch directory, which is removed
+# afterwards, and its standard output is discarded. The results of one
+# invocation of the suite form a "run", which is appended to a JSON history
+# file together with the versions, git commit and host that produced it.
+
+CASES = {}
+
+def register (name):
+    '''Decorator adding a case function to CASES under name'''
+    def wrapper (fn):
+        CASES[name] = fn
+        return fn
+    return wrapper
+
+def select (patterns=None):
+    '''Names of the cases matching any of the shell-style patterns'''
+    if not patterns: return list (CASES.keys ())
+    return [name for name in CASES
+            if any (fnmatch.fnmatch (name, p) for p in patterns)]
+
+def _maxrss_mb ():
+    maxrss = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': return maxrss / 1e6 # bytes
+    return maxrss / 1e3 # kilobytes
+
+def run_case (name, size, repeat=3):
+    '''Set up and time one case in the current process
+
+    Args:
+        name : str
+            Key of CASES
+        size : str
+
+    Kwargs:
+        repeat : integer
+            Number of timed calls
+
+    Returns:
+        result : dict
+            wall and cpu are the minimum wall and CPU times (s) over the
+            calls, wall_all and cpu_all all of them. cpu counts all threads,
+            so cpu/wall is the effective parallelism. maxrss_setup_mb and
+            maxrss_mb are the peak RSS (MB) after setup and after the
+            timed calls. gflops = flops/wall/1e9. If anything raises,
+            only 'error' is set besides name and size.
+    '''
+    result = {'case': name, 'size': size}
+    try:
+        t0 = time.perf_counter ()
+        fn, dims, flops = CASES[name] (size)
+        result['setup_wall'] = time.perf_counter () - t0
+        result['maxrss_setup_mb'] = _maxrss_mb ()
+        wall, cpu = [], []
+        for i in range (repeat):
+            gc.collect ()
+            w0, c0 = time.perf_counter (), time.process_time ()
+            fn ()
+            wall.append (time.perf_counter () - w0)
+            cpu.append (time.process_time () - c0)
+    except Exception as e:
+        result['error'] = '{}: {}'.format (type (e).__name__, e)
+        result['traceback'] = traceback.format_exc ()
+        return result
+    result.update ({'wall': min (wall), 'cpu': min (cpu),
+                    'wall_all': wall, 'cpu_all': cpu,
+                    'maxrss_mb': _maxrss_mb (),
+                    'dims': dims, 'flops': flops,
+                    'gflops': None if flops is None else flops/min (wall)/1e9})
+    return result
+
+def _jsonable (x):
+    # numpy scalars and arrays in dims
+    if isinstance (x, np.generic): return x.item ()
+    if isinstance (x, np.ndarray): return x.tolist ()
+    raise TypeError ('{} is not JSON serializable'.format (type (x)))
+
+def worker (name, size, repeat, outfile):
+    '''Entry point of the process of one case: run it in a scratch
+    directory with standard output discarded and write the result to
+    outfile as JSON'''
+    outfile = os.path.abspath (outfile)
+    with tempfile.TemporaryDirectory () as scratch:
+        cwd = os.getcwd ()
+        os.chdir (scratch)
+        try:
+            with open (os.devnull, 'w') as devnull:
+                with contextlib.redirect_stdout (devnull):
+                    result = run_case (name, size, repeat=repeat)
+        finally:
+            os.chdir (cwd)
+    with open (outfile, 'w') as f:
+        json.dump (result, f, default=_jsonable)
+
+def run_isolated (name, size, repeat=3, timeout=None):
+    '''run_case in a new Python process'''
+    with tempfile.TemporaryDirectory () as tmp:
+        outfile = os.path.join (tmp, 'result.json')
+        cmd = [sys.executable, '-m', __package__, 'worker', name, size,
+               '--repeat', str (repeat), '--outfile', outfile]
+        try:
+            p = subprocess.run (cmd, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {'case': name, 'size': size,
+                    'error': 'timed out after {} s'.format (timeout)}
+        if not os.path.exists (outfile):
+            err = p.stderr.decode (errors='replace').strip ().splitlines ()
+            return {'case': name, 'size': size,
+                    'error': 'worker exited with status {}: {}'.format (
+                        p.returncode, err[-1] if len (err) else '')}
+        try:
+            with open (outfile, 'r') as f:
+                return json.load (f)
+        except ValueError as e:
+            return {'case': name, 'size': size,
+                    'error': 'unreadable result: {}'.format (e)}
+
+def _git_describe ():
+    repo = os.path.dirname (os.path.dirname (os.path.abspath (__file__)))
+    try:
+        commit = subprocess.run (['git', '-C', repo, 'rev-parse', 'HEAD'],
+            capture_output=True, text=True, check=True).stdout.strip ()
+        dirty = subprocess.run (['git', '-C', repo, 'status', '--porcelain',
+            '--untracked-files=no'], capture_output=True, text=True,
+            check=True).stdout.strip ()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+def environment ():
+    '''Versions, commit and host of the current run'''
+    import scipy, pyscf
+    from pyscf import lib
+    return {'date': datetime.datetime.now ().isoformat (timespec='seconds'),
+            'git': _git_describe (),
+            'host': platform.node (),
+            'platform': platform.platform (),
+            'python': platform.python_version (),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'pyscf': pyscf.__version__,
+            'num_threads': lib.num_threads ()}
+
+def load_history (fname):
+    if not os.path.exists (fname): return []
+    with open (fname, 'r') as f:
+        return json.load (f)
+
+def save_history (fname, history):
+    # Write to a temporary file first so that an interrupted run can't
+    # corrupt the history
+    tmp = fname + '.tmp'
+    with open (tmp, 'w') as f:
+        json.dump (history, f, indent=1)
+    os.replace (tmp, fname)
+
+def run_suite (names, sizes, repeat=3, history=None, label=None,
+               timeout=None, log=sys.stdout):
+    '''Run the cases names at sizes, each in its own process, and append
+    the run to the history file
+
+    Returns:
+        run : dict
+            environment (), plus 'label' and 'results', the list of the
+            return values of run_case
+    '''
+    run = environment ()
+    run['label'] = label
+    run['results'] = []
+    for name in names:
+        for size in sizes:
+            result = run_isolated (name, size, repeat=repeat, timeout=timeout)
+            run['results'].append (result)
+            log.write (format_result (result) + '\n')
+            log.flush ()
+    if history is not None:
+        runs = load_history (history)
+        run['id'] = len (runs)
+        runs.append (run)
+        save_history (history, runs)
+    return run
+
+def format_result (result):
+    line = '{:<32s} {:<7s}'.format (result['case'], result['size'])
+    if 'error' in result:
+        return line + ' ERROR ' + result['error']
+    line += ' wall {:9.4f} s  cpu {:9.4f} s  maxrss {:8.1f} MB'.format (
+        result['wall'], result['cpu'], result['maxrss_mb'])
+    if result.get ('gflops', None) is not None:
+        line += '  {:7.2f} GFLOP/s'.format (result['gflops'])
+    return line
+
+def _get_run (runs, key):
+    if isinstance (key, int) or key.lstrip ('-').isdigit ():
+        return runs[int (key)]
+    for run in runs[::-1]:
+        if run.get ('label', None) == key: return run
+    raise KeyError ('no run labelled {}'.format (key))
+
+def compare (history, base='-2', new='-1', threshold=0.1, log=sys.stdout):
+    '''Compare the timings of two runs of the history file
+
+    Kwargs:
+        base, new : str or int
+            Index in the history (negative counts from the end) or label
+            of the runs. Default: the last two.
+        threshold : float
+            Relative change of the wall time beyond which a case is
+            flagged as slower or faster
+
+    Returns:
+        nslower : integer
+            Number of cases which got slower beyond the threshold
+    '''
+    runs = load_history (history)
+    run0, run1 = _get_run (runs, base), _get_run (runs, new)
+    tab0 = {(r['case'], r['size']): r for r in run0['results']}
+    log.write ('base: run {} ({}, {}, {})\n'.format (run0.get ('id'),
+        run0.get ('label'), run0['date'], run0['git']))
+    log.write ('new:  run {} ({}, {}, {})\n'.format (run1.get ('id'),
+        run1.get ('label'), run1['date'], run1['git']))
+    log.write ('{:<32s} {:<7s} {:>10s} {:>10s} {:>7s} {:>7s}\n'.format (
+        'case', 'size', 'base (s)', 'new (s)', 'wall', 'maxrss'))
+    nslower = 0
+    for r1 in run1['results']:
+        key = (r1['case'], r1['size'])
+        line = '{:<32s} {:<7s}'.format (*key)
+        r0 = tab0.get (key, None)
+        if r0 is None or 'error' in r0 or 'error' in r1:
+            note = 'missing in base' if r0 is None else 'error'
+            log.write (line + ' ' + note + '\n')
+            continue
+        ratio = r1['wall'] / r0['wall']
+        ratio_rss = r1['maxrss_mb'] / r0['maxrss_mb']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'SLOWER'
+            nslower += 1
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        log.write (line + ' {:10.4f} {:10.4f} {:6.2f}x {:6.2f}x {}\n'.format (
+            r0['wall'], r1['wall'], ratio, ratio_rss, flag))
+    return nslower
@@ -0,0 +1,87 @@
+import numpy as np
+from pyscf import gto, scf
+from pyscf.fci import cistring
+
+# Molecules of increasing size for the benchmark cases. Real molecules are
+# built from idealized geometries so that no external files are needed;
+# synthetic systems are hydrogen chains with alternating bond lengths, whose
+# size can be scaled freely. All molecules are built with verbose=0 and
+# output='/dev/null'.
+
+SIZES = ('small', 'medium', 'large')
+
+def _mol (atom, basis, **kwargs):
+    return gto.M (atom=atom, basis=basis, verbose=0, output='/dev/null',
+                  **kwargs)
+
+def water (basis='6-31g'):
+    return _mol ('O 0 0 0; H 0 0.757 0.587; H 0 -0.757 0.587', basis)
+
+def formaldehyde (basis='6-31g'):
+    return _mol ('C 0 0 0; O 0 0 1.208; H 0 0.943 -0.587; H 0 -0.943 -0.587',
+                 basis)
+
+def benzene (basis='6-31g', r_cc=1.39, r_ch=1.09):
+    '''Regular hexagon with C-C bond length r_cc and C-H bond length r_ch
+    (Angstrom)'''
+    atom = []
+    for i in range (6):
+        phi = i * np.pi / 3
+        c, s = np.cos (phi), np.sin (phi)
+        atom.append ('C {:.6f} {:.6f} 0'.format (r_cc*c, r_cc*s))
+        atom.append ('H {:.6f} {:.6f} 0'.format ((r_cc+r_ch)*c, (r_cc+r_ch)*s))
+    return _mol ('; '.join (atom), basis)
+
+def h_chain (natm, basis='6-31g', r_in=0.75, r_out=1.25):
+    '''Linear chain of natm hydrogen atoms, with bond lengths (Angstrom)
+    alternating between r_in and r_out, i.e., a chain of stretched H2
+    molecules'''
+    z = np.cumsum ([0,] + [(r_in, r_out)[i%2] for i in range (natm-1)])
+    atom = '; '.join ('H 0 0 {:.6f}'.format (zi) for zi in z)
+    return _mol (atom, basis, spin=natm%2)
+
+# MC-PDFT: (molecule, ncas, nelecas)
+def pdft_system (size):
+    if size == 'small': return water (), 4, 4
+    elif size == 'medium': return formaldehyde ('cc-pvdz'), 6, 6
+    elif size == 'large': return benzene ('cc-pvdz'), 6, 6
+    raise RuntimeError ('unknown size {}'.format (size))
+
+# LASSCF, LASSI and DMET: number of H4 (LAS) or H2 (DMET) fragments
+las_nfrag = {'small': 2, 'medium': 4, 'large': 6}
+dmet_nfrag = {'small': 4, 'medium': 6, 'large': 8}
+
+# CSF solver: (norb, nelec) of the random Hamiltonian
+csf_space = {'small': (8, 8), 'medium': (10, 10), 'large': (12, 12)}
+
+def rhf (mol):
+    return scf.RHF (mol).run ()
+
+def random_las_ci (las, seed=0):
+    '''Normalized random CI vectors of the right shape for all fragments
+    and states of las. Good enough for timing: neither the cost of the
+    LASSI operators nor that of a fixed number of LASSCF macrocycles depends
+    much on the CI vectors, and this avoids the initial-guess machinery.'''
+    rng = np.random.default_rng (seed)
+    ci = []
+    for norb, nelec, fcibox in zip (las.ncas_sub, las.nelecas_sub,
+                                    las.fciboxes):
+        ci_r = []
+        for solver in fcibox.fcisolvers:
+            neleca, nelecb = fcibox._get_nelec (solver, nelec)
+            c = rng.random ((cistring.num_strings (norb, neleca),
+                             cistring.num_strings (norb, nelecb)))
+            ci_r.append (c / np.linalg.norm (c))
+        ci.append (ci_r)
+    return ci
+
+def random_eris (norb, seed=0):
+    '''Random 1- and 2-electron integrals with the permutation symmetry of
+    real molecular integrals'''
+    rng = np.random.default_rng (seed)
+    h1 = rng.random ((norb,norb)) - 0.5
+    h1 = h1 + h1.T
+    npair = norb*(norb+1)//2
+    h2 = rng.random ((npair,npair)) - 0.5
+    h2 = (h2 + h2.T) / 10
+    return h1, h2
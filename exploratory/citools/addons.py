@@ -81,9 +81,9 @@ def get_dense_heff (psi, x, h, ifrag, nelec=None):
      nelec=nelec):
         psi.log.debug ("dense heff fragment %d: %d,%d / %d,%d", ifrag, 
             ideta, idetb, ndet, ndet)
-        uhuc = uop (c)
+        uhuc = psi.apply_uop (c)
         uhuc = psi.contract_h2 (h, uhuc)
-        uhuc = uop (uhuc, transpose=True)
+        uhuc = psi.apply_uop (uhuc, transpose=True)
         heff[ideta,idetb,:,:] = psi.project_frag (ifrag, uhuc,
             ci0_f=ci_f)
     heff = LASUCCEffectiveHamiltonian (heff)
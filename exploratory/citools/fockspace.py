@@ -37,6 +37,33 @@ def fock2hilbert (ci, norb, nelec):
     ci1[:,:,:] = ci[:,strsa[:,None],strsb]
     return ci1
 
+def sector_strs (norb, nelec):
+    ''' Fock-space addresses of the determinants of one (neleca, nelecb)
+    sector, in the order of the corresponding Hilbert-space CI vector; i.e.,
+
+    hilbert2fock (ci, norb, nelec).ravel ()[sector_strs (norb, nelec)]
+        == ci.ravel ()
+
+    Since the strings of pyscf.fci.cistring are in ascending order, the
+    returned array is sorted and can be searched with np.searchsorted.
+
+    Args:
+        norb : integer
+            Number of spatial orbitals
+        nelec : integer or tuple of length 2
+            Number of electrons
+
+    Returns:
+        strs : ndarray of shape (ndeta*ndetb) and dtype np.uint64
+            Fock-space determinant strings (stra << norb) | strb
+    '''
+    assert (norb <= MAX_NORB)
+    nelec = _unpack_nelec (nelec)
+    strsa = cistring.make_strings (range (norb), nelec[0]).astype (np.uint64)
+    strsb = cistring.make_strings (range (norb), nelec[1]).astype (np.uint64)
+    strs = (strsa[:,None] << np.uint64 (norb)) | strsb[None,:]
+    return strs.ravel ()
+
 def fermion_spin_shuffle (norb, norb_f):
     ''' Compute the sign factors corresponding to the convention
     difference between
@@ -17,12 +17,15 @@ from pyscf.fci import direct_spin1, cistring, spin_op
 from pyscf.fci import addons as fci_addons
 from itertools import product
 from mrh.exploratory.citools import fockspace, addons
+from mrh.exploratory.citools.lbfgs import lbfgs
 from mrh.exploratory.unitary_cc.uccsd_sym1 import get_uccs_op
 from mrh.my_pyscf.mcscf.lasci_sync import all_nonredundant_idx
 from mrh.my_pyscf.fci import csf_solver
 from itertools import product
 
 verbose_lbjfgs = [-1,-1,-1,0,50,99,100,101,101,101]
+LBFGS_M = 20
+PRECOND_LEVEL_SHIFT = 0.1
 
 def _n_m_s (dm1s, dm2s, _print_fn=print):
     neleca = np.trace (dm1s[0])
@@ -49,21 +52,33 @@ def kernel (fci, h1, h2, norb, nelec, norb_f=None, ci0_f=None,
     psi = getattr (fci, 'psi', fci.build_psi (ci0_f, norb, norb_f, nelec,
         log=log, frozen=frozen))
     assert (psi.check_ci0_constr)
-    psi_options = {'gtol':     gtol,
-                   'maxiter':  max_cycle,
-                   'disp':     verbose>lib.logger.DEBUG}
     log.info ('LASCI object has %d degrees of freedom', psi.nvar)
     h = [ecore, h1, h2]
     psi_callback = psi.get_solver_callback (h)
-    res = optimize.minimize (psi.e_de, psi.x, args=(h,), method='BFGS',
-        jac=True, callback=psi_callback, options=psi_options)
-
-    fci.converged = res.success
-    e_tot = psi.energy_tot (res.x, h)
-    ci1 = psi.get_fcivec (res.x)
+    method = getattr (fci, 'opt_method', 'LBFGS').upper ()
+    if method == 'BFGS':
+        psi_options = {'gtol':     gtol,
+                       'maxiter':  max_cycle,
+                       'disp':     verbose>lib.logger.DEBUG}
+        res = optimize.minimize (psi.e_de, psi.x, args=(h,), method='BFGS',
+            jac=True, callback=psi_callback, options=psi_options)
+        conv, x = res.success, res.x
+    else:
+        precond = psi.get_precond (h, level_shift=getattr (fci,
+            'precond_level_shift', PRECOND_LEVEL_SHIFT))
+        conv, x, _, it = lbfgs (lambda x: psi.e_de (x, h), psi.x,
+            precond=precond, gtol=gtol, max_cycle=max_cycle,
+            m=getattr (fci, 'lbfgs_m', LBFGS_M), callback=psi_callback,
+            log=log)
+        log.info ('L-BFGS %s after %d iterations',
+            ('not converged', 'converged')[int (conv)], it)
+
+    fci.converged = conv
+    e_tot = psi.energy_tot (x, h)
+    ci1 = psi.get_fcivec (x)
     if verbose>=lib.logger.DEBUG:
         psi.uop.print_tab (_print_fn=log.debug)
-        psi.print_x (res.x, h, _print_fn=log.debug)
+        psi.print_x (x, h, _print_fn=log.debug)
     if verbose>=lib.logger.INFO:
         dm1s, dm2s = fci.make_rdm12s (ci1, norb, nelec)
         dm1s = np.stack (dm1s, axis=0)
@@ -74,8 +89,8 @@ def kernel (fci, h1, h2, norb, nelec, norb_f=None, ci0_f=None,
             _n_m_s (dm1s[:,i:j,i:j], dm2s[:,i:j,i:j,i:j,i:j], _print_fn=log.info)
         log.info ('Whole system quantum numbers')
         _n_m_s (dm1s, dm2s, _print_fn=log.info)
-    psi.x = res.x
-    psi.converged = res.success
+    psi.x = x
+    psi.converged = conv
     psi.finalize_()
     fci.psi = psi
     return e_tot, ci1
@@ -85,6 +100,7 @@ def make_rdm1 (fci, fcivec, norb, nelec, **kwargs):
     dm1 = np.zeros ((norb, norb))
     for nelec in product (range (norb+1), repeat=2):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
+        if not np.any (ci): continue # empty sector
         d = direct_spin1.make_rdm1 (ci, norb, nelec, **kwargs)
         dm1 += d
     return dm1
@@ -94,6 +110,7 @@ def make_rdm1s (fci, fcivec, norb, nelec, **kwargs):
     dm1b = np.zeros ((norb,norb))
     for nelec in product (range (norb+1), repeat=2):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
+        if not np.any (ci): continue # empty sector
         da, db = direct_spin1.make_rdm1s (ci, norb, nelec, **kwargs)
         dm1a += da
         dm1b += db
@@ -104,6 +121,7 @@ def make_rdm12 (fci, fcivec, norb, nelec, **kwargs):
     dm2 = np.zeros ((norb,norb,norb,norb))
     for nelec in product (range (norb+1), repeat=2):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
+        if not np.any (ci): continue # empty sector
         d1, d2 = direct_spin1.make_rdm12 (ci, norb, nelec, **kwargs)
         dm1 += d1
         dm2 += d2
@@ -114,6 +132,7 @@ def make_rdm12s (fci, fcivec, norb, nelec, **kwargs):
     dm2 = np.zeros ((3,norb,norb,norb,norb))
     for nelec in product (range (norb+1), repeat=2):
         ci = fockspace.fock2hilbert (fcivec, norb, nelec)
+        if not np.any (ci): continue # empty sector
         d1, d2 = direct_spin1.make_rdm12s (ci, norb, nelec, **kwargs)
         dm1 += np.stack (d1, axis=0)
         dm2 += np.stack (d2, axis=0)
@@ -207,6 +226,10 @@ class LASUCCTrialState (object):
         self.log = log if log is not None else lib.logger.new_logger (fcisolver, fcisolver.verbose)
         self.it_cnt = 0
         self.uop = fcisolver.get_uop (norb, norb_f)
+        self.sector = getattr (fcisolver, 'sector', False)
+        if self.sector:
+            self._sector_strs = {nelec: fockspace.sector_strs (norb, nelec)
+                for nelec in product (range (norb+1), repeat=2)}
         self.var_mask = np.ones (self.nvar_tot, dtype=np.bool_)
         if frozen is not None:
             if frozen.upper () == 'CI':
@@ -311,7 +334,7 @@ class LASUCCTrialState (object):
         # number symmetry
         jacconstr = self.get_jac_constr (uc)
         t1 = log.timer ('las_obj constr jac', *t0)
-        jact1 = self.get_jac_t1 (x, h, c=c, huc=huc, uhuc=uhuc)
+        jact1 = self.get_jac_t1 (x, h, c=c, uc=uc, huc=huc, uhuc=uhuc)
         t1 = log.timer ('las_obj ucc jac', *t1)
         jacci_f = self.get_jac_ci (x, h, uhuc=uhuc, uci_f=c_f)
         t1 = log.timer ('las_obj ci jac', *t1)
@@ -328,18 +351,55 @@ class LASUCCTrialState (object):
         h = self.constr_h (xconstr, h)
         c_f = self.rotate_ci0 (xci)
         c = self.dp_ci (c_f)
-        uc = self.uop (c)
+        uc = self.apply_uop (c)
         huc = self.contract_h2 (h, uc)
-        uhuc = self.uop (huc, transpose=True)
+        uhuc = self.apply_uop (huc, transpose=True)
         return c, uc, huc, uhuc, c_f
+
+    def gen_sectors (self, c):
+        ''' Iterate over the (neleca, nelecb) sectors in which the Fock-space
+            CI vector c has nonzero elements, yielding nelec and the
+            Fock-space addresses of the sector (see fockspace.sector_strs) '''
+        c = c.reshape (-1)
+        for nelec, strs in self._sector_strs.items ():
+            if np.any (c[strs]): yield nelec, strs
+
+    def apply_uop (self, c, transpose=False):
+        ''' Apply the UCC operator (or its transpose) to the Fock-space CI
+            vector c. If self.sector, it is applied to the sector-restricted
+            CI vector of each (neleca, nelecb) sector of c in turn, since the
+            generators conserve neleca and nelecb. '''
+        if not self.sector: return self.uop (c, transpose=transpose)
+        uc = np.zeros_like (c)
+        uc_flat, c = uc.reshape (-1), c.reshape (-1)
+        for nelec, strs in self.gen_sectors (c):
+            self.uop.set_sector_(nelec)
+            uc_flat[strs] = self.uop (c[strs], transpose=transpose)
+        self.uop.set_sector_(None)
+        return uc
+
+    def contract_uop_deriv1 (self, c, bra, uc):
+        ''' <bra|dU/dun|c> for all generator amplitudes un, sector by sector
+            if self.sector; see FSUCCOperator.contract_deriv1 '''
+        if not self.sector:
+            return self.uop.contract_deriv1 (c, bra, upsi=uc)[0]
+        c, bra, uc = c.reshape (-1), bra.reshape (-1), uc.reshape (-1)
+        g = np.zeros (self.uop.ngen, dtype=np.float64)
+        for nelec, strs in self.gen_sectors (c):
+            self.uop.set_sector_(nelec)
+            g += self.uop.contract_deriv1 (c[strs], bra[strs],
+                upsi=uc[strs])[0]
+        self.uop.set_sector_(None)
+        return g
         
     def contract_h2 (self, h, ci, norb=None):
         if norb is None: norb = self.norb
         hci = h[0] * ci
         for neleca, nelecb in product (range (norb+1), repeat=2):
             nelec = (neleca, nelecb)
-            h2eff = self.fcisolver.absorb_h1e (h[1], h[2], norb, nelec, 0.5)
             ci_h = np.squeeze (fockspace.fock2hilbert (ci, norb, nelec))
+            if not np.any (ci_h): continue # empty sector
+            h2eff = self.fcisolver.absorb_h1e (h[1], h[2], norb, nelec, 0.5)
             hc = direct_spin1.contract_2e (h2eff, ci_h, norb, nelec)
             hci += np.squeeze (fockspace.hilbert2fock (hc, norb, nelec))
         return hci
@@ -389,10 +449,8 @@ class LASUCCTrialState (object):
             # the orbitals we are integrating over in this particular cycle of the for loop,
             # and the fast-moving orbital indices that we have to keep uncontracted
             # because they correspond to the outer for loop.
-            # We want to move the field operators corresponding to the generation of the
-            # norb1 set to the front of the operator products in order to integrate
-            # with the correct sign.
-            vec = self.fermion_frag_shuffle (vec, norb2, norb2+norb1, norb=norb0+norb1+norb2)
+            # No fermion sign is incurred: the derivative of the direct product wrt
+            # one factor is itself a direct product in the same operator order.
             ndet0 = 2**norb0
             ndet1 = 2**norb1
             vec = vec.reshape (ndet0, ndet1, ndet2, ndet0, ndet1, ndet2)
@@ -403,14 +461,12 @@ class LASUCCTrialState (object):
         dm1 = self.fcisolver.make_rdm12 (ci, self.norb, 0)[0]
         return np.array ([np.trace (dm1) - self.nelec])
 
-    def get_jac_t1 (self, x, h, c=None, huc=None, uhuc=None):
-        g = []
+    def get_jac_t1 (self, x, h, c=None, uc=None, huc=None, uhuc=None):
         xconstr, xcc, xci_f = self.unpack (x)
         self.uop.set_uniq_amps_(xcc)
-        if (c is None) or (uhuc is None):
-            c, _, _, uhuc = self.hc_x (x, h)[:4] 
-        for duc, uhuc_i in zip (self.uop.gen_deriv1 (c, _full=False), self.uop.gen_partial (uhuc)):
-            g.append (2*duc.ravel ().dot (uhuc_i.ravel ()))
+        if (c is None) or (uc is None) or (huc is None):
+            c, uc, huc = self.hc_x (x, h)[:3]
+        g = 2 * self.contract_uop_deriv1 (c, huc, uc)
         g = self.uop.product_rule_pack (g)
         return np.asarray (g)
 
@@ -435,6 +491,8 @@ class LASUCCTrialState (object):
             # dU|0>/dxq = sin (xp) |q> / xp
             cuhuc_i = ci0.conj ().ravel ().dot (uhuc_i.ravel ())
             uhuc_i -= ci0 * cuhuc_i # subtract component along |0>
+            # as in rotate_ci0, the component of xci along |0> is ignored
+            xci = xci - ci0 * ci0.conj ().ravel ().dot (xci.ravel ())
             xp = linalg.norm (xci)
             if xp > 1e-8:
                 xci = xci / xp
@@ -448,6 +506,43 @@ class LASUCCTrialState (object):
 
         return jacci_f
 
+    def get_precond (self, h, level_shift=PRECOND_LEVEL_SHIFT):
+        ''' Diagonal approximation to the inverse Hessian for the L-BFGS
+            solver. The CI blocks use the diagonal of each fragment's own
+            Hamiltonian in the Fock-space determinant basis relative to the
+            fragment energy of the current CI vector, 1/(2|Hdiag_f - E_f|),
+            floored by level_shift; the charge-constraint and UCC blocks are
+            left at unity.
+
+        Args:
+            h : list of length 3
+                [h0, h1, h2] as passed to e_de
+
+        Kwargs:
+            level_shift : float
+                Lower bound for 2|Hdiag_f - E_f|
+
+        Returns:
+            precond : ndarray of shape (nvar)
+        '''
+        norb, norb_f, ci_f = self.norb, self.norb_f, self.ci_f
+        h1 = np.asarray (h[1])
+        h2 = ao2mo.restore (1, h[2], norb)
+        precond = [np.ones (self.nconstr + self.uop.ngen_uniq)]
+        for ci, i, j in zip (ci_f, np.cumsum (norb_f) - norb_f, np.cumsum (norb_f)):
+            n = j - i
+            h1_i = h1[i:j,i:j]
+            h2_i = h2[i:j,i:j,i:j,i:j]
+            hdiag = np.zeros ((2**n, 2**n))
+            for nelec in product (range (n+1), repeat=2):
+                hd = self.fcisolver.make_hdiag (h1_i, h2_i, n, nelec)
+                hdiag += np.squeeze (fockspace.hilbert2fock (hd, n, nelec))
+            hc = self.contract_h2 ([0, h1_i, h2_i], ci, norb=n)
+            e_i = ci.conj ().ravel ().dot (hc.ravel ()) / ci.conj ().ravel ().dot (ci.ravel ())
+            precond.append (1.0 / np.maximum (2*np.abs (hdiag - e_i), level_shift).ravel ())
+        precond = np.concatenate (precond)
+        return precond[self.var_mask]
+
     def get_solver_callback (self, h):
         self.it_cnt = 0
         log = self.log
@@ -470,7 +565,7 @@ class LASUCCTrialState (object):
         uc_f = self.rotate_ci0 (xci_f)
         uc = self.dp_ci (uc_f)
         self.uop.set_uniq_amps_(xcc)
-        uc = self.uop (uc)
+        uc = self.apply_uop (uc)
         return uc / linalg.norm (uc)
 
     def check_ci0_constr (self):
@@ -551,6 +646,9 @@ class LASUCCTrialState (object):
     get_dense_heff = addons.get_dense_heff
 
 class FCISolver (direct_spin1.FCISolver):
+    # Set sector = True to apply the UCC operator to one (neleca, nelecb)
+    # sector of the product of the fragment wave functions at a time
+    sector = False
     kernel = kernel
     approx_kernel = kernel
     make_rdm1 = make_rdm1
@@ -0,0 +1,123 @@
+import sys
+import numpy as np
+from scipy import linalg
+from pyscf.lib import logger
+
+# Limited-memory BFGS with a diagonal preconditioner, for objective functions
+# which return the value and the gradient together (e.g., the LASUCC trial
+# state of lasci_ominus1). The preconditioner plays the role of the initial
+# inverse Hessian of the two-loop recursion and is rescaled at every
+# iteration by the usual s.y/y.H0.y factor, so only its shape (i.e., the
+# relative curvature of different blocks of variables) needs to be sensible.
+# Memory cost is O(m*nvar) instead of the O(nvar**2) of dense BFGS.
+
+def _two_loop (g, s_list, y_list, rho_list, h0):
+    q = g.copy ()
+    alpha = []
+    for s, y, rho in zip (s_list[::-1], y_list[::-1], rho_list[::-1]):
+        a = rho * s.dot (q)
+        q -= a * y
+        alpha.append (a)
+    r = h0 * q
+    for s, y, rho, a in zip (s_list, y_list, rho_list, alpha[::-1]):
+        b = rho * y.dot (r)
+        r += (a - b) * s
+    return r
+
+def lbfgs (fun, x0, precond=None, gtol=1e-4, max_cycle=15000, m=20,
+        max_stepsize=0.5, c1=1e-4, max_ls=20, callback=None, verbose=None,
+        log=None):
+    '''Minimize a function with preconditioned L-BFGS and a backtracking
+    (Armijo) line search.
+
+    Args:
+        fun : callable
+            Takes x and returns the function value and the gradient
+        x0 : ndarray of shape (n)
+            Initial guess
+
+    Kwargs:
+        precond : ndarray of shape (n)
+            Positive approximation to the diagonal of the inverse Hessian
+        gtol : float
+            Convergence threshold on the largest gradient element
+        max_cycle : integer
+            Maximum number of iterations
+        m : integer
+            Number of correction pairs kept in memory
+        max_stepsize : float
+            Maximum norm of a single step
+        c1 : float
+            Sufficient-decrease parameter of the line search
+        max_ls : integer
+            Maximum number of line-search function evaluations per iteration
+        callback : callable
+            Called as callback (x) after every iteration
+        verbose : integer
+            Verbosity level of log; default: logger.NOTE
+        log : object of class logger.Logger
+
+    Returns:
+        conv : logical
+            Whether the gradient converged
+        x : ndarray of shape (n)
+            Final point
+        f : float
+            Function value at x
+        it : integer
+            Number of iterations performed
+    '''
+    if log is None:
+        if verbose is None: verbose = logger.NOTE
+        log = logger.Logger (sys.stdout, verbose)
+    x = np.array (x0, dtype=np.float64)
+    if precond is None: precond = np.ones_like (x)
+    precond = np.asarray (precond, dtype=np.float64)
+    f, g = fun (x)
+    s_list, y_list, rho_list = [], [], []
+    gamma = 1.0
+    conv = np.amax (np.abs (g)) < gtol if g.size else True
+    it = 0
+    while it < max_cycle and not conv:
+        p = -_two_loop (g, s_list, y_list, rho_list, gamma*precond)
+        slope = p.dot (g)
+        if slope >= 0:
+            log.debug ('L-BFGS: not a descent direction; resetting memory')
+            s_list, y_list, rho_list, gamma = [], [], [], 1.0
+            p = -precond * g
+            slope = p.dot (g)
+        pnorm = linalg.norm (p)
+        if pnorm > max_stepsize:
+            p *= max_stepsize / pnorm
+            slope *= max_stepsize / pnorm
+        # Backtracking with safeguarded quadratic interpolation
+        t = 1.0
+        for ils in range (max_ls):
+            x1 = x + t*p
+            f1, g1 = fun (x1)
+            if f1 <= f + c1*t*slope: break
+            t_quad = -slope*t*t / (2*(f1 - f - slope*t))
+            t = min (max (t_quad, 0.1*t), 0.5*t)
+        else:
+            log.warn ('L-BFGS: line search failed at iteration %d', it)
+            break
+        s, y = x1 - x, g1 - g
+        sy = s.dot (y)
+        if sy > 1e-12 * linalg.norm (s) * linalg.norm (y):
+            s_list.append (s)
+            y_list.append (y)
+            rho_list.append (1.0 / sy)
+            if len (s_list) > m:
+                s_list.pop (0)
+                y_list.pop (0)
+                rho_list.pop (0)
+            gamma = sy / y.dot (precond*y)
+        x, f, g = x1, f1, g1
+        it += 1
+        gmax = np.amax (np.abs (g))
+        conv = gmax < gtol
+        log.debug ('L-BFGS iteration %d: f = %.12g, max |g| = %.3e, step = %.3e, '
+                   '%d line-search evaluations', it, f, gmax, t*linalg.norm (p), ils+1)
+        if callable (callback): callback (x)
+    return conv, x, f, it
+
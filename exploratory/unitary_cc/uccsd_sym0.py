@@ -195,13 +195,25 @@ class FSUCCOperator (object):
             # we have to project away all spectator determinants!
             if ix==igend: 
                 if _cache: _upsi = psi.copy ()
-                _projai_(self.norb, aidx, iidx, psi) # project spectators
-            _op1u_(self.norb, aidx, iidx, amp, psi,
-                transpose=transpose, deriv=(ix==igend))
+                self._projai_(aidx, iidx, psi) # project spectators
+            self._op1u_(aidx, iidx, amp, psi,
+                transpose=transpose, deriv=(ix==igend), igen=ix)
             if ix==igend and not _full: break
         if _cache: return psi, _upsi
         return psi
 
+    def _op1u_(self, aidx, iidx, amp, psi, transpose=False, deriv=0,
+            igen=None):
+        ''' Apply one unitary factor to psi in-place; see _op1u_. igen is the
+            index of the generator, which subclasses may use to look up
+            precomputed data '''
+        return _op1u_(self.norb, aidx, iidx, amp, psi, transpose=transpose,
+            deriv=deriv)
+
+    def _projai_(self, aidx, iidx, psi):
+        ''' Project psi in-place; see _projai_ '''
+        return _projai_(self.norb, aidx, iidx, psi)
+
     def product_rule_pack (self, g): return g
 
     def gen_deriv1 (self, psi, transpose=False, _full=True):
@@ -218,12 +230,49 @@ class FSUCCOperator (object):
             ustart = igend
             yield dupsi
 
+    def contract_deriv1 (self, psi, bra, upsi=None):
+        ''' Evaluate <bra|dU/dun|Psi> for all generator amplitudes un in one
+            backward (adjoint-mode) sweep. Starting from U|Psi> and <bra|, the
+            factors are un-applied one at a time from the left, so that at
+            factor n the ket is U(n-1)...U(0)|Psi> and the bra is
+            <bra|U(ngen-1)...U(n+1). Each factor is applied three times in
+            total instead of O(ngen) times as in gen_deriv1.
+
+        Args:
+            psi : ndarray of shape (2**norb)
+                wfn |Psi> in dU/dun |Psi>
+            bra : ndarray of shape (2**norb)
+                e.g., H U|Psi> for the gradient of <Psi|U'HU|Psi>
+
+        Kwargs:
+            upsi : ndarray of shape (2**norb)
+                U|Psi>, if already available
+
+        Returns:
+            g : ndarray of shape (ngen)
+                <bra|dU/dun|Psi>; use product_rule_pack to contract to
+                the unique amplitudes
+            ubra : ndarray of shape (2**norb)
+                U'|bra>, which the sweep produces as a byproduct '''
+        if upsi is None: upsi = self (psi)
+        ket = np.array (upsi, dtype=np.float64).ravel ()
+        bra = np.array (bra, dtype=np.float64).ravel ()
+        g = np.zeros (self.ngen, dtype=np.float64)
+        for ix, aidx, iidx, amp in self.gen_fac (reverse=True):
+            self._op1u_(aidx, iidx, amp, ket, transpose=True, deriv=0, igen=ix)
+            dket = self._projai_(aidx, iidx, ket.copy ())
+            self._op1u_(aidx, iidx, amp, dket, deriv=1, igen=ix)
+            g[ix] = bra.dot (dket)
+            self._op1u_(aidx, iidx, amp, bra, transpose=True, deriv=0, igen=ix)
+        return g, bra.reshape (np.shape (upsi))
+
     def gen_partial (self, psi, transpose=False, inplace=False):
         ''' Like __call__, except it yields the partially-transformed vector after
             each factor. Be careful not to destroy the data in the yield vector.'''
         upsi = psi.view () if inplace else psi.copy ()
         for ix, aidx, iidx, amp in self.gen_fac (reverse=transpose):
-            _op1u_(self.norb, aidx, iidx, amp, upsi, transpose=transpose, deriv=0)
+            self._op1u_(aidx, iidx, amp, upsi, transpose=transpose, deriv=0,
+                igen=ix)
             yield upsi
 
     def assert_sanity (self, nodupes=True):
@@ -255,7 +304,8 @@ class FSUCCOperator (object):
     def __call__(self, psi, transpose=False, inplace=False):
         upsi = psi.view () if inplace else psi.copy ()
         for ix, aidx, iidx, amp in self.gen_fac (reverse=transpose):
-            _op1u_(self.norb, aidx, iidx, amp, upsi, transpose=transpose, deriv=0)
+            self._op1u_(aidx, iidx, amp, upsi, transpose=transpose, deriv=0,
+                igen=ix)
         return upsi
 
     def get_uniq_amps (self):
@@ -387,10 +437,7 @@ class UCCS (lib.StreamObject):
             upsi = uop (psi0) 
             hupsi = hop (upsi)
             e_tot = upsi.conj ().dot (hupsi)
-            uhupsi = uop (hupsi, transpose=True)
-            jac = []
-            for du, uhu in zip (uop.gen_deriv1 (psi0, _full=False), uop.gen_partial (uhupsi)):
-                jac.append (2*du.conj ().dot (uhu)) 
+            jac = 2 * uop.contract_deriv1 (psi0, hupsi, upsi=upsi)[0]
             jac = uop.product_rule_pack (jac)
             return e_tot, np.asarray (jac)
         return mo_coeff, obj_fun, x0
@@ -1,9 +1,12 @@
 import numpy as np
 import math, ctypes
 from scipy import linalg
+from pyscf import lib
 from pyscf.lib import logger
+from pyscf.fci import direct_spin1
 from mrh.lib.helper import load_library
 from mrh.exploratory.unitary_cc import uccsd_sym0
+from mrh.exploratory.citools import fockspace
 from itertools import combinations, permutations, product, combinations_with_replacement
 
 libfsucc = load_library ('libfsucc')
@@ -55,6 +58,138 @@ def spincases (p_idxs, norb):
     m = m[idx_uniq]
     return p_idxs, m
 
+# Because the generators conserve n and sz, the operators can also act on
+# "sector-restricted" CI vectors, which only store the determinants of one
+# (neleca, nelecb) sector in the same order as the Hilbert-space CI vectors
+# of pyscf.fci (see fockspace.sector_strs), instead of all 4**norb
+# determinants of the Fock space. The determinant pairs coupled by a
+# generator are found by bit arithmetic on the sorted string table.
+
+def _parity (strs):
+    ''' Parity (True = odd) of the number of set bits in each string '''
+    strs = strs.copy ()
+    for shift in (32, 16, 8, 4, 2, 1):
+        strs ^= strs >> np.uint64 (shift)
+    return (strs & np.uint64 (1)).astype (np.bool_)
+
+def _sector_tab (strs, aidx, iidx):
+    ''' Addresses and signs of the pairs of determinants of a sector which
+        are coupled by the generator a0'a1'...i1i0 - h.c.; cf. FSUCCcontract1
+        in lib/fsucc.c
+
+        Args:
+            strs : ndarray of dtype np.uint64
+                Sorted Fock-space strings of the sector
+            aidx : list of len (na)
+                lists +cr,-an operators
+            iidx : list of len (ni)
+                lists +an,-cr operators
+
+        Returns:
+            ia : ndarray of dtype int
+                Addresses of determinants in which all i are occupied
+            ai : ndarray of dtype int
+                Addresses of the partner determinants (all a occupied)
+            sgn : ndarray of dtype float
+                +-1 for each determinant pair
+    '''
+    det_i = sum ([1<<int (i) for i in iidx])
+    det_a = sum ([1<<int (a) for a in aidx])
+    det_ia = np.uint64 (det_i | det_a)
+    det_i, det_a = np.uint64 (det_i), np.uint64 (det_a)
+    ia = np.where ((strs & det_ia) == det_i)[0]
+    str_ia = strs[ia]
+    str_ai = (str_ia ^ det_i) | det_a
+    ai = np.searchsorted (strs, str_ai)
+    sgnbit = np.zeros (len (ia), dtype=np.bool_)
+    for p, det in zip ((iidx, aidx), (str_ia, str_ai)):
+        det = det.copy ()
+        for q in p:
+            above = np.uint64 (((1<<64)-1) ^ ((1<<(int (q)+1))-1))
+            sgnbit ^= _parity (det & above)
+            det ^= np.uint64 (1<<int (q))
+    sgn = 1.0 - 2.0*sgnbit
+    return ia, ai, sgn
+
+def _op1u_sector_(strs, aidx, iidx, amp, psi, transpose=False, deriv=0,
+        tab=None):
+    ''' Sector-restricted counterpart of uccsd_sym0._op1u_
+
+        Args:
+            strs : ndarray of dtype np.uint64
+                Sorted Fock-space strings of the sector
+            aidx : list of len (na)
+                lists +cr,-an operators
+            iidx : list of len (ni)
+                lists +an,-cr operators
+            amp : float
+                amplitude for generator
+            psi : contiguous ndarray of len (strs.size)
+                sector-restricted CI array; modified in-place
+
+        Kwargs:
+            transpose : logical
+                Setting to True multiplies the amp by -1
+            deriv: int
+                Order of differentiation wrt the amp
+            tab : tuple of 3 ndarrays
+                Return value of _sector_tab (strs, aidx, iidx), if already
+                available
+
+        Returns:
+            psi : ndarray of len (strs.size)
+                arg "psi" after operation
+    '''
+    if tab is None: tab = _sector_tab (strs, aidx, iidx)
+    ia, ai, sgn = tab
+    my_amp = (1 - (2*int (transpose))) * (amp + (deriv * math.pi / 2))
+    ct, st = math.cos (my_amp), sgn * math.sin (my_amp)
+    psi = np.ascontiguousarray (psi, dtype=np.float64)
+    psi_flat = psi.reshape (-1)
+    psi_ia, psi_ai = psi_flat[ia], psi_flat[ai]
+    psi_flat[ia] = (ct*psi_ia) - (st*psi_ai)
+    psi_flat[ai] = (st*psi_ia) + (ct*psi_ai)
+    return psi
+
+def _projai_sector_(strs, aidx, iidx, psi):
+    ''' Sector-restricted counterpart of uccsd_sym0._projai_ '''
+    det_i = np.uint64 (sum ([1<<int (i) for i in iidx]))
+    det_a = np.uint64 (sum ([1<<int (a) for a in aidx]))
+    det_proj = strs & (det_i | det_a)
+    psi = np.ascontiguousarray (psi, dtype=np.float64)
+    psi.reshape (-1)[(det_proj != det_i) & (det_proj != det_a)] = 0.0
+    return psi
+
+def _op1h_sector (norb, nelec, herm, psi):
+    ''' Sector-restricted counterpart of uccsd_sym0._op1h_spinsym
+
+        Args:
+            norb : integer
+                number of SPATIAL orbitals
+            nelec : tuple of length 2
+                numbers of electrons in the sector
+            herm : list or tuple
+                [h0, h1, h2] with h1 lower-triangular-packed and h2 of shape
+                [norb*(norb+1)//2,]*2. Higher-order terms are not supported.
+            psi : ndarray of shape (ndeta*ndetb)
+                sector-restricted CI vector
+
+        Returns:
+            hpsi : ndarray of shape (ndeta*ndetb)
+                output wfn
+    '''
+    if len (herm) > 3:
+        raise NotImplementedError ("sector-restricted {}-body operator".format (
+            len (herm)-1))
+    hpsi = herm[0] * psi
+    if len (herm) > 1:
+        h1 = lib.unpack_tril (np.asarray (herm[1]))
+        h2 = herm[2] if len (herm) > 2 else np.zeros ((norb,)*4)
+        h2eff = direct_spin1.absorb_h1e (h1, h2, norb, nelec, 0.5)
+        hpsi = hpsi + direct_spin1.contract_2e (h2eff, psi, norb,
+            nelec).reshape (hpsi.shape)
+    return hpsi
+
 class FSUCCOperator (uccsd_sym0.FSUCCOperator):
     ''' A callable spin-adapted (Sz only) unrestricted coupled cluster
         operator. For single-excitation operators, spin-up and spin-down
@@ -74,6 +209,10 @@ class FSUCCOperator (uccsd_sym0.FSUCCOperator):
         The spatial-orbital excitation patterns are applied to the ket in
         ascending order of their ordinal positions in the 'a_idxs' and 'i_idxs'
         lists provided to the constructor.
+
+        After set_sector_ (nelec), the operator acts on sector-restricted CI
+        vectors of length ndeta*ndetb instead of Fock-space CI vectors of
+        length 4**norb.
     '''
 
 
@@ -124,8 +263,44 @@ class FSUCCOperator (uccsd_sym0.FSUCCOperator):
         assert (len (self.i_idxs) == self.ngen)
         self.uniq_gen_idx = np.array ([x[0] for x in self.symtab])
         self.amps = np.zeros (self.ngen)
+        self.nelec = None
+        self.sector_strs = None
+        self._sector_tabs = None
+        self._sector_cache = {}
         self.assert_sanity ()
 
+    def set_sector_(self, nelec):
+        ''' Restrict the operator to act on sector-restricted CI vectors of the
+            (neleca, nelecb) sector, or on full Fock-space CI vectors if nelec
+            is None. The determinant pairs coupled by each generator are
+            tabulated the first time a sector is set and kept for later calls
+        '''
+        if nelec is None:
+            self.nelec = self.sector_strs = self._sector_tabs = None
+            return self
+        self.nelec = direct_spin1._unpack_nelec (nelec)
+        if self.nelec not in self._sector_cache:
+            strs = fockspace.sector_strs (self.norb // 2, self.nelec)
+            tabs = [_sector_tab (strs, aidx, iidx)
+                    for aidx, iidx in zip (self.a_idxs, self.i_idxs)]
+            self._sector_cache[self.nelec] = (strs, tabs)
+        self.sector_strs, self._sector_tabs = self._sector_cache[self.nelec]
+        return self
+
+    def _op1u_(self, aidx, iidx, amp, psi, transpose=False, deriv=0,
+            igen=None):
+        if self.sector_strs is None:
+            return uccsd_sym0.FSUCCOperator._op1u_(self, aidx, iidx, amp, psi,
+                transpose=transpose, deriv=deriv)
+        tab = None if igen is None else self._sector_tabs[igen]
+        return _op1u_sector_(self.sector_strs, aidx, iidx, amp, psi,
+            transpose=transpose, deriv=deriv, tab=tab)
+
+    def _projai_(self, aidx, iidx, psi):
+        if self.sector_strs is None:
+            return uccsd_sym0.FSUCCOperator._projai_(self, aidx, iidx, psi)
+        return _projai_sector_(self.sector_strs, aidx, iidx, psi)
+
     def assert_sanity (self):
         norb = self.norb // 2
         uccsd_sym0.FSUCCOperator.assert_sanity (self)
@@ -265,8 +440,40 @@ def spin_square (psi, norb):
     return ss, multip
 
 class UCCS (uccsd_sym0.UCCS):
+    ''' Set sector = True to work with sector-restricted CI vectors of the
+        (neleca, nelecb) sector of mol instead of Fock-space CI vectors '''
+    sector = False
+
+    @property
+    def nelec (self):
+        neleca = (self.mol.nelectron + self.mol.spin) // 2
+        nelecb = (self.mol.nelectron - self.mol.spin) // 2
+        return neleca, nelecb
+
     def get_uop (self):
-        return get_uccs_op (self.norb)
+        return self._sector_uop (get_uccs_op (self.norb))
+
+    def _sector_uop (self, uop):
+        if self.sector: uop.set_sector_(self.nelec)
+        return uop
+
+    def get_hop (self, mo_coeff=None, ham=None):
+        if not self.sector:
+            return super().get_hop (mo_coeff=mo_coeff, ham=ham)
+        if ham is None:
+            mo_coeff, h0, h1, h2 = self.get_ham (mo_coeff=mo_coeff)
+            ham = [h0, h1, h2]
+        norb, nelec = self.norb, self.nelec
+        def hop (psi): return _op1h_sector (norb, nelec, ham, psi)
+        return mo_coeff, hop
+
+    def get_psi0 (self):
+        if not self.sector: return super().get_psi0 ()
+        # The aufbau determinant is the first string of the sector
+        psi0 = np.zeros (fockspace.sector_strs (self.norb, self.nelec).size,
+            dtype=np.float64)
+        psi0[0] = 1.0
+        return psi0
 
     def rotate_mo (self, mo_coeff=None, x=None):
         if mo_coeff is None: mo_coeff=self.mo_coeff
@@ -288,7 +495,7 @@ class UCCS (uccsd_sym0.UCCS):
 
 class UCCSD (UCCS):
     def get_uop (self):
-        return get_uccsd_op (self.norb)
+        return self._sector_uop (get_uccsd_op (self.norb))
 
 
 if __name__ == '__main__':
@@ -31,6 +31,7 @@ from pyscf.scf.rohf import get_roothaan_fock
 from pyscf import __config__
 from mrh.my_dmet import rhf as wm_rhf
 from mrh.my_dmet import iao_helper
+from mrh.my_pyscf.df import sparse_df
 import numpy as np
 import scipy
 from mrh.util.my_math import is_close_to_integer
@@ -258,7 +259,11 @@ class localintegrals:
             DMloc must be the spin-summed density matrix
         '''
         DM_ao = represent_operator_in_basis (DMloc, self.ao2loc.T )
-        JK_ao = self.get_veff_ao (DM_ao, 0, 0, 1) #Last 3 numbers: dm_last, vhf_last, hermi
+        if self.with_df is not None:
+            vj, vk = sparse_df.get_jk (self.with_df, DM_ao, hermi=1)
+            JK_ao = vj - vk/2
+        else:
+            JK_ao = self.get_veff_ao (DM_ao, 0, 0, 1) #Last 3 numbers: dm_last, vhf_last, hermi
         if JK_ao.ndim == 3:
             JK_ao = JK_ao[0]
         JK_loc = represent_operator_in_basis (JK_ao, self.ao2loc )
@@ -272,7 +277,10 @@ class localintegrals:
     def loc_rhf_k_bis (self, DMloc):
 
         DM_ao = represent_operator_in_basis (DMloc, self.ao2loc.T)
-        K_ao = self.get_k_ao (DM_ao, 1)
+        if self.with_df is not None:
+            K_ao = sparse_df.get_jk (self.with_df, DM_ao, hermi=1, with_j=False)[1]
+        else:
+            K_ao = self.get_k_ao (DM_ao, 1)
         K_loc = represent_operator_in_basis (K_ao, self.ao2loc)
         return K_loc
 
@@ -2,7 +2,7 @@ from pyscf import lib
 import numpy as np
 from scipy import linalg
 from mrh.lib.helper import load_library
-import ctypes, time
+import ctypes
 libsint = load_library ('libsint')
 
 class sparsedf_array (np.ndarray):
@@ -53,7 +53,7 @@ class sparsedf_array (np.ndarray):
         return sparsedf_array (np.asfortranarray (self), nmo=self.nmo)
 
     def naux_slow (self): # Since naux is always the first index, this corresponds to making the array C-contiguous
-        return sparsedf_array (np.ascontiguousnarray (self), nmo=self.nmo)
+        return sparsedf_array (np.ascontiguousarray (self), nmo=self.nmo)
 
     def get_sparsity_ (self, thresh=1e-8):
         metric = linalg.norm (self, axis=0)
@@ -173,3 +173,87 @@ class sparsedf_array (np.ndarray):
         return vk
 
 
+
+def get_jk (with_df, dm, hermi=1, with_j=True, with_k=True, thresh=1e-8, max_memory=None):
+    ''' J and K matrices from density-fitted ERIs, streamed in auxiliary-basis chunks with
+    with_df.loop (). In each chunk, AO pairs whose CDERI vectors have a norm below thresh
+    are screened out (sum_P (uv|P)^2 = (uv|uv) is the Schwarz bound of the pair), and the
+    exchange matrix is built from the factorization D = C s C^T of each density matrix:
+
+    K_uv = sum_iP s_i b^P_ui b^P_vi, b^P_ui = sum_w (uw|P) C_wi
+
+    where the first contraction uses the sparsity of the chunk (contract1). Only hermitian
+    real density matrices take this path; anything else is passed to with_df.get_jk.
+
+    Args:
+        with_df : instance of :class:`pyscf.df.DF`
+        dm : ndarray of shape (nao,nao) or (*,nao,nao)
+
+    Kwargs:
+        hermi : integer
+            As in PySCF get_jk
+        with_j : logical
+            Whether to compute vj
+        with_k : logical
+            Whether to compute vk
+        thresh : float
+            Screening threshold for AO pairs and density-matrix eigenvalues
+        max_memory : float
+            In MB. Default is with_df.max_memory less current usage
+
+    Returns:
+        vj : ndarray of shape dm.shape or None
+        vk : ndarray of shape dm.shape or None
+    '''
+    dm = np.asarray (dm)
+    if hermi != 1 or np.iscomplexobj (dm):
+        return with_df.get_jk (dm, hermi=hermi, with_j=with_j, with_k=with_k)
+    dm_shape = dm.shape
+    nao = dm_shape[-1]
+    dms = dm.reshape (-1,nao,nao)
+    ndm = len (dms)
+    vj = np.zeros ((ndm, nao*(nao+1)//2), dtype=dms.dtype)
+    vk = np.zeros ((ndm, nao, nao), dtype=dms.dtype)
+
+    # Density matrices for vj: lower-triangular, off-diagonal elements doubled
+    idx = np.arange (nao)
+    dmtril = lib.pack_tril (dms + dms.transpose (0,2,1))
+    dmtril[:,idx*(idx+1)//2+idx] *= .5
+
+    # Factorized density matrices for vk
+    orbs = []
+    for d in dms:
+        e, u = linalg.eigh (d)
+        idx = np.abs (e) > thresh
+        orbs.append ((np.ascontiguousarray (u[:,idx] * np.sqrt (np.abs (e[idx]))[None,:]),
+                      np.sign (e[idx])))
+    nocc = max ([mo.shape[1] for mo, sgn in orbs] + [1])
+
+    if max_memory is None: max_memory = with_df.max_memory - lib.current_memory ()[0]
+    # Per auxiliary function: cderi chunk, its copy, the contract1 product and its work array
+    mem_aux = (nao*(nao+1) + 2*nao*nocc) * 8 / 1e6
+    blksize = max (4, int (min (with_df.blockdim, max_memory * .5 / mem_aux)))
+    for eri1 in with_df.loop (blksize=blksize):
+        bPmn = sparsedf_array (np.ascontiguousarray (eri1), nmo=(nao,nao))
+        bPmn.get_sparsity_ (thresh=thresh)
+        if bPmn.nentpair == 0: continue
+        if with_j:
+            bPij = np.ascontiguousarray (eri1[:,bPmn.entpair])
+            rho = lib.dot (dmtril[:,bPmn.entpair], bPij.T)
+            vj[:,bPmn.entpair] += lib.dot (rho, bPij)
+            bPij = rho = None
+        if with_k:
+            for k, (mo, sgn) in enumerate (orbs):
+                if mo.shape[1] == 0: continue
+                bmiP = np.asarray (bPmn.contract1 (mo)).reshape (nao, -1)
+                smiP = (bmiP.reshape (nao, -1, bPmn.naux) * sgn[None,:,None]).reshape (nao, -1)
+                vk[k] = lib.dot (smiP, bmiP.T, c=vk[k], beta=1)
+                bmiP = smiP = None
+        bPmn = None
+
+    if with_j: vj = lib.unpack_tril (vj).reshape (dm_shape)
+    else: vj = None
+    if with_k: vk = vk.reshape (dm_shape)
+    else: vk = None
+    return vj, vk
+
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from pyscf import gto, __config__
+from pyscf.lib import logger
+from pyscf.dft import gen_grid, radi
+
+# Atomic grid templates
+#
+# The grid of each element around its own nucleus (its radial and angular
+# quadrature) depends only on the element and the grid scheme, not on the
+# geometry. gen_atomic_grids is a drop-in replacement for
+# pyscf.dft.gen_grid.gen_atomic_grids which keeps these templates, keyed by
+# element and scheme, so that rebuilding grids at new geometries, for other
+# molecules or fragments, or for other Grids objects, only moves and
+# re-partitions them. At most MAX_TEMPLATES templates (or, if more, those of
+# the molecule of the latest call) are kept; the least recently used one is
+# dropped first. Evictions are logged at the debug level, and rebuilding an
+# evicted template (i.e., a workload which cycles through more templates
+# than the cache holds) at the warning level. MAX_TEMPLATES can be set with
+# the PySCF config key dft_gen_grid_max_templates. The cached arrays are
+# shared: don't modify them in place.
+
+MAX_TEMPLATES = getattr(__config__, 'dft_gen_grid_max_templates', 64)
+_templates = OrderedDict()
+_evicted = set()
+
+def gen_atomic_grids(mol, atom_grid={}, radi_method=radi.gauss_chebyshev,
+                     level=3, prune=gen_grid.nwchem_prune, **kwargs):
+    '''Cached pyscf.dft.gen_grid.gen_atomic_grids; same arguments and
+    return value'''
+    if isinstance(atom_grid, (list, tuple)):
+        atom_grid = dict([(mol.atom_symbol(ia), atom_grid)
+                          for ia in range(mol.natm)])
+    symbs = sorted(set(mol.atom_symbol(ia) for ia in range(mol.natm)))
+    keys = {symb: (symb, gto.charge(symb), tuple(atom_grid.get(symb, ())),
+                   radi_method, level, prune, repr(sorted(kwargs.items())))
+            for symb in symbs}
+    missing = [symb for symb in symbs if keys[symb] not in _templates]
+    rebuilt = [symb for symb in missing if keys[symb] in _evicted]
+    if len(rebuilt):
+        logger.warn(mol, 'Rebuilding evicted atomic grid templates of %s; '
+                    'gen_grid.MAX_TEMPLATES = %d is too small for this '
+                    'workload', ' '.join(rebuilt), MAX_TEMPLATES)
+    if len(missing):
+        tab = gen_grid.gen_atomic_grids(mol, atom_grid, radi_method, level,
+                                        prune, **kwargs)
+        for symb in missing:
+            _templates[keys[symb]] = tab[symb]
+    tab = {}
+    for symb in symbs:
+        _templates.move_to_end(keys[symb])
+        tab[symb] = _templates[keys[symb]]
+    while len(_templates) > max(MAX_TEMPLATES, len(symbs)):
+        key = _templates.popitem(last=False)[0]
+        _evicted.add(key)
+        logger.debug(mol, 'Evicted atomic grid template of %s', key[0])
+    _evicted.difference_update(keys.values())
+    return tab
+
+def clear_templates():
+    _templates.clear()
+    _evicted.clear()
+
+def reuse_atomic_grids(grids):
+    '''Make grids take its atomic grid templates from gen_atomic_grids. A
+    generator already set on grids itself (e.g., through the grids_attr of
+    MC-PDFT) is kept.'''
+    if 'gen_atomic_grids' not in grids.__dict__:
+        grids.gen_atomic_grids = gen_atomic_grids
+    return grids
@@ -1,4 +1,6 @@
 import numpy
+from pyscf.dft import gen_grid, radi
+from mrh.my_pyscf.dft.gen_grid import gen_atomic_grids
 
 # Update 04/07/2022:
 # OpenMolcas seems to have changed something about its angular grids
@@ -29,21 +31,78 @@ def om_treutler_ahlrichs(n, chg, *args, **kwargs):
     '''
     "Treutler-Ahlrichs" as implemented in OpenMolcas
     '''
-    r = numpy.empty(n)
-    dr = numpy.empty(n)
     alpha = om_ta_alpha[chg-1]
     step = 2.0 / (n+1) # = numpy.pi / (n+1)
     ln2 = alpha / numpy.log(2)
-    for i in range(n):
-        x = (i+1)*step - 1 # = numpy.cos((i+1)*step)
-        r [i] = -ln2*(1+x)**.6 * numpy.log((1-x)/2)
-        dr[i] = (step #* numpy.sin((i+1)*step) 
-                * ln2*(1+x)**.6 *(-.6/(1+x)*numpy.log((1-x)/2)+1/(1-x)))
+    x = numpy.arange(1,n+1)*step - 1 # = numpy.cos((i+1)*step)
+    log1mx = numpy.log((1-x)/2)
+    r = -ln2*(1+x)**.6 * log1mx
+    dr = (step #* numpy.sin((i+1)*step)
+          * ln2*(1+x)**.6 *(-.6/(1+x)*log1mx+1/(1-x)))
     return r[::-1], dr[::-1]
 
+# Angular pruning
+#
+# The density close to a nucleus is nearly spherical, and far from all
+# nuclei it is small and smooth, so neither region needs the full angular
+# grid. om_prune reduces the angular order l of each radial shell in both
+# regions, in the spirit of the pruning OpenMolcas applies by default
+# (i.e., without the "nopr" keyword), which is controlled by a "crowding"
+# factor: inside R/crowding, where R is the Bragg-Slater radius of the
+# element, l decreases linearly with r; outside fade*R it decreases as 1/r.
+# l is rounded up to the nearest available Lebedev order and never drops
+# below om_prune_lmin.
+
+om_prune_crowding = 3.0
+om_prune_fade = 6.0
+om_prune_lmin = 5
+
+_leb_l = numpy.array(sorted(l for l in gen_grid.LEBEDEV_ORDER
+                            if gen_grid.LEBEDEV_ORDER[l] > 1))
+_leb_n = numpy.array([gen_grid.LEBEDEV_ORDER[l] for l in _leb_l])
+
+def om_prune(nuc, rads, n_ang, radii=radi.BRAGG_RADII,
+             crowding=None, fade=None, lmin=None):
+    '''Angular pruning with a crowding factor (see above)
+
+    Args:
+        nuc : int
+            Nuclear charge.
+        rads : 1D array
+            Grid coordinates on radial axis.
+        n_ang : int
+            Max number of grids over angular part.
+
+    Kwargs:
+        radii : 1D array
+            radii (in Bohr) for atoms in periodic table
+        crowding : float
+            Default is om_prune_crowding
+        fade : float
+            Default is om_prune_fade
+        lmin : int
+            Default is om_prune_lmin
+
+    Returns:
+        A 1D array with the same length as rads. The element is the number of
+        grids over angular part for each radial grid.
+    '''
+    if crowding is None: crowding = om_prune_crowding
+    if fade is None: fade = om_prune_fade
+    if lmin is None: lmin = om_prune_lmin
+    rads = numpy.asarray(rads)
+    lmax = _leb_l[_leb_n==n_ang][0]
+    r_atom = radii[nuc] + 1e-200
+    scale = numpy.minimum(crowding*rads/r_atom, fade*r_atom/(rads+1e-200))
+    l = numpy.clip(lmax*scale, min(lmin, lmax), lmax)
+    idx = numpy.searchsorted(_leb_l, l - 1e-8)
+    return _leb_n[idx]
+
 quasi_ultrafine = {'atom_grid': (99,590),
     'radi_method': om_treutler_ahlrichs,
     'prune': False,
-    'radii_adjust': None}
-
+    'radii_adjust': None,
+    'gen_atomic_grids': gen_atomic_grids}
 
+# Same, without "nopr": pruned with om_prune
+quasi_ultrafine_pruned = dict(quasi_ultrafine, prune=om_prune)
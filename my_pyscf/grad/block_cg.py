@@ -0,0 +1,113 @@
+import numpy as np
+from scipy import linalg
+from pyscf.lib import logger
+
+# Block preconditioned conjugate gradient for linear equations with many
+# right-hand sides sharing one operator, e.g., the Lagrange-multiplier
+# equations of several states' or properties' analytical derivatives. All
+# right-hand sides share a single Krylov space, so the number of operator
+# applications per converged vector is usually much smaller than for
+# independent CG solves. Converged columns are frozen and dropped from the
+# search space; linearly-dependent search directions are removed by a
+# rank-revealing QR at every iteration.
+
+def columnwise (fn):
+    '''Wrap a function of one vector into a function of a block of
+    vectors stored as the columns of a 2d array, by calling it once per
+    column. Meant for cheap functions such as diagonal preconditioners;
+    operators with intermediates that can be shared between columns
+    should act on the whole block instead.'''
+    def block_fn (x):
+        return np.stack ([fn (xi) for xi in x.T], axis=-1)
+    return block_fn
+
+def _orth_search_space (p, lindep=1e-10):
+    if p.shape[1] == 0: return p
+    q, r, piv = linalg.qr (p, mode='economic', pivoting=True)
+    rdiag = np.abs (np.diag (r))
+    idx = rdiag > lindep * rdiag[0]
+    return q[:,idx]
+
+def block_cg (Aop, b, x0=None, precond=None, tol=0, atol=1e-6, max_cycle=50,
+        callback=None, lindep=1e-10, verbose=None, log=None):
+    '''Solve A x = b for several right-hand sides b simultaneously.
+
+    Args:
+        Aop : callable
+            Takes an ndarray of shape (n,k) and returns the product of
+            the matrix A with each of its k columns, in the same shape
+        b : ndarray of shape (n,nrhs) or (n)
+            Right-hand sides
+
+    Kwargs:
+        x0 : ndarray of shape b.shape
+            Initial guess
+        precond : callable
+            Same signature as Aop; approximates the action of A^-1
+        tol : float
+            Relative convergence threshold on the residual norm
+        atol : float
+            Absolute convergence threshold on the residual norm. Column i
+            is converged if |b_i - A x_i| <= max (tol*|b_i|, atol)
+        max_cycle : integer
+            Maximum number of iterations
+        callback : callable
+            Called as callback (it, x, rnorm) after every iteration
+        lindep : float
+            Threshold for dropping linearly-dependent search directions
+        verbose : integer
+            Verbosity level of log
+        log : object of class logger.Logger
+
+    Returns:
+        conv : ndarray of shape (nrhs) and dtype bool
+            Whether each column is converged
+        x : ndarray of shape b.shape
+            Solution vectors
+        it : integer
+            Number of iterations (i.e., calls to Aop) performed
+    '''
+    if log is None: log = logger.Logger (verbose=verbose)
+    b = np.asarray (b)
+    is_vector = (b.ndim == 1)
+    if is_vector: b = b[:,None]
+    if precond is None: precond = lambda x: x
+    n, nrhs = b.shape
+    if x0 is None:
+        x = np.zeros_like (b)
+        r = b.copy ()
+    else:
+        x = np.array (x0, dtype=b.dtype).reshape (n, nrhs)
+        r = b - Aop (x)
+    thresh = np.maximum (tol * linalg.norm (b, axis=0), atol)
+    rnorm = linalg.norm (r, axis=0)
+    conv = rnorm <= thresh
+    p = q = ptq = None
+    it = 0
+    while it < max_cycle and not np.all (conv):
+        act = ~conv
+        z = precond (r[:,act])
+        if p is not None:
+            # A-conjugate to the previous search directions
+            beta = linalg.lstsq (ptq, q.conj ().T @ z)[0]
+            z = z - p @ beta
+        p = _orth_search_space (z, lindep=lindep)
+        if p.shape[1] == 0:
+            log.warn ('Block CG: search space collapsed with %d unconverged '
+                      'vectors', np.count_nonzero (act))
+            break
+        q = Aop (p)
+        it += 1
+        ptq = p.conj ().T @ q
+        alpha = linalg.lstsq (ptq, p.conj ().T @ r[:,act])[0]
+        x[:,act] += p @ alpha
+        r[:,act] -= q @ alpha
+        rnorm[act] = linalg.norm (r[:,act], axis=0)
+        conv = rnorm <= thresh
+        log.debug ('Block CG iteration %d: %d search directions, max |r| = '
+                   '%.3e, %d/%d converged', it, p.shape[1], np.amax (rnorm),
+                   np.count_nonzero (conv), nrhs)
+        if callable (callback): callback (it, x, rnorm)
+    if is_vector: x = x[:,0]
+    return conv, x, it
+
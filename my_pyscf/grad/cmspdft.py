@@ -5,10 +5,66 @@ from pyscf.lib import logger
 from pyscf.mcscf import newton_casscf
 import copy
 from functools import reduce
-from mrh.my_pyscf.mcpdft.cmspdft import coulomb_tensor
+from mrh.my_pyscf.mcpdft.cmspdft import coulomb_factor, states_trans_rdm1
+
+def diab_response_cache (mc_grad, mo=None, ci=None, eris=None, **kwargs):
+    '''Computes the intermediates of diab_response which do not depend
+    on the intermediate-state rotation vector, so that they can be
+    reused for every Hessian-vector product of a Lagrange equation
+    solve.
+
+    Args:
+        mc_grad : object of class Gradients (CASSCF or CASCI)
+
+    Kwargs:
+        mo : ndarray of shape (nao,nmo)
+            Contains MO coefficients
+        ci : ndarray or list of length (nroots)
+            Contains intermediate-state CI vectors
+        eris : object of class ERIS (CASSCF or CASCI)
+            Contains (true) ERIs in the MO basis
+
+    Returns:
+        cache : dict
+            Contains the state 1-RDMs "dm1", the ERIs "aapa", the
+            Coulomb potentials "vj", their products with the CI vectors
+            "vci", and the factors "B" and signs "sgn" of the Coulomb
+            tensor (see mcpdft.cmspdft.coulomb_factor), which is never
+            built
+    '''
+    mc = mc_grad.base
+    if mo is None: mo = mc.mo_coeff
+    if ci is None: ci = mc.ci
+    if eris is None: eris = mc.ao2mo (mo)
+    ncore, ncas, nelecas = mc.ncore, mc.ncas, mc.nelecas
+    nroots, nocc = mc_grad.nroots, ncore + ncas
+    nmo = mo.shape[1]
+    ci_arr = np.asarray (ci)
+
+    # Density matrices
+    tril_idx = np.tril_indices (nroots)
+    diag_idx = np.arange (nroots)
+    diag_idx = diag_idx * (diag_idx+1) // 2 + diag_idx
+    tdm1 = states_trans_rdm1 (mc, ci_arr[tril_idx[0]], ci_arr[tril_idx[1]])
+    dm1 = tdm1[diag_idx,:,:]
+
+    # Potentials
+    aapa = np.zeros ([ncas,ncas,nmo,ncas], dtype=dm1.dtype)
+    for i in range (ncas):
+        j = i + ncore
+        aapa[i,:,:,:] = eris.papa[j][:,:,:]
+    vj = np.tensordot (dm1, aapa, axes=2)
+    B, sgn = coulomb_factor (mc, mo_coeff=mo, ci=ci,
+        h2eff=aapa[:,:,ncore:nocc,:])
+    def contract (v,c): return mc.fcisolver.contract_1e (v, c, ncas, nelecas)
+    vci = np.stack ([contract (v,c) for v, c in zip (vj[:,ncore:nocc,:], ci)],
+        axis=0)
+    return {'dm1': dm1, 'aapa': aapa, 'vj': vj, 'vci': vci, 'B': B,
+            'sgn': sgn}
 
 # TODO: docstring?
-def diab_response (mc_grad, Lis, mo=None, ci=None, eris=None, **kwargs):
+def diab_response (mc_grad, Lis, mo=None, ci=None, eris=None, cache=None,
+        **kwargs):
     '''Computes the Hessian-vector product of
 
     Q_a-a = 1/2 sum_I g_pqrs <I|p'q|I> <I|r's|I>
@@ -29,6 +85,9 @@ def diab_response (mc_grad, Lis, mo=None, ci=None, eris=None, **kwargs):
             Contains intermediate-state CI vectors
         eris : object of class ERIS (CASSCF or CASCI)
             Contains (true) ERIs in the MO basis
+        cache : dict
+            Output of diab_response_cache for the same mo, ci, and eris.
+            Computed on the fly if omitted.
 
     Returns:
         R : ndarray of shape (mc_grad.ngorb+mc_grad.nci)
@@ -38,10 +97,13 @@ def diab_response (mc_grad, Lis, mo=None, ci=None, eris=None, **kwargs):
     mc = mc_grad.base
     if mo is None: mo = mc.mo_coeff
     if ci is None: ci = mc.ci
-    if eris is None: eris = mc.ao2mo (mo)
+    if cache is None:
+        cache = diab_response_cache (mc_grad, mo=mo, ci=ci, eris=eris)
     ncore, ncas, nelecas = mc.ncore, mc.ncas, mc.nelecas
     nroots, nocc = mc_grad.nroots, ncore + ncas
     nmo = mo.shape[1]
+    dm1, aapa, vj, vci, B, sgn = [cache[key] for key in ('dm1', 'aapa',
+        'vj', 'vci', 'B', 'sgn')]
 
     # CI vector shift
     L = np.zeros ((nroots, nroots), dtype=Lis.dtype)
@@ -50,23 +112,9 @@ def diab_response (mc_grad, Lis, mo=None, ci=None, eris=None, **kwargs):
     ci_arr = np.asarray (ci)
     Lci = np.tensordot (L, ci_arr, axes=1)
 
-    # Density matrices
-    tril_idx = np.tril_indices (nroots)
-    diag_idx = np.arange (nroots)
-    diag_idx = diag_idx * (diag_idx+1) // 2 + diag_idx
-    tdm1 = np.stack (mc.fcisolver.states_trans_rdm12 (ci_arr[tril_idx[0]],
-        ci_arr[tril_idx[1]], ncas, nelecas)[0], axis=0)
-    dm1 = tdm1[diag_idx,:,:]
-    edm1 = np.stack (mc.fcisolver.states_trans_rdm12 (Lci, ci, ncas,
-        nelecas)[0], axis=0)
+    # Transfer density matrices and potentials
+    edm1 = states_trans_rdm1 (mc, Lci, ci)
     edm1 += edm1.transpose (0,2,1)
-
-    # Potentials
-    aapa = np.zeros ([ncas,ncas,nmo,ncas], dtype=dm1.dtype)
-    for i in range (ncas):
-        j = i + ncore
-        aapa[i,:,:,:] = eris.papa[j][:,:,:]
-    vj = np.tensordot (dm1, aapa, axes=2)
     evj = np.tensordot (edm1, aapa, axes=2)
 
     # Orbital degree of freedom
@@ -75,15 +123,19 @@ def diab_response (mc_grad, Lis, mo=None, ci=None, eris=None, **kwargs):
         for v, d, ev, ed in zip (vj, dm1, evj, edm1)])
     Rorb -= Rorb.T
     
-    # CI degree of freedom 
-    w = coulomb_tensor (mc, mo_coeff=mo, ci=ci, h2eff=aapa[:,:,ncore:nocc,:])
-    const_IJ = -4*np.einsum ('jiik,ik->ij', w, L)
-    const_IJ -= 2*np.einsum ('iijk,ik->ij', w, L)
-    const_IJ += 2*np.einsum ('jkkk,ik->ij', w, L)
+    # CI degree of freedom; w_IJKL = sum_P sgn_P B^P_IJ B^P_KL
+    sB = B * sgn[:,None,None]
+    sB_KK = np.diagonal (sB, axis1=1, axis2=2)
+    B_KK = np.diagonal (B, axis1=1, axis2=2)
+    BL = np.einsum ('pik,ik->pi', B, L)
+    const_IJ = -4*np.einsum ('pji,pi->ij', sB, BL) # w_JIIK L_IK
+    const_IJ -= 2*np.einsum ('pi,pjk,ik->ij', sB_KK, B, L,
+        optimize=True) # w_IIJK L_IK
+    w_JKKK = np.einsum ('pjk,pk->jk', sB, B_KK)
+    const_IJ += 2*np.dot (L, w_JKKK.T) # w_JKKK L_IK
     Rci = np.tensordot (const_IJ, ci_arr, axes=1) # Delta_IJ |J> term
     def contract (v,c): return mc.fcisolver.contract_1e (v, c, ncas, nelecas)
     vj, evj = vj[:,ncore:nocc,:], evj[:,ncore:nocc,:]
-    vci = np.stack ([contract (v,c) for v, c in zip (vj, ci)], axis=0)
     Rci -= 2 * np.tensordot (L, vci, axes=1) # -2 |zW_I> term
     for I in range (nroots):
         Rci[I] += 2 * contract (vj[I], Lci[I]) # 2 W^I_I |z_I> term
@@ -245,8 +297,7 @@ def diab_grad (mc_grad, Lis, atmlst=None, mo=None, ci=None, eris=None,
 
     # Density matrices
     dm1 = np.stack (mc.fcisolver.states_make_rdm1 (ci, ncas, nelecas), axis=0)
-    edm1 = np.stack (mc.fcisolver.states_trans_rdm12 (Lci, ci, ncas,
-        nelecas)[0], axis=0)
+    edm1 = states_trans_rdm1 (mc, Lci, ci)
     edm1 += edm1.transpose (0,2,1)
     dm1_ao = reduce (np.dot, (mo_cas, dm1, moH_cas)).transpose (1,0,2)
     edm1_ao = reduce (np.dot, (mo_cas, edm1, moH_cas)).transpose (1,0,2)
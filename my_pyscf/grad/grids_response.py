@@ -0,0 +1,147 @@
+import numpy as np
+from pyscf import gto
+from pyscf.dft import radi, gen_grid
+
+# Sparse counterpart of pyscf.grad.rks.grids_response_cc. The weights
+# themselves are those of the full Becke partition, i.e., the quadrature
+# weights of the energy. Only their derivative with respect to atomic
+# positions, for the grid of atom A, is built from the atoms within a cutoff
+# distance of A (a neighbor list), so that it costs O(nnbr**2) instead of
+# O(natm**2) pair terms and has shape (nnbr,3,ngrids) instead of
+# (natm,3,ngrids). Atoms beyond the cutoff are taken not to compete for the
+# points of A's grid in the derivative, which is exact for points close to
+# A and only matters far out where the density and therefore the integrand
+# is negligible; the error decays as the cutoff grows.
+
+def get_neighbors (mol, rcut):
+    '''Neighbor list: for each atom, the sorted indices of the atoms
+    (including itself) closer than rcut (in Bohr)'''
+    atm_coords = np.asarray (mol.atom_coords (), order='C')
+    atm_dist = gto.inter_distance (mol, atm_coords)
+    return [np.where (d < rcut)[0] for d in atm_dist]
+
+def _radii_adjust (grids, charges):
+    if grids.radii_adjust == radi.treutler_atomic_radii_adjust:
+        rad = np.sqrt (grids.atomic_radii[charges]) + 1e-200
+    elif grids.radii_adjust == radi.becke_atomic_radii_adjust:
+        rad = grids.atomic_radii[charges] + 1e-200
+    else:
+        return None
+    rr = rad.reshape (-1,1) * (1./rad)
+    a = .25 * (rr.T - rr)
+    a[a<-.5] = -.5
+    a[a>0.5] = 0.5
+    return a
+
+def _partition (coords, nbr_coords, nbr_charges, grids, a_own):
+    '''Becke partition among the atoms nbr and its derivative, as in
+    pyscf.grad.rks.grids_response_cc, for the grid of nbr[a_own]. Only the
+    two contractions of the derivative that the weights need are kept.
+
+    Returns:
+        pbecke : ndarray of shape (nnbr,ngrids)
+        dp_own : ndarray of shape (nnbr,3,ngrids)
+            d/dR_i pbecke[a_own]
+        dp_sum : ndarray of shape (nnbr,3,ngrids)
+            d/dR_i sum_j pbecke[j]
+    '''
+    nnbr, ngrids = nbr_coords.shape[0], coords.shape[0]
+    atm_dist = gto.inter_distance (None, nbr_coords) if nnbr > 1 else (
+        np.zeros ((1,1)))
+    adj = _radii_adjust (grids, nbr_charges)
+    grid_norm_vec = (nbr_coords[:,:,None] - coords.T[None,:,:])
+    grid_dist = np.linalg.norm (grid_norm_vec, axis=1) + 1e-200
+    grid_norm_vec /= grid_dist[:,None,:]
+
+    def pair (ia, ib):
+        g = (grid_dist[ia]-grid_dist[ib]) / atm_dist[ia,ib]
+        p0 = g if adj is None else g + adj[ia,ib]*(1-g**2)
+        p1 = (3 - p0**2) * p0 * .5
+        p2 = (3 - p1**2) * p1 * .5
+        p3 = (3 - p2**2) * p2 * .5
+        return g, p0, p1, p2, p3
+
+    pbecke = np.ones ((nnbr,ngrids))
+    for ia in range (nnbr):
+        for ib in range (ia):
+            p3 = pair (ia, ib)[4]
+            pbecke[ia] *= .5 * (1 - p3 + 1e-200)
+            pbecke[ib] *= .5 * (1 + p3 + 1e-200)
+
+    def get_du (ia, ib):  # JCP 98, 5612 (1993); (B10)
+        uab = nbr_coords[ia] - nbr_coords[ib]
+        duab = 1./atm_dist[ia,ib] * grid_norm_vec[ia]
+        duab-= uab[:,None]/atm_dist[ia,ib]**3 * (grid_dist[ia]-grid_dist[ib])
+        return duab
+
+    # dpbecke[i,j] of the dense code, contracted on the fly with pbecke[j]
+    dp_own = np.zeros ((nnbr,3,ngrids))
+    dp_sum = np.zeros ((nnbr,3,ngrids))
+    def add (i, j, x):
+        x = x * pbecke[j]
+        dp_sum[i] += x
+        if j == a_own: dp_own[i] += x
+
+    for ia in range (nnbr):
+        for ib in range (ia):
+            g, p0, p1, p2, p3 = pair (ia, ib)
+            t_uab = 27./16 * (1-p2**2) * (1-p1**2) * (1-p0**2)
+            if adj is not None: t_uab *= 1 - 2*adj[ia,ib]*g
+            pt_uab =-t_uab / (.5 * (1 - p3 + 1e-200))
+            pt_uba = t_uab / (.5 * (1 + p3 + 1e-200))
+            duab = get_du (ia, ib)
+            duba = get_du (ib, ia)
+            dua = duba if ia == a_own else duab
+            add (ia, ia, pt_uab * dua)
+            add (ia, ib, pt_uba * dua)
+            dub = duab if ib == a_own else duba
+            add (ib, ib, -pt_uba * dub)
+            add (ib, ia, -pt_uab * dub)
+            if ia != a_own and ib != a_own:
+                ua_ub = (grid_norm_vec[ia] - grid_norm_vec[ib]) / atm_dist[ia,ib]
+                add (a_own, ia, -pt_uab * ua_ub)
+                add (a_own, ib, -pt_uba * ua_ub)
+    return pbecke, dp_own, dp_sum
+
+def grids_response_sparse (grids, rcut=20.0):
+    '''Like pyscf.grad.rks.grids_response_cc, but with the derivative of
+    the Becke partition of each atom's grid restricted to a neighbor list
+
+    Args:
+        grids : object of class pyscf.dft.gen_grid.Grids
+
+    Kwargs:
+        rcut : float
+            Cutoff distance (Bohr) of the neighbor list
+
+    Yields, for each atom:
+        coords : ndarray of shape (ngrids,3)
+        w0 : ndarray of shape (ngrids)
+            Weights of the full Becke partition (as in grids.weights)
+        w1 : ndarray of shape (nnbr,3,ngrids)
+            Derivatives of the weights with respect to the positions of
+            the atoms nbr
+        nbr : ndarray of shape (nnbr)
+            Indices of the neighbor atoms
+    '''
+    mol = grids.mol
+    atom_grids_tab = grids.gen_atomic_grids (mol, grids.atom_grid,
+                                             grids.radi_method,
+                                             grids.level, grids.prune)
+    w0_all = gen_grid.get_partition (mol, atom_grids_tab,
+        grids.radii_adjust, grids.atomic_radii, grids.becke_scheme,
+        concat=False)[1]
+    atm_coords = np.asarray (mol.atom_coords (), order='C')
+    charges = mol.atom_charges ()
+    for ia, nbr in enumerate (get_neighbors (mol, rcut)):
+        coords, vol = atom_grids_tab[mol.atom_symbol(ia)]
+        coords = coords + atm_coords[ia]
+        a_own = int (np.searchsorted (nbr, ia))
+        pbecke, dp_own, dp_sum = _partition (coords, atm_coords[nbr],
+            charges[nbr], grids, a_own)
+        z = 1./pbecke.sum (axis=0)
+        w1 = dp_own * z
+        w1 -= pbecke[a_own] * z**2 * dp_sum
+        w1 *= vol
+        yield coords, w0_all[ia], w1, nbr
+
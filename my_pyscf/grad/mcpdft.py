@@ -1,30 +1,195 @@
 from pyscf.mcscf import newton_casscf, casci, mc1step
 from pyscf.grad import rks as rks_grad
 from pyscf.dft import gen_grid
+from pyscf import lib
 from pyscf.lib import logger, pack_tril, current_memory, tag_array
 #from mrh.my_pyscf.grad import sacasscf
 from pyscf.grad import sacasscf
 from pyscf.mcscf.casci import cas_natorb
+from pyscf.fci.direct_spin1 import _unpack_nelec
+from pyscf.fci.addons import transform_ci_for_orbital_rotation
 from mrh.my_pyscf.mcpdft.otpd import get_ontop_pair_density, _grid_ao2mo
 from mrh.my_pyscf.mcpdft.pdft_veff import _contract_vot_rho, _contract_ao_vao
-from mrh.my_pyscf.mcpdft import _dms
+from mrh.my_pyscf.mcpdft import _dms, _gridblocks
+from mrh.my_pyscf.grad.block_cg import block_cg, columnwise
+from mrh.my_pyscf.grad.grids_response import grids_response_sparse
+from mrh.my_pyscf.grad.numeric import fork_pool, pool_call
+from mrh.my_pyscf.dft.gen_grid import reuse_atomic_grids
 from functools import reduce
 from itertools import product
+from collections import deque
 from scipy import linalg
 import numpy as np
 import time, gc
 
 BLKSIZE = gen_grid.BLKSIZE
 
+def _hf_grad_atom_quadrature (mc, ot, coords, w0, qargs, ia=0):
+    '''Quadrature over the grid of one atom for
+    mcpdft_HellmanFeynman_grad; independent of every other atom's grid.
+
+    Args:
+        mc : instance of CASSCF
+        ot : instance of otfnal
+        coords : ndarray of shape (ngrids,3)
+            Grid coordinates
+        w0 : ndarray of shape (ngrids)
+            Grid weights
+        qargs : tuple
+            make_rho, twoCDM, casdm2_pack, mo_occ, mo_occup, idx, max_memory
+            as in mcpdft_HellmanFeynman_grad
+
+    Kwargs:
+        ia : integer
+            Index of the atom, for the log
+
+    Returns:
+        eot : ndarray of shape (ngrids)
+            On-top energy density, to be contracted with the weight
+            derivatives
+        dvxc : ndarray of shape (3,nao)
+            XC response contribution
+        de_grid : ndarray of shape (3)
+            Grid response contribution of atom ia
+    '''
+    make_rho, twoCDM, casdm2_pack, mo_occ, mo_occup, idx, max_memory = qargs
+    mol = mc.mol
+    ncore, ncas = mc.ncore, mc.ncas
+    nao, nocc = mo_occ.shape
+    mo_cas = mo_occ[:,ncore:nocc]
+    eot_atm = np.zeros (coords.shape[0])
+    dvxc = np.zeros ((3,nao))
+    de_grid = np.zeros (3)
+    t1 = (logger.process_clock (), logger.perf_counter ())
+    gc.collect ()
+    ngrids = coords.shape[0]
+    ndao = (1,4)[ot.dens_deriv]
+    ndpi = (1,4)[ot.Pi_deriv]
+    ncols = _gridblocks.ncols_grad (nao, ncas, nocc, ot.dens_deriv,
+        ot.Pi_deriv)
+    blksize = _gridblocks.get_blksize (ncols, ngrids, max_memory,
+        log=logger.new_logger (mc, mc.verbose),
+        label='PDFT HlFn quadrature atom {}'.format (ia))
+    t1 = logger.timer (mc, 'PDFT HlFn quadrature atom {} mask and memory '
+        'setup'.format (ia), *t1)
+    for ip0 in range (0, ngrids, blksize):
+        ip1 = min (ngrids, ip0+blksize)
+        mask = gen_grid.make_mask (mol, coords[ip0:ip1])
+        logger.info (mc, ('PDFT gradient atom {} slice {}-{} of {} '
+            'total').format (ia, ip0, ip1, ngrids))
+        ao = ot._numint.eval_ao (mol, coords[ip0:ip1],
+            deriv=ot.dens_deriv+1, non0tab=mask) 
+        # Need 1st derivs for LDA, 2nd for GGA, etc.
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} ao '
+            'grids').format (ia), *t1)
+        # Slice down ao so as not to confuse the rho and Pi generators
+        if ot.xctype == 'LDA': 
+            aoval = ao[0]
+        if ot.xctype == 'GGA':
+            aoval = ao[:4]
+        rho = make_rho (0, aoval, mask, ot.xctype) / 2.0
+        rho = np.stack ((rho,)*2, axis=0)
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} rho '
+            'calc').format (ia), *t1)
+        Pi = get_ontop_pair_density (ot, rho, aoval, twoCDM, mo_cas,
+            ot.dens_deriv, mask)
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} Pi '
+            'calc').format (ia), *t1)
+
+        # TODO: consistent format requirements for shape of ao grid
+        if ot.xctype == 'LDA': 
+            aoval = ao[:1]
+        moval_occ = _grid_ao2mo (mol, aoval, mo_occ, mask)
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} ao2mo '
+            'grid').format (ia), *t1)
+        aoval = np.ascontiguousarray ([ao[ix].transpose (0,2,1)
+            for ix in idx[:,:ndao]]).transpose (0,1,3,2)
+        ao = None
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} ao grid '
+            'reshape').format (ia), *t1)
+        eot, vot = ot.eval_ot (rho, Pi, weights=w0[ip0:ip1])[:2]
+        vrho, vPi = vot
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} '
+            'eval_ot').format (ia), *t1)
+        puvx_mem = 2 * ndpi * (ip1-ip0) * ncas * ncas * 8 / 1e6
+        remaining_mem = max_memory - current_memory ()[0]
+        logger.info (mc, ('PDFT gradient memory note: working on {} grid '
+            'points; estimated puvx usage = {:.1f} of {:.1f} remaining '
+            'MB').format ((ip1-ip0), puvx_mem, remaining_mem))
+
+        # Weight response is contracted with eot by the caller
+        eot_atm[ip0:ip1] = eot
+
+        # Vpq + Vpqrs * Drs ; I'm not sure why the list comprehension down
+        # there doesn't break ao's stride order but I'm not complaining
+        vrho = _contract_vot_rho (vPi, rho.sum (0), add_vrho=vrho)
+        tmp_dv = np.stack ([ot.get_veff_1body (rho, Pi, [ao_i, moval_occ],
+            w0[ip0:ip1], kern=vrho) for ao_i in aoval], axis=0)
+        tmp_dv = (tmp_dv * mo_occ[None,:,:] 
+            * mo_occup[None,None,:nocc]).sum (2)
+        de_grid += 2 * tmp_dv.sum (1) # Grid response
+        dvxc -= tmp_dv # XC response
+        vrho = tmp_dv = None
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} Vpq + Vpqrs '
+            '* Drs').format (ia), *t1)
+
+        # Vpuvx * Lpuvx ; remember the stupid slowest->fastest->medium
+        # stride order of the ao grid arrays
+        moval_cas = moval_occ = np.ascontiguousarray (
+            moval_occ[...,ncore:].transpose (0,2,1)).transpose (0,2,1)
+        tmp_dv = ot.get_veff_2body_kl (rho, Pi, moval_cas, moval_cas,
+            w0[ip0:ip1], symm=True, kern=vPi) 
+        # tmp_dv.shape = ndpi,ngrids,ncas*(ncas+1)//2
+        tmp_dv = np.tensordot (tmp_dv, casdm2_pack, axes=(-1,-1))
+        # tmp_dv.shape = ndpi, ngrids, ncas, ncas
+        tmp_dv[0] = (tmp_dv[:ndpi] * moval_cas[:ndpi,:,None,:]).sum (0) 
+        # Chain and product rule
+        tmp_dv[1:ndpi] *= moval_cas[0,:,None,:] 
+        # Chain and product rule
+        tmp_dv = tmp_dv.sum (-1) 
+        # tmp_dv.shape = ndpi, ngrids, ncas
+        tmp_dv = np.tensordot (aoval[:,:ndpi], tmp_dv, axes=((1,2),(0,1))) 
+        # tmp_dv.shape = comp, nao (orb), ncas (dm2)
+        tmp_dv = np.einsum ('cpu,pu->cp', tmp_dv, mo_cas) 
+        # tmp_dv.shape = comp, ncas 
+        # it's ok to not vectorize this b/c the quadrature grid is gone
+        de_grid += 2 * tmp_dv.sum (1) # Grid response
+        dvxc -= tmp_dv # XC response
+        tmp_dv = None
+        t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} Vpuvx * '
+            'Lpuvx').format (ia), *t1)
+
+        rho = Pi = eot = vot = vPi = aoval = moval_occ = moval_cas = None
+        gc.collect ()
+    return eot_atm, dvxc, de_grid
+
+def _pool_init_hf_quad (mc, ot, qargs, budget):
+    # The memory limit of a worker is its own usage after the fork plus its
+    # share of what the parent had left
+    qargs = qargs[:-1] + (current_memory ()[0] + budget,)
+    return mc, ot, qargs
+
+def _pool_hf_grad_atom (args, x):
+    mc, ot, qargs = args
+    ia, coords, w0 = x
+    return _hf_grad_atom_quadrature (mc, ot, coords, w0, qargs, ia=ia)
+
 def mcpdft_HellmanFeynman_grad (mc, ot, veff1, veff2, mo_coeff=None, ci=None,
         atmlst=None, mf_grad=None, verbose=None, max_memory=None,
-        auxbasis_response=False):
+        auxbasis_response=False, nproc=None, grid_response_rcut=None):
     '''Modification of pyscf.grad.casscf.kernel to compute instead the
     Hellman-Feynman gradient terms of MC-PDFT. From the differentiated
     Hamiltonian matrix elements, only the core and Coulomb energy parts
     remain. For the renormalization terms, the effective Fock matrix is
     as in CASSCF, but with the same Hamiltonian substutition that is
-    used for the energy response terms. '''
+    used for the energy response terms. The quadrature over the grid of
+    each atom is independent; if nproc > 1, it is distributed over that
+    many worker processes with one OpenMP thread each (see
+    grad.numeric.fork_pool), each of which gets an equal share of the
+    memory left below max_memory. If
+    grid_response_rcut is given, the Becke partition of each atom's grid
+    and its derivative only involve the atoms closer than that (in Bohr);
+    see grids_response.grids_response_sparse. '''
     if mo_coeff is None: mo_coeff = mc.mo_coeff
     if ci is None: ci = mc.ci
     if mf_grad is None: mf_grad = mc._scf.nuc_grad_method()
@@ -56,21 +221,17 @@ def mcpdft_HellmanFeynman_grad (mc, ot, veff1, veff2, mo_coeff=None, ci=None,
     # molecule's actual integrals. The true Coulomb repulsion should already be
     # in veff1, but I need to generate the "fake" vj - vk/2 from veff2
     h1e_mo = mo_coeff.T @ (mc.get_hcore() + veff1) @ mo_coeff + veff2.vhf_c
-    aapa = np.zeros ((ncas,ncas,nmo,ncas), dtype=h1e_mo.dtype)
-    vhf_a = np.zeros ((nmo,nmo), dtype=h1e_mo.dtype)
-    for i in range (nmo):
-        jbuf = veff2.ppaa[i]
-        kbuf = veff2.papa[i]
-        aapa[:,:,i,:] = jbuf[ncore:nocc,:,:]
-        vhf_a[i] = np.tensordot (jbuf, casdm1, axes=2)
-    vhf_a *= 0.5
+    paaa = veff2.get_paaa ()
     # for this potential, vj = vk: vj - vk/2 = vj - vj/2 = vj/2
+    vhf_a = veff2.get_vhf_a (casdm1)
     gfock = np.zeros ((nmo, nmo))
     gfock[:,:ncore] = (h1e_mo[:,:ncore] + vhf_a[:,:ncore]) * 2
     gfock[:,ncore:nocc] = h1e_mo[:,ncore:nocc] @ casdm1
-    gfock[:,ncore:nocc] += np.einsum('uviw,vuwt->it', aapa, casdm2)
+    # einsum ('iuvw,vuwt->it', paaa, casdm2)
+    gfock[:,ncore:nocc] += np.tensordot (paaa, casdm2,
+        axes=((1,2,3),(1,0,2)))
     dme0 = reduce(np.dot, (mo_coeff, (gfock+gfock.T)*.5, mo_coeff.T))
-    aapa = vhf_a = h1e_mo = gfock = None
+    paaa = vhf_a = h1e_mo = gfock = None
 
     if atmlst is None:
         atmlst = range(mol.natm)
@@ -134,120 +295,63 @@ def mcpdft_HellmanFeynman_grad (mc, ot, veff1, veff2, mo_coeff=None, ci=None,
     t1 = logger.timer (mc, 'PDFT HlFn quadrature setup', *t0)
     for k, ia in enumerate (atmlst):
         full_atmlst[ia] = k
-    for ia, (coords, w0, w1) in enumerate (rks_grad.grids_response_cc (
-            ot.grids)):
-        # For the xc potential derivative, I need every grid point in the
-        # entire molecule regardless of atmlist. (Because that's about orbs.)
-        # For the grid and weight derivatives, I only need the gridpoints that
-        # are in atmlst. It is conceivable that I can make this more efficient
-        # by only doing cross-combinations of grids and AOs, but I don't know
-        # how "mask" works yet or how else I could do this.
-        gc.collect ()
-        ngrids = coords.shape[0]
-        ndao = (1,4)[ot.dens_deriv]
-        ndpi = (1,4)[ot.Pi_deriv]
-        ncols = 1.05 * 3 * (ndao*(nao+nocc) + max(ndao*nao,ndpi*ncas*ncas))
-        remaining_floats = (max_memory - current_memory ()[0]) * 1e6 / 8
-        blksize = int (remaining_floats / (ncols*BLKSIZE)) * BLKSIZE
-        blksize = max (BLKSIZE, min (blksize, ngrids, BLKSIZE*1200))
-        t1 = logger.timer (mc, 'PDFT HlFn quadrature atom {} mask and memory '
-            'setup'.format (ia), *t1)
-        for ip0 in range (0, ngrids, blksize):
-            ip1 = min (ngrids, ip0+blksize)
-            mask = gen_grid.make_mask (mol, coords[ip0:ip1])
-            logger.info (mc, ('PDFT gradient atom {} slice {}-{} of {} '
-                'total').format (ia, ip0, ip1, ngrids))
-            ao = ot._numint.eval_ao (mol, coords[ip0:ip1],
-                deriv=ot.dens_deriv+1, non0tab=mask) 
-            # Need 1st derivs for LDA, 2nd for GGA, etc.
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} ao '
-                'grids').format (ia), *t1)
-            # Slice down ao so as not to confuse the rho and Pi generators
-            if ot.xctype == 'LDA': 
-                aoval = ao[0]
-            if ot.xctype == 'GGA':
-                aoval = ao[:4]
-            rho = make_rho (0, aoval, mask, ot.xctype) / 2.0
-            rho = np.stack ((rho,)*2, axis=0)
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} rho '
-                'calc').format (ia), *t1)
-            Pi = get_ontop_pair_density (ot, rho, aoval, twoCDM, mo_cas,
-                ot.dens_deriv, mask)
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} Pi '
-                'calc').format (ia), *t1)
-
-            # TODO: consistent format requirements for shape of ao grid
-            if ot.xctype == 'LDA': 
-                aoval = ao[:1]
-            moval_occ = _grid_ao2mo (mol, aoval, mo_occ, mask)
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} ao2mo '
-                'grid').format (ia), *t1)
-            aoval = np.ascontiguousarray ([ao[ix].transpose (0,2,1)
-                for ix in idx[:,:ndao]]).transpose (0,1,3,2)
-            ao = None
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} ao grid '
-                'reshape').format (ia), *t1)
-            eot, vot = ot.eval_ot (rho, Pi, weights=w0[ip0:ip1])[:2]
-            vrho, vPi = vot
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} '
-                'eval_ot').format (ia), *t1)
-            puvx_mem = 2 * ndpi * (ip1-ip0) * ncas * ncas * 8 / 1e6
-            remaining_mem = max_memory - current_memory ()[0]
-            logger.info (mc, ('PDFT gradient memory note: working on {} grid '
-                'points; estimated puvx usage = {:.1f} of {:.1f} remaining '
-                'MB').format ((ip1-ip0), puvx_mem, remaining_mem))
-
-            # Weight response
-            de_wgt += np.tensordot (eot, w1[atmlst,...,ip0:ip1], axes=(0,2))
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} weight '
-                'response').format (ia), *t1)
-
-            # Find the atoms that are a part of the atomlist
-            # grid correction shouldn't be added if they aren't there
-            # The last stuff to vectorize is in get_veff_2body!
-            k = full_atmlst[ia]
-
-            # Vpq + Vpqrs * Drs ; I'm not sure why the list comprehension down
-            # there doesn't break ao's stride order but I'm not complaining
-            vrho = _contract_vot_rho (vPi, rho.sum (0), add_vrho=vrho)
-            tmp_dv = np.stack ([ot.get_veff_1body (rho, Pi, [ao_i, moval_occ],
-                w0[ip0:ip1], kern=vrho) for ao_i in aoval], axis=0)
-            tmp_dv = (tmp_dv * mo_occ[None,:,:] 
-                * mo_occup[None,None,:nocc]).sum (2)
-            if k >= 0: de_grid[k] += 2 * tmp_dv.sum (1) # Grid response
-            dvxc -= tmp_dv # XC response
-            vrho = tmp_dv = None
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} Vpq + Vpqrs '
-                '* Drs').format (ia), *t1)
-
-            # Vpuvx * Lpuvx ; remember the stupid slowest->fastest->medium
-            # stride order of the ao grid arrays
-            moval_cas = moval_occ = np.ascontiguousarray (
-                moval_occ[...,ncore:].transpose (0,2,1)).transpose (0,2,1)
-            tmp_dv = ot.get_veff_2body_kl (rho, Pi, moval_cas, moval_cas,
-                w0[ip0:ip1], symm=True, kern=vPi) 
-            # tmp_dv.shape = ndpi,ngrids,ncas*(ncas+1)//2
-            tmp_dv = np.tensordot (tmp_dv, casdm2_pack, axes=(-1,-1))
-            # tmp_dv.shape = ndpi, ngrids, ncas, ncas
-            tmp_dv[0] = (tmp_dv[:ndpi] * moval_cas[:ndpi,:,None,:]).sum (0) 
-            # Chain and product rule
-            tmp_dv[1:ndpi] *= moval_cas[0,:,None,:] 
-            # Chain and product rule
-            tmp_dv = tmp_dv.sum (-1) 
-            # tmp_dv.shape = ndpi, ngrids, ncas
-            tmp_dv = np.tensordot (aoval[:,:ndpi], tmp_dv, axes=((1,2),(0,1))) 
-            # tmp_dv.shape = comp, nao (orb), ncas (dm2)
-            tmp_dv = np.einsum ('cpu,pu->cp', tmp_dv, mo_cas) 
-            # tmp_dv.shape = comp, ncas 
-            # it's ok to not vectorize this b/c the quadrature grid is gone
-            if k >= 0: de_grid[k] += 2 * tmp_dv.sum (1) # Grid response
-            dvxc -= tmp_dv # XC response
-            tmp_dv = None
-            t1 = logger.timer (mc, ('PDFT HlFn quadrature atom {} Vpuvx * '
-                'Lpuvx').format (ia), *t1)
-
-            rho = Pi = eot = vot = vPi = aoval = moval_occ = moval_cas = None
-            gc.collect ()
+    qargs = (make_rho, twoCDM, casdm2_pack, mo_occ, mo_occup, idx, max_memory)
+    # For the xc potential derivative, I need every grid point in the
+    # entire molecule regardless of atmlist. (Because that's about orbs.)
+    # For the grid and weight derivatives, I only need the gridpoints that
+    # are in atmlst. It is conceivable that I can make this more efficient
+    # by only doing cross-combinations of grids and AOs, but I don't know
+    # how "mask" works yet or how else I could do this.
+    def _reduce (ia, w1, res):
+        w1, nbr = w1
+        eot, tmp_dv, tmp_de_grid = res
+        # Weight response
+        if nbr is None:
+            de_wgt[:] += np.tensordot (eot, w1[atmlst], axes=(0,2))
+        else:
+            kk = full_atmlst[nbr]
+            idx_nbr = kk >= 0
+            de_wgt[kk[idx_nbr]] += np.tensordot (eot, w1[idx_nbr], axes=(0,2))
+        # Find the atoms that are a part of the atomlist
+        # grid correction shouldn't be added if they aren't there
+        k = full_atmlst[ia]
+        if k >= 0: de_grid[k] += tmp_de_grid
+        dvxc[:] += tmp_dv
+    if grid_response_rcut is None:
+        atm_grids = ((coords, w0, (w1, None)) for coords, w0, w1
+                     in rks_grad.grids_response_cc (ot.grids))
+    else:
+        atm_grids = ((coords, w0, (w1, nbr)) for coords, w0, w1, nbr
+                     in grids_response_sparse (ot.grids,
+                                               rcut=grid_response_rcut))
+    if nproc is None: nproc = 1
+    nproc = min (nproc, mol.natm)
+    if nproc > 1:
+        # The partition-weight derivatives come out of one generator in the
+        # calling process; the workers do the quadrature, and at most 2*nproc
+        # atoms' w1 arrays are kept waiting for their eot.
+        logger.info (mc, 'PDFT HlFn quadrature on %d processes', nproc)
+        budget = (max_memory - current_memory ()[0]) / nproc
+        with fork_pool (nproc, initializer=_pool_init_hf_quad,
+                        initargs=(mc, ot, qargs, budget)) as pool:
+            fn = pool_call (_pool_hf_grad_atom)
+            pending = deque ()
+            for ia, (coords, w0, w1) in enumerate (atm_grids):
+                pending.append ((ia, w1, pool.apply_async (fn,
+                    ((ia, coords, w0),))))
+                if len (pending) >= 2*nproc:
+                    ja, w1, res = pending.popleft ()
+                    _reduce (ja, w1, res.get ())
+            while len (pending):
+                ja, w1, res = pending.popleft ()
+                _reduce (ja, w1, res.get ())
+        t1 = logger.timer (mc, 'PDFT HlFn quadrature', *t1)
+    else:
+        for ia, (coords, w0, w1) in enumerate (atm_grids):
+            _reduce (ia, w1, _hf_grad_atom_quadrature (mc, ot, coords, w0,
+                qargs, ia=ia))
+            t1 = logger.timer (mc, 'PDFT HlFn quadrature atom {}'.format (ia),
+                *t1)
 
     for k, ia in enumerate(atmlst):
         shl0, shl1, p0, p1 = aoslices[ia]
@@ -287,8 +391,93 @@ def mcpdft_HellmanFeynman_grad (mc, ot, veff1, veff2, mo_coeff=None, ci=None,
 
 # TODO: docstrings (parent classes???)
 # TODO: add a consistent threshold for elimination of degenerate-state rotations
+def gen_block_hop (fcasscf, mo, ci, hop, ngorb):
+    '''Block version of the Hessian-vector product function hop returned
+    by newton_casscf.gen_g_hop (fcasscf, mo, ci, eris), acting on the
+    columns of a 2d array at once. The AO-basis Coulomb and exchange
+    matrices of all the columns (mc1step.CASSCF.update_jk_in_ah) are
+    computed by a single get_jk call, i.e., in one pass over the AO
+    integrals; the remaining terms of hop, which only involve MO-basis
+    arrays and CI vectors, are evaluated one column at a time.
+
+    Args:
+        fcasscf : instance of mc1step.CASSCF
+            The same object passed to newton_casscf.gen_g_hop
+        mo : ndarray of shape (nao,nmo)
+        ci : list of ndarrays
+            CI vectors of the states of fcasscf
+        hop : callable
+        ngorb : integer
+            Number of orbital-rotation degrees of freedom
+
+    Returns:
+        hop_block : callable
+            Takes and returns ndarrays of shape (ngorb+nci,k)
+    '''
+    ncore, ncas = fcasscf.ncore, fcasscf.ncas
+    nocc = ncore + ncas
+    mo_c, mo_a, mo_v = mo[:,:ncore], mo[:,ncore:nocc], mo[:,ncore:]
+    casdm1 = fcasscf.fcisolver.make_rdm1 (ci, ncas, fcasscf.nelecas)
+    def hop_block (x):
+        if ncore == 0: # update_jk_in_ah isn't called
+            return np.stack ([hop (xi) for xi in x.T], axis=-1)
+        dms = []
+        for xi in x.T:
+            r = fcasscf.unpack_uniq_var (xi[:ngorb])
+            dm3 = reduce (np.dot, (mo_c, r[:ncore,ncore:], mo_v.T))
+            dm3 = dm3 + dm3.T
+            dm4 = reduce (np.dot, (mo_a, casdm1, r[ncore:nocc], mo.T))
+            dm4 = dm4 + dm4.T
+            dms.extend ([dm3, dm3*2+dm4])
+        vj, vk = fcasscf.get_jk (fcasscf.mol, np.asarray (dms))
+        Ax = []
+        for i, xi in enumerate (x.T):
+            va = reduce (np.dot, (casdm1, mo_a.T, vj[2*i]*2-vk[2*i], mo))
+            vc = reduce (np.dot, (mo_c.T, vj[2*i+1]*2-vk[2*i+1], mo_v))
+            jk_in_ah = lambda *args, v=(va, vc): v
+            with lib.temporary_env (fcasscf, update_jk_in_ah=jk_in_ah):
+                Ax.append (hop (xi))
+        return np.stack (Ax, axis=-1)
+    return hop_block
+
+def _Lvec_key (state):
+    # Transition properties index a pair of states with a list
+    if isinstance (state, (list, np.ndarray)): return tuple (state)
+    return state
+
+def as_scanner (mcpdft_grad, state=None):
+    '''Generate a nuclear gradients scanner (for geometry optimization);
+    see pyscf.grad.sacasscf.as_scanner. At each new geometry, the energy
+    scanner starts from the MOs of the previous geometry projected onto
+    the new basis and from the previous CI vectors, the Lagrange equations
+    start from the multipliers of the previous geometry (see
+    Gradients._warm_start), and the atomic grid templates of the on-top
+    functional's grids are reused rather than recomputed (see
+    dft.gen_grid.gen_atomic_grids).
+
+    Examples:
+
+    >>> from pyscf import gto, scf
+    >>> from mrh.my_pyscf import mcpdft
+    >>> mol = gto.M(atom='N 0 0 0; N 0 0 1.1', verbose=0)
+    >>> mc = mcpdft.CASSCF(scf.RHF(mol), 'tPBE', 4, 4)
+    >>> mc_grad_scanner = mc.nuc_grad_method().as_scanner()
+    >>> etot, grad = mc_grad_scanner(gto.M(atom='N 0 0 0; N 0 0 1.1'))
+    >>> etot, grad = mc_grad_scanner(gto.M(atom='N 0 0 0; N 0 0 1.5'))
+    '''
+    if isinstance (mcpdft_grad, lib.GradScanner): return mcpdft_grad
+    reuse_atomic_grids (mcpdft_grad.base.otfnal.grids)
+    return sacasscf.as_scanner (mcpdft_grad, state=state)
+
 class Gradients (sacasscf.Gradients):
 
+    # Number of worker processes for the Hellmann-Feynman quadrature (see
+    # grad.numeric.fork_pool)
+    nproc = 1
+    # Neighbor-list cutoff (Bohr) for the grid weight response; None = all
+    # atoms
+    grid_response_rcut = None
+
     def __init__(self, pdft, state=None):
         super().__init__(pdft, state=state)
         # TODO: gradient of PDFT state-average energy 
@@ -297,6 +486,9 @@ class Gradients (sacasscf.Gradients):
             self.state = 0
         self.e_mcscf = self.base.e_mcscf
         self._not_implemented_check ()
+        # Lagrange multipliers of the last solution for each state, with
+        # the CI vectors they refer to (warm start at the next geometry)
+        self._Lvec_prev = {}
 
     def _not_implemented_check (self):
         name = self.__class__.__name__
@@ -382,13 +574,14 @@ class Gradients (sacasscf.Gradients):
         fcasscf.ci = ci[state]
         return mcpdft_HellmanFeynman_grad (fcasscf, self.base.otfnal, veff1,
             veff2, mo_coeff=mo, ci=ci[state], atmlst=atmlst, mf_grad=mf_grad,
-            verbose=verbose)
+            verbose=verbose, nproc=self.nproc,
+            grid_response_rcut=self.grid_response_rcut)
 
-    def get_init_guess (self, bvec, Adiag, Aop, precond):
+    def get_init_guess (self, bvec, Adiag, Aop, precond, state=None):
         '''Initial guess should solve the problem for SA-SA rotations'''
         sing_tol = getattr (self, 'sing_tol_sasa', 1e-8)
         ci = self.base.ci
-        state = self.state
+        if state is None: state = self.state
         if self.nroots == 1: ci = [ci,]
         idx_spin = [i for i in range (self.nroots)
                     if self.spin_states[i]==self.spin_states[state]]
@@ -449,8 +642,210 @@ class Gradients (sacasscf.Gradients):
         if self.ngorb: logger.debug (self, 'Lagrange residual orbital norms '
             'after first precondition:\n{}'.format (linalg.norm (
             r1_orb)))
+        return self._warm_start (x0, bvec, Aop, state=state, r0=r1)
+
+    def _project_out_sa (self, x, ci=None):
+        '''Remove from the CI part of x its components along all CI
+        vectors of the state-average space (of the same spin)'''
+        if ci is None: ci = self.base.ci
+        if self.nroots == 1 and isinstance (ci, np.ndarray): ci = [ci,]
+        x_orb, x_ci = self.unpack_uniq_var (x)
+        for i, j in product (range (self.nroots), repeat=2):
+            if self.spin_states[i] != self.spin_states[j]: continue
+            x_ci[i] = x_ci[i] - np.dot (x_ci[i].ravel (),
+                ci[j].ravel ()) * ci[j]
+        return self.pack_uniq_var (x_orb, x_ci)
+
+    def _get_Lvec_prev (self, x0, state=None, ci=None, mo=None):
+        '''Lagrange multipliers of the previous solution for state,
+        transformed to the basis of the current MOs and CI vectors, or None
+        if there isn't a compatible one'''
+        if state is None: state = self.state
+        if ci is None: ci = self.base.ci
+        if mo is None: mo = self.base.mo_coeff
+        if self.nroots == 1 and isinstance (ci, np.ndarray): ci = [ci,]
+        prev = getattr (self, '_Lvec_prev', {}).get (_Lvec_key (state), None)
+        if prev is None: return None
+        Lvec, ci_prev, mo_prev = prev
+        if Lvec.size != x0.size or mo_prev.shape != mo.shape: return None
+        # Overlap of the previous and current MOs; at a new geometry this is
+        # only approximately unitary
+        umat = mo_prev.conj ().T @ self.base._scf.get_ovlp () @ mo
+        return self._transform_Lvec (Lvec, umat, ci_prev, ci)
+
+    def _transform_Lorb_Lci (self, Lorb, Lci, umat, ci_prev, ci):
+        '''Rotate the orbital and CI parts of Lagrange multipliers from
+        the orbitals and CI vectors ci_prev to the orbitals mo_prev @ umat
+        and the CI vectors ci. Also returns the signs of the overlaps
+        between ci_prev, so rotated, and ci.'''
+        ncore, ncas = self.base.ncore, self.base.ncas
+        nocc = ncore + ncas
+        nelec = sum (_unpack_nelec (self.base.nelecas))
+        ucas = umat[ncore:nocc,ncore:nocc]
+        Lorb = umat.conj ().T @ Lorb @ umat
+        Lci1, sgn = [], []
+        for spin, l, c0, c in zip (self.spin_states, Lci, ci_prev, ci):
+            ne = ((nelec+spin)//2, (nelec-spin)//2)
+            l = transform_ci_for_orbital_rotation (l, ncas, ne, ucas)
+            c0 = transform_ci_for_orbital_rotation (c0, ncas, ne, ucas)
+            sgn.append (-1 if np.dot (c.ravel (), c0.ravel ()) < 0 else 1)
+            Lci1.append (sgn[-1] * l)
+        return Lorb, Lci1, sgn
+
+    def _transform_Lvec (self, Lvec, umat, ci_prev, ci):
+        Lorb, Lci = self.unpack_uniq_var (Lvec)
+        Lorb, Lci = self._transform_Lorb_Lci (Lorb, Lci, umat, ci_prev, ci)[:2]
+        return self.pack_uniq_var (Lorb, Lci)
+
+    def _warm_start (self, x0, bvec, Aop, state=None, ci=None, r0=None):
+        '''Replace the non-SA part of the initial guess x0 with the
+        Lagrange multipliers of the same state from the previous solution
+        (i.e., at the previous geometry in a scan or optimization), if
+        that reduces the residual. The SA-SA part of x0, which is solved
+        exactly, is kept. r0, if given, is the residual bvec + Aop (x0),
+        which the caller may already have. No Hessian-vector product is
+        computed if there is no previous solution.'''
+        if not getattr (self, '_Lvec_prev', None): return x0
+        if ci is None: ci = self.base.ci
+        if self.nroots == 1 and isinstance (ci, np.ndarray): ci = [ci,]
+        x1 = self._get_Lvec_prev (x0, state=state, ci=ci)
+        if x1 is None: return x0
+        x0_sa = x0 - self._project_out_sa (x0, ci=ci)
+        x1 = x0_sa + self._project_out_sa (x1, ci=ci)
+        if r0 is None: r0 = bvec + Aop (x0)
+        r0 = linalg.norm (r0)
+        r1 = linalg.norm (bvec + Aop (x1))
+        logger.debug (self, 'Lagrange initial residual: cold start %e; warm '
+            'start %e', r0, r1)
+        if r1 < r0: return x1
         return x0
 
+    def _save_Lvec (self, state, Lvec, ci=None, mo=None):
+        if ci is None: ci = self.base.ci
+        if mo is None: mo = self.base.mo_coeff
+        if self.nroots == 1 and isinstance (ci, np.ndarray): ci = [ci,]
+        self._Lvec_prev[_Lvec_key (state)] = (Lvec.copy (),
+            [c.copy () for c in ci], mo.copy ())
+
+    def solve_lagrange_batch (self, states, mo=None, ci=None, veff1=None,
+            veff2=None, level_shift=None, **kwargs):
+        '''Solve the Lagrange multiplier equations of several states
+        (or several properties) together by block preconditioned
+        conjugate gradient, sharing the Hessian-vector products.
+
+        The SA-SA part of each solution, where the Hessian depends on the
+        state, is solved exactly by get_init_guess; the rest shares a
+        single state-independent Hessian, applied to all unconverged
+        search directions at once with one pass over the AO integrals
+        (see gen_block_hop). Each solution is warm-started from the same
+        state's Lagrange multipliers at the previous geometry, if
+        available.
+
+        Args:
+            states : list of integers
+                Target states
+
+        Kwargs:
+            veff1 : list of length len (states)
+                Contains 1-body PDFT effective potentials of each state
+            veff2 : list of length len (states)
+                Contains 2-body PDFT effective potentials of each state
+
+        Returns:
+            conv : ndarray of shape (len (states)) and dtype bool
+            Lvec : ndarray of shape (nlag, len (states))
+            bvec : ndarray of shape (nlag, len (states))
+        '''
+        log = logger.new_logger (self, self.verbose)
+        if mo is None: mo = self.base.mo_coeff
+        if ci is None: ci = self.base.ci
+        if isinstance (ci, np.ndarray): ci = [ci] # hack hack hack...
+        if level_shift is None: level_shift = self.level_shift
+        if veff1 is None or veff2 is None:
+            veff1, veff2 = [], []
+            for state in states:
+                v1, v2 = self.base.get_pdft_veff (mo, ci, incl_coul=True,
+                    paaa_only=True, state=state)
+                veff1.append (v1)
+                veff2.append (v2)
+        eris = self.eris = self.base.ao2mo (mo)
+        ci_sa = ci[0] if self.nroots == 1 else ci
+        fcasscf = self.make_fcasscf_sa ()
+        hop, Adiag = newton_casscf.gen_g_hop (fcasscf, mo, ci_sa, eris,
+            self.verbose)[2:]
+        precond = self.get_lagrange_precond (Adiag, level_shift=level_shift,
+            ci=ci)
+        # Search directions lie outside of the SA space, where every state
+        # has the same Hessian
+        hop_block = gen_block_hop (fcasscf, mo, ci_sa, hop, self.ngorb)
+        project = sacasscf.Gradients.project_Aop (self, lambda x: x, ci, None)
+        def Aop (x):
+            return np.stack ([project (Ax) for Ax in hop_block (x).T],
+                axis=-1)
+        bvec, x0, r0 = [], [], []
+        for state, v1, v2 in zip (states, veff1, veff2):
+            b = self.get_wfn_response (state=state, mo=mo, ci=ci, veff1=v1,
+                veff2=v2, **kwargs)
+            Aop_state = self.project_Aop (hop, ci_sa, state)
+            x = self.get_init_guess (b, Adiag, Aop_state, precond,
+                state=state)
+            bvec.append (b)
+            x0.append (x)
+            r0.append (self._project_out_sa (-(b + Aop_state (x)), ci=ci))
+        bvec, x0, r0 = [np.stack (x, axis=-1) for x in (bvec, x0, r0)]
+        conv, dx, it = block_cg (Aop, r0,
+            precond=columnwise (precond), tol=self.conv_rtol,
+            atol=self.conv_atol, max_cycle=self.max_cycle, log=log)
+        Lvec = x0 + dx
+        for state, L in zip (states, Lvec.T):
+            self._save_Lvec (state, L, ci=ci, mo=mo)
+        log.info ('Lagrange multiplier determination for %d states %s after '
+                  '%d block iterations', len (states), ('not converged',
+                  'converged')[int (np.all (conv))], it)
+        return conv, Lvec, bvec
+
+    def kernel_batch (self, states, mo=None, ci=None, atmlst=None,
+            **kwargs):
+        '''Gradients of several states, with all Lagrange equations
+        solved together (see solve_lagrange_batch)
+
+        Args:
+            states : list of integers
+                Target states
+
+        Returns:
+            de : ndarray of shape (len (states), len (atmlst), 3)
+        '''
+        t0 = (logger.process_clock (), logger.perf_counter ())
+        if mo is None: mo = self.base.mo_coeff
+        if ci is None: ci = self.base.ci
+        if isinstance (ci, np.ndarray): ci = [ci] # hack hack hack...
+        if atmlst is not None: self.atmlst = atmlst
+        atmlst = self.atmlst
+        if self.verbose >= logger.WARN: self.check_sanity ()
+        veff1, veff2 = [], []
+        for state in states:
+            v1, v2 = self.base.get_pdft_veff (mo, ci, incl_coul=True,
+                paaa_only=True, state=state)
+            veff1.append (v1)
+            veff2.append (v2)
+        conv, Lvec, bvec = self.solve_lagrange_batch (states, mo=mo, ci=ci,
+            veff1=veff1, veff2=veff2, **kwargs)
+        self.converged = np.all (conv)
+        mf_grad = self.base._scf.nuc_grad_method ()
+        de = []
+        for state, L, v1, v2 in zip (states, Lvec.T, veff1, veff2):
+            ham_response = self.get_ham_response (state=state, mo=mo, ci=ci,
+                veff1=v1, veff2=v2, eris=self.eris, mf_grad=mf_grad,
+                atmlst=atmlst)
+            LdotJnuc = self.get_LdotJnuc (L, state=state, mo=mo, ci=ci,
+                eris=self.eris, mf_grad=mf_grad, atmlst=atmlst)
+            de.append (ham_response + LdotJnuc)
+        self.de = np.stack (de, axis=0)
+        logger.timer (self, 'Lagrange gradients for {} states'.format (
+            len (states)), *t0)
+        return self.de
+
     def kernel (self, **kwargs):
         '''Cache the effective Hamiltonian terms so you don't have to
         calculate them twice
@@ -466,7 +861,11 @@ class Gradients (sacasscf.Gradients):
         if ('veff1' not in kwargs) or ('veff2' not in kwargs):
             kwargs['veff1'], kwargs['veff2'] = self.base.get_pdft_veff (mo,
                 ci, incl_coul=True, paaa_only=True, state=state)
-        return super().kernel (**kwargs)
+        de = super().kernel (**kwargs)
+        self._save_Lvec (state, self.Lvec, ci=ci, mo=mo)
+        return de
+
+    as_scanner = as_scanner
 
     def project_Aop (self, Aop, ci, state):
         '''Wrap the Aop function to project out redundant degrees of
@@ -3,6 +3,7 @@ import numpy as np
 from scipy import linalg
 from mrh.my_pyscf import mcpdft
 from mrh.my_pyscf.grad import mcpdft as mcpdft_grad
+from mrh.my_pyscf.grad.block_cg import block_cg, columnwise
 from pyscf import lib
 from pyscf.lib import logger
 from pyscf.fci import direct_spin1
@@ -183,21 +184,46 @@ def get_diabfns (obj):
         diab_grad : callable
             Computes the gradient of the MS objective function wrt
             geometry perturbation
+        diab_response_cache : callable
+            Computes the intermediates of diab_response which do not
+            depend on the intermediate-state rotation vector
     '''
     if obj.upper () == 'CMS':
         from mrh.my_pyscf.grad.cmspdft import diab_response, diab_grad
+        from mrh.my_pyscf.grad.cmspdft import diab_response_cache
     else:
         raise RuntimeError ('MS-PDFT type not supported')
-    return diab_response, diab_grad
+    return diab_response, diab_grad, diab_response_cache
+
+def _cache_ao_derivs (mf_grad, mol):
+    '''Memoize the overlap and core-Hamiltonian derivative integrals of
+    mf_grad, which are otherwise recomputed by every Hellmann-Feynman and
+    Lagrange term of every state in a batch of gradient calculations'''
+    get_ovlp0 = mf_grad.get_ovlp
+    hcore_generator0 = mf_grad.hcore_generator
+    s1 = get_ovlp0 (mol)
+    hcore_deriv0 = hcore_generator0 (mol)
+    h1 = {}
+    def hcore_deriv (atm_id):
+        if atm_id not in h1: h1[atm_id] = hcore_deriv0 (atm_id)
+        return h1[atm_id]
+    def get_ovlp (mol1=None):
+        if mol1 is None or mol1 is mol: return s1
+        return get_ovlp0 (mol1)
+    def hcore_generator (mol1=None):
+        if mol1 is None or mol1 is mol: return hcore_deriv
+        return hcore_generator0 (mol1)
+    mf_grad.get_ovlp = get_ovlp
+    mf_grad.hcore_generator = hcore_generator
+    return mf_grad
 
 # TODO: docstring? especially considering the "si_bra," "si_ket" 
 # functionality??
 # TODO: figure out how to log the gradients with the right method name!
 class Gradients (mcpdft_grad.Gradients):
 
-    # Preconditioner solves the IS problem; hence, get_init_guess rewrite is 
-    # unnecessary
-    get_init_guess = sacasscf_grad.Gradients.get_init_guess
+    # Preconditioner solves the IS problem; hence, get_init_guess only needs
+    # the warm start (see below)
     project_Aop = sacasscf_grad.Gradients.project_Aop
 
     def __init__(self, mc):
@@ -210,9 +236,10 @@ class Gradients (mcpdft_grad.Gradients):
         self.conv_atol = min (def_tol0, def_tol1)
         self.sing_step_tol = SING_STEP_TOL
         mcpdft_grad.Gradients.__init__(self, mc)
-        r, g = get_diabfns (self.base.diabatization)
+        r, g, c = get_diabfns (self.base.diabatization)
         self._diab_response = r
         self._diab_grad = g
+        self._diab_response_cache = c
         self.nlag += self.nis
 
     @property
@@ -222,6 +249,8 @@ class Gradients (mcpdft_grad.Gradients):
         return self._diab_response (self, Lis, **kwargs)
     def diab_grad (self, Lis, **kwargs):
         return self._diab_grad (self, Lis, **kwargs)
+    def diab_response_cache (self, **kwargs):
+        return self._diab_response_cache (self, **kwargs)
 
     def kernel (self, state=None, mo=None, ci=None, si=None, _freeze_is=False, 
             **kwargs):
@@ -256,6 +285,110 @@ class Gradients (mcpdft_grad.Gradients):
             si=si, d2f=d2f, veff1=veff1, veff2=veff2, _freeze_is=_freeze_is,
             **kwargs)
 
+    def kernel_batch (self, states, mo=None, ci=None, si=None, atmlst=None,
+            level_shift=None, _freeze_is=False, **kwargs):
+        '''Compute the gradients of several states at once. The MO-basis
+        ERIs, the AO derivative integrals, the diabatizer Hessian and
+        response, and the PDFT effective potentials and diagonal PDFT
+        response and Hellmann-Feynman terms of each intermediate state are
+        computed once for all target states, instead of once per target
+        state. (Each intermediate state still has its own pass over the
+        grid.) The Lagrange equations of all states are solved together by
+        block preconditioned conjugate gradient, with one pass over the AO
+        integrals per block Hessian-vector product (see _get_Aop_Adiag).
+
+        Args:
+            states : list
+                Elements are target states; integers or, as for
+                NonAdiabaticCouplings, tuples (ket, bra)
+
+        Returns:
+            de : ndarray of shape (len (states), len (atmlst), 3)
+                Gradients (or NACs) of each element of states
+        '''
+        t0 = (logger.process_clock (), logger.perf_counter ())
+        log = logger.new_logger (self, self.verbose)
+        if mo is None: mo = self.base.mo_coeff
+        if ci is None: ci = self.base.ci
+        if si is None: si = self.base.si
+        if isinstance (ci, np.ndarray): ci = [ci] # hack hack hack...
+        if atmlst is not None: self.atmlst = atmlst
+        atmlst = self.atmlst
+        if level_shift is None: level_shift = self.level_shift
+        nroots, nlag = self.nroots, self.nlag - self.nis
+        if self.verbose >= logger.WARN: self.check_sanity ()
+
+        # State-independent intermediates
+        eris = self.eris = self.base.ao2mo (mo)
+        mf_grad = _cache_ao_derivs (self.base._scf.nuc_grad_method (),
+            self.mol)
+        d2f = self.base.diabatizer (ci=ci)[2]
+        de_nuc = mf_grad.grad_nuc (self.mol, atmlst)
+        si_diag = []
+        for state in states:
+            ket, bra = _unpack_state (state)
+            si_diag.append (si[:,bra] * si[:,ket])
+        idx_amp = np.any (np.asarray (si_diag) != 0, axis=0)
+        veff1, veff2 = [], []
+        wfn_pdft, ham_pdft = [None,]*nroots, [None,]*nroots
+        for i in range (nroots):
+            v1, v2 = self.base.get_pdft_veff (mo, ci, incl_coul=True,
+                paaa_only=True, state=i)
+            veff1.append (v1)
+            veff2.append (v2)
+            if not idx_amp[i]: continue
+            wfn_pdft[i] = mcpdft_grad.Gradients.get_wfn_response (self,
+                state=i, mo=mo, ci=ci, veff1=v1, veff2=v2, nlag=nlag,
+                **kwargs)
+            ham_pdft[i] = mcpdft_grad.Gradients.get_ham_response (self,
+                state=i, mo=mo, ci=ci, veff1=v1, veff2=v2, eris=eris,
+                mf_grad=mf_grad, atmlst=atmlst, verbose=0, **kwargs) - de_nuc
+        t0 = log.timer ('MS-PDFT batch gradient intermediates', *t0)
+
+        # Lagrange multipliers
+        bvec = np.stack ([self.get_wfn_response (state=state, mo=mo, ci=ci,
+            si=si, eris=eris, veff1=veff1, veff2=veff2, d2f=d2f,
+            _freeze_is=_freeze_is, wfn_pdft=wfn_pdft, **kwargs)
+            for state in states], axis=-1)
+        Aop, Aop_block, Adiag = self._get_Aop_Adiag (mo=mo, ci=ci, eris=eris,
+            d2f=d2f, level_shift=level_shift)
+        precond = self.get_lagrange_precond (Adiag, level_shift=level_shift,
+            ci=ci, d2f=d2f)
+        x0 = []
+        for state, b in zip (states, bvec.T):
+            x0.append (self.get_init_guess (b, Adiag, Aop, precond,
+                state=state))
+        x0 = np.stack (x0, axis=-1)
+        conv, Lvec, it = block_cg (Aop_block, -bvec, x0=x0,
+            precond=columnwise (precond), tol=self.conv_rtol,
+            atol=self.conv_atol, max_cycle=self.max_cycle, log=log)
+        for state, L in zip (states, Lvec.T):
+            self._save_Lvec (state, L, ci=ci, mo=mo)
+        self.converged = np.all (conv)
+        log.info ('Lagrange multiplier determination for %d states %s after '
+                  '%d block iterations', len (states), ('not converged',
+                  'converged')[int (self.converged)], it)
+        t0 = log.timer ('MS-PDFT batch Lagrange multiplier solution', *t0)
+
+        # Hellmann-Feynman and Lagrange terms
+        de = []
+        for state, L in zip (states, Lvec.T):
+            ham_response = self.get_ham_response (state=state, mo=mo, ci=ci,
+                si=si, eris=eris, veff1=veff1, veff2=veff2, mf_grad=mf_grad,
+                atmlst=atmlst, ham_pdft=ham_pdft, **kwargs)
+            LdotJnuc = self.get_LdotJnuc (L, state=state, atmlst=atmlst,
+                mo=mo, ci=ci, eris=eris, mf_grad=mf_grad, d2f=d2f)
+            de.append (ham_response + LdotJnuc)
+            if self.verbose >= logger.INFO:
+                logger.info (self, '--------------- %s gradient for state %s '
+                    '---------------', self.base.__class__.__name__, state)
+                rhf_grad._write (self, self.mol, de[-1], atmlst)
+                logger.info (self, '----------------------------------------'
+                    '------')
+        self.de = np.stack (de, axis=0)
+        log.timer ('MS-PDFT batch gradients', *t0)
+        return self.de
+
     def pack_uniq_var (self, xorb, xci, xis=None):
         x = sacasscf_grad.Gradients.pack_uniq_var (self, xorb, xci)
         if xis is not None: x = np.append (x, xis)
@@ -268,6 +401,38 @@ class Gradients (mcpdft_grad.Gradients):
         if len (xis)==nis: return xorb, xci, xis
         return xorb, xci
 
+    def _transform_Lvec (self, Lvec, umat, ci_prev, ci):
+        Lorb, Lci, Lis = self.unpack_uniq_var (Lvec)
+        Lorb, Lci, sgn = self._transform_Lorb_Lci (Lorb, Lci, umat, ci_prev,
+            ci)
+        sgn = np.multiply.outer (sgn, sgn)[np.tril_indices (self.nroots, k=-1)]
+        return self.pack_uniq_var (Lorb, Lci, sgn*Lis)
+
+    def get_init_guess (self, bvec, Adiag, Aop, precond, state=None):
+        x0 = sacasscf_grad.Gradients.get_init_guess (self, bvec, Adiag, Aop,
+            precond)
+        return self._warm_start (x0, bvec, Aop, state=state)
+
+    def _warm_start (self, x0, bvec, Aop, state=None, ci=None):
+        '''Replace the initial guess x0 with the Lagrange multipliers of
+        the same state from the previous solution (i.e., at the previous
+        geometry in a scan or optimization), if that reduces the
+        residual. The CI part of the previous multipliers is projected
+        onto the orthogonal complement of the current model space, which
+        is represented by the IS part instead.'''
+        if ci is None: ci = self.base.ci
+        x1 = self._get_Lvec_prev (x0, state=state, ci=ci)
+        if x1 is None: return x0
+        Lorb, Lci, Lis = self.unpack_uniq_var (x1)
+        Lci = self._separate_is_component (Lci, ci=ci)[0]
+        x1 = self.pack_uniq_var (Lorb, Lci, Lis)
+        r0 = linalg.norm (bvec + Aop (x0))
+        r1 = linalg.norm (bvec + Aop (x1))
+        logger.debug (self, 'Lagrange initial residual: cold start %e; warm '
+            'start %e', r0, r1)
+        if r1 < r0: return x1
+        return x0
+
     def _get_is_component (self, xci, ci=None, symm=-1):
         # TODO: state-average-mix
         if ci is None: ci = self.base.ci
@@ -304,7 +469,9 @@ class Gradients (mcpdft_grad.Gradients):
 
     def get_wfn_response (self, si_bra=None, si_ket=None, state=None, mo=None,
             ci=None, si=None, eris=None, veff1=None, veff2=None,
-            _freeze_is=False, d2f=None, **kwargs):
+            _freeze_is=False, d2f=None, wfn_pdft=None, **kwargs):
+        '''wfn_pdft, if provided, is a list of the precomputed diagonal
+        PDFT responses of each intermediate state (see kernel_batch)'''
         if mo is None: mo = self.base.mo_coeff
         if ci is None: ci = self.base.ci
         if si is None: si = self.base.si
@@ -323,8 +490,11 @@ class Gradients (mcpdft_grad.Gradients):
         g_all_pdft = np.zeros (nlag)
         for i, (amp, c, v1, v2) in enumerate (zip (si_diag, ci, veff1, veff2)):
             if not amp: continue
-            g_i = mcpdft_grad.Gradients.get_wfn_response (self,
-                state=i, mo=mo, ci=ci, veff1=v1, veff2=v2, nlag=nlag, **kwargs)
+            if wfn_pdft is not None and wfn_pdft[i] is not None:
+                g_i = wfn_pdft[i]
+            else:
+                g_i = mcpdft_grad.Gradients.get_wfn_response (self, state=i,
+                    mo=mo, ci=ci, veff1=v1, veff2=v2, nlag=nlag, **kwargs)
             g_all_pdft += amp * g_i
             if self.verbose >= lib.logger.DEBUG:
                 g_orb, g_ci = self.unpack_uniq_var (g_i)
@@ -363,6 +533,18 @@ class Gradients (mcpdft_grad.Gradients):
 
     def get_Aop_Adiag (self, verbose=None, mo=None, ci=None, eris=None,
             level_shift=None, d2f=None, **kwargs):
+        Aop, Aop_block, Adiag = self._get_Aop_Adiag (verbose=verbose, mo=mo,
+            ci=ci, eris=eris, level_shift=level_shift, d2f=d2f, **kwargs)
+        return Aop, Adiag
+
+    def _get_Aop_Adiag (self, verbose=None, mo=None, ci=None, eris=None,
+            level_shift=None, d2f=None, **kwargs):
+        '''Aop and Adiag of get_Aop_Adiag, and Aop_block, which is the
+        same operator acting on the columns of a 2d array at once (for
+        block_cg). Aop_block makes one pass over the AO integrals per call
+        for all columns (see grad.mcpdft.gen_block_hop) and computes the
+        diabatizer response, which is linear in the IS component, once for
+        each IS degree of freedom the first time it is needed.'''
         if verbose is None: verbose = self.verbose
         if mo is None: mo = self.base.mo_coeff
         if ci is None: ci = self.base.ci
@@ -376,12 +558,12 @@ class Gradients (mcpdft_grad.Gradients):
         fcasscf = self.make_fcasscf_sa ()
         hop, Adiag = newton_casscf.gen_g_hop (fcasscf, mo, ci, eris,
             verbose)[2:]
-        ngorb, nci = self.ngorb, self.nci
-        # TODO: cacheing diab_response? or an x=0 branch?
-        def Aop (x):
+        hop_block = mcpdft_grad.gen_block_hop (fcasscf, mo, ci, hop,
+            self.ngorb)
+        ngorb, nci, nis = self.ngorb, self.nci, self.nis
+        diab_cache = self.diab_response_cache (mo=mo, ci=ci, eris=eris)
+        def finish_Aop (x, Ax_v):
             x_v, x_is = x[:ngorb+nci], x[ngorb+nci:]
-            Ax_v = hop (x_v) + self.diab_response (x_is, mo=mo, ci=ci,
-                eris=eris)
             x_c = self.unpack_uniq_var (x_v)[1]
             Ax_is = np.dot (d2f, x_is)
             Ax_o, Ax_c = self.unpack_uniq_var (Ax_v)
@@ -391,7 +573,26 @@ class Gradients (mcpdft_grad.Gradients):
             Ax_c = [a1 + (w*a2) for a1, a2, w in zip (Ax_c, Ax_c_od,
                 self.base.weights)]
             return self.pack_uniq_var (Ax_o, Ax_c, Ax_is)
-        return Aop, Adiag
+        def Aop (x):
+            x_v, x_is = x[:ngorb+nci], x[ngorb+nci:]
+            Ax_v = hop (x_v)
+            if np.any (x_is): # linear in x_is
+                Ax_v += self.diab_response (x_is, mo=mo, ci=ci, eris=eris,
+                    cache=diab_cache)
+            return finish_Aop (x, Ax_v)
+        diab_mat = []
+        def Aop_block (x):
+            x_v, x_is = x[:ngorb+nci], x[ngorb+nci:]
+            Ax_v = hop_block (x_v)
+            if np.any (x_is):
+                if not len (diab_mat):
+                    diab_mat.append (np.stack ([self.diab_response (e,
+                        mo=mo, ci=ci, eris=eris, cache=diab_cache)
+                        for e in np.eye (nis)], axis=-1))
+                Ax_v += np.dot (diab_mat[0], x_is)
+            return np.stack ([finish_Aop (xi, Ax_vi) for xi, Ax_vi
+                              in zip (x.T, Ax_v.T)], axis=-1)
+        return Aop, Aop_block, Adiag
 
     def get_lagrange_precond (self, Adiag, level_shift=None, ci=None, d2f=None,
             **kwargs):
@@ -403,9 +604,13 @@ class Gradients (mcpdft_grad.Gradients):
 
     def get_ham_response (self, si_bra=None, si_ket=None, state=None, mo=None,
             ci=None, si=None, eris=None, veff1=None, veff2=None, mf_grad=None, 
-            atmlst=None, verbose=None, **kwargs):
+            atmlst=None, verbose=None, ham_pdft=None, **kwargs):
         '''write mspdft heff Hellmann-Feynman calculator; sum over
         diagonal PDFT Hellmann-Feynman terms
+
+        ham_pdft, if provided, is a list of the precomputed diagonal PDFT
+        Hellmann-Feynman terms of each intermediate state, less the n-n
+        terms (see kernel_batch)
         '''
         if atmlst is None: atmlst = self.atmlst
         if mo is None: mo = self.base.mo_coeff
@@ -428,9 +633,12 @@ class Gradients (mcpdft_grad.Gradients):
         # Diagonal: PDFT component
         for i, (amp, c, v1, v2) in enumerate (zip (si_diag, ci, veff1, veff2)):
             if not amp: continue
-            de_i = mcpdft_grad.Gradients.get_ham_response (self, state=i,
-                mo=mo, ci=ci, veff1=v1, veff2=v2, eris=eris, mf_grad=mf_grad,
-                verbose=0, **kwargs) - de_nuc
+            if ham_pdft is not None and ham_pdft[i] is not None:
+                de_i = ham_pdft[i]
+            else:
+                de_i = mcpdft_grad.Gradients.get_ham_response (self, state=i,
+                    mo=mo, ci=ci, veff1=v1, veff2=v2, eris=eris,
+                    mf_grad=mf_grad, verbose=0, **kwargs) - de_nuc
             log.debug ('MS-PDFT gradient int-state {} EPDFT terms:\n{}'.format
                 (i, de_i))
             log.debug ('Factor for these terms: {}'.format (amp))
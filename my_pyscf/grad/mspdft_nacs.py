@@ -115,6 +115,20 @@ class NonAdiabaticCouplings (mspdft_grad.Gradients):
             nac /= e_bra - e_ket
         return nac
 
+    def kernel_batch (self, states, mult_ediff=None, **kwargs):
+        '''NACs for a list of (ket, bra) pairs, sharing intermediates and
+        solving all Lagrange equations together (see
+        mspdft_grad.Gradients.kernel_batch)'''
+        if mult_ediff is None: mult_ediff = self.mult_ediff
+        nac = mspdft_grad.Gradients.kernel_batch (self, states, **kwargs)
+        if not mult_ediff:
+            for i, state in enumerate (states):
+                ket, bra = _unpack_state (state)
+                e_bra = self.base.e_states[bra]
+                e_ket = self.base.e_states[ket]
+                nac[i] /= e_bra - e_ket
+        return nac
+
 if __name__=='__main__':
     from pyscf import gto, scf, mcscf
     from mrh.my_pyscf import mcpdft
@@ -1,33 +1,186 @@
 import numpy as np
+import functools
+import multiprocessing
 from pyscf.grad import rhf as rhf_grad
+from pyscf.symm import geom as symm_geom
 from pyscf.lib import param, logger
+from pyscf import lib
 
 STEPSIZE_DEFAULT=0.001
 SCANNER_VERBOSE_DEFAULT=4
+NPROC_DEFAULT=1
+NPOINT_DEFAULT=2
 
-# MRH 05/04/2020: I don't know why I have to present the molecule instead
-# of just the coordinates, but somehow I can't get the units right any other
-# way.
+# Central finite-difference stencils: {npoint: ((displacement/stepsize, weight), ...)}
+STENCILS = {2: ((1, 1/2), (-1, -1/2)),
+            4: ((2, -1/12), (1, 8/12), (-1, -8/12), (-2, 1/12))}
 
-def _make_mol (mol, coords):
-    return [[mol.atom_symbol (i), coords[i,:]] for i in range (mol.natm)]
+def _get_guess (method):
+    ''' Reference wave function (MOs, CI vectors, and SCF MOs) from which each displaced
+    calculation is warm-started '''
+    guess = {}
+    for key in ('mo_coeff', 'ci'):
+        if getattr (method, key, None) is not None: guess[key] = getattr (method, key)
+    mf = getattr (method, '_scf', None)
+    if getattr (mf, 'mo_coeff', None) is not None:
+        guess['_scf'] = (mf.mo_coeff, mf.mo_occ)
+    return guess
 
-def _numgrad_1df (mol, scanner, coords, iatm, icoord, delta=0.002):
-    coords[iatm,icoord] += delta
-    ep = scanner (_make_mol (mol, coords))
-    ep_states = np.array (getattr (scanner, 'e_states', [ep]))
-    coords[iatm,icoord] -= 2*delta
-    em = scanner (_make_mol (mol, coords))
-    em_states = np.array (getattr (scanner, 'e_states', [em]))
-    coords[iatm,icoord] += delta
-    de_states = (ep_states - em_states) / (2*delta)*param.BOHR
-    return (ep-em) / (2*delta)*param.BOHR, de_states
+def _set_guess (scanner, guess):
+    for key in ('mo_coeff', 'ci'):
+        if key in guess: setattr (scanner, key, guess[key])
+    if '_scf' in guess:
+        scanner._scf.mo_coeff, scanner._scf.mo_occ = guess['_scf']
+
+def _scan_energy (mol, scanner, coords, guess=None):
+    if guess is not None: _set_guess (scanner, guess)
+    e = scanner (mol.set_geom_ (coords, unit='Angstrom', inplace=False))
+    e_states = np.array (getattr (scanner, 'e_states', [e]))
+    return e, e_states
+
+# Worker pools. Work that runs whole calculations (numeric derivatives) or
+# grid quadratures in parallel is distributed over worker processes forked
+# from the calling one, which inherit all of its data, rather than over
+# threads, so that each worker has its own copy of mutable objects such as
+# scanners and nothing serializes on the GIL. A forked child deadlocks in
+# its first multithreaded OpenMP region if the parent has already used
+# OpenMP (libgomp is not fork-safe), so the workers run with a single
+# OpenMP thread; the parallelism comes from the number of workers.
+_pool_args = None
+
+def _pool_init (initializer, initargs):
+    global _pool_args
+    lib.num_threads (1)
+    _pool_args = initargs if initializer is None else initializer (*initargs)
+
+def _pool_call (fn, x):
+    return fn (_pool_args, x)
+
+def fork_pool (nproc, initializer=None, initargs=()):
+    ''' Pool of nproc worker processes forked from this one, each running with a
+    single OpenMP thread. Requires the 'fork' start method.
+
+    Args:
+        nproc : integer
+            Number of worker processes
+
+    Kwargs:
+        initializer : callable or None
+            Called as initializer (*initargs) once in every worker. Its return value
+            (initargs itself if initializer is None) is passed as the first argument to
+            the functions wrapped by pool_call.
+        initargs : tuple
+            Inherited by the workers, not pickled
+
+    Returns:
+        pool : instance of :class:`multiprocessing.pool.Pool`
+    '''
+    ctx = multiprocessing.get_context ('fork')
+    return ctx.Pool (nproc, initializer=_pool_init, initargs=(initializer, initargs))
+
+def pool_call (fn):
+    ''' Wrap fn (args, x), where args is the per-worker data set up by fork_pool, as a
+    function of x to be passed to the map and apply methods of the pool '''
+    return functools.partial (_pool_call, fn)
+
+def detach_chkfile (method):
+    ''' Workers must not fight over the parent's checkpoint file '''
+    method.chkfile = None
+    if getattr (method, '_scf', None) is not None: method._scf.chkfile = None
+    return method
+
+def _pool_init_scan (mol, scanner, guess):
+    detach_chkfile (scanner)
+    return mol, scanner, guess
+
+def _pool_scan_energy (args, coords):
+    mol, scanner, guess = args
+    return _scan_energy (mol, scanner, coords, guess=guess)
+
+def symm_unique_displacements (mol, atmlst=None, tol=1e-5):
+    ''' Use the Abelian point-group operations (C2 rotations about and reflections through
+    the Cartesian axes, and inversion through the center of charge) that leave the geometry
+    of mol unchanged to reduce the set of Cartesian displacements needed for a numeric
+    gradient. The operations are detected from the coordinates, so the molecule has to be
+    oriented with its symmetry elements along the Cartesian axes (as PySCF does when
+    mol.symmetry is set) to benefit from this. The energy is assumed to be invariant under
+    the same operations.
+
+    Args:
+        mol : instance of :class:`gto.Mole`
+
+    Kwargs:
+        atmlst : list of integers
+            Atoms whose gradients are required. Default is all atoms.
+        tol : float
+            Tolerance (in Bohr) for recognizing symmetry-equivalent atoms
+
+    Returns:
+        disps : list of tuples (iatm, icoord)
+            The symmetry-unique displacements
+        images : list of tuples (iatm, icoord, jatm, sign)
+            For every required gradient component (iatm, icoord) not among disps,
+            de[iatm,icoord] = sign * de[jatm,icoord]. sign = 0 means the component
+            vanishes by symmetry.
+    '''
+    if atmlst is None: atmlst = list (range (mol.natm))
+    charges = mol.atom_charges ()
+    coords = mol.atom_coords ()
+    coords = coords - np.dot (charges, coords)[None,:] / charges.sum ()
+    symbs = [mol.atom_symbol (i) for i in range (mol.natm)]
+    ops = []
+    for op in symm_geom.symm_ops ('D2h').values ():
+        op = np.diag (op) if np.ndim (op) == 2 else np.repeat (op, 3)
+        perm = []
+        for iatm in range (mol.natm):
+            dist = np.linalg.norm (coords - (op * coords[iatm])[None,:], axis=1)
+            jatm = np.argmin (dist)
+            if dist[jatm] > tol or symbs[jatm] != symbs[iatm]: break
+            perm.append (jatm)
+        else:
+            ops.append ((op, np.asarray (perm)))
+    disps, images = [], []
+    for iatm in atmlst:
+        # Representative: lowest-index equivalent atom
+        op_ij, perm = min (ops, key=lambda x: x[1][iatm])
+        jatm = perm[iatm]
+        for icoord in range (3):
+            stab = [op[icoord] for op, perm in ops if perm[jatm] == jatm]
+            if min (stab) < 0:
+                images.append ((iatm, icoord, jatm, 0))
+            elif jatm != iatm:
+                images.append ((iatm, icoord, jatm, int (op_ij[icoord])))
+            elif (iatm, icoord) not in disps:
+                disps.append ((iatm, icoord))
+    for iatm, icoord, jatm, sign in images:
+        if sign != 0 and (jatm, icoord) not in disps:
+            disps.append ((jatm, icoord))
+    return disps, images
 
 
 class Gradients (rhf_grad.GradientsMixin):
+    ''' Numeric gradients from finite differences of scanner energies
+
+    Extra attributes:
+        stepsize : float
+            Finite-difference step in Angstrom
+        nproc : integer
+            Number of worker processes among which the displaced calculations are
+            distributed. Each worker has its own copy of the scanner and runs with a
+            single OpenMP thread (see fork_pool). Requires the 'fork' start method.
+        npoint : integer
+            2 or 4; number of points in the central-difference stencil
+        use_symmetry : logical
+            If True, only symmetry-unique displacements are computed
+            (see symm_unique_displacements)
+    '''
 
-    def __init__(self, method, stepsize=STEPSIZE_DEFAULT, scanner_verbose=SCANNER_VERBOSE_DEFAULT):
+    def __init__(self, method, stepsize=STEPSIZE_DEFAULT, scanner_verbose=SCANNER_VERBOSE_DEFAULT,
+                 nproc=NPROC_DEFAULT, npoint=NPOINT_DEFAULT, use_symmetry=False):
         self.stepsize = stepsize
+        self.nproc = nproc
+        self.npoint = npoint
+        self.use_symmetry = use_symmetry
         self.scanner = None 
         # MRH 05/04/2020: there must be a better way to do this
         if hasattr (self.scanner, '_scf'):
@@ -36,25 +189,66 @@ class Gradients (rhf_grad.GradientsMixin):
         self.scanner = self.base.as_scanner ()
         self.scanner.verbose = scanner_verbose
 
-    def _numgrad_1df (self, iatm, icoord):
-        return _numgrad_1df (self.mol, self.scanner, self.mol.atom_coords () * param.BOHR,
-            iatm, icoord, delta=self.stepsize)
+    def get_displacements (self, atmlst=None):
+        ''' List of (iatm, icoord) to displace, and list of (iatm, icoord, jatm, sign)
+        of gradient components inferred from others by symmetry '''
+        if atmlst is None: atmlst = list (range (self.mol.natm))
+        if self.use_symmetry:
+            return symm_unique_displacements (self.mol, atmlst=atmlst)
+        return [(iatm, icoord) for iatm in atmlst for icoord in range (3)], []
 
-    def kernel (self, atmlst=None, stepsize=None, state=None):
+    def scan_energies (self, geoms):
+        ''' Energies and state energies at a list of geometries (arrays of shape (natm,3)
+        in Angstrom), each warm-started from the reference wave function of self.base '''
+        guess = _get_guess (self.base)
+        nproc = min (self.nproc, len (geoms))
+        if nproc > 1:
+            with fork_pool (nproc, initializer=_pool_init_scan,
+                            initargs=(self.mol, self.scanner, guess)) as pool:
+                return pool.map (pool_call (_pool_scan_energy), geoms, chunksize=1)
+        results = [_scan_energy (self.mol, self.scanner, x, guess=guess) for x in geoms]
+        self.scanner (self.mol) # Reset!
+        return results
+
+    def kernel (self, atmlst=None, stepsize=None, state=None, nproc=None, npoint=None):
         if atmlst is None:
             atmlst = self.atmlst
         if stepsize is None:
             stepsize = self.stepsize
         else:
             self.stepsize = stepsize
+        if nproc is not None: self.nproc = nproc
+        if npoint is not None: self.npoint = npoint
         if atmlst is None:
             atmlst = list (range (self.mol.natm))
+        stencil = STENCILS[self.npoint]
         
         coords = self.mol.atom_coords () * param.BOHR
-        de = [[self._numgrad_1df (i, j) for j in range (3)] for i in atmlst]
-        self.scanner (_make_mol (self.mol, coords)) # Reset!
-        self.de = np.asarray ([[i for i,j in k] for k in de])
-        self.de_states = np.asarray ([[j for i,j in k] for k in de]).transpose (2,0,1)
+        disps, images = self.get_displacements (atmlst)
+        geoms = []
+        for iatm, icoord in disps:
+            for step, wgt in stencil:
+                geoms.append (coords.copy ())
+                geoms[-1][iatm,icoord] += step * stepsize
+        logger.info (self, 'Numeric gradient: %d displaced calculations on %d processes',
+                     len (geoms), min (self.nproc, max (1, len (geoms))))
+        results = self.scan_energies (geoms)
+
+        de = np.zeros ((self.mol.natm, 3))
+        de_states = None
+        results = iter (results)
+        for iatm, icoord in disps:
+            for step, wgt in stencil:
+                e, e_states = next (results)
+                if de_states is None: de_states = np.zeros ((len (e_states), self.mol.natm, 3))
+                de[iatm,icoord] += wgt * e / stepsize * param.BOHR
+                de_states[:,iatm,icoord] += wgt * e_states / stepsize * param.BOHR
+        if de_states is None: de_states = np.zeros ((1, self.mol.natm, 3))
+        for iatm, icoord, jatm, sign in images:
+            de[iatm,icoord] = sign * de[jatm,icoord]
+            de_states[:,iatm,icoord] = sign * de_states[:,jatm,icoord]
+        self.de = de[atmlst]
+        self.de_states = de_states[:,atmlst]
         if state is not None: self.de = self.de_states[state]
         return self.de
 
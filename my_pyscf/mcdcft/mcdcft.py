@@ -2,12 +2,14 @@ import pyscf
 import numpy as np
 
 import time
+import copy
 from scipy import linalg
 from pyscf import gto, dft, ao2mo, fci, mcscf, lib
 from pyscf.lib import logger
 from pyscf.mcscf import mc_ao2mo
 from pyscf.mcscf.addons import StateAverageMCSCFSolver, state_average_mix, state_average_mix_
 from mrh.my_pyscf.mcdcft.convfnal import convfnal
+from mrh.my_pyscf.mcpdft import _gridblocks
 
 def get_unpaired_density(natorb, occ, ao):
     r''' Calculate unpaired density D
@@ -23,24 +25,41 @@ def get_unpaired_density(natorb, occ, ao):
         Returns : ndarray with shape (ngrids,) for LDA or (4, ngrids) for GGA
             unpaired density of each grid
     '''
-    if ao.ndim == 3:  # GGA
-        ao_magnitude = ao[0]
-        ao_magnitude_grad = ao[1:4]
-    else:  # LDA
-        ao_magnitude = ao
+    c = (occ * (2 - occ))
+    return _density_from_no (c, _eval_no (natorb, ao))
 
-    # Magnitude of natural orbital and gradient
-    natorb_magnitude = natorb @ ao_magnitude.T
+def _eval_no (natorb, ao):
+    ''' Values [and gradients] of natural orbitals on a grid block
 
-    c = (occ * (2 - occ))
-    D = c @ (natorb_magnitude ** 2)
+        Args:
+            natorb : ndarray of shape (nno, nao)
+                natural-orbital coefficients (transposed)
+            ao : ndarray of shape (ngrids, nao) for LDA or (4, ngrids, nao) for GGA
 
+        Returns : ndarray of shape (nno, ngrids) for LDA or (4, nno, ngrids) for GGA
+    '''
     if ao.ndim == 3:  # GGA
-        natorb_magnitude_grad = natorb @ ao_magnitude_grad.transpose((0,2,1))
-        D_grad = (2 * c) @ (natorb_magnitude * natorb_magnitude_grad)
-        return np.vstack((D, D_grad))
-    else:  # LDA
-        return D
+        return np.stack ([natorb @ a.T for a in ao[:4]], axis=0)
+    return natorb @ ao.T
+
+def _density_from_no (p, no):
+    ''' Density [and gradient] sum_pq no_p P_pq no_q, where P is either the
+        vector of its diagonal elements or a symmetric matrix
+
+        Args:
+            p : ndarray of shape (nno,) or (nno, nno)
+            no : ndarray of shape (nno, ngrids) or (4, nno, ngrids)
+                from _eval_no
+
+        Returns : ndarray of shape (ngrids,) or (4, ngrids)
+    '''
+    no0 = no[0] if no.ndim == 3 else no
+    pno = p[:,None] * no0 if p.ndim == 1 else p @ no0
+    rho = (no0 * pno).sum (0)
+    if no.ndim == 3:  # GGA
+        rho_grad = 2 * (no[1:4] * pno[None,:,:]).sum (1)
+        return np.vstack ((rho, rho_grad))
+    return rho
 
 
 def kernel(mc, ot, root=-1):
@@ -143,6 +162,55 @@ def _recalculate_with_xc(ot, chkdata):
     return e_tot, E_ot
 
 
+def _recalculate_with_xc_multi (ots, chkdata, scaleDs=None):
+    ''' Recalculate MC-DCFT total energies for several on-top functionals
+        (and/or scalings of the unpaired density) from intermediate quantities
+        of a previous MC-DCFT calculation, with one numerical integration sweep
+
+        Args:
+            ots : list of instances of on-top density functional class
+                all sharing the same grids and natural orbitals
+            chkdata : chkdata dict generated by previous calculation
+
+        Kwargs:
+            scaleDs : list of callables or None
+                Scaling of the unpaired density for each functional. Defaults
+                to the scaleD attribute of each functional.
+
+        Returns:
+            e_tot : ndarray of shape (len (ots),)
+                Total MC-DCFT energies including nuclear repulsion energy.
+            E_ot : ndarray of shape (len (ots),)
+                On-top exchange-correlation energies
+    '''
+    t0 = (logger.process_clock(), logger.perf_counter())
+    ot0 = ots[0]
+    Vnn = chkdata['Vnn']
+    Te_Vne = chkdata['Te_Vne']
+    E_j = chkdata['E_j']
+    E_x = chkdata['E_x']
+    dm1s = chkdata['dm1s']
+    logger.debug(ot0, 'CAS energy decomposition (restored from previous calculation):')
+    logger.debug(ot0, 'Vnn = %s', Vnn)
+    logger.debug(ot0, 'Te + Vne = %s', Te_Vne)
+    logger.debug(ot0, 'E_j = %s', E_j)
+    logger.debug(ot0, 'E_x = %s', E_x)
+
+    E_ot = get_E_ot_multi(ots, dm1s, scaleDs=scaleDs)
+    t0 = logger.timer (ot0, 'E_ot', *t0)
+
+    e_tot = np.empty (len (ots))
+    for ix, ot in enumerate (ots):
+        omega, alpha, hyb = ot._numint.rsh_and_hybrid_coeff(ot.otxc, spin=chkdata['spin'])
+        hyb_x, hyb_c = hyb
+        if (abs(hyb_x) > 1e-10 or abs(hyb_c) > 1e-10) and E_x == 0:
+            logger.warn(ot, 'E_x == 0. Hybrid functionals might give wrong results!')
+        e_tot[ix] = Vnn + Te_Vne + E_j + (hyb_x * E_x) + E_ot[ix]
+        logger.note(ot, 'MC-DCFT E = %s, Eot(%s) = %s', e_tot[ix], ot.ot_name, E_ot[ix])
+
+    return e_tot, E_ot
+
+
 def get_E_ot (ot, oneCDMs, max_memory=20000, hermi=1):
     ''' E_MCDCFT = h_pq l_pq + 1/2 v_pqrs l_pq l_rs + E_ot[D] 
         or, in other terms, 
@@ -164,27 +232,101 @@ def get_E_ot (ot, oneCDMs, max_memory=20000, hermi=1):
             The MC-DCFT on-top exchange-correlation energy
 
     '''
-    ni, xctype, dens_deriv = ot._numint, ot.xctype, ot.dens_deriv
-    norbs_ao = oneCDMs.shape[1]
+    return get_E_ot_multi ([ot], oneCDMs, max_memory=max_memory, hermi=hermi)[0]
+
+def _dm_in_no_basis (mol, natorb, oneCDMs):
+    ''' Express spin-separated 1-RDMs in the basis of natural orbitals, or
+        return None if they are not spanned by the natural orbitals '''
+    if natorb is None: return None
+    s0 = mol.intor_symmetric ('int1e_ovlp')
+    cs = natorb @ s0
+    dm_no = np.stack ([cs @ dm @ cs.T for dm in oneCDMs], axis=0)
+    err = max ([linalg.norm (natorb.T @ d @ natorb - dm)
+                for d, dm in zip (dm_no, oneCDMs)])
+    if err > 1e-8: return None
+    return dm_no
+
+def get_E_ot_multi (ots, oneCDMs, scaleDs=None, max_memory=20000, hermi=1):
+    ''' On-top exchange-correlation energies of several on-top functionals
+        (and/or scalings of the unpaired density D) from a single sweep over
+        the grids. The natural orbitals are evaluated once per grid block and
+        used for both the density and D; natural orbitals which contribute
+        to neither (e.g., virtual orbitals) are skipped. If the 1-RDMs are not
+        spanned by the natural orbitals, the density is evaluated in the AO
+        basis instead.
 
-    E_ot = 0.0
-    ot.ms = 0.0
+        Args:
+            ots : list of instances of otfnal class
+                all sharing the same natural orbitals and occupations. The
+                grids and numint object of ots[0] are used for all of them.
+            oneCDMs : ndarray of shape (2, nao, nao)
+                containing spin-separated one-body density matrices
+
+        Kwargs:
+            scaleDs : list of callables or None
+                Scaling of D for each functional; defaults to the scaleD
+                attribute of each functional
+            max_memory : int or float
+                maximum cache size in MB
+                default is 20000
+            hermi : int
+                1 if 1CDMs are assumed hermitian, 0 otherwise
 
+        Returns : ndarray of shape (len (ots),)
+            The MC-DCFT on-top exchange-correlation energies
+    '''
+    ot0 = ots[0]
+    if scaleDs is None: scaleDs = [getattr (ot, 'scaleD', None) for ot in ots]
+    ni, grids = ot0._numint, ot0.grids
+    ot_max = ots[int (np.argmax ([ot.dens_deriv for ot in ots]))]
+    xctype, dens_deriv = ot_max.xctype, ot_max.dens_deriv
+    norbs_ao = oneCDMs.shape[1]
+    for ot in ots: ot.ms = 0.0
+
+    natorb, occ = ot0.natorb, ot0.occ
+    c = occ * (2 - occ)
+    dm_no = _dm_in_no_basis (ot0.mol, natorb, oneCDMs) if hermi else None
+    if dm_no is None:
+        logger.debug (ot0, 'MC-DCFT: density evaluated in AO basis')
+        make_rho = tuple (ni._gen_rho_evaluator (ot0.mol, oneCDMs[i,:,:], hermi) for i in range(2))
+        idx = np.abs (c) > 1e-14
+    else:
+        idx = (np.abs (c) > 1e-14) | (np.abs (dm_no).max ((0,2)) > 1e-14)
+        dm_no = dm_no[:,idx][:,:,idx]
+        offdiag = dm_no - np.stack ([np.diag (np.diag (d)) for d in dm_no], axis=0)
+        if np.amax (np.abs (offdiag), initial=0) < 1e-10:
+            dm_no = np.stack ([np.diag (d) for d in dm_no], axis=0)
+    natorb, c = natorb[idx], c[idx]
+    logger.debug (ot0, 'MC-DCFT: %d of %d natural orbitals evaluated on grids',
+                  natorb.shape[0], len (idx))
+
+    E_ot = np.zeros (len (ots))
+    ncols = _gridblocks.ncols_mcdcft (norbs_ao, natorb.shape[0], dens_deriv,
+                                      nfnal=len (ots))
+    blksize = _gridblocks.get_blksize (ncols, _gridblocks.get_ngrids (grids),
+        max_memory, log=logger.new_logger (ot0, ot0.verbose), label='MC-DCFT')
     t0 = (logger.process_clock (), logger.perf_counter ())
-    make_rho = tuple (ni._gen_rho_evaluator (ot.mol, oneCDMs[i,:,:], hermi) for i in range(2))
-    for ao, mask, weight, coords in ni.block_loop (ot.mol, ot.grids, norbs_ao, dens_deriv, max_memory):
-        rho = np.asarray ([m[0] (0, ao, mask, xctype) for m in make_rho])
-        if ot.verbose > logger.DEBUG and dens_deriv > 0:
+    for ao, mask, weight, coords in ni.block_loop (ot0.mol, grids, norbs_ao, dens_deriv, max_memory, blksize=blksize):
+        no = _eval_no (natorb, ao)
+        if dm_no is None:
+            rho = np.asarray ([m[0] (0, ao, mask, xctype) for m in make_rho])
+        else:
+            rho = np.asarray ([_density_from_no (d, no) for d in dm_no])
+        if ot0.verbose > logger.DEBUG and dens_deriv > 0:
             for ideriv in range (1,4):
                 rho_test  = np.einsum ('ijk,aj,ak->ia', oneCDMs, ao[ideriv], ao[0])
                 rho_test += np.einsum ('ijk,ak,aj->ia', oneCDMs, ao[ideriv], ao[0])
-                logger.debug (ot, "Spin-density derivatives, |PySCF-einsum| = %s", linalg.norm (rho[:,ideriv,:]-rho_test))
-        t0 = logger.timer (ot, 'untransformed density', *t0)
-        D = get_unpaired_density(ot.natorb, ot.occ, ao)
-        if ot.scaleD is not None:
-            D = ot.scaleD(D)
-        E_ot += ot.get_E_ot(rho, D, weight)
-        t0 = logger.timer (ot, 'on-top exchange-correlation energy calculation', *t0) 
+                logger.debug (ot0, "Spin-density derivatives, |PySCF-einsum| = %s", linalg.norm (rho[:,ideriv,:]-rho_test))
+        t0 = logger.timer (ot0, 'untransformed density', *t0)
+        D = _density_from_no (c, no)
+        for ix, (ot, scaleD) in enumerate (zip (ots, scaleDs)):
+            rho_i, D_i = rho, D
+            if ot.dens_deriv < dens_deriv:
+                rho_i, D_i = rho[:,0], D[0]
+            if scaleD is not None:
+                D_i = scaleD(D_i.copy ())
+            E_ot[ix] += ot.get_E_ot(rho_i, D_i, weight)
+        t0 = logger.timer (ot0, 'on-top exchange-correlation energy calculation', *t0) 
 
     return E_ot
 
@@ -206,21 +348,31 @@ def get_mcdcft_child_class (mc, ot, **kwargs):
                 self._init_ot_grids(my_ot, ot_name, grids_level=grids_level)
 
         def _init_ot_grids (self, my_ot, ot_name, grids_level=None):
-            if isinstance (my_ot, (str, np.string_)):
-                ks = dft.RKS(self.mol)
-                ks.xc = my_ot
-                self.otfnal = convfnal(ks)
-                self.otfnal.scaleD = None
-            else:
-                self.otfnal = my_ot
+            self.otfnal = self._make_otfnal (my_ot, ot_name)
             self.grids = self.otfnal.grids
-            self.ot_name = self.otfnal.ot_name = my_ot if ot_name is None else ot_name
+            self.ot_name = self.otfnal.ot_name
             if grids_level is not None:
                 self.grids.level = grids_level
                 assert (self.grids.level == self.otfnal.grids.level)
+
+        def _make_otfnal (self, my_ot, ot_name, grids=None):
+            ''' On-top functional object for my_ot (str or otfnal instance),
+                using grids instead of its own grids if given. Unlike
+                _init_ot_grids, self is not modified. '''
+            if isinstance (my_ot, (str, np.string_)):
+                ks = dft.RKS(self.mol)
+                ks.xc = my_ot
+                otfnal = convfnal(ks)
+                otfnal.scaleD = None
+            else:
+                otfnal = my_ot
+            if grids is not None:
+                otfnal.grids = grids
+            otfnal.ot_name = my_ot if ot_name is None else ot_name
             # Make sure verbose and stdout don't accidentally change (i.e., in scanner mode)
-            self.otfnal.verbose = self.verbose
-            self.otfnal.stdout = self.stdout
+            otfnal.verbose = self.verbose
+            otfnal.stdout = self.stdout
+            return otfnal
             
         def load_mcdcft_chk(self, chkfile):
             self.chkdata = lib.chkfile.load(chkfile, 'mcdcft')
@@ -265,6 +417,63 @@ def get_mcdcft_child_class (mc, ot, **kwargs):
                 lib.chkfile.dump(dump_chk, 'mcdcft/e_ot/' + self.otfnal.ot_name, self.e_ot)
             return self.e_tot, self.e_ot
 
+        def recalculate_with_xc_multi(self, fnals, chkdata=None, load_chk=None, dump_chk=None, grids_level=None):
+            ''' Recalculate MC-DCFT total energies for a list of functionals and/or scalings of the
+                unpaired density based on intermediate quantities from a previous MC-DCFT calculation,
+                integrating all of them in one sweep over the grids
+
+                Args:
+                    fnals : list of tuples (ot, scaleD) or (ot, scaleD, ot_name), where ot, scaleD,
+                            and ot_name are as in recalculate_with_xc
+                    chkdata : chkdata dict generated by previous calculation
+                    load_chk : str of chk filename to load chkdata from before the calculation
+                    dump_chk : str of chk filename to dump newly calculated energies
+                    grids_level : grids
+
+                Returns:
+                    e_tot : ndarray of shape (len (fnals),) or, for state-averaged
+                            calculations, (len (fnals), n_states)
+                        Total MC-DCFT energies including nuclear repulsion energy
+                    e_ot : ndarray of the same shape as e_tot
+                        On-top exchange-correlation energies
+            '''
+            if grids_level is None:
+                grids_level = self.grids_level
+            if load_chk is not None:
+                self.load_mcdcft_chk(load_chk)
+            if chkdata is None:
+                chkdata = self.chkdata
+            natorb = chkdata['natorb']
+            occ = chkdata['occ']
+            # All functionals share the grids of the first one; self.otfnal
+            # and self.grids are left alone, and so are otfnal instances
+            # given in fnals (their copies are modified instead)
+            ots, grids = [], None
+            for fnal in fnals:
+                ot, scaleD = fnal[:2]
+                ot_name = fnal[2] if len (fnal) > 2 else None
+                if not isinstance (ot, (str, np.string_)): ot = copy.copy (ot)
+                ot = self._make_otfnal (ot, ot_name, grids=grids)
+                if grids is None:
+                    grids = ot.grids = copy.copy (ot.grids)
+                    if grids_level is not None and grids_level != grids.level:
+                        grids.level = grids_level
+                        grids.reset ()
+                ot.scaleD = scaleD
+                ot._set_natorb(natorb, occ)
+                ots.append (ot)
+            n_states = chkdata['n_states']
+            if n_states > 1:
+                epdft = [_recalculate_with_xc_multi(ots, ichkdata) for ichkdata in chkdata]
+                e_tot, e_ot = [np.stack (x, axis=-1) for x in zip (*epdft)]
+            else:
+                e_tot, e_ot = _recalculate_with_xc_multi(ots, chkdata)
+            if dump_chk is not None:
+                for ot, e_tot_i, e_ot_i in zip (ots, e_tot, e_ot):
+                    lib.chkfile.dump(dump_chk, 'mcdcft/e_tot/' + ot.ot_name, e_tot_i)
+                    lib.chkfile.dump(dump_chk, 'mcdcft/e_ot/' + ot.ot_name, e_ot_i)
+            return e_tot, e_ot
+
         def kernel(self, mo_coeff=None, ci=None, skip_scf=False, **kwargs):
             # Hafta reset the grids so that geometry optimization works!
             ot_name = self.ot_name
@@ -0,0 +1,128 @@
+# Common grid-block size planning for numerical-integration loops
+#
+# Every loop over grid blocks keeps a number of arrays whose size is
+# proportional to the number of grid points in the block. The functions
+# ncols_* estimate, for each consumer, how many floats per grid point those
+# arrays take ("columns"), in terms of the number of AOs, active orbitals,
+# density derivatives, and so on. get_blksize turns the estimate into the
+# largest block size which fits in the memory still available.
+
+from pyscf.lib import current_memory
+from pyscf.dft.gen_grid import BLKSIZE
+
+# Largest block, in units of BLKSIZE grid points
+MAX_NBLK = 1200
+# Safety factor for temporaries not accounted for explicitly
+FUDGE = 1.1
+
+def _nderiv (deriv):
+    return (1,4,10)[deriv]
+
+def ncols_ao (nao, deriv):
+    '''AO values and derivatives plus coordinates and weights'''
+    return _nderiv (deriv) * nao + 4
+
+def ncols_otpd (ncas, deriv):
+    '''Intermediates of otpd.get_ontop_pair_density: active-orbital
+    values (grid2amo), the pair tensor product (gridkern), and its
+    contraction with the cumulant (wrk0)'''
+    nderiv = _nderiv (deriv)
+    return nderiv * ncas + (nderiv + 1) * ncas * ncas
+
+def ncols_energy_ot (nao, ncas, dens_deriv, Pi_deriv=0):
+    '''otfnal.energy_ot'''
+    nderiv_rho, nderiv_Pi = _nderiv (dens_deriv), _nderiv (Pi_deriv)
+    ncols = ncols_ao (nao, dens_deriv)
+    ncols += 2 * nao                  # rho evaluator intermediates
+    ncols += 2 * nderiv_rho           # rho
+    ncols += ncols_otpd (ncas, dens_deriv)
+    ncols += nderiv_Pi + 2            # Pi, eot
+    return FUDGE * ncols
+
+def ncols_pdft_veff (nao, dens_deriv, Pi_deriv, nveff2=0):
+    '''pdft_veff.kernel. nveff2 is the per-point footprint of the
+    two-body potential accumulator (pdft_veff._ERIS._accumulate_ftpt) for
+    a single density component.'''
+    nderiv_rho, nderiv_Pi = _nderiv (dens_deriv), _nderiv (Pi_deriv)
+    ncols = ncols_ao (nao, dens_deriv)
+    ncols += nderiv_rho * 4 + nderiv_Pi   # rho, rho_a, rho_c, Pi
+    ncols += 1 + nderiv_rho + nderiv_Pi   # eot, vot
+    # veff1 and veff2 are accumulated one after the other
+    ncols += max (nderiv_rho * (nao+1), nveff2 * nderiv_Pi)
+    return ncols
+
+def ncols_feff (nao, ncas, nocc, nderiv_ao, nderiv_rho, nderiv_Pi, nvec=1):
+    '''pdft_feff.EotOrbitalHessianOperator. Everything that doesn't scale
+    with the size of the molecule or the active space is ignored.'''
+    ncols = (nderiv_ao*(2*nao+ncas)        # ao + copy + mo_cas
+         + (2+nderiv_Pi)*(ncas**2)         # tensor-product intermediate
+         + nocc*(2*nderiv_rho+nderiv_Pi)   # drho_a, drho_b, dPi
+         + nvec*nocc*(nderiv_ao+nderiv_rho)) # mo1, v.drho, per vector
+    return FUDGE * ncols
+
+def ncols_grad (nao, ncas, nocc, dens_deriv, Pi_deriv):
+    '''grad.mcpdft.mcpdft_HellmanFeynman_grad, per atomic grid'''
+    ndao, ndpi = _nderiv (dens_deriv), _nderiv (Pi_deriv)
+    return 1.05 * 3 * (ndao*(nao+nocc) + max(ndao*nao,ndpi*ncas*ncas))
+
+def ncols_mcdcft (nao, nno, dens_deriv, nfnal=1):
+    '''mcdcft.get_E_ot_multi. nno is the number of natural orbitals
+    evaluated on the grid.'''
+    nderiv = _nderiv (dens_deriv)
+    ncols = ncols_ao (nao, dens_deriv)
+    ncols += nderiv * 2 * nno         # natural orbitals, density intermediate
+    ncols += 3 * nderiv               # rho, D
+    ncols += 2 * nderiv * 2           # translated density, one functional
+    ncols += nfnal                    # scaled D is made one at a time
+    return FUDGE * ncols
+
+def ncols_unpxc (nao, dens_deriv):
+    '''mcudft.unpxcfnal.kernel'''
+    nderiv = _nderiv (dens_deriv)
+    return FUDGE * (ncols_ao (nao, dens_deriv) + 2*nao + 6*nderiv)
+
+def get_ngrids (grids):
+    if grids.coords is None:
+        grids.build (with_non0tab=True)
+    return grids.coords.shape[0]
+
+def get_blksize (ncols, ngrids, max_memory, log=None, label='grid loop'):
+    '''Choose the size of grid blocks from a per-point memory footprint
+
+    Args:
+        ncols : float
+            Number of floats per grid point kept in memory by the loop
+        ngrids : integer
+            Total number of grid points
+        max_memory : float
+            Memory limit in MB
+
+    Kwargs:
+        log : object of class logger.Logger
+            If provided, the choice and the estimated peak memory are
+            reported at the debug level, and a warning is issued if even
+            the smallest block is estimated to exceed max_memory
+        label : str
+            Name of the loop for the log
+
+    Returns:
+        blksize : integer
+            Number of grid points per block, a multiple of BLKSIZE (as
+            numint.block_loop requires) even if ngrids is not
+    '''
+    mem_now = current_memory ()[0]
+    remaining_floats = (max_memory - mem_now) * 1e6 / 8
+    blksize = int (remaining_floats / (ncols*BLKSIZE)) * BLKSIZE
+    ngrids_pad = ((ngrids + BLKSIZE - 1) // BLKSIZE) * BLKSIZE
+    blksize = max (BLKSIZE, min (blksize, ngrids_pad, BLKSIZE*MAX_NBLK))
+    if log is not None:
+        peak = mem_now + ncols * blksize * 8 / 1e6
+        if peak > max_memory:
+            log.warn ('%s: estimated peak memory %.0f MB exceeds max_memory '
+                      '= %.0f MB even at the smallest block size', label, peak,
+                      max_memory)
+        log.debug ('%s: %.0f floats per grid point; %d of %d grid points per '
+                   'block; estimated peak memory %.0f MB of %.0f MB', label,
+                   ncols, blksize, ngrids, peak, max_memory)
+    return blksize
+
@@ -0,0 +1,195 @@
+import numpy as np
+import h5py
+from pyscf import lib
+from mrh.my_pyscf.mcpdft import pdft_veff
+
+# Checkpoint file for MC-PDFT and MS-PDFT results. The format is that of
+# pyscf.lib.chkfile (HDF5), under the key 'pdft' by default:
+#
+#   pdft/otxc, grids_level, grids_attr
+#   pdft/mo_coeff, ci, e_tot, e_ot, e_mcscf, e_states, converged
+#   pdft/heff_mcscf, hdiag_pdft, si_pdft, si_mcscf       (MS-PDFT only)
+#   pdft/veff/<state>/veff1, vhf_c, energy_core, ppaa, j_pc
+#   pdft/e_decomp/<xc or x_c>/...
+#
+# dump_pdft writes the results of the kernel. The effective potentials of
+# the individual (diabatic) states and the energy decompositions are
+# expensive, so they are written only once they are computed, by
+# _PDFT.get_pdft_veff and _PDFT.get_energy_decomposition, and read back only
+# when they are requested again for the same wave function, functional and
+# grid. Properties (dipole moments, gradients, energy decompositions) of a
+# converged calculation can therefore be computed in a new process without
+# repeating the MC-SCF or any grid work already done. grids_attr is a string
+# of the grid settings other than the level (see _get_grids_attr); it is only
+# compared, not restored.
+
+KEY = 'pdft'
+_results = ('mo_coeff', 'ci', 'e_tot', 'e_ot', 'e_mcscf', 'e_states',
+            'converged', 'heff_mcscf', 'hdiag_pdft', 'si_pdft', 'si_mcscf')
+_grids_keys = ('atom_grid', 'radi_method', 'prune', 'becke_scheme',
+               'radii_adjust', 'atomic_radii')
+
+def _get_ci (ci, state):
+    if isinstance (ci, np.ndarray) and ci.ndim == 2: return ci
+    return ci[state]
+
+def _decode (x):
+    if isinstance (x, bytes): return x.decode ()
+    return x
+
+def _get_grids_attr (grids):
+    '''The settings of grids, other than the level, which determine the
+    quadrature, as a string'''
+    attr = []
+    for k in _grids_keys:
+        v = getattr (grids, k, None)
+        if callable (v): v = getattr (v, '__name__', repr (v))
+        elif isinstance (v, dict): v = sorted (v.items ())
+        elif isinstance (v, np.ndarray): v = v.tolist ()
+        attr.append ((k, v))
+    return repr (attr)
+
+def dump_pdft (mc, chkfile, key=KEY):
+    '''Save the results of an MC-PDFT or MS-PDFT calculation in chkfile.
+    Potentials and energy decompositions already in chkfile are kept if
+    the wave function and functional are unchanged and removed otherwise.
+
+    Args:
+        mc : instance of class _PDFT or _MSPDFT
+        chkfile : str
+            Name of the HDF5 file
+
+    Kwargs:
+        key : str
+            Name of the HDF5 group
+    '''
+    nroots = getattr (mc.fcisolver, 'nroots', 1)
+    keep = is_current (mc, chkfile, mc.mo_coeff, mc.ci, range (nroots),
+                       key=key)
+    if h5py.is_hdf5 (chkfile):
+        with h5py.File (chkfile, 'r+') as f:
+            if key in f:
+                for k in list (f[key].keys ()):
+                    if keep and k in ('veff', 'e_decomp'): continue
+                    del f[key][k]
+    data = {'otxc': mc.otfnal.otxc,
+            'grids_level': mc.grids.level,
+            'grids_attr': _get_grids_attr (mc.grids)}
+    for k in _results:
+        v = getattr (mc, k, None)
+        if v is not None: data[k] = v
+    for k, v in data.items ():
+        lib.chkfile.dump (chkfile, key + '/' + k, v)
+    lib.chkfile.dump_mol (mc.mol, chkfile)
+
+def load_pdft (chkfile, key=KEY):
+    '''Load the results saved by dump_pdft, without the grid settings,
+    potentials and energy decompositions
+
+    Returns:
+        data : dict
+            Keys are the names of the _PDFT or _MSPDFT attributes
+    '''
+    data = {}
+    with h5py.File (chkfile, 'r') as f:
+        keys = [k.replace ('__from_list__', '') for k in f[key].keys ()]
+    for k in keys:
+        if k in ('veff', 'e_decomp', 'grids_level', 'grids_attr'): continue
+        data[k] = _decode (lib.chkfile.load (chkfile, key + '/' + k))
+    if isinstance (data.get ('ci', None), list):
+        data['ci'] = [np.asarray (c) for c in data['ci']]
+    return data
+
+def is_current (mc, chkfile, mo, ci, states, key=KEY):
+    '''Whether chkfile holds the wave function given by mo and the CI
+    vectors ci of states, and the functional and grid settings of mc'''
+    if not h5py.is_hdf5 (chkfile): return False
+    with h5py.File (chkfile, 'r') as f:
+        if key not in f: return False
+        grp = f[key]
+        for k in ('mo_coeff', 'otxc', 'grids_level', 'grids_attr'):
+            if k not in grp: return False
+        if _decode (grp['otxc'][()]) != mc.otfnal.otxc: return False
+        if grp['grids_level'][()] != mc.grids.level: return False
+        if _decode (grp['grids_attr'][()]) != _get_grids_attr (mc.grids):
+            return False
+        if not np.array_equal (grp['mo_coeff'][()], mo): return False
+        if 'ci__from_list__' in grp:
+            ci_grp = grp['ci__from_list__']
+            ci_chk = lambda i: ci_grp['%06d' % i][()]
+        elif 'ci' in grp:
+            ci_all = grp['ci'][()]
+            ci_chk = lambda i: _get_ci (ci_all, i)
+        else:
+            return False
+        for state in states:
+            try:
+                if not np.array_equal (ci_chk (state), _get_ci (ci, state)):
+                    return False
+            except (KeyError, IndexError):
+                return False
+    return True
+
+def dump_veff (mc, chkfile, state, veff1, veff2, key=KEY):
+    '''Save the effective potentials of one state returned by
+    mc.get_pdft_veff (incl_coul=True, paaa_only=True). ppaa, which may be a
+    memory map, is written in blocks of at most veff2.max_memory MB.'''
+    grp_key = '{}/veff/{}'.format (key, state)
+    data = {'veff1': veff1,
+            'vhf_c': veff2.vhf_c,
+            'energy_core': veff2.energy_core,
+            'j_pc': veff2.j_pc}
+    lib.chkfile.dump (chkfile, grp_key, data)
+    ppaa = veff2.ppaa
+    with h5py.File (chkfile, 'r+') as f:
+        dset = f[grp_key].create_dataset ('ppaa', ppaa.shape, ppaa.dtype)
+        for i0, i1 in veff2._blocks ():
+            dset[i0:i1] = ppaa[i0:i1]
+
+def load_veff (mc, chkfile, state, mo, key=KEY):
+    '''Load the effective potentials of one state saved by dump_veff. ppaa
+    is copied from chkfile in blocks of at most mc.max_memory MB into a
+    memory map if it would take more than half of mc.max_memory, and into
+    memory otherwise, as in pdft_veff.kernel
+
+    Returns:
+        veff1 : ndarray of shape (nao,nao)
+        veff2 : instance of pdft_veff._ERIS
+        or None if they are not in chkfile
+    '''
+    grp_key = '{}/veff/{}'.format (key, state)
+    if not h5py.is_hdf5 (chkfile): return None
+    with h5py.File (chkfile, 'r') as f:
+        if grp_key not in f: return None
+        grp = f[grp_key]
+        data = {k: grp[k][()] for k in ('veff1', 'vhf_c', 'energy_core',
+                                        'j_pc')}
+        ppaa = grp['ppaa']
+        ncore, ncas = mc.ncore, mc.ncas
+        mem_ppaa = ppaa.size * ppaa.dtype.itemsize / 1e6
+        method = 'memmap' if mem_ppaa > mc.max_memory/2 else 'incore'
+        veff2 = pdft_veff._ERIS (mc.mol, mo, ncore, ncas, method=method,
+                                 paaa_only=True, verbose=mc.verbose,
+                                 stdout=mc.stdout, max_memory=mc.max_memory,
+                                 ppaa=ppaa)
+    veff2.vhf_c = data['vhf_c']
+    veff2.energy_core = data['energy_core']
+    veff2.j_pc = data['j_pc']
+    veff2.k_pc = veff2.j_pc.copy ()
+    return data['veff1'], veff2
+
+def _e_decomp_key (key, split_x_c):
+    return '{}/e_decomp/{}'.format (key, ('xc', 'x_c')[int (bool (split_x_c))])
+
+def dump_e_decomp (chkfile, split_x_c, e_decomp, key=KEY):
+    '''Save the return value of get_energy_decomposition'''
+    lib.chkfile.dump (chkfile, _e_decomp_key (key, split_x_c),
+                      [np.asarray (e) for e in e_decomp])
+
+def load_e_decomp (chkfile, split_x_c, key=KEY):
+    '''Load the return value of get_energy_decomposition saved by
+    dump_e_decomp, or None if it isn't in chkfile'''
+    e_decomp = lib.chkfile.load (chkfile, _e_decomp_key (key, split_x_c))
+    if e_decomp is None: return None
+    return tuple (e.tolist () for e in map (np.asarray, e_decomp))
+
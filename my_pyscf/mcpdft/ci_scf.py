@@ -22,9 +22,7 @@ def get_heff_cas (mc, mo_coeff, ci, link_index=None):
         + veff2.energy_core)
     h1 = (mo_cas.conj ().T @ (h1_ao) @ mo_cas
         + veff2.vhf_c[ncore:nocc,ncore:nocc])
-    h2 = np.zeros ([ncas,]*4) # Forward-compatibility for outcore pdft veff...
-    for i in range (ncore, nocc): 
-        h2[i-ncore] = veff2.ppaa[i][ncore:nocc].copy ()
+    h2 = veff2.get_paaa ()[ncore:nocc]
 
     return h0, h1, h2
 
@@ -2,11 +2,98 @@ import numpy as np
 from itertools import product
 from scipy import linalg
 from pyscf import gto, dft, ao2mo, fci, mcscf, lib
+from pyscf.ao2mo import _ao2mo
 from pyscf.lib import logger, temporary_env
 from pyscf.mcscf.addons import StateAverageMCSCFSolver, state_average_mix, state_average_mix_, state_average
 from pyscf.fci import direct_spin1
 from mrh.my_pyscf import mcpdft
 
+def states_trans_rdm1 (mc, ci_bra, ci_ket):
+    '''Transition 1-RDMs <bra|t'u|ket> between pairs of CI vectors,
+    without the 2-RDMs that states_trans_rdm12 would also build
+
+    Args:
+        mc : mcscf method instance
+        ci_bra : sequence of ndarrays of shape (ndeta,ndetb)
+        ci_ket : sequence of ndarrays of shape (ndeta,ndetb)
+
+    Returns:
+        tdm1 : ndarray of shape (len (ci_bra),ncas,ncas)
+    '''
+    ncas, nelecas = mc.ncas, mc.nelecas
+    return np.stack ([mc.fcisolver.trans_rdm1 (bra, ket, ncas, nelecas)
+        for bra, ket in zip (ci_bra, ci_ket)], axis=0)
+
+def _pack_tdm1 (tdm1):
+    # D_tu + D_ut for t > u; D_tt on the diagonal: contracts with the
+    # lower-triangular pair index of (tu|vx) or (P|tu) in place of D_tu
+    tdm1 = tdm1 + tdm1.transpose (0,2,1)
+    ncas = tdm1.shape[-1]
+    diag = np.arange (ncas)
+    tdm1[:,diag,diag] /= 2
+    return lib.pack_tril (tdm1)
+
+def coulomb_factor (mc, mo_coeff=None, ci=None, h2eff=None, eris=None):
+    '''Compute the factors B^P_IJ = (P|tu) D^IJ_tu of the Coulomb tensor
+    w_IJKL = sum_P s_P B^P_IJ B^P_KL, where (P|tu) are the three-index
+    density-fitting integrals if mc has a with_df object and h2eff and
+    eris are not passed. Otherwise, they come from the eigendecomposition
+    (tu|vx) = sum_P (P|tu) s_P (P|vx) of the active-space ERIs, keeping
+    at most ncas*(ncas+1)/2 factors.
+
+    Args:
+        mc : mcscf method instance
+
+    Kwargs:
+        mo_coeff : ndarray of shape (nao,nmo)
+            Contains molecular orbital coefficients
+        ci : list of ndarrays of shape (ndeta,ndetb)
+            Contains CI vectors
+        h2eff : ndarray of shape [ncas,]*4 or any other ao2mo storage form
+            Contains active-space ERIs
+        eris : mc_ao2mo.ERI object
+            Contains active-space ERIs. Ignored if h2eff is passed; if
+            h2eff is not passed then it is constructed from eris.ppaa
+
+    Returns:
+        B : ndarray of shape (naux,nroots,nroots)
+            Symmetric in the last two indices
+        sgn : ndarray of shape (naux)
+            Signs of the factors; -1 only for numerically negative
+            eigenvalues of the ERIs
+    '''
+    if mo_coeff is None: mo_coeff=mc.mo_coeff
+    if ci is None: ci = mc.ci
+    ci = np.asarray (ci)
+    ncore, ncas = mc.ncore, mc.ncas
+    nroots, nocc = mc.fcisolver.nroots, ncore + ncas
+    row, col = np.tril_indices (nroots)
+    tdm1 = _pack_tdm1 (states_trans_rdm1 (mc, ci[col], ci[row]))
+
+    with_df = getattr (mc, 'with_df', None)
+    if h2eff is None and eris is None and with_df:
+        mo_cas = np.asarray (mo_coeff[:,ncore:nocc], order='F')
+        slices = (0, ncas, 0, ncas)
+        B = []
+        Lpq = None
+        for eri1 in with_df.loop ():
+            Lpq = _ao2mo.nr_e2 (eri1, mo_cas, slices, aosym='s2', mosym='s2',
+                out=Lpq)
+            B.append (np.dot (Lpq, tdm1.T))
+        B = np.concatenate (B, axis=0)
+        sgn = np.ones (B.shape[0])
+    else:
+        if h2eff is None:
+            if eris is None: h2eff = mc.get_h2eff (mo_coeff=mo_coeff)
+            else: h2eff = np.asarray (eris.ppaa[ncore:nocc,ncore:nocc,:,:])
+        h2eff = ao2mo.restore (4, h2eff, ncas)
+        evals, evecs = linalg.eigh (h2eff)
+        idx = np.abs (evals) > 1e-14 * max (np.amax (np.abs (evals)), 1)
+        evals, evecs = evals[idx], evecs[:,idx]
+        sgn = np.sign (evals)
+        B = np.dot ((evecs * np.sqrt (np.abs (evals))[None,:]).T, tdm1.T)
+    return lib.unpack_tril (B, filltriu=lib.SYMMETRIC), sgn
+
 def coulomb_tensor (mc, mo_coeff=None, ci=None, h2eff=None, eris=None):
     '''Compute w_IJKL = (tu|vx) D^IJ_tu D^KL_vx
 
@@ -39,8 +126,7 @@ def coulomb_tensor (mc, mo_coeff=None, ci=None, h2eff=None, eris=None):
     h2eff = ao2mo.restore (1, h2eff, ncas)   
  
     row, col = np.tril_indices (nroots)
-    tdm1 = np.stack (mc.fcisolver.states_trans_rdm12(ci[col], ci[row], ncas,
-        nelecas)[0], axis=0)
+    tdm1 = states_trans_rdm1 (mc, ci[col], ci[row])
     
     w = np.tensordot (tdm1, h2eff, axes=2)
     w = np.tensordot (w, tdm1, axes=((1,2),(1,2)))
@@ -74,22 +160,38 @@ def e_coul (mc, mo_coeff=None, ci=None, h2eff=None, eris=None):
         Qaa_update : callable
             Takes a unitary matrix of shape (nroots, nroots) and returns
             Qaa, dQaa, and d2Qaa as above using the stored Coulomb
-            tensor intermediate from this function. 
+            tensor factors from this function.
+
+    The Coulomb tensor is never built: everything is evaluated from its
+    factors (see coulomb_factor) in O(naux*nroots^3) operations.
     '''
     nroots = mc.fcisolver.nroots   
  
-    w0 = coulomb_tensor (mc, mo_coeff=mo_coeff, ci=ci, h2eff=h2eff,
+    B0, sgn = coulomb_factor (mc, mo_coeff=mo_coeff, ci=ci, h2eff=h2eff,
         eris=eris)
-    Qaa0, dQaa0, d2Qaa0 = _e_coul (w0, nroots)
+    Qaa0, dQaa0, d2Qaa0 = _e_coul_factor (B0, sgn, nroots)
     def Qaa_update (u=1):
-        w1 = ao2mo.incore.full (w0, u, compact=False)
-        return _e_coul (w1, nroots)
+        if np.isscalar (u): u = u * np.eye (nroots)
+        B1 = np.matmul (np.matmul (u.T, B0), u)
+        return _e_coul_factor (B1, sgn, nroots)
     return Qaa0, dQaa0, d2Qaa0, Qaa_update
 
+def _e_coul_factor (B, sgn, nroots):
+    # w_IJKK and w_IKJK from w_IJKL = sum_P sgn_P B^P_IJ B^P_KL
+    B_KK = np.diagonal (B, axis1=1, axis2=2) * sgn[:,None]
+    w_IJKK = np.tensordot (B, B_KK, axes=((0),(0)))
+    sB = B * sgn[:,None,None]
+    w_IKJK = np.einsum ('pik,pjk->ijk', sB, B, optimize=True)
+    return _e_coul_diags (w_IJKK, w_IKJK, nroots)
+
 def _e_coul (w_IJKL, nroots):
-    npair = nroots * (nroots - 1) // 2
     w_IJKK = np.diagonal (w_IJKL, axis1=2, axis2=3)
     w_IKJK = np.diagonal (w_IJKL, axis1=1, axis2=3)
+    return _e_coul_diags (w_IJKK, w_IKJK, nroots)
+
+def _e_coul_diags (w_IJKK, w_IKJK, nroots):
+    # Only the elements w_IJKK and w_IKJK of the Coulomb tensor are needed
+    npair = nroots * (nroots - 1) // 2
     w_IJJJ = np.diagonal (w_IJKK, axis1=1, axis2=2)
     
     Qaa = np.trace (w_IJJJ) / 2.0
@@ -109,13 +211,21 @@ def _e_coul (w_IJKL, nroots):
     
     v_IJ_K = -4*w_IKJK - 2*w_IJKK
     v_IJ_K += (w_IJJJ+w_IJJJ.T)[:,:,None]
-    d2Qaa = np.zeros_like (w_IJKL)
-    for k in range (nroots):
-        d2Qaa[:,k,k,:] = v_IJ_K[:,:,k]
-    d2Qaa -= d2Qaa.transpose (0,1,3,2)
-    d2Qaa -= d2Qaa.transpose (1,0,2,3)
-    tril_mask2 = np.logical_and.outer (tril_mask, tril_mask)
-    d2Qaa = d2Qaa[tril_mask2].reshape (npair, npair)
+    # d2Qaa[IJ,KL] = d_JK v_IL_J - d_JL v_IK_J - d_IK v_JL_I + d_IL v_JK_I
+    # for I > J, K > L, assembled directly in the (npair,npair) basis
+    pair = -np.ones ((nroots,nroots), dtype=int)
+    pair[tril_mask] = np.arange (npair)
+    a, b, c = np.indices ((nroots,)*3).reshape (3,-1)
+    d2Qaa = np.zeros ((npair,npair), dtype=v_IJ_K.dtype)
+    i, j, l = [x[(a>b) & (b>c)] for x in (a,b,c)]
+    d2Qaa[pair[i,j],pair[j,l]] += v_IJ_K[i,l,j]
+    d2Qaa[pair[j,l],pair[i,j]] += v_IJ_K[i,l,j]
+    i, j, k = [x[(a>b) & (c>b) & (a!=c)] for x in (a,b,c)]
+    d2Qaa[pair[i,j],pair[k,j]] -= v_IJ_K[i,k,j]
+    i, j, l = [x[(a>b) & (a>c) & (b!=c)] for x in (a,b,c)]
+    d2Qaa[pair[i,j],pair[i,l]] -= v_IJ_K[j,l,i]
+    i, j = np.where (tril_mask)
+    d2Qaa[pair[i,j],pair[i,j]] -= v_IJ_K[i,i,j] + v_IJ_K[j,j,i]
 
     return Qaa, dQaa, d2Qaa
 
@@ -16,6 +16,7 @@ from mrh.my_pyscf.mcpdft import pdft_veff
 from mrh.my_pyscf.mcpdft.otpd import get_ontop_pair_density
 from mrh.my_pyscf.mcpdft.otfnal import otfnal, transfnal, get_transfnal
 from mrh.my_pyscf.mcpdft import _dms 
+from mrh.my_pyscf.mcpdft import chkfile as pdft_chk
 
 def energy_tot (mc, mo_coeff=None, ci=None, ot=None, state=0, verbose=None):
     '''Calculate MC-PDFT total energy
@@ -180,6 +181,44 @@ def energy_dft (mc, mo_coeff=None, ci=None, ot=None, state=0, casdm1s=None,
     return ot.energy_ot (casdm1s, casdm2, mo_coeff, mc.ncore,
         max_memory=max_memory, hermi=hermi)
 
+def check_mixed_precision (mcs, verbose=None):
+    '''Compare on-top energies computed with mixed-precision quadrature
+    (see otfnal.mixed_precision) to double-precision ones over a reference
+    set of MC-PDFT calculations
+
+    Args:
+        mcs : list of MC-PDFT objects
+            Reference set; wave functions must already be available (i.e.,
+            each element must have been run)
+
+    Kwargs:
+        verbose : integer
+            Verbosity level of the report; default is that of mcs[0]
+
+    Returns:
+        err : list of ndarrays of shape (nroots,)
+            E_ot(mixed) - E_ot(double) for each state of each element of mcs
+    '''
+    if verbose is None: verbose = mcs[0].verbose
+    log = logger.new_logger (mcs[0], verbose)
+    err = []
+    for i, mc in enumerate (mcs):
+        ot = mc.otfnal
+        nroots = getattr (mc.fcisolver, 'nroots', 1)
+        e = np.zeros ((2, nroots))
+        for j, mixed in enumerate ((False, True)):
+            t0 = (logger.process_clock (), logger.perf_counter ())
+            with temporary_env (ot, mixed_precision=mixed):
+                e[j] = [mc.energy_dft (state=state) for state in range (nroots)]
+            log.timer ('E_ot ({} precision) of system {}'.format (
+                ('double', 'mixed')[j], i), *t0)
+        err.append (e[1] - e[0])
+        log.info ('System %d (%s, %d states): max |E_ot(mixed) - E_ot(double)| '
+                  '= %.3e', i, ot.otxc, nroots, np.amax (np.abs (err[-1])))
+    log.note ('Mixed-precision quadrature: max |error| over %d systems = %.3e',
+              len (mcs), max ([np.amax (np.abs (x)) for x in err]))
+    return err
+
 def get_energy_decomposition (mc, mo_coeff=None, ci=None, ot=None, otxc=None,
                               grids_level=None, grids_attr=None,
                               split_x_c=None, verbose=None):
@@ -244,6 +283,7 @@ def get_energy_decomposition (mc, mo_coeff=None, ci=None, ot=None, otxc=None,
         # TODO: general compatibility with arbitrary (non-translated) fnals
         if otxc is None: otxc = old_ot.otxc
         new_ot = get_transfnal (mc.mol, otxc)
+        new_ot.mixed_precision = old_ot.mixed_precision
         new_ot.grids.__dict__.update (old_grids.__dict__)
         new_ot.grids.__dict__.update (**grids_attr)
         ot = new_ot
@@ -367,6 +407,14 @@ class _PDFT ():
             Vnn + h_pq*D_pq + g_pqrs*d_pqrs/2
         e_ot : float or list of length nroots
             On-top nonclassical term in the MC-PDFT energy
+
+    Checkpoint file:
+        pdft_chkfile : str
+            HDF5 file of dump_pdft_chk or load_pdft_chk. If set,
+            effective potentials (get_pdft_veff) and energy decompositions
+            (get_energy_decomposition) of the saved wave function are
+            written to it when they are computed and read from it when
+            they are requested again. See mcpdft.chkfile.
     '''
 
     def __init__(self, scf, ncas, nelecas, my_ot=None, grids_level=None,
@@ -381,12 +429,14 @@ class _PDFT ():
             # gradients earlier
             super().__init__()
         keys = set (('e_ot', 'e_mcscf', 'get_pdft_veff', 'e_states', 'otfnal',
-            'grids', 'max_cycle_fp', 'conv_tol_ci_fp', 'mcscf_kernel'))
+            'grids', 'max_cycle_fp', 'conv_tol_ci_fp', 'mcscf_kernel',
+            'pdft_chkfile'))
         self.max_cycle_fp = getattr (__config__, 'mcscf_mcpdft_max_cycle_fp',
             50)
         self.conv_tol_ci_fp = getattr (__config__,
             'mcscf_mcpdft_conv_tol_ci_fp', 1e-8)
         self.mcscf_kernel = super().kernel
+        self.pdft_chkfile = None
         self._in_mcscf_env = False
         self._keys = set ((self.__dict__.keys ())).union (keys)
         if grids_level is not None:
@@ -398,7 +448,10 @@ class _PDFT ():
         if grids_attr is None: grids_attr = {}
         old_grids = getattr (self, 'grids', None)
         if isinstance (my_ot, (str, np.string_)):
+            mixed_precision = getattr (getattr (self, 'otfnal', None),
+                'mixed_precision', False)
             self.otfnal = get_transfnal (self.mol, my_ot)
+            self.otfnal.mixed_precision = mixed_precision
         else:
             self.otfnal = my_ot
         if isinstance (old_grids, gen_grid.Grids):
@@ -527,6 +580,18 @@ class _PDFT ():
         t0 = (logger.process_clock (), logger.perf_counter ())
         if mo is None: mo = self.mo_coeff
         if ci is None: ci = self.ci
+        # Only the potentials of properties and gradients are checkpointed
+        use_chk = ((self.pdft_chkfile is not None) and (casdm1s is None)
+                   and (casdm2 is None) and incl_coul and paaa_only
+                   and not (aaaa_only or jk_pc)
+                   and pdft_chk.is_current (self, self.pdft_chkfile, mo, ci,
+                                            [state]))
+        if use_chk:
+            veff = pdft_chk.load_veff (self, self.pdft_chkfile, state, mo)
+            if veff is not None:
+                logger.debug (self, 'get_pdft_veff: state %d read from %s',
+                              state, self.pdft_chkfile)
+                return veff
         if casdm1s is None: casdm1s = self.make_one_casdm1s (ci, state=state)
         if casdm2 is None: casdm2 = self.make_one_casdm2 (ci, state=state)
         ncore, ncas, nelecas = self.ncore, self.ncas, self.nelecas
@@ -541,6 +606,9 @@ class _PDFT ():
         
         if incl_coul:
             pdft_veff1 += self._scf.get_j (self.mol, dm1s[0] + dm1s[1])
+        if use_chk:
+            pdft_chk.dump_veff (self, self.pdft_chkfile, state, pdft_veff1,
+                                pdft_veff2)
         logger.timer (self, 'get_pdft_veff', *t0)
         return pdft_veff1, pdft_veff2
 
@@ -574,14 +642,69 @@ class _PDFT ():
                                   otxc=None, grids_level=None,
                                   grids_attr=None, split_x_c=None,
                                   verbose=None):
+        use_chk = ((self.pdft_chkfile is not None) and (mo_coeff is None)
+                   and (ci is None) and (ot is None) and (otxc is None)
+                   and (grids_level is None) and (grids_attr is None))
         if mo_coeff is None: mo_coeff = self.mo_coeff
         if ci is None: ci = self.ci
         if verbose is None: verbose = self.verbose
-        return get_energy_decomposition (
+        if use_chk:
+            nroots = getattr (self.fcisolver, 'nroots', 1)
+            use_chk = pdft_chk.is_current (self, self.pdft_chkfile, mo_coeff,
+                                           ci, range (nroots))
+        # split_x_c=None is True in get_energy_decomposition
+        if use_chk:
+            e_decomp = pdft_chk.load_e_decomp (self.pdft_chkfile,
+                split_x_c in (None, True))
+            if e_decomp is not None: return e_decomp
+        e_decomp = get_energy_decomposition (
             self, mo_coeff=mo_coeff, ci=ci, ot=ot, otxc=otxc,
             grids_level=grids_level, grids_attr=grids_attr,
             split_x_c=split_x_c, verbose=verbose
         )
+        if use_chk:
+            pdft_chk.dump_e_decomp (self.pdft_chkfile,
+                split_x_c in (None, True), e_decomp)
+        return e_decomp
+
+    def dump_pdft_chk (self, chkfile=None):
+        '''Save the results in an HDF5 checkpoint file (see
+        mcpdft.chkfile) and attach it as self.pdft_chkfile
+
+        Kwargs:
+            chkfile : str
+                Defaults to self.pdft_chkfile, or self.chkfile if that is
+                not set
+        '''
+        if chkfile is None: chkfile = self.pdft_chkfile
+        if chkfile is None: chkfile = self.chkfile
+        self.pdft_chkfile = chkfile
+        pdft_chk.dump_pdft (self, chkfile)
+        return self
+
+    def load_pdft_chk (self, chkfile):
+        '''Restore the results of dump_pdft_chk, e.g., to compute
+        properties without repeating the calculation. The on-top functional
+        is set to the one saved, and chkfile is attached as
+        self.pdft_chkfile.
+
+        Args:
+            chkfile : str
+                Name of the HDF5 file
+        '''
+        data = pdft_chk.load_pdft (chkfile)
+        otxc = data.pop ('otxc')
+        if otxc != self.otxc: self.otxc = otxc
+        e_states = data.pop ('e_states', None)
+        self.__dict__.update (data)
+        if e_states is not None:
+            try:
+                self.e_states = e_states
+            except AttributeError as e:
+                self.fcisolver.e_states = e_states
+                assert (self.e_states is e_states), str (e)
+        self.pdft_chkfile = chkfile
+        return self
 
     def state_average_mix (self, fcisolvers=None, weights=(0.5,0.5)):
         return state_average_mix (self, fcisolvers, weights)
@@ -627,6 +750,7 @@ class _PDFT ():
             # TODO: general compatibility with arbitrary (non-translated) fnals
             if otxc is None: otxc = old_ot.otxc
             new_ot = get_transfnal (self.mol, otxc)
+            new_ot.mixed_precision = old_ot.mixed_precision
             new_ot.grids.__dict__.update (old_grids.__dict__)
             new_ot.grids.__dict__.update (**grids_attr)
             ot = new_ot
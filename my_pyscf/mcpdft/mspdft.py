@@ -1,5 +1,5 @@
 import numpy as np
-from scipy import linalg
+from scipy import linalg, optimize
 from pyscf import lib
 from pyscf.mcscf.addons import StateAverageMCSCFSolver
 from pyscf.mcscf.addons import StateAverageMixFCISolver
@@ -23,6 +23,8 @@ MAX_CYC_DIABATIZE = getattr(__config__, 'mcpdft_mspdft_max_cyc_diabatize', 50)
 CONV_TOL_DIABATIZE = getattr(__config__, 'mcpdft_mspdft_conv_tol_diabatize', 1e-8)
 SING_TOL_DIABATIZE = getattr(__config__, 'mcpdft_mspdft_sing_tol_diabatize', 1e-8)
 NUDGE_TOL_DIABATIZE = getattr(__config__, 'mcpdft_mspdft_nudge_tol_diabatize', 1e-3)
+ALGORITHM_DIABATIZE = getattr(__config__, 'mcpdft_mspdft_algorithm_diabatize', 'newton')
+TRUST_RADIUS_DIABATIZE = getattr(__config__, 'mcpdft_mspdft_trust_radius_diabatize', 0.5)
 
 def make_heff_mcscf (mc, mo_coeff=None, ci=None):
     '''Build Hamiltonian matrix in basis of ci vector
@@ -59,11 +61,15 @@ def make_heff_mcscf (mc, mo_coeff=None, ci=None):
     return heff
 
 def si_newton (mc, ci=None, objfn=None, max_cyc=None, conv_tol=None,
-        sing_tol=None, nudge_tol=None):
+        sing_tol=None, nudge_tol=None, algorithm=None):
     '''Optimize the intermediate states describing the model space of
     an MS-PDFT calculation by maximizing the provided objective function
     using a gradient-ascent algorithm
 
+    If algorithm (default: mc.algorithm_diabatize) is 'trust' or 'bfgs',
+    or if objfn does not provide a Hessian, this calls si_trust_region
+    instead.
+
     Args:
         mc : an instance of MSPDFT class
 
@@ -86,6 +92,8 @@ def si_newton (mc, ci=None, objfn=None, max_cyc=None, conv_tol=None,
         nudge_tol : float
             Minimum step size along a normal coordinate when the surface
             is locally concave.
+        algorithm : string
+            'newton', 'trust', or 'bfgs'. See above.
 
     Returns:
         conv : logical
@@ -100,6 +108,18 @@ def si_newton (mc, ci=None, objfn=None, max_cyc=None, conv_tol=None,
     if conv_tol is None: conv_tol = getattr (mc, 'conv_tol_diabatize', CONV_TOL_DIABATIZE)
     if sing_tol is None: sing_tol = getattr (mc, 'sing_tol_diabatize', SING_TOL_DIABATIZE)
     if nudge_tol is None: nudge_tol = getattr (mc, 'nudge_tol_diabatize', NUDGE_TOL_DIABATIZE)
+    if algorithm is None: algorithm = getattr (mc, 'algorithm_diabatize', ALGORITHM_DIABATIZE)
+    if algorithm.lower () in ('trust', 'bfgs'):
+        return si_trust_region (mc, ci=ci, objfn=objfn, max_cyc=max_cyc,
+            conv_tol=conv_tol, sing_tol=sing_tol,
+            quasi_newton=(algorithm.lower () == 'bfgs'))
+    elif algorithm.lower () != 'newton':
+        raise RuntimeError ("Unknown diabatization algorithm '{}'".format (
+            algorithm))
+    f, df, d2f, f_update = objfn (ci=ci)
+    if d2f is None:
+        return si_trust_region (mc, ci=ci, objfn=objfn, max_cyc=max_cyc,
+            conv_tol=conv_tol, sing_tol=sing_tol, quasi_newton=True)
     ci = np.array (ci) # copy
     ci_old = ci.copy ()
     log = lib.logger.new_logger (mc, mc.verbose)
@@ -110,7 +130,6 @@ def si_newton (mc, ci=None, objfn=None, max_cyc=None, conv_tol=None,
     t = np.zeros((nroots,nroots))
     conv = False
     hdr = '{} intermediate-state'.format (mc.__class__.__name__)
-    f, df, d2f, f_update = objfn (ci=ci)
     for it in range(max_cyc):
         log.info ("****iter {} ***********".format (it))
         log.info ("{} objective function value = {}".format (hdr, f))
@@ -177,6 +196,180 @@ def si_newton (mc, ci=None, objfn=None, max_cyc=None, conv_tol=None,
 
     return conv, list (ci)
 
+def _trust_region_step (df, d2f, radius):
+    '''Maximize the model df.x + x.d2f.x/2 in the eigenbasis of d2f
+    subject to |x| <= radius. The level shift mu is first taken from the
+    augmented Hessian [[0, df],[df, d2f]] (the secular equation
+    mu = sum_i df_i^2 / (mu - d2f_i)) and then raised, if necessary, to
+    bring the step back inside the trust radius.
+
+    Args:
+        df : ndarray of shape (n)
+            Gradient in the eigenbasis of the Hessian
+        d2f : ndarray of shape (n)
+            Hessian eigenvalues
+        radius : float
+            Trust radius
+
+    Returns:
+        x : ndarray of shape (n)
+            Step in the eigenbasis of the Hessian
+        pred : float
+            Predicted change of the objective function
+    '''
+    gnorm = linalg.norm (df)
+    if gnorm == 0: return np.zeros_like (df), 0.0
+    mu_lo = max (np.amax (d2f), 0.0)
+    mu_lo += 1e-12 * max (1.0, mu_lo)
+    secular = lambda mu: mu - np.dot (df, df / (mu - d2f))
+    if secular (mu_lo) >= 0: mu = mu_lo
+    else: mu = optimize.brentq (secular, mu_lo, mu_lo + gnorm)
+    x = df / (mu - d2f)
+    if linalg.norm (x) > radius:
+        overshoot = lambda mu: linalg.norm (df / (mu - d2f)) - radius
+        mu = optimize.brentq (overshoot, mu, mu_lo + gnorm/radius)
+        x = df / (mu - d2f)
+    pred = np.dot (df, x) + np.dot (x, d2f * x) / 2
+    return x, pred
+
+def si_trust_region (mc, ci=None, objfn=None, max_cyc=None, conv_tol=None,
+        sing_tol=None, trust_radius=None, quasi_newton=False):
+    '''Optimize the intermediate states describing the model space of
+    an MS-PDFT calculation by maximizing the provided objective function
+    using augmented-Hessian steps within a trust region. Steps that do
+    not increase the objective function are rejected and the trust
+    radius is adjusted according to the ratio of the actual to the
+    predicted increase.
+
+    Args:
+        mc : an instance of MSPDFT class
+
+    Kwargs:
+        ci : ndarray or list of len (nroots)
+            CI vectors spanning the model space
+        objfn : callable
+            Takes CI vectors as a kwarg and returns the value, gradient,
+            and Hessian of a chosen objective function wrt rotation
+            between pairs of CI vectors, and optionally an update
+            function (see _MSPDFT.diabatizer). The Hessian may be None,
+            in which case quasi_newton is set to True.
+        max_cyc : integer
+            Maximum number of accepted steps; rejected steps don't count
+        conv_tol : float
+            Maximum value of both gradient and step vectors at
+            convergence
+        sing_tol : float
+            Tolerance for determining when normal coordinate belongs to
+            the null space (df = d2f = 0)
+        trust_radius : float
+            Initial (and 1/4 of the maximum) trust radius, in radians
+        quasi_newton : logical
+            If True, the Hessian is approximated by BFGS updates from the
+            gradients instead of taken from objfn
+
+    Returns:
+        conv : logical
+            True if the optimization is converged
+        ci : list of len (nroots)
+            Optimized CI vectors describing intermediate states
+    '''
+    if ci is None: ci = mc.ci
+    if objfn is None: objfn = mc.diabatizer
+    if max_cyc is None: max_cyc = getattr (mc, 'max_cyc_diabatize', MAX_CYC_DIABATIZE)
+    if conv_tol is None: conv_tol = getattr (mc, 'conv_tol_diabatize', CONV_TOL_DIABATIZE)
+    if sing_tol is None: sing_tol = getattr (mc, 'sing_tol_diabatize', SING_TOL_DIABATIZE)
+    if trust_radius is None: trust_radius = getattr (mc, 'trust_radius_diabatize',
+                                                     TRUST_RADIUS_DIABATIZE)
+    max_radius = 4 * trust_radius
+    ci = np.array (ci) # copy
+    log = lib.logger.new_logger (mc, mc.verbose)
+    nroots = mc.fcisolver.nroots 
+    npairs = nroots * (nroots - 1) // 2
+    hdr = '{} intermediate-state'.format (mc.__class__.__name__)
+    f, df, d2f, f_update = objfn (ci=ci)
+    if d2f is None: quasi_newton = True
+    if quasi_newton: d2f = -np.eye (npairs)
+    u = np.eye (nroots)
+    t = np.zeros ((nroots,nroots))
+    radius = trust_radius
+    conv = False
+    it = 0
+    while it < max_cyc:
+        log.info ("****iter {} ***********".format (it))
+        log.info ("{} objective function value = {}".format (hdr, f))
+
+        # Analyze Hessian
+        evals, evecs = linalg.eigh (d2f)
+        df_nm = np.dot (df, evecs)
+        idx_null = (np.abs (evals) < sing_tol) & (np.abs (df_nm) < sing_tol)
+        df_nm[idx_null] = 0.0
+        neg_def = np.all ((evals < 0) | idx_null)
+        log.info ("{} Hessian is negative-definite? {}".format (hdr, neg_def))
+        grad_norm = linalg.norm (df_nm)
+        log.info ("{} grad norm = %f".format (hdr), grad_norm)
+
+        # Step within the trust region
+        x, pred = _trust_region_step (df_nm, evals, radius)
+        if grad_norm < conv_tol and not neg_def:
+            # Stationary but not a maximum: leave along the mode of
+            # greatest curvature
+            x[:] = 0
+            x[np.argmax (evals)] = radius
+            pred = np.amax (evals) * radius * radius / 2
+        step_norm = linalg.norm (x)
+        log.info ("{} trust radius = %f; step norm = %f; predicted change "
+                  "= %e".format (hdr), radius, step_norm, pred)
+        if grad_norm < conv_tol and step_norm < conv_tol and neg_def:
+            conv = True
+            break
+        dx = np.dot (evecs, x)
+        t[:] = 0
+        t[np.tril_indices (nroots, k=-1)] = dx
+        t = t - t.T
+        # See si_newton for the transpose
+        u1 = np.dot (u, linalg.expm (t).T)
+        f1, df1, d2f1 = f_update (u1)
+        ratio = (f1 - f) / pred if pred > 0 else 1.0
+        log.debug ("{} actual/predicted change = %f".format (hdr), ratio)
+        if ratio < 0.25:
+            radius = 0.25 * step_norm
+        elif ratio > 0.75 and step_norm > 0.99 * radius:
+            radius = min (2 * radius, max_radius)
+        if f1 < f:
+            log.debug ("{} step rejected".format (hdr))
+            # The radius shrinks at least fourfold with every rejection;
+            # once it is below conv_tol, f is as large as its numerical
+            # precision allows
+            if radius < conv_tol: break
+            continue
+        if quasi_newton:
+            # BFGS update of the negative-definite Hessian, treating the
+            # pairwise rotations in successive frames as one coordinate
+            y = df1 - df
+            sy = np.dot (dx, y)
+            if sy < -1e-12 * linalg.norm (dx) * linalg.norm (y):
+                Hs = np.dot (d2f, dx)
+                d2f = (d2f + np.multiply.outer (Hs, Hs) / np.dot (dx, -Hs)
+                       + np.multiply.outer (y, y) / sy)
+                d2f = (d2f + d2f.T) / 2
+        else:
+            d2f = d2f1
+        u, f, df = u1, f1, df1
+        it += 1
+
+    ci = np.tensordot(u.T, ci, 1)
+    if mc.verbose >= lib.logger.DEBUG:
+        fmt_str = ' ' + ' '.join (['{:5.2f}',]*nroots)
+        log.debug ("{} final overlap matrix:".format (hdr))
+        for row in u: log.debug (fmt_str.format (*row))
+    if conv:
+        log.note ("{} optimization CONVERGED".format (hdr))
+    else:
+        log.note (("{} optimization did not converge after {} "
+                   "cycles".format (hdr, it)))
+
+    return conv, list (ci)
+
 class MultiStateMCPDFTSolver ():
     pass
     # tag
@@ -205,6 +398,13 @@ class _MSPDFT (MultiStateMCPDFTSolver):
             Minimum step size along modes with positive curvature during
             the diabatization algorithm, so as to push away from saddle
             points and minima. Default is 1e-3.
+        algorithm_diabatize : string
+            'newton' (default) for the Newton iteration with nudging
+            above; 'trust' for augmented-Hessian steps in a trust region;
+            'bfgs' for the trust-region algorithm with a BFGS Hessian
+        trust_radius_diabatize : float
+            Initial trust radius (radians) of the 'trust' and 'bfgs'
+            algorithms. Default is 0.5.
 
     Saved results
 
@@ -243,7 +443,8 @@ class _MSPDFT (MultiStateMCPDFTSolver):
                      'get_heff_offdiag', 'get_heff_pdft', 
                      'si', 'si_mcscf', 'si_pdft',
                      'max_cyc_diabatize', 'conv_tol_diabatize',
-                     'sing_tol_diabatize', 'nudge_tol_diabatize'))
+                     'sing_tol_diabatize', 'nudge_tol_diabatize',
+                     'algorithm_diabatize', 'trust_radius_diabatize'))
         self._diabatizer = diabatizer
         self._diabatize = diabatize
         self._e_states = None
@@ -251,6 +452,8 @@ class _MSPDFT (MultiStateMCPDFTSolver):
         self.conv_tol_diabatize = CONV_TOL_DIABATIZE
         self.sing_tol_diabatize = SING_TOL_DIABATIZE
         self.nudge_tol_diabatize = CONV_TOL_DIABATIZE
+        self.algorithm_diabatize = ALGORITHM_DIABATIZE
+        self.trust_radius_diabatize = TRUST_RADIUS_DIABATIZE
         self.diabatization = diabatization
         self.si_mcscf = None
         self.si_pdft = None
@@ -25,18 +25,15 @@ def get_gorb_update (mc, mo_coeff, ncore=None, ncas=None, nelecas=None,
             incl_coul=incl_coul, paaa_only=True)
         h1e_mo = ((mo.T @ (hcore + veff1) @ mo)
                    + veff2.vhf_c)
-        aapa = np.zeros ((ncas,ncas,nmo,ncas), dtype=h1e_mo.dtype)
-        vhf_a = np.zeros ((nmo,nmo), dtype=h1e_mo.dtype)
-        for i in range (nmo):
-            jbuf = veff2.ppaa[i]
-            aapa[:,:,i,:] = jbuf[ncore:nocc,:,:]
-            vhf_a[i] = np.tensordot (jbuf, casdm1, axes=2)
-        vhf_a *= 0.5
+        paaa = veff2.get_paaa ()
         # for this potential, vj = vk: vj - vk/2 = vj - vj/2 = vj/2
+        vhf_a = veff2.get_vhf_a (casdm1)
         g = np.zeros ((nmo, nmo))
         g[:,:ncore] = (h1e_mo[:,:ncore] + vhf_a[:,:ncore]) * 2
         g[:,ncore:nocc] = h1e_mo[:,ncore:nocc] @ casdm1
-        g[:,ncore:nocc] += np.einsum('uviw,vuwt->it', aapa, casdm2)
+        # einsum ('iuvw,vuwt->it', paaa, casdm2)
+        g[:,ncore:nocc] += np.tensordot (paaa, casdm2,
+            axes=((1,2,3),(1,0,2)))
         return mc.pack_uniq_var(g-g.T)
     return gorb_update
 
@@ -52,7 +49,7 @@ def mc1step_gen_g_hop (mc, mo, u, casdm1, casdm2, eris):
     veff1, veff2 = mc.get_pdft_veff (mo=mo, casdm1s=casdm1s, casdm2=casdm2,
         incl_coul=True)
     veff2.eot_h_op = EotOrbitalHessianOperator (mc, mo_coeff=mo, casdm1=casdm1,
-        casdm2=casdm2, do_cumulant=True)
+        casdm2=casdm2, do_cumulant=True, cache=True)
     def get_hcore (mol=None):
         return mc._scf.get_hcore (mol) + veff1
     with lib.temporary_env (mc, get_hcore=get_hcore):
@@ -7,6 +7,7 @@ from pyscf.lib import logger
 from pyscf.dft.gen_grid import Grids
 from pyscf.dft.numint import _NumInt, NumInt
 from mrh.my_pyscf.mcpdft import pdft_veff, tfnal_derivs, _libxc, _dms
+from mrh.my_pyscf.mcpdft import _gridblocks
 from mrh.my_pyscf.mcpdft.otpd import get_ontop_pair_density
 from pyscf import __config__
 
@@ -64,8 +65,12 @@ def energy_ot (ot, casdm1s, casdm2, mo_coeff, ncore, max_memory=2000, hermi=1):
     t0 = (logger.process_clock (), logger.perf_counter ())
     make_rho = tuple (ni._gen_rho_evaluator (ot.mol, dm1s[i,:,:], hermi) for
         i in range(2))
+    ncols = _gridblocks.ncols_energy_ot (nao, ncas, dens_deriv, ot.Pi_deriv)
+    ngrids = _gridblocks.get_ngrids (ot.grids)
+    blksize = _gridblocks.get_blksize (ncols, ngrids, max_memory,
+        log=logger.new_logger (ot, ot.verbose), label='PDFT energy')
     for ao, mask, weight, coords in ni.block_loop (ot.mol, ot.grids, nao,
-            dens_deriv, max_memory):
+            dens_deriv, max_memory, blksize=blksize):
         rho = np.asarray ([m[0] (0, ao, mask, xctype) for m in make_rho])
         t0 = logger.timer (ot, 'untransformed density', *t0)
         Pi = get_ontop_pair_density (ot, rho, ao, cascm2, mo_cas,
@@ -100,6 +105,12 @@ class otfnal:
             and "_xc_type" (at least) must be overloaded; see below
         otxc : string
             name of on-top pair-density exchange-correlation functional
+        mixed_precision : logical
+            If True, the active-orbital part of the on-top pair density
+            (AO->MO transformation and contraction with the cumulant) is
+            evaluated in single precision, with grid-point sums
+            accumulated in double precision. Meant for screening; see
+            mcpdft.check_mixed_precision for the size of the error.
     '''
 
     def __init__ (self, mol, **kwargs):
@@ -108,6 +119,7 @@ class otfnal:
         self.stdout = mol.stdout    
 
     Pi_deriv = 0
+    mixed_precision = False
 
     def _init_info (self):
         logger.info (self, 'Building %s functional', self.otxc)
@@ -9,20 +9,28 @@ from itertools import product
 from os import path
 
 def _grid_ao2mo (mol, ao, mo_coeff, non0tab=None, shls_slice=None,
-        ao_loc=None):
+        ao_loc=None, dtype=None):
     '''ao[deriv,grid,AO].mo_coeff[AO,MO]->mo[deriv,grid,MO]
     ASSUMES that ao is in data layout (deriv,AO,grid) in row-major order!
-    mo is returned in data layout (deriv,MO,grid) in row-major order '''
+    mo is returned in data layout (deriv,MO,grid) in row-major order
+    If dtype is given (e.g., np.float32 in mixed-precision mode), mo is
+    still evaluated by the screened double-precision kernel, one derivative
+    at a time, and stored as dtype. '''
     nderiv, ngrid, nao = ao.shape
     nmo = mo_coeff.shape[-1]
-    mo = np.empty ((nderiv,nmo,ngrid), dtype=mo_coeff.dtype, order='C')
+    if dtype is None: dtype = mo_coeff.dtype
+    mo = np.empty ((nderiv,nmo,ngrid), dtype=dtype, order='C')
     mo = mo.transpose (0,2,1)
+    buf = None
+    if mo.dtype != mo_coeff.dtype:
+        buf = np.empty ((nmo,ngrid), dtype=mo_coeff.dtype).T
     if shls_slice is None: shls_slice = (0, mol.nbas)
     if ao_loc is None: ao_loc = mol.ao_loc_nr ()
     for ideriv in range (nderiv):
         ao_i = ao[ideriv,:,:]
+        out = mo[ideriv] if buf is None else buf
         mo[ideriv] = _dot_ao_dm (mol, ao_i, mo_coeff, non0tab, shls_slice,
-            ao_loc, out=mo[ideriv])
+            ao_loc, out=out)
     return mo 
 
 
@@ -97,7 +105,17 @@ def get_ontop_pair_density (ot, rho, ao, cascm2, mo_cas, deriv=0,
     # but whether or when they actually multithread is unclear
     # Update 05/11/2020: ao is actually stored in row-major order
     # = (deriv,AOs,grids).
-    grid2amo = _grid_ao2mo (ot.mol, ao, mo_cas, non0tab=non0tab)
+    # In mixed-precision mode, the second cumulant is evaluated in single
+    # precision and only the grid-point sums are accumulated in double.
+    # The AOs stay in double precision; only the active orbitals on the
+    # grid are stored in single precision.
+    amo_dtype = None
+    if getattr (ot, 'mixed_precision', False):
+        ao = ao[:(1,4,10)[deriv]]
+        cascm2 = cascm2.astype (np.float32)
+        amo_dtype = np.float32
+    grid2amo = _grid_ao2mo (ot.mol, ao, mo_cas, non0tab=non0tab,
+        dtype=amo_dtype)
     t0 = logger.timer (ot, 'otpd ao2mo', *t0)
     gridkern = np.zeros (grid2amo.shape + (grid2amo.shape[2],),
         dtype=grid2amo.dtype)
@@ -105,7 +123,7 @@ def get_ontop_pair_density (ot, rho, ao, cascm2, mo_cas, deriv=0,
     # r_0ai,  r_0aj  -> r_0aij
     wrk0 = np.tensordot (gridkern[0], cascm2, axes=2)                  
     # r_0aij, P_ijkl -> P_0akl
-    Pi[0] += (gridkern[0] * wrk0).sum ((1,2)) / 2                          
+    Pi[0] += (gridkern[0] * wrk0).sum ((1,2), dtype=Pi.dtype) / 2                          
     # r_0aij, P_0aij -> P_0a
     t0 = logger.timer_debug1 (ot, 'otpd second cumulant 0th derivative', *t0)
     if deriv > 0:
@@ -115,7 +133,8 @@ def get_ontop_pair_density (ot, rho, ao, cascm2, mo_cas, deriv=0,
             gridkern[ideriv] = (grid2amo[ideriv,:,:,np.newaxis]
                 * grid2amo[0,:,np.newaxis,:])
             # r_1ai,  r_0aj  -> r_1aij
-            Pi[ideriv] += (gridkern[ideriv] * wrk0).sum ((1,2)) * 2
+            Pi[ideriv] += (gridkern[ideriv] * wrk0).sum ((1,2),
+                dtype=Pi.dtype) * 2
             # r_1aij, P_0aij -> P_1a  
             t0 = logger.timer_debug1 (ot, 'otpd second cumulant 1st derivative'
                 ' ({})'.format (ideriv), *t0)
@@ -135,10 +154,10 @@ def get_ontop_pair_density (ot, rho, ao, cascm2, mo_cas, deriv=0,
         # r_1ai, r_1aj -> r_2aij
         wrk1 = np.tensordot (gridkern[1:4], cascm2, axes=2)
         # r_1aij, P_ijkl -> P_1akl
-        Pi[4] += (gridkern[4] * wrk0).sum ((1,2)) / 2
+        Pi[4] += (gridkern[4] * wrk0).sum ((1,2), dtype=Pi.dtype) / 2
         # r_2aij, P_0aij -> P_2a
         Pi[4] -= ((gridkern[1:4] + gridkern[1:4].transpose (0, 1, 3, 2))
-            * wrk1).sum ((0,2,3)) / 2
+            * wrk1).sum ((0,2,3), dtype=Pi.dtype) / 2
         # r_1aij, P_1aij -> P_2a
         t0 = logger.timer (ot, 'otpd second cumulant off-top Laplacian', *t0)
 
@@ -1,17 +1,17 @@
-import time, math
+import time, math, tempfile
 import numpy as np
 from scipy import linalg
 from itertools import combinations_with_replacement, product
 from pyscf import lib, ao2mo
-from pyscf.dft.gen_grid import BLKSIZE
 from pyscf.dft.numint import _contract_rho
 from pyscf.mcscf import mc1step
 from pyscf.scf import hf
 from mrh.my_pyscf.mcpdft.otpd import *
 from mrh.my_pyscf.mcpdft.otpd import _grid_ao2mo
 from mrh.my_pyscf.mcpdft.tfnal_derivs import contract_fot, _unpack_sigma_vector
-from mrh.my_pyscf.mcpdft.pdft_veff import _contract_vot_ao, _contract_vot_rho
+from mrh.my_pyscf.mcpdft.pdft_veff import _contract_vot_rho
 from mrh.my_pyscf.mcpdft.pdft_veff import _dot_ao_mo
+from mrh.my_pyscf.mcpdft import _gridblocks
 
 def _contract_rho_all (bra, ket):
     # Apply the product rule when computing density & derivs on a grid
@@ -33,6 +33,46 @@ def _contract_rho_all (bra, ket):
 from mrh.util import la
 def vector_error (test, ref): return la.vector_error (test, ref, 'rel')
 
+class _BlockCache (object):
+    '''Store for the data of a sequence of grid blocks, held in memory up
+    to max_memory (in MB) and spilled beyond that to a scratch file in
+    tmpdir which is read back through read-only memory maps'''
+
+    def __init__(self, max_memory, tmpdir=None):
+        if tmpdir is None: tmpdir = lib.param.TMPDIR
+        self.max_memory = max_memory
+        self.tmpdir = tmpdir
+        self.blocks = []
+        self.nbytes_mem = self.nbytes_disk = 0
+        self._scratch = None
+
+    def _put (self, arr):
+        if arr is None: return None
+        if isinstance (arr, (list, tuple)):
+            return type (arr) (self._put (a) for a in arr)
+        # Always copy: block_loop reuses its ao buffer
+        arr = np.array (arr, order='C')
+        if arr.size == 0 or (self.nbytes_mem + arr.nbytes
+                             <= self.max_memory*1e6):
+            self.nbytes_mem += arr.nbytes
+            return arr
+        if self._scratch is None:
+            self._scratch = tempfile.NamedTemporaryFile (dir=self.tmpdir)
+        self._scratch.write (arr.tobytes ())
+        self._scratch.flush ()
+        arr_mm = np.memmap (self._scratch.name, dtype=arr.dtype, mode='r',
+            offset=self.nbytes_disk, shape=arr.shape)
+        self.nbytes_disk += arr.nbytes
+        return arr_mm
+
+    def append (self, blk):
+        blk = self._put (tuple (blk))
+        self.blocks.append (blk)
+        return blk
+
+    def __iter__(self):
+        return iter (self.blocks)
+
 # PySCF's overall sign convention is
 #   de = h.D - D.h
 #   dD = x.D - D.x
@@ -77,7 +117,7 @@ class EotOrbitalHessianOperator (object):
     
     def __init__(self, mc, ot=None, mo_coeff=None, ncore=None, ncas=None,
             casdm1=None, casdm2=None, max_memory=None, do_cumulant=True,
-            incl_d2rho=False):
+            incl_d2rho=False, cache=False, max_cache_memory=None):
         if ot is None: ot = mc.otfnal
         if mo_coeff is None: mo_coeff = mc.mo_coeff
         if ncore is None: ncore = mc.ncore
@@ -115,6 +155,9 @@ class EotOrbitalHessianOperator (object):
         self.max_memory = max_memory        
         self.do_cumulant = do_cumulant
         self.incl_d2rho = incl_d2rho
+        self.cache = cache
+        self.max_cache_memory = max_cache_memory
+        self._block_cache = None
 
         dm1 = 2 * np.eye (nocc, dtype=casdm1.dtype)
         dm1[ncore:,ncore:] = casdm1
@@ -148,11 +191,8 @@ class EotOrbitalHessianOperator (object):
             # calculation. Have to completely redo the gradient matrix
             # because "redundant" d.o.f. aren't
             v1 = mo_coeff.conj ().T @ veff1 @ mo_coeff + veff2.vhf_c
-            v2 = np.zeros ((nmo,ncas,ncas,ncas), dtype=v1.dtype)
-            for i in range (nmo):
-                jbuf = veff2.ppaa[i]
-                v2[i,:,:,:] = jbuf[ncore:nocc,:,:]
-                v1[i,:] += np.tensordot (jbuf, casdm1, axes=2) * 0.5
+            v2 = veff2.get_paaa ()
+            v1 += veff2.get_vhf_a (casdm1)
             f1 = np.zeros_like (v1)
             f1[:,:ncore] = 2 * v1[:,:ncore]
             f1[:,ncore:nocc] += v1[:,ncore:nocc] @ casdm1
@@ -203,21 +243,50 @@ class EotOrbitalHessianOperator (object):
             self._v1 = mo_coeff.conj ().T @ v1 @ mo_coeff
             self._v2 = ao2mo.full (v2, mo_coeff)
 
-    def get_blocksize (self):
+    def get_blocksize (self, nvec=1):
         nderiv_ao, nao = self.nderiv_ao, self.nao
         nderiv_rho, nderiv_Pi = self.nderiv_rho, self.nderiv_Pi
         ncas, nocc = self.ncas, self.nocc
-        # Ignore everything that doesn't scale with the size of the molecule
-        # or the active space
-        nvar = 2 + int (self.rho_deriv) + 2*int (self.Pi_deriv)
-        ncol = (nderiv_ao*(2*nao+ncas)        # ao + copy + mo_cas
-             + (2+nderiv_Pi)*(ncas**2)        # tensor-product intermediate
-             + nocc*(2*nderiv_rho+nderiv_Pi)) # drho_a, drho_b, dPi
-        ncol *= 1.1 # fudge factor
-        ngrids = self.ot.grids.coords.shape[0]
-        remaining_floats = (self.max_memory-lib.current_memory()[0]) * 1e6 / 8
-        blksize = int (remaining_floats/(ncol*BLKSIZE))*BLKSIZE
-        return max(BLKSIZE,min(blksize,ngrids,BLKSIZE*1200))
+        ncol = _gridblocks.ncols_feff (nao, ncas, nocc, nderiv_ao, nderiv_rho,
+            nderiv_Pi, nvec=nvec)
+        ngrids = _gridblocks.get_ngrids (self.ot.grids)
+        return _gridblocks.get_blksize (ncol, ngrids, self.max_memory,
+            log=self.log, label='PDFT feff')
+
+    def gen_block_data (self, nvec=1):
+        '''Generate the x-independent data of each grid block: ao, mask,
+        weights, rho0, Pi0, drho, dPi, and (vot, fot). If self.cache,
+        the first sweep stores them, in memory up to max_cache_memory
+        (default: half of the memory available) and in a memory-mapped
+        scratch file beyond that, and later sweeps reuse them. The cache
+        lives as long as this object, whose mo_coeff, casdm1, and casdm2
+        are fixed. nvec is the number of trial vectors for which the grid
+        block size is chosen if the blocks are not cached.'''
+        if self._block_cache is not None:
+            for blk in self._block_cache: yield blk
+            return
+        store = None
+        if self.cache:
+            max_cache_memory = self.max_cache_memory
+            if max_cache_memory is None:
+                max_cache_memory = max (0, (self.max_memory
+                    - lib.current_memory ()[0]) / 2)
+            store = _BlockCache (max_cache_memory)
+        for ao, mask, weights, coords in self.ni.block_loop (self.ot.mol,
+                self.ot.grids, self.nao, self.rho_deriv, self.max_memory,
+                blksize=self.get_blocksize (nvec=nvec)):
+            rho0, Pi0 = self.make_dens0 (ao, mask)
+            if ao.ndim == 2: ao = ao[None,:,:]
+            drho, dPi = self.make_ddens (ao, rho0, mask)
+            vot_fot = self.get_fot (rho0, Pi0, weights)
+            blk = (ao, mask, weights, rho0, Pi0, drho, dPi, vot_fot)
+            if store is not None: blk = store.append (blk)
+            yield blk
+        if store is not None:
+            self.log.debug ('EotOrbitalHessianOperator cached %d grid blocks: '
+                '%.1f MB in memory, %.1f MB on disk', len (store.blocks),
+                store.nbytes_mem/1e6, store.nbytes_disk/1e6)
+            self._block_cache = store
 
     def make_dens0 (self, ao, mask, make_rho=None, casdm1s=None, cascm2=None,
             mo_cas=None):
@@ -265,18 +334,28 @@ class EotOrbitalHessianOperator (object):
         # Therefore,
         # 1) the SECOND index of x contracts with drho
         # 2) we MULTIPLY BY TWO to to account for + transpose
+        # If x has shape (nvec,nmo,nmo), all vectors share one
+        # AO-to-MO transformation on the grid and the returned densities
+        # have a leading dimension of size nvec.
         
         ngrids = drho.shape[-1]
-        ncore, nocc = self.ncore, self.nocc
-        occ_coeff_1 = self.mo_coeff @ x[:,:self.nocc] * 2
-        mo1 = _grid_ao2mo (self.ot.mol, ao, occ_coeff_1, non0tab=mask)
-        Pi1 = _contract_rho_all (mo1[:self.nderiv_Pi], dPi)
-        mo1 = mo1[:self.nderiv_rho]
-        drho_c, mo1_c = drho[:,:,:ncore],     mo1[:,:,:ncore]
-        drho_a, mo1_a = drho[:,:,ncore:nocc], mo1[:,:,ncore:nocc]
-        rho1_c = _contract_rho_all (mo1_c, drho_c)
-        rho1_a = _contract_rho_all (mo1_a, drho_a)
-        return rho1_c, rho1_a, Pi1
+        ncore, nocc, nmo = self.ncore, self.nocc, self.nmo
+        xs = x if x.ndim == 3 else x[None,:,:]
+        nvec = xs.shape[0]
+        x_occ = xs[:,:,:nocc].transpose (1,0,2).reshape (nmo, nvec*nocc)
+        occ_coeff_1 = self.mo_coeff @ x_occ * 2
+        mo1_all = _grid_ao2mo (self.ot.mol, ao, occ_coeff_1, non0tab=mask)
+        drho_c, drho_a = drho[:,:,:ncore], drho[:,:,ncore:nocc]
+        rho1_c, rho1_a, Pi1 = [], [], []
+        for i in range (nvec):
+            mo1 = mo1_all[:,:,i*nocc:(i+1)*nocc]
+            Pi1.append (_contract_rho_all (mo1[:self.nderiv_Pi], dPi))
+            mo1 = mo1[:self.nderiv_rho]
+            rho1_c.append (_contract_rho_all (mo1[:,:,:ncore], drho_c))
+            rho1_a.append (_contract_rho_all (mo1[:,:,ncore:nocc], drho_a))
+        if x.ndim == 3:
+            return np.stack (rho1_c), np.stack (rho1_a), np.stack (Pi1)
+        return rho1_c[0], rho1_a[0], Pi1[0]
 
     def debug_dens1 (self, ao, mask, x, weights, rho0, Pi0, rho1_test,
             Pi1_test):
@@ -328,9 +407,23 @@ class EotOrbitalHessianOperator (object):
         return vrho, vPi
 
     def get_fxot (self, ao, rho0, Pi0, drho, dPi, x, weights, mask,
-            return_num=False):
-        vot, fot = self.get_fot (rho0, Pi0, weights)
+            return_num=False, vot_fot=None):
+        if vot_fot is None: vot_fot = self.get_fot (rho0, Pi0, weights)
+        vot, fot = vot_fot
         rho1_c, rho1_a, Pi1 = self.make_dens1 (ao, drho, dPi, mask, x)
+        if x.ndim == 3:
+            assert (not return_num)
+            res = [self._get_fxot_dens1 (ao, rho0, Pi0, r1_c, r1_a, P1, xi,
+                weights, mask, vot, fot)
+                for r1_c, r1_a, P1, xi in zip (rho1_c, rho1_a, Pi1, x)]
+            de = np.array ([r[0] for r in res])
+            return [de] + [None if r[0] is None else np.stack (r, axis=0)
+                for r in list (zip (*res))[1:]]
+        return self._get_fxot_dens1 (ao, rho0, Pi0, rho1_c, rho1_a, Pi1, x,
+            weights, mask, vot, fot, return_num=return_num)
+
+    def _get_fxot_dens1 (self, ao, rho0, Pi0, rho1_c, rho1_a, Pi1, x,
+            weights, mask, vot, fot, return_num=False):
         rho1 = rho1_c + rho1_a
         if self.verbose > lib.logger.DEBUG:
             self.debug_dens1 (ao, mask, x, weights, rho0, Pi0, rho1, Pi1)
@@ -354,11 +447,31 @@ class EotOrbitalHessianOperator (object):
         return de, fxrho, fxPi, fxrho_c, fxrho_a
 
     def contract_v_ddens (self, v, ddens, ao, weights, mask):
-        vw = v * weights[None,:]
-        vao = _contract_vot_ao (vw, ao)
-        return sum ([_dot_ao_mo (self.ot.mol, v, d, non0tab=mask,
-            shls_slice=self.shls_slice, ao_loc=self.ao_loc,
-            hermi=0) for v, d in zip (vao, ddens)])
+        # With vao = _contract_vot_ao (v, ao), the product rule gives
+        #   sum_k vao[k].T @ ddens[k]
+        #   = sum_j ao[j].T @ (v[j]*ddens[0])
+        #   + ao[0].T @ sum_(k>0) (v[k]*ddens[k])
+        # The second form lets the vectors of a batch v of shape
+        # (nvec,nderiv,ngrids) share one GEMM per AO derivative, returning
+        # an array of shape (nvec,nao,norb)
+        is_batch = (v.ndim == 3)
+        if not is_batch: v = v[None,:,:]
+        nvec, nderiv = v.shape[:2]
+        ngrids, norb = ddens.shape[1:]
+        nd = min (nderiv, len (ddens))
+        vw = (v * weights[None,None,:]).transpose (1,2,0)
+        w = np.empty ((nderiv, ngrids, nvec, norb),
+            dtype=np.result_type (vw, ddens))
+        np.multiply (vw[:,:,:,None], ddens[0][None,:,None,:], out=w)
+        for k in range (1, nd):
+            w[0] += vw[k][:,:,None] * ddens[k][:,None,:]
+        w = w.reshape (nderiv, ngrids, nvec*norb)
+        vd = sum ([_dot_ao_mo (self.ot.mol, ao[j], w[j], non0tab=mask,
+            shls_slice=self.shls_slice, ao_loc=self.ao_loc, hermi=0)
+            for j in range (nderiv)])
+        vd = vd.reshape (-1, nvec, norb).transpose (1,0,2)
+        if not is_batch: vd = vd[0]
+        return vd
 
     def debug_cumulant (self, x, dg_cum):
         norm_x = linalg.norm (x)
@@ -389,7 +502,9 @@ class EotOrbitalHessianOperator (object):
             Args:
                 x : ndarray
                     Orbital-rotation step vector. See kwarg "packed" for
-                    shape
+                    shape. An additional leading dimension of size nvec
+                    requests the products with nvec vectors at once, in a
+                    single sweep over the grid
     
             Kwargs:
                 packed : logical
@@ -402,7 +517,7 @@ class EotOrbitalHessianOperator (object):
             Returns:
                 dg : ndarray of shape (x.shape)
                     Hessian-vector product
-                de : float
+                de : float or ndarray of shape (nvec)
                     gradient-vector product 
         '''
         if algorithm.lower () == 'analytic': return self.kernel (x, 
@@ -412,39 +527,43 @@ class EotOrbitalHessianOperator (object):
 
     def kernel (self, x, packed=False):
         ncore, nocc = self.ncore, self.nocc
+        is_batch = x.ndim == (2 if (packed or self.incl_d2rho) else 3)
+        xs = x if is_batch else x[None]
         if self.incl_d2rho:
             packed = True
-            dg_d2rho = self.d2rho_h_op (x)
+            dg_d2rho = np.stack ([self.d2rho_h_op (xi) for xi in xs], axis=0)
         if packed: 
-            x_packed = x.copy ()
-            x = self.unpack_uniq_var (x)
+            x_packed = xs.copy ()
+            xs = np.stack ([self.unpack_uniq_var (xi) for xi in xs], axis=0)
         else:
-            x_packed = self.pack_uniq_var (x)
-        dg = np.zeros ((self.nocc, self.nao), dtype=x.dtype)
+            x_packed = np.stack ([self.pack_uniq_var (xi) for xi in xs],
+                axis=0)
+        nvec = xs.shape[0]
+        # A batch of one takes the single-vector code path, so that
+        # debug_hessian_blocks can patch get_fxot and make_dens1
+        x = xs if is_batch else xs[0]
+        dg = np.zeros ((nvec, self.nocc, self.nao), dtype=x.dtype)
         dg_cum = np.zeros_like (dg)
-        de = 0
-        for ao, mask, weights, coords in self.ni.block_loop (self.ot.mol,
-                self.ot.grids, self.nao, self.rho_deriv, self.max_memory,
-                blksize=self.get_blocksize ()):
-            rho0, Pi0 = self.make_dens0 (ao, mask)
-            if ao.ndim == 2: ao = ao[None,:,:]
-            drho, dPi = self.make_ddens (ao, rho0, mask)
+        de = np.zeros (nvec)
+        t = lambda arr: arr.swapaxes (-1,-2)
+        for blk in self.gen_block_data (nvec=nvec):
+            ao, mask, weights, rho0, Pi0, drho, dPi, vot_fot = blk
             dde, fxrho, fxPi, fxrho_c, fxrho_a = self.get_fxot (ao, rho0, Pi0,
-                drho, dPi, x, weights, mask)
+                drho, dPi, x, weights, mask, vot_fot=vot_fot)
             de += dde
-            dg -= self.contract_v_ddens (fxrho, drho, ao, weights, mask).T
-            dg -= self.contract_v_ddens (fxPi, dPi, ao, weights, mask).T
+            dg -= t (self.contract_v_ddens (fxrho, drho, ao, weights, mask))
+            dg -= t (self.contract_v_ddens (fxPi, dPi, ao, weights, mask))
             # Transpose because update_jk_in_ah requires this shape
             # Minus because I want to use 1 consistent sign rule here
             if self.do_cumulant and ncore: # The D_c D_a part
                 drho_c = drho[:self.nderiv_Pi,:,:ncore]
                 drho_a = drho[:self.nderiv_Pi,:,ncore:nocc]
-                dg_cum[:ncore] -= self.contract_v_ddens (fxrho_c, drho_c,
-                    ao, weights, mask).T
-                dg_cum[:ncore] -= self.contract_v_ddens (fxrho_a, drho_c,
-                    ao, weights, mask).T
-                dg_cum[ncore:nocc] -= self.contract_v_ddens (fxrho_c, drho_a,
-                    ao, weights, mask).T
+                dg_cum[:,:ncore] -= t (self.contract_v_ddens (fxrho_c, drho_c,
+                    ao, weights, mask))
+                dg_cum[:,:ncore] -= t (self.contract_v_ddens (fxrho_a, drho_c,
+                    ao, weights, mask))
+                dg_cum[:,ncore:nocc] -= t (self.contract_v_ddens (fxrho_c,
+                    drho_a, ao, weights, mask))
         dg = np.dot (dg, self.mo_coeff) 
         dg_cum = np.dot (dg_cum, self.mo_coeff) 
         if self.incl_d2rho:
@@ -452,19 +571,23 @@ class EotOrbitalHessianOperator (object):
             # The factor of 2 is because g_orb is evaluated in terms of square
             # antihermitian arrays, but only the lower-triangular parts are
             # stored in x and g_orb.
-            self.log.debug (('E from integration: %e; from stored grad: %e; '
-                'diff: %e'), de, de_test, de-de_test)
+            for de_i, de_test_i in zip (de, de_test):
+                self.log.debug (('E from integration: %e; from stored grad: '
+                    '%e; diff: %e'), de_i, de_test_i, de_i-de_test_i)
             if self.verbose > lib.logger.DEBUG: 
-                self.debug_d2rho (x, dg_d2rho, dg_cum)
+                for xi, dg_d2rho_i, dg_cum_i in zip (xs, dg_d2rho, dg_cum):
+                    self.debug_d2rho (xi, dg_d2rho_i, dg_cum_i)
         dg += dg_cum
         if self.verbose > lib.logger.DEBUG and self.do_cumulant and ncore:
-            self.debug_cumulant (x, dg_cum)
+            for xi, dg_cum_i in zip (xs, dg_cum):
+                self.debug_cumulant (xi, dg_cum_i)
         if packed:
-            dg_full = np.zeros ((self.nmo, self.nmo), dtype=dg.dtype)
-            dg_full[:self.nocc,:] = dg[:,:]
-            dg_full -= dg_full.T
-            dg = self.pack_uniq_var (dg_full)
+            dg_full = np.zeros ((nvec, self.nmo, self.nmo), dtype=dg.dtype)
+            dg_full[:,:self.nocc,:] = dg[:,:,:]
+            dg_full -= dg_full.transpose (0,2,1)
+            dg = np.stack ([self.pack_uniq_var (d) for d in dg_full], axis=0)
             if self.incl_d2rho: dg += dg_d2rho
+        if not is_batch: dg, de = dg[0], de[0]
         return dg, de
 
     def seminum_orb (self, x):
@@ -531,9 +654,10 @@ class EotOrbitalHessianOperator (object):
         get_fxot = self.get_fxot
         def mask_fxot (irow, my_dg):
             def get_masked_fxot (ao, rho0, Pi0, drho, dPi, my_x, weights,
-                    mask):
+                    mask, **kwargs):
                 de, fxrho, fxPi, fxrho_c, fxrho_a, dvot = get_fxot (ao, rho0,
-                    Pi0, drho, dPi, my_x, weights, mask, return_num=True)
+                    Pi0, drho, dPi, my_x, weights, mask, return_num=True,
+                    **kwargs)
                 norm_x = linalg.norm (my_x)
                 if rho0.ndim == 1: rho0 = rho0[None,:]
                 dvrho, dvPi, rho1, Pi1 = dvot
@@ -595,12 +719,15 @@ class ExcOrbitalHessianOperator (object):
         self.h_diag = h_diag
 
     def __call__(self, x):
-        ''' return dg, de; always packed '''
+        ''' return dg, de; always packed. x may have shape (nvec,npair),
+        in which case dg has the same shape and de has shape (nvec) '''
         def no_j (*args, **kwargs): return 0
         def no_jk (*args, **kwargs): return 0, 0
+        xs = x if x.ndim == 2 else x[None,:]
         with lib.temporary_env (self.ks, get_j=no_j, get_jk=no_jk):
-            dg = self.h_op (x)
-        de = 2*np.dot (self.g_orb.ravel (), x.ravel ())
+            dg = np.stack ([self.h_op (xi) for xi in xs], axis=0)
+        de = 2*np.dot (xs, self.g_orb.ravel ())
+        if x.ndim == 1: dg, de = dg[0], de[0]
         return dg, de
 
     def seminum_orb (self, x):
@@ -1,14 +1,14 @@
 from pyscf import ao2mo, __config__, lib
-from pyscf.lib import logger, pack_tril, unpack_tril, current_memory, tag_array
+from pyscf.lib import logger, pack_tril, unpack_tril, tag_array
 from pyscf.lib import einsum as einsum_threads
 from pyscf.dft import numint
-from pyscf.dft.gen_grid import BLKSIZE
 from mrh.my_pyscf.mcpdft.otpd import get_ontop_pair_density, _grid_ao2mo
+from mrh.my_pyscf.mcpdft import _gridblocks
 from mrh.lib.helper import load_library
 from scipy import linalg
 from os import path
 import numpy as np
-import time, gc, ctypes
+import time, gc, ctypes, tempfile
 
 # MRH 05/18/2020: An annoying convention in pyscf.dft.numint that I have to 
 # comply with is that the AO grid-value arrays and all their derivatives are in
@@ -31,7 +31,6 @@ import time, gc, ctypes
 SWITCH_SIZE = getattr(__config__, 'dft_numint_SWITCH_SIZE', 800)
 libpdft = load_library('libpdft')
 
-# TODO: outcore implementation; can I use properties instead of copying?
 class _ERIS(object):
     '''Stores two-body PDFT on-top effective potential array in a form
     compatible with existing MC-SCF kernel and derivative functions.
@@ -39,9 +38,21 @@ class _ERIS(object):
     j_pc = k_pc and ppaa = papa.transpose (0,2,1,3). The mcscf _ERIS is
     currently undocumented so I won't spend more time documenting this
     for now.
+
+    With method='memmap', papa and ppaa are numpy memory maps of scratch
+    files in tmpdir instead of arrays held in memory. Callers that need
+    whole slices or contractions of ppaa should use get_paaa and
+    get_vhf_a, which work in blocks of at most max_memory MB, rather than
+    looping over ppaa[i].
+
+    A finished ppaa (e.g., an h5py dataset of a checkpoint file) can be
+    given to the constructor. It is copied in blocks of at most max_memory
+    MB into a new array (a memory map if method='memmap') and papa is a
+    view of that copy.
     '''
     def __init__(self, mol, mo_coeff, ncore, ncas, method='incore',
-            paaa_only=False, aaaa_only=False, jk_pc=False, verbose=0, stdout=None):
+            paaa_only=False, aaaa_only=False, jk_pc=False, verbose=0,
+            stdout=None, max_memory=2000, tmpdir=None, ppaa=None):
         self.mol = mol
         self.mo_coeff = mo_coeff
         self.nao, self.nmo = mo_coeff.shape
@@ -54,19 +65,81 @@ class _ERIS(object):
         self.jk_pc = jk_pc
         self.verbose = verbose
         self.stdout = stdout
-        if method == 'incore':
-            self.papa = np.zeros ((self.nmo, ncas, self.nmo, ncas),
-                dtype=mo_coeff.dtype)
+        self.max_memory = max_memory
+        self.tmpdir = lib.param.TMPDIR if tmpdir is None else tmpdir
+        self._scratch = []
+        if ppaa is not None and method.lower () in ('incore', 'memmap'):
+            self.ppaa = self._new_array ((self.nmo, self.nmo, ncas, ncas))
+            for i0, i1 in self._blocks ():
+                self.ppaa[i0:i1] = ppaa[i0:i1]
+            if method.lower () == 'memmap': self.ppaa.flush ()
+            self.papa = self.ppaa.transpose (0,2,1,3)
+            self.j_pc = np.zeros ((self.nmo, ncore), dtype=mo_coeff.dtype)
+        elif method.lower () in ('incore', 'memmap'):
+            self.papa = self._new_array ((self.nmo, ncas, self.nmo, ncas))
             self.j_pc = np.zeros ((self.nmo, ncore), dtype=mo_coeff.dtype)
         else:
             raise NotImplementedError ("method={} for veff2".format (
                 self.method))
 
+    def _new_array (self, shape):
+        dtype = self.mo_coeff.dtype
+        if self.method.lower () == 'incore':
+            return np.zeros (shape, dtype=dtype)
+        # A new file is zero-filled; the file object must outlive the map
+        f = tempfile.NamedTemporaryFile (dir=self.tmpdir)
+        self._scratch.append (f)
+        return np.memmap (f.name, dtype=dtype, mode='w+', shape=shape)
+
+    def _blocks (self):
+        '''Ranges of the first index of ppaa of at most max_memory MB'''
+        nmo, ncas = self.nmo, self.ncas
+        if self.method.lower () == 'incore':
+            yield 0, nmo
+            return
+        blksize = int (self.max_memory*1e6 / 8 / (nmo*ncas*ncas))
+        blksize = max (1, min (nmo, blksize))
+        for i0 in range (0, nmo, blksize):
+            yield i0, min (nmo, i0+blksize)
+
+    def get_paaa (self):
+        '''Active-index slice of ppaa
+
+        Returns:
+            paaa : ndarray of shape (nmo,ncas,ncas,ncas)
+                ppaa[:,ncore:nocc,:,:], always in memory
+        '''
+        ncore, ncas = self.ncore, self.ncas
+        nocc = ncore + ncas
+        paaa = np.empty ((self.nmo,ncas,ncas,ncas), dtype=self.ppaa.dtype)
+        for i0, i1 in self._blocks ():
+            paaa[i0:i1] = self.ppaa[i0:i1,ncore:nocc]
+        return paaa
+
+    def get_vhf_a (self, casdm1):
+        '''"Fake" active-space vj - vk/2 of this potential, for which
+        vj = vk
+
+        Args:
+            casdm1 : ndarray of shape (ncas,ncas)
+                Spin-summed active-space 1-RDM
+
+        Returns:
+            vhf_a : ndarray of shape (nmo,nmo)
+                0.5 * einsum ('pquv,uv->pq', ppaa, casdm1)
+        '''
+        vhf_a = np.empty ((self.nmo,self.nmo),
+            dtype=np.result_type (self.ppaa, casdm1))
+        for i0, i1 in self._blocks ():
+            vhf_a[i0:i1] = np.tensordot (self.ppaa[i0:i1], casdm1, axes=2)
+        vhf_a *= 0.5
+        return vhf_a
+
     def _accumulate (self, ot, rho, Pi, ao, weight, rho_c, rho_a, vPi,
             non0tab=None, shls_slice=None, ao_loc=None):
         args = [ot,rho,Pi,ao,weight,rho_c,rho_a,vPi,non0tab,shls_slice,ao_loc]
         self._accumulate_vhf_c (*args)
-        if self.method.lower () == 'incore':
+        if self.method.lower () in ('incore', 'memmap'):
             self._accumulate_ppaa_incore (*args)
         else:
             raise NotImplementedError ("method={} for veff2".format (
@@ -122,12 +195,25 @@ class _ERIS(object):
             self.papa[:,:,ncore:nocc,:] += paaa
             self.papa[ncore:nocc,:,:,:] += paaa.transpose (2,3,0,1)
             self.papa[ncore:nocc,:,ncore:nocc,:] -= paaa[ncore:nocc,:,:,:]
-        else:
+        elif self.method.lower () == 'incore':
             papa = ot.get_veff_2body (rho, Pi, [ao, mo_cas, ao, mo_cas],
                 weight, aosym='s1', kern=vPi)
             papa = np.tensordot (mo_coeff.T, papa, axes=1)
             self.papa += np.tensordot (mo_coeff.T, papa,
                 axes=((1),(2))).transpose (1,2,0,3)
+        else:
+            # Memory map: directly in the MO basis, one range of the first
+            # index at a time, so that no temporary of the size of papa is
+            # made and each block of the file is read and written once per
+            # grid block
+            mo = _grid_ao2mo (self.mol, ao[:nderiv], mo_coeff, non0tab)
+            vao = ot.get_veff_2body_kl (rho, Pi, mo, mo_cas, weight,
+                kern=vPi)
+            for i0, i1 in self._blocks ():
+                mo_i = np.ascontiguousarray (mo.transpose (0,2,1)[:,i0:i1])
+                self.papa[i0:i1] += ot.get_veff_2body (rho, Pi,
+                    [mo_i.transpose (0,2,1), mo_cas, mo, mo_cas], weight,
+                    aosym='s1', kern=vPi, vao=vao)
 
     def _ftpt_ppaa_incore (self):
         nao, ncas = self.nao, self.ncas
@@ -135,7 +221,10 @@ class _ERIS(object):
         ij_aa = int (self.aaaa_only)
         kl_aa = int (ij_aa or self.paaa_only)
         ncol += (ij_aa + kl_aa) * (nao - ncas)
-        return ncol*ncas
+        ncol *= ncas
+        if not kl_aa and self.method.lower () == 'memmap':
+            ncol += self.nmo # MOs on the grid
+        return ncol
 
     def _accumulate_j_pc (self, ot, rho, Pi, ao, weight, rho_c, rho_a, vPi,
             non0tab, shls_slice, ao_loc):
@@ -156,7 +245,7 @@ class _ERIS(object):
         ''' memory footprint of _accumulate, divided by nderiv_Pi*ngrids '''
         ncol = 0
         ftpt_fns = [self._ftpt_vhf_c]
-        if self.method.lower () == 'incore':
+        if self.method.lower () in ('incore', 'memmap'):
             ftpt_fns.append (self._ftpt_ppaa_incore)
         else:
             raise NotImplementedError ("method={} for veff2".format (
@@ -168,11 +257,15 @@ class _ERIS(object):
         return ncol
 
     def _finalize (self):
-        if self.method == 'incore':
-            nmo, ncore, ncas = self.nmo, self.ncore, self.ncas
-            nocc = ncore + ncas
+        if self.method.lower () == 'incore':
             self.ppaa = np.ascontiguousarray (self.papa.transpose (0,2,1,3))
-            self.k_pc = self.j_pc.copy ()
+        elif self.method.lower () == 'memmap':
+            self.papa.flush ()
+            nmo, ncas = self.nmo, self.ncas
+            self.ppaa = self._new_array ((nmo, nmo, ncas, ncas))
+            for i0, i1 in self._blocks ():
+                self.ppaa[i0:i1] = self.papa[i0:i1].transpose (0,2,1,3)
+            self.ppaa.flush ()
         else:
             raise NotImplementedError ("method={} for veff2".format (
                 self.method))
@@ -180,7 +273,7 @@ class _ERIS(object):
 
 def kernel (ot, dm1s, cascm2, mo_coeff, ncore, ncas,
             max_memory=2000, hermi=1, paaa_only=False, aaaa_only=False,
-            jk_pc=False):
+            jk_pc=False, veff2_method=None):
     '''Get the 1- and 2-body effective potential from MC-PDFT.
 
     Args:
@@ -212,6 +305,10 @@ def kernel (ot, dm1s, cascm2, mo_coeff, ncore, ncas,
         jk_pc : logical
             If true, compute the ppii=pipi elements of veff2
             (otherwise, these are set to zero)
+        veff2_method : str
+            'incore' or 'memmap': storage of the papa and ppaa arrays of
+            veff2. If not provided, 'memmap' is chosen when they would
+            take more than half of max_memory.
 
     Returns:
         veff1 : ndarray of shape (nao, nao)
@@ -235,10 +332,18 @@ def kernel (ot, dm1s, cascm2, mo_coeff, ncore, ncas,
     if abs (hyb_x) > 1e-11 or abs (hyb_c) > 1e-11:
         raise NotImplementedError ("effective potential for hybrid functionals")
 
+    nmo = mo_coeff.shape[1]
+    if veff2_method is None:
+        mem_papa = 2 * nmo * nmo * ncas * ncas * 8 / 1e6
+        veff2_method = 'memmap' if mem_papa > max_memory/2 else 'incore'
+        if veff2_method == 'memmap':
+            logger.info (ot, 'PDFT veff2 papa and ppaa (%.0f MB) stored in '
+                         'memory maps', mem_papa)
+
     veff1 = np.zeros ((nao, nao), dtype=dm1s.dtype)
-    veff2 = _ERIS (ot.mol, mo_coeff, ncore, ncas, paaa_only=paaa_only, 
-        aaaa_only=aaaa_only, jk_pc=jk_pc, verbose=ot.verbose,
-        stdout=ot.stdout)
+    veff2 = _ERIS (ot.mol, mo_coeff, ncore, ncas, method=veff2_method,
+        paaa_only=paaa_only, aaaa_only=aaaa_only, jk_pc=jk_pc,
+        verbose=ot.verbose, stdout=ot.stdout, max_memory=max_memory)
 
     t0 = (logger.process_clock (), logger.perf_counter ())
 
@@ -261,25 +366,11 @@ def kernel (ot, dm1s, cascm2, mo_coeff, ncore, ncas,
 
     # memory block size
     gc.collect ()
-    remaining_floats = (max_memory - current_memory ()[0]) * 1e6 / 8
-    nderiv_rho = (1,4,10)[dens_deriv] # ?? for meta-GGA
-    nderiv_Pi = (1,4)[ot.Pi_deriv]
-    ncols  = 4 + nderiv_rho*nao # ao, weight, coords
-    ncols += nderiv_rho * 4 + nderiv_Pi # rho, rho_a, rho_c, Pi
-    ncols += 1 + nderiv_rho + nderiv_Pi # eot, vot
- 
-   # Asynchronous part
-    nveff1 = nderiv_rho * (nao+1) # footprint of get_veff_1body
-    nveff2 = veff2._accumulate_ftpt () * nderiv_Pi
-    ncols += np.amax ([nveff1, nveff2]) # asynchronous fns
-    pdft_blksize = int (remaining_floats / (ncols * BLKSIZE)) * BLKSIZE
-    if ot.grids.coords is None:
-        ot.grids.build(with_non0tab=True)
-    ngrids = ot.grids.coords.shape[0]
-    pdft_blksize = max(BLKSIZE, min(pdft_blksize, ngrids, BLKSIZE*1200))
-    logger.debug (ot, ('{} MB used of {} available; block size of {} chosen'
-        'for grid with {} points').format (current_memory ()[0], max_memory,
-        pdft_blksize, ngrids))
+    ncols = _gridblocks.ncols_pdft_veff (nao, dens_deriv, ot.Pi_deriv,
+        nveff2=veff2._accumulate_ftpt ())
+    ngrids = _gridblocks.get_ngrids (ot.grids)
+    pdft_blksize = _gridblocks.get_blksize (ncols, ngrids, max_memory,
+        log=logger.new_logger (ot, ot.verbose), label='PDFT veff')
 
     # The actual loop
     for ao, mask, weight, coords in ni.block_loop (ot.mol, ot.grids, nao,
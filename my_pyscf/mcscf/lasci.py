@@ -6,6 +6,7 @@ from mrh.my_pyscf.mcscf.addons import state_average_n_mix, get_h1e_zipped_fcisol
 from mrh.my_pyscf.mcscf import lasci_sync, _DFLASCI
 from mrh.my_pyscf.fci import csf_solver
 from mrh.my_pyscf.df.sparse_df import sparsedf_array
+from mrh.my_pyscf.df import sparse_df
 from mrh.my_pyscf.mcscf.lassi import lassi
 from mrh.my_pyscf.mcscf.productstate import ProductStateFCISolver
 from itertools import combinations
@@ -316,7 +317,7 @@ def get_fock (las, mo_coeff=None, ci=None, eris=None, casdm1s=None, verbose=None
         return get_roothaan_fock (fock, dm1s, las._scf.get_ovlp ())
     dm1 = dm1s[0] + dm1s[1]
     if isinstance (las, _DFLASCI):
-        vj, vk = las.with_df.get_jk(dm1, hermi=1)
+        vj, vk = sparse_df.get_jk (las.with_df, dm1, hermi=1)
     else:
         vj, vk = las._scf.get_jk(las.mol, dm1, hermi=1)
     fock = las.get_hcore () + vj - (vk/2)
@@ -1021,7 +1022,7 @@ class LASCINoSymm (casci.CASCI):
         dm1s = np.asarray (dm1s)
         if dm1s.ndim == 2: dm1s = dm1s[None,:,:]
         if isinstance (self, _DFLASCI):
-            vj, vk = self.with_df.get_jk(dm1s, hermi=hermi)
+            vj, vk = sparse_df.get_jk (self.with_df, dm1s, hermi=hermi)
         else:
             vj, vk = self._scf.get_jk(mol, dm1s, hermi=hermi)
         if spin_sep:
@@ -3,7 +3,7 @@ import numpy as np
 from scipy import linalg
 from pyscf.lib import logger, tag_array
 from pyscf.dft.rks import _dft_common_init_
-from mrh.my_pyscf.mcpdft import otfnal
+from mrh.my_pyscf.mcpdft import otfnal, _gridblocks
 
 def kernel (fnal, dm, max_memory=None, hermi=1):
     if max_memory is None: max_memory = fnal.max_memory
@@ -25,8 +25,11 @@ def kernel (fnal, dm, max_memory=None, hermi=1):
 
     Exc = 0.0
     make_rho, ndms, nao = ni._gen_rho_evaluator (fnal.mol, dm1, hermi)
+    ncols = _gridblocks.ncols_unpxc (nao, dens_deriv)
+    blksize = _gridblocks.get_blksize (ncols, _gridblocks.get_ngrids (fnal.grids),
+        max_memory, log=logger.new_logger (fnal, fnal.verbose), label='MC-UDFT')
     t0 = (logger.process_clock (), logger.perf_counter ())
-    for ao, mask, weight, coords in ni.block_loop (fnal.mol, fnal.grids, nao, dens_deriv, max_memory):
+    for ao, mask, weight, coords in ni.block_loop (fnal.mol, fnal.grids, nao, dens_deriv, max_memory, blksize=blksize):
         rho_eff = np.stack ([make_rho (spin, ao, mask, xctype) for spin in range (ndms)], axis=0)
         rho_eff = 0.5 * np.stack ((rho_eff.sum (0), rho_eff[0] - rho_eff[1]), axis=0)
         # I do it this way, rather than just passing (dma_eff,dmb_eff) to make_rho, in order to exploit
@@ -83,6 +83,7 @@ class ElectricDipole (mcpdft_grad.Gradients):
                 ci, incl_coul=True, paaa_only=True, state=state)
 
         conv, Lvec, bvec, Aop, Adiag = self.solve_lagrange (**kwargs)
+        self._save_Lvec (state, Lvec, ci=ci, mo=mo)
         self.debug_lagrange (Lvec, bvec, Aop, Adiag, **kwargs)
 
         ham_response = self.get_ham_response (origin=origin, **kwargs)
@@ -94,6 +95,32 @@ class ElectricDipole (mcpdft_grad.Gradients):
         mol_dip = self.convert_dipole (ham_response, LdotJnuc, mol_dip, unit=unit)
         return mol_dip
 
+    def kernel_batch (self, states, unit='Debye', origin='Coord_Center',
+            mo=None, ci=None, **kwargs):
+        ''' Dipole moments of several states, with all Lagrange equations
+            solved together (see mcpdft_grad.Gradients.solve_lagrange_batch)
+
+            Returns:
+                mol_dip : ndarray of shape (len (states), 3)
+        '''
+        if mo is None: mo = self.base.mo_coeff
+        if ci is None: ci = self.base.ci
+        if isinstance (ci, np.ndarray): ci = [ci] # hack hack hack...
+        conv, Lvec, bvec = self.solve_lagrange_batch (states, mo=mo, ci=ci,
+            **kwargs)
+        self.converged = np.all (conv)
+        mol_dip = []
+        for state, L in zip (states, Lvec.T):
+            self.state = state
+            ham_response = self.get_ham_response (state=state, mo=mo, ci=ci,
+                origin=origin)
+            LdotJnuc = self.get_LdotJnuc (L, state=state, mo=mo, ci=ci,
+                origin=origin)
+            dip = ham_response + LdotJnuc
+            mol_dip.append (self.convert_dipole (ham_response, LdotJnuc, dip,
+                unit=unit))
+        return np.stack (mol_dip, axis=0)
+
     def convert_dipole (self, ham_response, LdotJnuc, mol_dip, unit='Debye'):
         i = self.state
         if unit.upper() == 'DEBYE':
@@ -7,6 +7,7 @@ import scipy as sp
 from functools import reduce
 from pyscf.scf.hf import energy_elec
 from pyscf.lib import logger
+from mrh.my_pyscf.df import sparse_df
 
 def metaclass (mf):
 
@@ -37,6 +38,7 @@ def metaclass (mf):
         get_fo_coeff = RHFas.get_fo_coeff
         get_ufo_coeff = RHFas.get_ufo_coeff
         canonicalize = RHFas.canonicalize
+        get_jk = _sparsedf_get_jk (mf_class)
         def newton (self):
             if isinstance (self, _CIAH_SOSCF): return self
             assert(isinstance(mf, hf.SCF))
@@ -112,6 +114,17 @@ def metaclass_2 (mf):
 
     return HFmetaclass_2 (mf)
 
+def _sparsedf_get_jk (mf_class):
+    ''' get_jk method that uses the sparse-DF J/K builder (mrh.my_pyscf.df.sparse_df.get_jk)
+    whenever density fitting is turned on and falls back to mf_class.get_jk otherwise '''
+    def get_jk (self, mol=None, dm=None, hermi=1, with_j=True, with_k=True, omega=None):
+        if (getattr (self, 'with_df', None) is None or omega is not None
+                or getattr (self, 'only_dfj', False)):
+            return mf_class.get_jk (self, mol, dm, hermi, with_j, with_k, omega)
+        if dm is None: dm = self.make_rdm1 ()
+        return sparse_df.get_jk (self.with_df, dm, hermi=hermi, with_j=with_j, with_k=with_k)
+    return get_jk
+
 def update_rdm12 (u, dm1, dm2):
     '''
     PySCF convention: density matrix indices are backwards?
@@ -336,6 +349,16 @@ class RHFas(hf.RHF):
                 cycle=cycle, diis=diis, diis_start_cycle=diis_start_cycle,
                 level_shift_factor=level_shift_factor, damp_factor=damp_factor)
 
+    def density_fit (self, auxbasis=None, with_df=None, only_dfj=False):
+        ''' Density-fitted RHFas; J and K are built by mrh.my_pyscf.df.sparse_df.get_jk '''
+        mf = hf.RHF.density_fit (self, auxbasis=auxbasis, with_df=with_df, only_dfj=only_dfj)
+        mf_class = mf.__class__
+        class SparseDFRHFas (mf_class):
+            def __init__(self, my_mf):
+                self.__dict__.update (my_mf.__dict__)
+            get_jk = _sparsedf_get_jk (mf_class)
+        return SparseDFRHFas (mf)
+
     def canonicalize (self, mo_coeff, mo_occ, fock=None):
         ''' We do not canonicalize the frozen space because that messes up energy calculation '''
         if fock is None:
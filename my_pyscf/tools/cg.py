@@ -1,9 +1,43 @@
 import numpy as np
 from scipy import linalg
-from sympy import S
-from sympy.physics.quantum.cg import CG
 from pyscf.lib import logger
 from itertools import product
+from fractions import Fraction
+from functools import lru_cache
+from math import factorial, sqrt
+
+@lru_cache (maxsize=None)
+def cg_coeff (j2a, m2a, j2b, m2b, j2c, m2c):
+    r'''A single Clebsch-Gordan coefficient :math:`<j_a m_a; j_b m_b|j_c m_c>`
+        from Racah's closed formula, in exact rational arithmetic up to the
+        final square root. All arguments are twice the actual quantum
+        numbers (i.e., integers). Coefficients which violate the selection
+        rules are zero. Results are cached.
+
+        Returns:
+            coeff: floating-point
+    '''
+    if m2c != m2a + m2b: return 0.0
+    if (j2a+j2b+j2c) % 2: return 0.0
+    for j2, m2 in ((j2a,m2a), (j2b,m2b), (j2c,m2c)):
+        if j2 < 0 or abs (m2) > j2 or (j2-m2) % 2: return 0.0
+    if j2c < abs (j2a-j2b) or j2c > j2a+j2b: return 0.0
+    # Everything below is an integer
+    a, b, c = (j2a+j2b-j2c)//2, (j2a-j2b+j2c)//2, (-j2a+j2b+j2c)//2
+    pref = Fraction ((j2c+1) * factorial (a) * factorial (b) * factorial (c),
+                     factorial ((j2a+j2b+j2c)//2 + 1))
+    pref *= (factorial ((j2a+m2a)//2) * factorial ((j2a-m2a)//2)
+           * factorial ((j2b+m2b)//2) * factorial ((j2b-m2b)//2)
+           * factorial ((j2c+m2c)//2) * factorial ((j2c-m2c)//2))
+    d1, d2 = (j2a-m2a)//2, (j2b+m2b)//2
+    d3, d4 = (j2c-j2b+m2a)//2, (j2c-j2a-m2b)//2
+    tot = Fraction (0)
+    for k in range (max (0, -d3, -d4), min (a, d1, d2)+1):
+        den = (factorial (k) * factorial (a-k) * factorial (d1-k)
+             * factorial (d2-k) * factorial (d3+k) * factorial (d4+k))
+        tot += Fraction ((-1)**k, den)
+    if tot == 0: return 0.0
+    return float (np.sign (tot.numerator)) * sqrt (pref * tot * tot)
 
 def _assert_selection_rule (cond, errmsg, j2, m2):
     errmsg = errmsg + '\nj2 = {}\nm2 = {}'.format (j2, m2)
@@ -75,14 +109,14 @@ def cg_prod (jmag, jpol, mpol, fac=2, log=None):
     assert (mtot in range (-jtot, jtot+1, 2)), 'mpol and jpol mismatch'
     if log is None: log = logger.Logger (verbose=logger.DEBUG4)
 
-    coeff = S(1)
+    coeff = 1.0
     jrun = np.cumsum (jpol)
     mrun = np.cumsum (mpol)
     for i in range (1, len(jmag)):
-        coeff *= CG (S(jrun[i-1])/2, S(mrun[i-1])/2,       # j1, m1
-                     S(jmag[i])/2,   S(mpol[i])/2,         # j2, m2
-                     S(jrun[i])/2,   S(mrun[i])/2).doit () # j3, m3 = m1 + m2
-    return coeff.evalf ()
+        coeff *= cg_coeff (int (jrun[i-1]), int (mrun[i-1]), # j1, m1
+                           int (jmag[i]),   int (mpol[i]),   # j2, m2
+                           int (jrun[i]),   int (mrun[i]))   # j3, m3 = m1 + m2
+    return coeff
 
 def cg_prod_vec (jmag, jpol, mtot, fac=2, log=None):
     r'''Compute unitary vector :math:`<\vec{j}\vec{m}|\vec{j}\vec{j}^\prime>` for all :math:`\vec{m}`,
@@ -125,35 +159,42 @@ def cg_prod_vec (jmag, jpol, mtot, fac=2, log=None):
     if log is None: log = logger.Logger (verbose=logger.DEBUG3)
  
     ### Recursion function ###
-    def _recurse (m2a_str, coeffs_in, j2, m2c_max, m2c_min):    
+    def _recurse (m2a_str, coeffs_in, j2, m2c_max, m2c_min):
+        # All strings with the same running m2a share the same set of CG
+        # coefficients, so they are extended together
+        m2a_all = m2a_str.sum (1)
         m2c_str = []
         coeffs_out = []
+        parent = []
         logger.debug4 (log, 'Entering _recurse with {} strings, {} coeffs, and {} <= m2c <= {}'.format (len (m2a_str), len (coeffs_in), m2c_min, m2c_max))
-        for m2a_vec, coeff in zip (m2a_str, coeffs_in):
-            m2a = m2a_vec.sum ()
+        for m2a in np.unique (m2a_all):
+            idx = m2a_all == m2a
+            m2a_vecs, coeffs = m2a_str[idx], coeffs_in[idx]
             m2b_max = min (m2c_max - m2a, j2[1])
             m2b_min = max (m2c_min - m2a, -j2[1])
-            logger.debug4 (log, 'For this string, {} <= m2b <= {}'.format (m2b_min, m2b_max))
+            logger.debug4 (log, 'For m2a = {}, {} <= m2b <= {}'.format (m2a, m2b_min, m2b_max))
             for m2b in range (m2b_min, m2b_max+1, 2):
                 m2c = m2a + m2b
-                m2 = np.array ([m2a, m2b, m2c])
-                cgfac = CG (S(j2[0])/2, S(m2a)/2,
-                            S(j2[1])/2, S(m2b)/2,
-                            S(j2[2])/2, S(m2c)/2).doit ()
-                logger.debug4 (log, 'Computing <{},{};{},{}|{},{}> = {}'.format (
-                    str(S(j2[0])/2), str(S(m2a)/2),
-                    str(S(j2[1])/2), str(S(m2b)/2),
-                    str(S(j2[2])/2), str(S(m2c)/2), str (cgfac)))
-                m2c_str.append (np.append (m2a_vec, m2b))
-                try:
-                    coeffs_out.append (float (coeff * cgfac.evalf ()))
-                except TypeError as e:
-                    assert (j2.sum () % 2 == 0), 'Coupling parity error? {}'.format (j2)
-        return m2c_str, coeffs_out 
+                cgfac = cg_coeff (int (j2[0]), int (m2a), int (j2[1]),
+                                  int (m2b), int (j2[2]), int (m2c))
+                logger.debug4 (log, 'Computing <{}/2,{}/2;{}/2,{}/2|{}/2,{}/2> = {}'.format (
+                    j2[0], m2a, j2[1], m2b, j2[2], m2c, cgfac))
+                m2b_col = np.full ((len (m2a_vecs), 1), m2b, dtype=np.int32)
+                m2c_str.append (np.append (m2a_vecs, m2b_col, axis=1))
+                coeffs_out.append (coeffs * cgfac)
+                parent.append (np.where (idx)[0])
+        if len (m2c_str) == 0:
+            return (np.zeros ((0, m2a_str.shape[1]+1), dtype=np.int32),
+                    np.zeros (0))
+        m2c_str = np.concatenate (m2c_str, axis=0)
+        coeffs_out = np.concatenate (coeffs_out)
+        # Same order as extending one string at a time
+        idx = np.lexsort ((m2c_str[:,-1], np.concatenate (parent)))
+        return m2c_str[idx], coeffs_out[idx]
 
     ### Initialize and recurse ###
-    mpol_list = [np.zeros (0, dtype=np.int32)]
-    coeffs = [np.asarray([1.0])]
+    mpol_list = np.zeros ((1,0), dtype=np.int32)
+    coeffs = np.ones (1)
     j2a = 0
     mrem = jmag.sum ()
     for j2b, dj in zip (jmag, jpol):
@@ -168,7 +209,7 @@ def cg_prod_vec (jmag, jpol, mtot, fac=2, log=None):
         j2a = j2c
 
     ### Throat-clearing ###
-    mpol_list = np.stack (mpol_list, axis=0) // fac
+    mpol_list = mpol_list // fac
     return mpol_list, np.asarray (coeffs).astype (np.float64)
 
 
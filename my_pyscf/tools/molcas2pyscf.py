@@ -9,7 +9,77 @@ from pyscf.tools import molden
 
 CARTESIAN = "Cartesian or mixed Cartesian-spherical basis sets"
 
-def get_mo_from_h5 (mol, h5fname, symmetry=None):
+def get_ao_permutation (mol, basids):
+    ''' Map OpenMolcas basis functions onto PySCF AOs
+
+        Args:
+            mol : instance gto.mole
+            basids : ndarray of shape (nao_nr, 4)
+                (center, n, l, m) of each basis function in OpenMolcas's
+                order, as in the h5 dataset 'BASIS_FUNCTION_IDS'
+
+        Returns:
+            idx_ao : ndarray of shape (nao_nr)
+                OpenMolcas index of each PySCF AO, i.e., PySCF-ordered
+                arrays are obtained as molcas_array[idx_ao]
+    '''
+    basids = np.asarray (basids)
+    c, n, l, m = [basids[:,i].copy () for i in range (4)]
+    if np.any (l < 0): raise NotImplementedError (CARTESIAN)
+    # 0-index atom list in PySCF, 1-index atom list in Molcas
+    c -= 1
+    # l=1, ml=(-1,0,1) is (x,y,z) in PySCF, (y,z,x) in Molcas
+    p = l == 1
+    m[p] = np.where (m[p] > 0, m[p] - 2, m[p] + 1)
+    # Table of the first AO of the n-th contracted shell of each l on each
+    # atom, with the same conventions as gto.mole.search_ao_nr
+    lmax = max (int (l.max ()), int (mol._bas[:,gto.ANG_OF].max ()))
+    ao_loc = mol.ao_loc_nr ()
+    nshl = np.zeros ((mol.natm, lmax+1), dtype=int)
+    tab = np.full ((mol.natm, lmax+1, mol.nbas+1), -1, dtype=int)
+    for ib in range (mol.nbas):
+        ia, l1, nc = mol.bas_atom (ib), mol.bas_angular (ib), mol.bas_nctr (ib)
+        degen = (ao_loc[ib+1] - ao_loc[ib]) // nc
+        k = nshl[ia,l1]
+        tab[ia,l1,k:k+nc] = ao_loc[ib] + degen * np.arange (nc)
+        nshl[ia,l1] += nc
+    # Molcas n is 1-indexed within each l
+    if np.any (n > nshl[c,l]):
+        raise RuntimeError ('Required AO not found')
+    idx_ao = tab[c,l,n-1] + l + m
+    return np.argsort (idx_ao)
+
+def _get_irrep_layout (mol, molcas_usymm):
+    ''' Number of symmetry-adapted functions in each irrep, in the order of
+    the OpenMolcas irreps, from the desymmetrization matrix (with columns
+    already in PySCF AO order) '''
+    # I have to figure out what order the Molcas irreps are in on the fly
+    # because it seems to change depending on the xyz
+    proj = np.stack ([(np.dot (molcas_usymm,ir_coeff)**2).sum (1)
+        for ir_coeff in mol.symm_orb], axis=0)
+    errstr = ("Can't interpret h5 symmetry information; wrong mol? "
+                " <mol.symm_orb|desym_matrix> =\n{}").format (proj)
+    assert (np.allclose (np.amax (proj), 1)), errstr
+    ix_irrep = np.argmax (proj, axis=0)
+    uniq_idx = np.sort (np.unique (ix_irrep, return_index=True)[1])
+    uniq_idx = np.append (uniq_idx, len (ix_irrep))
+    nmo_irrep = []
+    for ix, i in enumerate (uniq_idx[:-1]):
+        j = uniq_idx[ix+1]
+        assert (len (np.unique (ix_irrep[i:j])) == 1), errstr
+        nmo_irrep.append (j-i)
+    return np.asarray (nmo_irrep)
+
+def _cached (cache, key, ref, fn):
+    ''' fn (), unless cache holds its value for the same ref array '''
+    if cache is None: return fn ()
+    if key in cache and np.array_equal (cache[key][0], ref):
+        return cache[key][1]
+    val = fn ()
+    cache[key] = (ref, val)
+    return val
+
+def get_mo_from_h5 (mol, h5fname, symmetry=None, mo_slice=None):
     ''' Get MO vectors for a pyscf molecule from an h5 file written by OpenMolcas
 
         Args:
@@ -26,14 +96,26 @@ def get_mo_from_h5 (mol, h5fname, symmetry=None):
             symmetry : str
                 Point group of the calculation in OpenMolcas. If not provided,
                 mol.groupname is used instead
+            mo_slice : slice or index array
+                Selects columns of the returned mo_coeff (after sorting by
+                occupation and energy). Only the parts of 'MO_VECTORS' that
+                contain them (the rows in between, or the irreps that
+                contain them) are read from the file.
 
         Returns:
             mo_coeff : ndarray of shape (nao_nr, nao_nr)
+                or (nao_nr, nmo) if mo_slice is given
     '''
 
     if symmetry is not None:
         mol = mol.copy()
         mol.build(symmetry=symmetry)
+    return _get_mo_from_h5 (mol, h5fname, mo_slice=mo_slice)
+
+def _get_mo_from_h5 (mol, h5fname, mo_slice=None, cache=None):
+    ''' get_mo_from_h5 for a mol already in the right point group. cache,
+    if given, is a dict in which the AO permutation and the irrep layout
+    are kept for the next file. '''
     nao = mol.nao_nr ()
 
     with h5py.File (h5fname, 'r') as f:
@@ -43,64 +125,44 @@ def get_mo_from_h5 (mol, h5fname, symmetry=None):
         except KeyError:
             assert (not mol.symmetry), "Can't find desym_ data; mol.symmetry = {}".format (mol.symmetry)
             molcas_basids = f['BASIS_FUNCTION_IDS'][()]
-        molcas_coeff = f['MO_VECTORS'][()]
         mo_energy = f['MO_ENERGIES'][()]
         mo_occ = f['MO_OCCUPATIONS'][()]
 
-    idx_ao = []
-    for (c, n, l, m) in molcas_basids:
-        if l < 0: raise NotImplementedError (CARTESIAN)
-        # 0-index atom list in PySCF, 1-index atom list in Molcas
-        c -= 1
-        # Actual principal quantum number in PySCF, 1-indexed list in Molcas
-        n += l
-        # l=1, ml=(-1,0,1) is (x,y,z) in PySCF, (y,z,x) in Molcas
-        if l == 1:
-            m = m - 2 if m > 0 else m + 1
-        idx_ao.append (mol.search_ao_nr (c, l, m, n))
-    idx_ao = np.argsort (np.asarray (idx_ao))
-
-    if mol.symmetry:
-        # I have to figure out what order the Molcas irreps are in on the fly
-        # because it seems to change depending on the xyz
-        molcas_usymm = molcas_usymm[:,idx_ao]
-        proj = np.stack ([(np.dot (molcas_usymm,ir_coeff)**2).sum (1)
-            for ir_coeff in mol.symm_orb], axis=0)
-        errstr = ("Can't interpret h5 symmetry information; wrong mol? "
-                    " <mol.symm_orb|desym_matrix> =\n{}").format (proj)
-        assert (np.allclose (np.amax (proj), 1)), errstr
-        ix_irrep = np.argmax (proj, axis=0)
-        uniq_idx = np.sort (np.unique (ix_irrep, return_index=True)[1])
-        uniq_idx = np.append (uniq_idx, len (ix_irrep))
-        nmo_irrep = []
-        for ix, i in enumerate (uniq_idx[:-1]):
-            j = uniq_idx[ix+1]
-            assert (len (np.unique (ix_irrep[i:j])) == 1), errstr
-            nmo_irrep.append (j-i)
-        nmo_irrep = np.asarray (nmo_irrep)
-        usymm_irrep_offset = np.cumsum (nmo_irrep) - nmo_irrep
-        coeff_irrep_offset = np.cumsum (nmo_irrep**2) - nmo_irrep**2
-        mo_coeff = np.zeros ((nao, nao), dtype=np.float_)
-        for m_ir, usymm_off, coeff_off in zip (nmo_irrep, usymm_irrep_offset, coeff_irrep_offset):
-            i, j = usymm_off, usymm_off+m_ir
-            u, v = coeff_off, coeff_off+(m_ir**2)
-            usymm = molcas_usymm[i:j,:].T
-            coeff = molcas_coeff[u:v].reshape (m_ir, m_ir).T
-            mo_coeff[:,i:j] = np.dot (usymm, coeff)
-    else:
-        assert (molcas_coeff.shape == (nao**2,)), 'mo_vectors.shape = {} but {} AOs'.format (
-            molcas_coeff.shape, nao)
-        mo_coeff = molcas_coeff.reshape (nao, nao)[:,idx_ao].T
-        
-    # 'mergesort' keeps degenerate or active-space orbitals in the provided order!
-    #  idx_ene = np.argsort (mo_energy, kind='mergesort')
-
-    # modified by Dayou: sort by mo_occ first, then mo_energy
-    sort_key = np.min(mo_energy) * 100000 * mo_occ + mo_energy
-    idx_ene = np.argsort(sort_key, kind='mergesort')
-    mo_coeff = mo_coeff[:,idx_ene]
-    mo_occ = mo_occ[idx_ene]
-    mo_energy = mo_energy[idx_ene]
+        idx_ao = _cached (cache, 'idx_ao', molcas_basids,
+            lambda: get_ao_permutation (mol, molcas_basids))
+
+        # 'mergesort' keeps degenerate or active-space orbitals in the provided order!
+        #  idx_ene = np.argsort (mo_energy, kind='mergesort')
+
+        # modified by Dayou: sort by mo_occ first, then mo_energy
+        sort_key = np.min(mo_energy) * 100000 * mo_occ + mo_energy
+        idx_ene = np.argsort(sort_key, kind='mergesort')
+        if mo_slice is not None: idx_ene = idx_ene[mo_slice]
+        mo_occ = mo_occ[idx_ene]
+        mo_energy = mo_energy[idx_ene]
+
+        molcas_coeff = f['MO_VECTORS']
+        if mol.symmetry:
+            molcas_usymm = molcas_usymm[:,idx_ao]
+            nmo_irrep = _cached (cache, 'nmo_irrep', molcas_usymm,
+                lambda: _get_irrep_layout (mol, molcas_usymm))
+            usymm_irrep_offset = np.cumsum (nmo_irrep) - nmo_irrep
+            coeff_irrep_offset = np.cumsum (nmo_irrep**2) - nmo_irrep**2
+            mo_coeff = np.zeros ((nao, nao), dtype=np.float_)
+            for m_ir, usymm_off, coeff_off in zip (nmo_irrep, usymm_irrep_offset, coeff_irrep_offset):
+                i, j = usymm_off, usymm_off+m_ir
+                if not np.any ((idx_ene >= i) & (idx_ene < j)): continue
+                u, v = coeff_off, coeff_off+(m_ir**2)
+                usymm = molcas_usymm[i:j,:].T
+                coeff = molcas_coeff[u:v].reshape (m_ir, m_ir).T
+                mo_coeff[:,i:j] = np.dot (usymm, coeff)
+            mo_coeff = mo_coeff[:,idx_ene]
+        else:
+            assert (molcas_coeff.shape == (nao**2,)), 'mo_vectors.shape = {} but {} AOs'.format (
+                molcas_coeff.shape, nao)
+            i, j = idx_ene.min (), idx_ene.max () + 1
+            mo_coeff = molcas_coeff[i*nao:j*nao].reshape (j-i, nao)
+            mo_coeff = mo_coeff[idx_ene-i][:,idx_ao].T
 
     if mol.verbose > logger.INFO:
         fname = str (mol.output)[:-4] + "_h5debug.molden"
@@ -114,6 +176,34 @@ def get_mo_from_h5 (mol, h5fname, symmetry=None):
 
     return mo_coeff
 
+def get_mo_from_h5_batch (mol, h5fnames, symmetry=None, mo_slice=None):
+    ''' Get MO vectors for a pyscf molecule from many h5 files written by
+        OpenMolcas for the same basis (e.g., points along a trajectory).
+        The AO permutation and the irrep layout are worked out once and
+        reused for as long as the files agree on them.
+
+        Args:
+            mol : instance gto.mole
+                See get_mo_from_h5; its geometry is not used
+            h5fnames : iterable of str
+                Paths to h5 files generated by OpenMolcas
+
+        Kwargs:
+            symmetry : str
+                Point group of the calculations in OpenMolcas
+            mo_slice : slice or index array
+                See get_mo_from_h5
+
+        Returns:
+            mo_coeff : list of ndarrays of shape (nao_nr, nmo)
+    '''
+    if symmetry is not None:
+        mol = mol.copy()
+        mol.build(symmetry=symmetry)
+    cache = {}
+    return [_get_mo_from_h5 (mol, h5fname, mo_slice=mo_slice, cache=cache)
+            for h5fname in h5fnames]
+
 def get_mol_from_h5 (h5fname, **kwargs):
     ''' Build a gto.mole object from an h5 file written by OpenMolcas 
 
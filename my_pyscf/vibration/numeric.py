@@ -0,0 +1,152 @@
+import numpy as np
+from scipy import linalg
+from pyscf import lib
+from pyscf.lib import param, logger
+from pyscf.data import nist
+from mrh.my_pyscf.vibration.coords import InternalCoords
+from mrh.my_pyscf.grad.numeric import _get_guess, _set_guess
+from mrh.my_pyscf.grad.numeric import fork_pool, pool_call, detach_chkfile
+
+STEPSIZE_DEFAULT=0.001
+SCANNER_VERBOSE_DEFAULT=0
+NPROC_DEFAULT=1
+
+# Semi-numerical Hessian: central finite differences of analytic gradients
+
+def _scan_grad (mol, scanner, coords, guess=None, state=None):
+    if guess is not None: _set_guess (scanner.base, guess)
+    kwargs = {} if state is None else {'state': state}
+    e, de = scanner (mol.set_geom_ (coords, unit='Angstrom', inplace=False), **kwargs)
+    return e, np.asarray (de)
+
+def _pool_init_scan (mol, scanner, guess, state):
+    detach_chkfile (scanner.base)
+    return mol, scanner, guess, state
+
+def _pool_scan_grad (args, coords):
+    mol, scanner, guess, state = args
+    return _scan_grad (mol, scanner, coords, guess=guess, state=state)
+
+def harmonic_analysis (mol, hess):
+    ''' Harmonic frequencies and normal modes from a Cartesian Hessian, with translations
+    and rotations projected out using :class:`InternalCoords`
+
+    Args:
+        mol : instance of :class:`gto.Mole`
+        hess : ndarray of shape (natm,natm,3,3)
+            Second derivatives of the energy in Hartree/Bohr^2, with
+            hess[i,j,x,y] = d^2E / dR[i,x] dR[j,y]
+
+    Returns:
+        freq : ndarray of shape (nvib)
+            Harmonic frequencies in cm^-1, in ascending order. Imaginary frequencies
+            are returned as negative numbers.
+        modes : ndarray of shape (nvib,natm,3)
+            Normalized Cartesian displacement vectors of the normal modes
+    '''
+    natm = mol.natm
+    ic = InternalCoords (mol)
+    # Isotope-averaged masses, as in pyscf.hessian.thermo, not mass numbers
+    ic.masses = mol.atom_mass_list (isotope_avg=True)
+    uvib = ic.get_coords ()[2].reshape (3*natm, -1)
+    mw = np.repeat (1 / np.sqrt (ic.masses), 3)
+    hess = np.asarray (hess).transpose (0,2,1,3).reshape (3*natm, 3*natm)
+    hess = hess * mw[:,None] * mw[None,:]
+    w2, c = linalg.eigh (uvib.T @ hess @ uvib)
+    w2 /= nist.AMU2AU
+    freq = np.sign (w2) * np.sqrt (np.abs (w2)) * nist.HARTREE2WAVENUMBER
+    modes = (uvib @ c) * mw[:,None]
+    modes /= linalg.norm (modes, axis=0)[None,:]
+    return freq, modes.T.reshape (-1, natm, 3)
+
+class Hessian (lib.StreamObject):
+    ''' Semi-numerical Hessian and harmonic frequencies from central finite differences of
+    analytic nuclear gradients (e.g., mrh.my_pyscf.grad.mcpdft.Gradients or
+    mrh.my_pyscf.grad.mspdft.Gradients)
+
+    Attributes:
+        stepsize : float
+            Finite-difference step in Angstrom
+        nproc : integer
+            Number of worker processes among which the displaced gradient calculations
+            are distributed. Each worker has its own copy of the gradient scanner and
+            runs with a single OpenMP thread (see grad.numeric.fork_pool). Requires the
+            'fork' start method.
+        state : integer or None
+            Passed to the gradient scanner for state-specific gradients
+
+    Saved results:
+        de : ndarray of shape (natm,natm,3,3)
+            Hessian, symmetrized, in Hartree/Bohr^2
+        freq : ndarray of shape (nvib)
+            Harmonic frequencies in cm^-1 (imaginary ones as negative numbers)
+        modes : ndarray of shape (nvib,natm,3)
+            Normal modes as normalized Cartesian displacements
+    '''
+
+    def __init__(self, grad_method, stepsize=STEPSIZE_DEFAULT, nproc=NPROC_DEFAULT, state=None,
+                 scanner_verbose=SCANNER_VERBOSE_DEFAULT):
+        self.grad_method = grad_method
+        self.base = grad_method.base
+        self.mol = grad_method.mol
+        self.stdout = grad_method.stdout
+        self.verbose = grad_method.verbose
+        self.max_memory = grad_method.max_memory
+        self.stepsize = stepsize
+        self.nproc = nproc
+        self.state = state
+        self.scanner = grad_method.as_scanner ()
+        self.scanner.verbose = scanner_verbose
+        self.scanner.base.verbose = scanner_verbose
+        self.de = self.freq = self.modes = None
+
+    def scan_gradients (self, geoms):
+        ''' Energies and gradients at a list of geometries (arrays of shape (natm,3) in
+        Angstrom), each warm-started from the reference wave function of self.base '''
+        guess = _get_guess (self.base)
+        nproc = min (self.nproc, len (geoms))
+        if nproc > 1:
+            with fork_pool (nproc, initializer=_pool_init_scan,
+                            initargs=(self.mol, self.scanner, guess, self.state)) as pool:
+                return pool.map (pool_call (_pool_scan_grad), geoms, chunksize=1)
+        return [_scan_grad (self.mol, self.scanner, x, guess=guess, state=self.state)
+                for x in geoms]
+
+    def kernel (self, stepsize=None, nproc=None, state=None):
+        if stepsize is not None: self.stepsize = stepsize
+        if nproc is not None: self.nproc = nproc
+        if state is not None: self.state = state
+        stepsize = self.stepsize
+        natm = self.mol.natm
+        t0 = (logger.process_clock (), logger.perf_counter ())
+
+        coords = self.mol.atom_coords () * param.BOHR
+        geoms = []
+        for iatm in range (natm):
+            for icoord in range (3):
+                for step in (1, -1):
+                    geoms.append (coords.copy ())
+                    geoms[-1][iatm,icoord] += step * stepsize
+        logger.info (self, 'Semi-numerical Hessian: %d displaced gradients on %d processes',
+                     len (geoms), min (self.nproc, len (geoms)))
+        results = self.scan_gradients (geoms)
+
+        de = np.stack ([gp - gm for (ep, gp), (em, gm) in zip (results[::2], results[1::2])],
+                       axis=0)
+        de = de.reshape (natm, 3, natm, 3).transpose (0,2,1,3) * param.BOHR / (2*stepsize)
+        asym = linalg.norm (de - de.transpose (1,0,3,2))
+        logger.debug (self, 'Finite-difference Hessian asymmetry norm: %e', asym)
+        self.de = (de + de.transpose (1,0,3,2)) / 2
+        self.freq, self.modes = harmonic_analysis (self.mol, self.de)
+        logger.timer (self, 'Semi-numerical Hessian', *t0)
+        self._finalize ()
+        return self.de
+
+    def _finalize (self):
+        if self.verbose >= logger.NOTE:
+            logger.note (self, '----------- %s semi-numerical frequencies (cm^-1) -----------',
+                         self.base.__class__.__name__)
+            for i, f in enumerate (self.freq):
+                logger.note (self, '  %4d  %12.4f%s', i, abs (f), ('', 'i')[int (f<0)])
+            logger.note (self, '-------------------------------------------------------------')
+
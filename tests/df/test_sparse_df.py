@@ -0,0 +1,40 @@
+import numpy as np
+from pyscf import gto, scf, lib
+from mrh.my_pyscf.df import sparse_df
+import unittest
+
+# Two fragments far apart so that many AO pairs are screened
+mol = gto.M (atom = 'O 0 0 0; H 0.757 0.587 0; H -0.757 0.587 0; H 12 0 0; H 12.74 0 0',
+    basis = '6-31g', verbose=0, output='/dev/null')
+mf = scf.RHF (mol).density_fit ().run ()
+
+def tearDownModule():
+    global mol, mf
+    mol.stdout.close ()
+    del mol, mf
+
+class KnownValues(unittest.TestCase):
+
+    def test_get_jk (self):
+        dm = mf.make_rdm1 ()
+        dms = np.stack ([dm, (.3*dm) - (.01*np.eye (mol.nao_nr ()))], axis=0)
+        vj_ref, vk_ref = mf.with_df.get_jk (dms, hermi=1)
+        for thresh, tol in ((1e-12, 9), (1e-8, 6)):
+            for max_memory in (None, .01):
+                vj, vk = sparse_df.get_jk (mf.with_df, dms, thresh=thresh, max_memory=max_memory)
+                with self.subTest (thresh=thresh, max_memory=max_memory):
+                    self.assertAlmostEqual (lib.fp (vj), lib.fp (vj_ref), tol)
+                    self.assertAlmostEqual (lib.fp (vk), lib.fp (vk_ref), tol)
+
+    def test_get_k_only (self):
+        dm = mf.make_rdm1 ()
+        vk_ref = mf.with_df.get_jk (dm, hermi=1, with_j=False)[1]
+        vj, vk = sparse_df.get_jk (mf.with_df, dm, with_j=False)
+        self.assertIsNone (vj)
+        self.assertEqual (vk.shape, dm.shape)
+        self.assertAlmostEqual (lib.fp (vk), lib.fp (vk_ref), 7)
+
+if __name__ == "__main__":
+    print("Full Tests for sparse DF")
+    unittest.main()
+
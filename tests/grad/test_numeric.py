@@ -0,0 +1,72 @@
+import numpy as np
+from pyscf import gto, scf, lib
+from mrh.my_pyscf.grad import numeric
+import unittest
+
+def setUpModule():
+    global mol, mf, de_ref
+    mol = gto.M (atom = 'O 0 0 0; H 0 0.757 0.587; H 0 -0.757 0.587',
+                 basis = '6-31g', symmetry = True, output = '/dev/null',
+                 verbose = 0)
+    mf = scf.RHF (mol).set (conv_tol=1e-12).run ()
+    de_ref = mf.nuc_grad_method ().kernel ()
+
+def tearDownModule():
+    global mol, mf, de_ref
+    mol.stdout.close ()
+    del mol, mf, de_ref
+
+class KnownValues(unittest.TestCase):
+
+    def test_stencils (self):
+        # A large step, so that the 4-point stencil is visibly better
+        err = {}
+        for npoint in (2, 4):
+            de = numeric.Gradients (mf, stepsize=0.01, scanner_verbose=0,
+                                    npoint=npoint).kernel ()
+            err[npoint] = np.amax (np.abs (de - de_ref))
+            with self.subTest (npoint=npoint):
+                self.assertLess (err[npoint], 1e-4)
+        self.assertLess (err[4], err[2] / 10)
+        self.assertLess (err[4], 1e-6)
+
+    def test_nproc (self):
+        de1 = numeric.Gradients (mf, scanner_verbose=0).kernel ()
+        de2 = numeric.Gradients (mf, scanner_verbose=0, nproc=2).kernel ()
+        self.assertAlmostEqual (lib.fp (de2), lib.fp (de1), 9)
+        self.assertAlmostEqual (lib.fp (de2), lib.fp (de_ref), 5)
+
+    def test_warm_start (self):
+        mf_grad = numeric.Gradients (mf, scanner_verbose=0)
+        coords = mol.atom_coords () * lib.param.BOHR
+        coords[1,1] += 0.001
+        guess = numeric._get_guess (mf)
+        self.assertIs (guess['mo_coeff'], mf.mo_coeff)
+        scanner = mf_grad.scanner
+        cycles = []
+        scanner.callback = lambda envs: cycles.append (envs['cycle'])
+        e_warm = numeric._scan_energy (mol, scanner, coords, guess=guess)[0]
+        ncyc_warm = len (cycles)
+        cycles.clear ()
+        scanner.mo_coeff = None
+        e_cold = numeric._scan_energy (mol, scanner, coords)[0]
+        ncyc_cold = len (cycles)
+        self.assertAlmostEqual (e_warm, e_cold, 9)
+        self.assertLess (ncyc_warm, ncyc_cold)
+
+    def test_symm_unique_displacements (self):
+        disps, images = numeric.symm_unique_displacements (mol)
+        # C2v water: O moves only along the axis and the two H are equivalent
+        self.assertEqual (len (disps), 3)
+        self.assertEqual (len (disps) + len (images), 3*mol.natm)
+        mf_grad = numeric.Gradients (mf, scanner_verbose=0, use_symmetry=True)
+        de = mf_grad.kernel ()
+        self.assertAlmostEqual (lib.fp (de), lib.fp (de_ref), 5)
+        for iatm, icoord, jatm, sign in images:
+            if sign == 0:
+                with self.subTest (atom=iatm, coord=icoord):
+                    self.assertEqual (de[iatm,icoord], 0)
+
+if __name__ == "__main__":
+    print("Full Tests for numeric gradients")
+    unittest.main()
@@ -38,6 +38,10 @@ class KnownValues(unittest.TestCase):
         uccsd = uccsd_sym1.UCCSD (mol).run ()
         self.assertAlmostEqual (uccsd.e_tot, fci.e_tot, 6)
 
+    def test_sym1_uccsd_sector (self):
+        uccsd = uccsd_sym1.UCCSD (mol).set (sector=True).run ()
+        self.assertAlmostEqual (uccsd.e_tot, fci.e_tot, 6)
+
 if __name__ == "__main__":
     print("Full Tests for UCCS & UCCSD/6-31g of H2 molecule")
     unittest.main()
@@ -0,0 +1,78 @@
+import numpy as np
+from pyscf import gto, scf, mcscf, lib
+from mrh.exploratory.unitary_cc import lasuccsd
+import unittest
+
+xyz = '''H 0.0 0.0 0.0
+         H 1.0 0.0 0.0
+         H 0.2 3.9 0.1
+         H 1.159166 4.1 -0.1'''
+
+def setUpModule():
+    global mol, mf, h, ci0_f
+    mol = gto.M (atom = xyz, basis = 'sto-3g', output='/dev/null', verbose=0)
+    mf = scf.RHF (mol).run ()
+    mc = mcscf.CASCI (mf, 4, 4)
+    h1, h0 = mc.get_h1eff ()
+    h = [h0, h1, mc.get_h2eff ()]
+    # Fock-space fragment wave functions: mostly one electron pair in the
+    # lower orbital of each fragment, with some weight in every sector
+    np.random.seed (0)
+    ci0_f = []
+    for i in range (2):
+        c = np.zeros ((4,4))
+        c[1,1] = 1.0
+        c += 0.1 * np.random.rand (4,4)
+        ci0_f.append (c / np.linalg.norm (c))
+
+def tearDownModule():
+    global mol, mf, h, ci0_f
+    mol.stdout.close ()
+    del mol, mf, h, ci0_f
+
+class KnownValues(unittest.TestCase):
+
+    def test_sector (self):
+        fci = lasuccsd.FCISolver (mol)
+        psi_ref = fci.build_psi (ci0_f, 4, [2,2], 4)
+        fci.sector = True
+        psi_test = fci.build_psi (ci0_f, 4, [2,2], 4)
+        x = 0.1 * np.random.rand (psi_ref.nvar)
+        e_ref, g_ref = psi_ref.e_de (x, h)
+        e_test, g_test = psi_test.e_de (x, h)
+        with self.subTest ('energy'):
+            self.assertAlmostEqual (e_test, e_ref, 9)
+        with self.subTest ('gradient'):
+            self.assertAlmostEqual (lib.fp (g_test), lib.fp (g_ref), 9)
+        with self.subTest ('fcivec'):
+            self.assertAlmostEqual (lib.fp (psi_test.get_fcivec (x)),
+                lib.fp (psi_ref.get_fcivec (x)), 9)
+
+    def test_gradient (self):
+        # x is not projected, so the CI steps have components along ci0_f
+        fci = lasuccsd.FCISolver (mol)
+        psi = fci.build_psi (ci0_f, 4, [2,2], 4)
+        x = 0.1 * np.random.rand (psi.nvar)
+        g = psi.e_de (x, h)[1]
+        delta = 1e-5
+        for k in range (3):
+            d = np.random.rand (psi.nvar) - 0.5
+            ep = psi.e_de (x + delta*d, h)[0]
+            em = psi.e_de (x - delta*d, h)[0]
+            with self.subTest (k=k):
+                self.assertAlmostEqual ((ep-em)/2/delta, np.dot (g, d), 8)
+
+    def test_opt_method (self):
+        e = {}
+        for method in ('BFGS', 'LBFGS'):
+            fci = lasuccsd.FCISolver (mol)
+            fci.opt_method = method
+            e[method] = fci.kernel (h[1], h[2], 4, (2,2), norb_f=[2,2],
+                ci0_f=ci0_f, ecore=h[0], gtol=1e-6)[0]
+            with self.subTest (method=method):
+                self.assertTrue (fci.converged)
+        self.assertAlmostEqual (e['LBFGS'], e['BFGS'], 9)
+
+if __name__ == "__main__":
+    print("Full Tests for LASUCCSD/sto-3g of H2 dimer")
+    unittest.main()
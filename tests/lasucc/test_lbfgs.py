@@ -0,0 +1,61 @@
+import numpy as np
+from scipy import optimize
+from mrh.exploratory.citools.lbfgs import lbfgs
+import unittest
+
+def quadratic (n=10, seed=0):
+    rng = np.random.RandomState (seed)
+    a = rng.rand (n,n)
+    a = np.dot (a, a.T) + np.eye (n)
+    b = rng.rand (n)
+    def fun (x):
+        ax = np.dot (a, x)
+        return 0.5 * x.dot (ax) - b.dot (x), ax - b
+    return fun, np.linalg.solve (a, b), a
+
+def rosenbrock (x):
+    return optimize.rosen (x), optimize.rosen_der (x)
+
+class KnownValues(unittest.TestCase):
+
+    def test_quadratic (self):
+        fun, x_ref, a = quadratic ()
+        f_ref = fun (x_ref)[0]
+        x0 = np.zeros_like (x_ref)
+        for lbl, precond in (('none', None), ('diag', 1/np.diag (a))):
+            for m in (3, 20):
+                conv, x, f, it = lbfgs (fun, x0, precond=precond, gtol=1e-8,
+                    m=m, max_stepsize=10.0)
+                with self.subTest (precond=lbl, m=m):
+                    self.assertTrue (conv)
+                    self.assertAlmostEqual (f, f_ref, 12)
+                    self.assertAlmostEqual (np.amax (np.abs (x-x_ref)), 0, 6)
+
+    def test_rosenbrock (self):
+        x0 = np.array ([-1.2, 1.0, -0.5, 0.8])
+        conv, x, f, it = lbfgs (rosenbrock, x0, gtol=1e-7, max_cycle=1000)
+        self.assertTrue (conv)
+        self.assertLess (it, 1000)
+        self.assertAlmostEqual (f, 0, 10)
+        self.assertAlmostEqual (np.amax (np.abs (x-1)), 0, 6)
+
+    def test_callback_max_cycle (self):
+        x0 = np.array ([-1.2, 1.0])
+        xs = []
+        conv, x, f, it = lbfgs (rosenbrock, x0, gtol=1e-12, max_cycle=5,
+            callback=xs.append)
+        self.assertFalse (conv)
+        self.assertEqual (it, 5)
+        self.assertEqual (len (xs), 5)
+        self.assertTrue (np.all (x == xs[-1]))
+        self.assertLess (f, rosenbrock (x0)[0])
+
+    def test_converged_x0 (self):
+        fun, x_ref, a = quadratic ()
+        conv, x, f, it = lbfgs (fun, x_ref, gtol=1e-6)
+        self.assertTrue (conv)
+        self.assertEqual (it, 0)
+
+if __name__ == "__main__":
+    print("Full Tests for preconditioned L-BFGS")
+    unittest.main()
@@ -50,6 +50,21 @@ class KnownValues(unittest.TestCase):
             with self.subTest (igen=i):
                 self.assertAlmostEqual (lib.fp (duc), lib.fp (duc_num), 4)
 
+    def test_contract_deriv1 (self):
+        norb = 4
+        c = np.random.rand (2**norb)
+        c /= linalg.norm (c)
+        bra = np.random.rand (2**norb)
+        uop = get_uccsd_op (norb)
+        x = (2 * np.random.rand (uop.ngen_uniq)) - 1
+        uop.set_uniq_amps_(x)
+        g_test, ubra = uop.contract_deriv1 (c, bra)
+        g_ref = [bra.dot (duc) for duc in uop.gen_deriv1 (c)]
+        with self.subTest ('gradient'):
+            self.assertAlmostEqual (lib.fp (g_test), lib.fp (g_ref), 8)
+        with self.subTest ('adjoint'):
+            self.assertAlmostEqual (lib.fp (ubra), lib.fp (uop (bra, transpose=True)), 8)
+
     def test_ham (self):
         for norb in range (2,5):
             npair = norb*(norb+1)//2
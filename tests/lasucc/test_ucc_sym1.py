@@ -59,6 +59,26 @@ class KnownValues(unittest.TestCase):
                     self.assertLessEqual (linalg.norm (comm_a), 1e-8)
                     self.assertLessEqual (linalg.norm (comm_b), 1e-8)
 
+    def test_sector (self):
+        for norb, c, uop_s, uop_sd in zip (range (2,5), c_list, uop_s_list, uop_sd_list):
+            for nelec in product (range (norb+1), repeat=2):
+                strs = fockspace.sector_strs (norb, nelec)
+                c_h = np.squeeze (fockspace.fock2hilbert (c, norb, nelec)).ravel ()
+                c_f = np.squeeze (fockspace.hilbert2fock (c_h, norb, nelec)).ravel ()
+                with self.subTest (norb=norb, nelec=nelec, op='strs'):
+                    self.assertTrue (np.all (np.diff (strs.astype (np.int64)) > 0))
+                    self.assertEqual (linalg.norm (c_f[strs] - c_h), 0.0)
+                for uop, l in zip ([uop_s, uop_sd], ['singles', 'singles and doubles']):
+                    uc_ref = uop (c_f)[strs]
+                    dc_ref = uop.get_deriv1 (c_f, uop.ngen-1)[strs]
+                    uop.set_sector_(nelec)
+                    uc = uop (c_h)
+                    dc = uop.get_deriv1 (c_h, uop.ngen-1)
+                    uop.set_sector_(None)
+                    with self.subTest (norb=norb, nelec=nelec, op=l):
+                        self.assertAlmostEqual (lib.fp (uc), lib.fp (uc_ref), 8)
+                        self.assertAlmostEqual (lib.fp (dc), lib.fp (dc_ref), 8)
+
 if __name__ == "__main__":
     print("Full Tests for UCC partial spin symmetry module")
     unittest.main()
@@ -46,7 +46,38 @@ class KnownValues(unittest.TestCase):
                                run(0.78, 'BLYP', 'cBLYP', chkfile2), 0.15624825293702616, 5)
         self.assertAlmostEqual(restart('PBE', 'cPBE', chkfile1) -
                                restart('PBE', 'cPBE', chkfile2), 0.14898997201251052, 5)
-        
+
+    def test_multi(self):
+        mol = gto.M(atom='H 0 0 0.4; H 0 0 -0.4', basis='cc-pvdz', symmetry=False, verbose=0)
+        mf = scf.RHF(mol).run()
+        mc = mcdcft.CASSCF(mf, 'PBE', 2, 2, ot_name='cPBE', grids_level=3)
+        mc.fix_spin_(ss=0)
+        mc.kernel()
+        fnals = [('PBE', None, 'cPBE'), ('PBE', lambda D: 0.8*D, 'cPBE0.8'), ('BLYP', None, 'cBLYP')]
+        otfnal, grids = mc.otfnal, mc.grids
+        e_tot, e_ot = mc.recalculate_with_xc_multi(fnals)
+        with self.subTest('otfnal restored'):
+            self.assertIs(mc.otfnal, otfnal)
+            self.assertIs(mc.grids, grids)
+            self.assertEqual(mc.ot_name, 'cPBE')
+        for ix, (xc, scaleD, ot_name) in enumerate(fnals):
+            e_ref = mc.recalculate_with_xc(xc, ot_name=ot_name, scaleD=scaleD)[0]
+            with self.subTest(ot_name=ot_name):
+                self.assertAlmostEqual(e_tot[ix], e_ref, 10)
+        # An otfnal instance given in fnals is not modified
+        ot = mcdcft.CASSCF(mf, 'BLYP', 2, 2, ot_name='cBLYP', grids_level=2).otfnal
+        ot_vars, grids_vars = dict(vars(ot)), dict(vars(ot.grids))
+        scaleD = lambda D: 0.8*D
+        e_tot = mc.recalculate_with_xc_multi([(ot, scaleD, 'cBLYP0.8'), ('PBE', None, 'cPBE')])[0]
+        e_ref = mc.recalculate_with_xc('BLYP', ot_name='cBLYP0.8', scaleD=scaleD)[0]
+        with self.subTest('otfnal instance'):
+            self.assertAlmostEqual(e_tot[0], e_ref, 10)
+            self.assertEqual(ot.grids.level, 2)
+            for test, ref in ((vars(ot), ot_vars), (vars(ot.grids), grids_vars)):
+                self.assertEqual(set(test.keys()), set(ref.keys()))
+                for k in ref:
+                    self.assertIs(test[k], ref[k])
+
 if __name__ == "__main__":
     print("Full Tests for MC-DCFT energies of H2 molecule")
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -105,6 +105,57 @@ class KnownValues(unittest.TestCase):
             self.assertAlmostEqual (dQ_test[0], dQ_ref[0], 9)
         with self.subTest (deriv=2):
             self.assertAlmostEqual (d2Q_test[0,0], d2Q_ref[0,0], 9)
+        with self.subTest ('incremental'):
+            Q_update (u_theta (theta0))
+            Q_test, dQ_test, d2Q_test = Q_update (u_rand)
+            self.assertAlmostEqual (Q_test, Q_ref, 9)
+            self.assertAlmostEqual (dQ_test[0], dQ_ref[0], 9)
+
+    def test_coulomb_factor (self):
+        from mrh.my_pyscf.mcpdft.cmspdft import coulomb_tensor, _e_coul
+        from mrh.my_pyscf.mcpdft.cmspdft import e_coul
+        ci_theta0 = mc.get_ci_basis (uci=u_theta(theta0))
+        mc_df = mcpdft.CASSCF (mf.density_fit (), 'ftLDA,VWN3', 2, 2,
+            grids_level=1).fix_spin_(ss=0).multi_state ([0.5,0.5], 'cms')
+        mc_df.mo_coeff = mc.mo_coeff
+        for lbl, my_mc in (('conventional', mc), ('DF', mc_df)):
+            w = coulomb_tensor (my_mc, ci=ci_theta0)
+            Q_ref, dQ_ref, d2Q_ref = _e_coul (w, 2)
+            Q_test, dQ_test, d2Q_test = e_coul (my_mc, ci=ci_theta0)[:3]
+            with self.subTest (lbl):
+                self.assertAlmostEqual (Q_test, Q_ref, 9)
+                self.assertAlmostEqual (dQ_test[0], dQ_ref[0], 9)
+                self.assertAlmostEqual (d2Q_test[0,0], d2Q_ref[0,0], 9)
+
+    def test_coulomb_factor_nroots3 (self):
+        from mrh.my_pyscf.mcpdft.cmspdft import coulomb_tensor, _e_coul
+        from mrh.my_pyscf.mcpdft.cmspdft import e_coul
+        u = linalg.qr (np.random.rand (3,3))[0]
+        for lbl, my_mf in (('conventional', mf), ('DF', mf.density_fit ())):
+            mc3 = mcpdft.CASSCF (my_mf, 'ftLDA,VWN3', 2, 2, grids_level=1)
+            mc3 = mc3.fix_spin_(ss=0).multi_state ([1.0/3,]*3, 'cms')
+            mc3.mo_coeff = mc.mo_coeff
+            mc3.ci = mc3.fcisolver.kernel (mc3.get_h1eff ()[0],
+                mc3.get_h2eff (), 2, 2, ecore=0)[1]
+            ci = mc3.get_ci_basis (uci=u)
+            w = coulomb_tensor (mc3, ci=ci)
+            Q_ref, dQ_ref, d2Q_ref = _e_coul (w, 3)
+            Q_test, dQ_test, d2Q_test = e_coul (mc3, ci=ci)[:3]
+            with self.subTest (lbl):
+                self.assertAlmostEqual (Q_test, Q_ref, 9)
+                self.assertAlmostEqual (np.amax (np.abs (dQ_test-dQ_ref)),
+                    0, 9)
+                self.assertAlmostEqual (np.amax (np.abs (d2Q_test-d2Q_ref)),
+                    0, 9)
+
+    def test_diabatize_algorithms (self):
+        ci0 = mc.get_ci_basis (uci=u_theta (theta0))
+        for algorithm in ('newton', 'trust', 'bfgs'):
+            with self.subTest (algorithm=algorithm):
+                conv, ci1 = mc.diabatize (ci=ci0, algorithm=algorithm)
+                self.assertTrue (conv)
+                Q_test = mc.diabatizer (ci=ci1)[0]
+                self.assertAlmostEqual (Q_test, Q_max, 9)
         
         
 
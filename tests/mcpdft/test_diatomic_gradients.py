@@ -109,6 +109,15 @@ class KnownValues(unittest.TestCase):
             de = mc_grad.kernel (state=i) [1,0] / BOHR
             self.assertAlmostEqual (de, de_ref[i], 6)
 
+    def test_grad_lih_cms3ftlda22_sto3g_batch (self):
+        mc_grad = diatomic ('Li', 'H', 2.5, 'ftLDA,VWN3', 'STO-3G', 2, 2, 3)
+        de_ref = [0.09307779491, 0.07169985876, -0.08034177097] 
+        # Numerical from this software
+        de = mc_grad.kernel_batch ([0,1,2])[:,1,0] / BOHR
+        for i in range (3):
+         with self.subTest (state=i):
+            self.assertAlmostEqual (de[i], de_ref[i], 6)
+
     def test_grad_lih_cms2ftlda22_sto3g (self):
         # z_orb:    yes
         # z_ci:     yes
@@ -19,6 +19,7 @@ import numpy as np
 from pyscf import gto, scf, mcscf, lib, fci, df
 from pyscf.fci.addons import fix_spin_
 from mrh.my_pyscf import mcpdft
+from mrh.my_pyscf.dft import gen_grid
 import unittest
 
 
@@ -92,6 +93,19 @@ class KnownValues(unittest.TestCase):
                     self.assertTrue(mc1_gradscanner.converged)
                     self.assertAlmostEqual (de0, de1, delta=1e-5)
 
+    def test_scanner_warm_start (self):
+        mc = mcpdft.CASSCF (mf_nosym, 'ftLDA,VWN3', 5, 2,
+                            grids_level=1).run ()
+        mc_gradscanner = mc.nuc_grad_method ().as_scanner ()
+        mc_gradscanner (mol_nosym)
+        # Same geometry: the previous multipliers, carried over to the new
+        # MOs and CI vectors, solve the new Lagrange equations
+        e1, de1 = mc_gradscanner (mol_nosym)
+        L1 = mc_gradscanner._get_Lvec_prev (mc_gradscanner.Lvec)
+        self.assertLess (np.amax (np.abs (L1 - mc_gradscanner.Lvec)), 1e-6)
+        self.assertIs (mc.otfnal.grids.gen_atomic_grids,
+                       gen_grid.gen_atomic_grids)
+
     def test_gradients (self):
         ref_ss = 5.29903936e-03
         ref_sa = [5.66392595e-03,3.67724051e-02,3.62698260e-02,2.53851408e-02,2.53848341e-02]
@@ -110,6 +124,127 @@ class KnownValues(unittest.TestCase):
                     de = mc_grad.kernel (state=i)[0,0]
                     self.assertAlmostEqual (de, ref_sa[state], 5)
 
+    def test_gradients_batch (self):
+        ref_sa = [5.66392595e-03,3.67724051e-02,3.62698260e-02,2.53851408e-02,2.53848341e-02]
+        # Source: numerical @ this program
+        for ix, mc in enumerate (mcp[1]):
+            tms = (0,1,'mixed')[ix]
+            sym = bool (ix//2)
+            mc_grad = mc.nuc_grad_method ()
+            idx = np.argsort (mc.e_states)
+            de = mc_grad.kernel_batch (list (idx))[:,0,0]
+            for state in range (5):
+                with self.subTest (state=state, symmetry=sym, triplet_ms=tms):
+                    self.assertTrue (mc_grad.converged)
+                    self.assertAlmostEqual (de[state], ref_sa[state], 5)
+
+    def test_block_hop (self):
+        from pyscf.mcscf import newton_casscf
+        from mrh.my_pyscf.grad.mcpdft import gen_block_hop
+        for ix, mc in enumerate (mcp[1]):
+            mc_grad = mc.nuc_grad_method ()
+            fcasscf = mc_grad.make_fcasscf_sa ()
+            hop = newton_casscf.gen_g_hop (fcasscf, mc.mo_coeff, mc.ci,
+                mc.ao2mo (mc.mo_coeff))[2]
+            hop_block = gen_block_hop (fcasscf, mc.mo_coeff, mc.ci, hop,
+                mc_grad.ngorb)
+            x = 2*np.random.rand (mc_grad.nlag, 3) - 1
+            ncall = [0]
+            get_jk = fcasscf.get_jk
+            def count_jk (*args, **kwargs):
+                ncall[0] += 1
+                return get_jk (*args, **kwargs)
+            with lib.temporary_env (fcasscf, get_jk=count_jk):
+                Ax_test = hop_block (x)
+            with self.subTest (case=ix, check='one get_jk call'):
+                self.assertEqual (ncall[0], 1)
+            for i, xi in enumerate (x.T):
+                with self.subTest (case=ix, col=i):
+                    self.assertAlmostEqual (lib.fp (Ax_test[:,i]),
+                                            lib.fp (hop (xi)), 9)
+
+    def test_gradients_nproc (self):
+        for mc, symm in zip (mcp[0], (False, True)):
+            mc_grad = mc.nuc_grad_method ()
+            de_ref = mc_grad.kernel ()
+            mc_grad.nproc = 2
+            de_test = mc_grad.kernel ()
+            with self.subTest (symmetry=symm):
+                self.assertAlmostEqual (lib.fp (de_test), lib.fp (de_ref), 9)
+
+    def test_grid_response_sparse (self):
+        from pyscf.grad.rks import grids_response_cc
+        from mrh.my_pyscf.grad.grids_response import grids_response_sparse
+        mc = mcp[0][0]
+        for ia, (ref, test) in enumerate (zip (grids_response_cc (mc.grids),
+                grids_response_sparse (mc.grids, rcut=100))):
+            with self.subTest ('grids_response', atom=ia):
+                self.assertEqual (list (test[3]), list (range (mc.mol.natm)))
+                for x_ref, x_test in zip (ref, test[:3]):
+                    self.assertAlmostEqual (lib.fp (x_test), lib.fp (x_ref), 9)
+        mc_grad = mc.nuc_grad_method ()
+        de_ref = mc_grad.kernel ()
+        mc_grad.grid_response_rcut = 100
+        de_test = mc_grad.kernel ()
+        with self.subTest ('gradient'):
+            self.assertAlmostEqual (lib.fp (de_test), lib.fp (de_ref), 9)
+
+    def test_grid_response_sparse_rcut (self):
+        # rcut shorter than the molecule: each atom's weights must be those
+        # of the full partition, and their derivative the dense one of the
+        # molecule made of its neighbors only
+        from pyscf.dft import gen_grid
+        from pyscf.grad.rks import grids_response_cc
+        from mrh.my_pyscf.grad.grids_response import grids_response_sparse
+        mol = gto.M (atom = '''C  0.0000  0.0000  0.6695
+                               C  0.0000  0.0000 -0.6695
+                               H  0.0000  0.9289  1.2321
+                               H  0.0000 -0.9289  1.2321
+                               H  0.0000  0.9289 -1.2321
+                               H  0.0000 -0.9289 -1.2321''',
+                     basis = 'sto3g', output = '/dev/null', verbose = 0)
+        mf = scf.RHF (mol).run ()
+        mc = mcpdft.CASSCF (mf, 'tLDA', 2, 2, grids_level=1).run ()
+        rcut = 3.0
+        w0_ref = [w0 for coords, w0, w1 in grids_response_cc (mc.grids)]
+        for ia, test in enumerate (grids_response_sparse (mc.grids,
+                rcut=rcut)):
+            nbr = test[3]
+            submol = gto.M (atom = [[mol.atom_symbol (i), mol.atom_coord (i)]
+                                    for i in nbr], unit = 'Bohr',
+                            basis = 'sto3g', spin = None,
+                            output = '/dev/null', verbose = 0)
+            subgrids = gen_grid.Grids (submol)
+            subgrids.level = mc.grids.level
+            ref = list (grids_response_cc (subgrids))[list (nbr).index (ia)]
+            with self.subTest ('grids_response', atom=ia):
+                self.assertLess (len (nbr), mol.natm)
+                self.assertAlmostEqual (lib.fp (test[0]), lib.fp (ref[0]), 9)
+                self.assertAlmostEqual (lib.fp (test[1]), lib.fp (w0_ref[ia]),
+                    9)
+                self.assertAlmostEqual (lib.fp (test[2]), lib.fp (ref[2]), 9)
+            submol.stdout.close ()
+        mc_grad = mc.nuc_grad_method ()
+        atmlst, full = [0, 2, 5], list (range (mol.natm))
+        # Only the weight derivative is truncated: the error vanishes once
+        # rcut exceeds the largest interatomic distance (5.8 Bohr) and is
+        # small just below that
+        for rcut, tol in ((100, 1e-9), (7.0, 1e-9), (5.0, 1e-3)):
+            de_ref = mc_grad.kernel (atmlst=full)
+            mc_grad.grid_response_rcut = rcut
+            de_test = mc_grad.kernel (atmlst=atmlst)
+            mc_grad.grid_response_rcut = None
+            with self.subTest ('gradient', rcut=rcut):
+                self.assertLess (np.amax (np.abs (de_test-de_ref[atmlst])),
+                    tol)
+        mc_grad.grid_response_rcut = rcut = 3.0
+        de_ref = mc_grad.kernel (atmlst=full)
+        de_test = mc_grad.kernel (atmlst=atmlst)
+        with self.subTest ('gradient atmlst', rcut=rcut):
+            self.assertAlmostEqual (lib.fp (de_test), lib.fp (de_ref[atmlst]),
+                9)
+        mol.stdout.close ()
+
 if __name__ == "__main__":
     print("Full Tests for MC-PDFT gradients API")
     unittest.main()
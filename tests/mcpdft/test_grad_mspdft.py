@@ -142,7 +142,42 @@ class KnownValues(unittest.TestCase):
             self.assertTrue(mc_grad2.converged)
             self.assertAlmostEqual (e1, e2, 6)
             self.assertAlmostEqual (lib.fp (de1), lib.fp (de2), 6)
-    
+
+    def test_scanner_warm_start (self):
+        # Step the geometry of a scanner which has solved the Lagrange
+        # equations at the old one: the previous multipliers carried over to
+        # the new geometry must be used and give the cold-start gradients
+        def get_lih (r):
+            mol = gto.M (atom='Li 0 0 0\nH {} 0 0'.format (r), basis='sto3g',
+                         output='/dev/null', verbose=0)
+            mf = scf.RHF (mol).run ()
+            mc = mcpdft.CASSCF (mf, 'ftLDA,VWN3', 2, 2, grids_level=1)
+            mc.fix_spin_(ss=0)
+            mc = mc.multi_state ([0.5,0.5], 'cms').run (conv_tol=1e-8)
+            return mol, mc.nuc_grad_method ()
+        mol1, mc_grad1 = get_lih (1.5)
+        mol2, mc_grad2 = get_lih (1.55)
+        mc_grad1.conv_rtol = mc_grad2.conv_rtol = 1e-10
+        de_cold = mc_grad2.kernel_batch ([0,1])
+        mc_scanner = mc_grad1.as_scanner ()
+        mc_scanner.kernel_batch ([0,1])
+        self.assertEqual (sorted (mc_scanner._Lvec_prev.keys ()), [0,1])
+        for state in 0,1:
+            e2, de2 = mc_scanner (mol2, state=state)
+            with self.subTest (state=state):
+                self.assertTrue (mc_scanner.converged)
+                self.assertIsNotNone (mc_scanner._get_Lvec_prev (
+                    mc_scanner.Lvec, state=state))
+                self.assertAlmostEqual (e2, mc_grad2.base.e_states[state], 6)
+                self.assertAlmostEqual (lib.fp (de2), lib.fp (de_cold[state]),
+                    6)
+        with self.subTest ('kernel_batch'):
+            mc_scanner.state = 0
+            de_warm = mc_scanner.kernel_batch ([1,0])
+            self.assertEqual (mc_scanner.state, 0)
+            de_warm = de_warm[::-1]
+            self.assertAlmostEqual (lib.fp (de_warm), lib.fp (de_cold), 6)
+
 
 if __name__ == "__main__":
     print("Full Tests for MS-PDFT gradient off-diagonal heff fns")
@@ -0,0 +1,66 @@
+import io
+from unittest import mock
+from pyscf import gto, dft, lib
+from pyscf.dft.gen_grid import BLKSIZE
+from mrh.my_pyscf.mcpdft import _gridblocks
+import unittest
+
+def setUpModule():
+    global mol
+    mol = gto.M (atom = 'Li 0 0 0; H 1.2 0 0', basis = 'sto-3g',
+        output='/dev/null', verbose=0)
+
+def tearDownModule():
+    global mol
+    mol.stdout.close ()
+    del mol
+
+class KnownValues(unittest.TestCase):
+
+    def test_get_ngrids (self):
+        grids = dft.gen_grid.Grids (mol)
+        grids.level = 1
+        self.assertIsNone (grids.coords)
+        ngrids = _gridblocks.get_ngrids (grids)
+        with self.subTest ('build'):
+            self.assertEqual (ngrids, grids.coords.shape[0])
+            self.assertIsNotNone (grids.non0tab)
+        with self.subTest ('built'):
+            grids.coords = grids.coords[:100]
+            self.assertEqual (_gridblocks.get_ngrids (grids), 100)
+
+    def test_get_blksize (self):
+        mem_now = 1000.0
+        ncols = 100
+        max_nblk = BLKSIZE * _gridblocks.MAX_NBLK
+        # Memory for exactly nblk blocks of BLKSIZE points (plus a margin)
+        def mem (nblk): return mem_now + (nblk+0.5)*BLKSIZE*ncols*8/1e6
+        for ngrids, max_memory, ref in ((10**6, mem (7), 7*BLKSIZE),
+                                        (10**6, mem (0), BLKSIZE),
+                                        (10**6, mem_now+1e6, max_nblk),
+                                        (BLKSIZE+1, mem (7), 2*BLKSIZE),
+                                        (10, mem_now+1e6, BLKSIZE)):
+            with mock.patch.object (_gridblocks, 'current_memory',
+                                    return_value=(mem_now, 2*mem_now)):
+                blksize = _gridblocks.get_blksize (ncols, ngrids, max_memory)
+            with self.subTest (ngrids=ngrids, max_memory=max_memory):
+                self.assertEqual (blksize % BLKSIZE, 0)
+                self.assertEqual (blksize, ref)
+
+    def test_get_blksize_log (self):
+        mem_now = 1000.0
+        for max_memory, warn in ((mem_now+1e3, False), (mem_now-1, True)):
+            out = io.StringIO ()
+            log = lib.logger.Logger (out, lib.logger.DEBUG)
+            with mock.patch.object (_gridblocks, 'current_memory',
+                                    return_value=(mem_now, 2*mem_now)):
+                _gridblocks.get_blksize (100, 10**5, max_memory, log=log,
+                    label='test loop')
+            out = out.getvalue ()
+            with self.subTest (warn=warn):
+                self.assertIn ('test loop', out)
+                self.assertEqual ('exceeds max_memory' in out, warn)
+
+if __name__ == "__main__":
+    print("Full Tests for MC-PDFT grid-block planning")
+    unittest.main()
@@ -436,6 +436,15 @@ class KnownValues(unittest.TestCase):
                 e_test_fp = lib.fp (np.sort (e_test))
                 self.assertAlmostEqual (e_test_fp, e_ref_fp, 10)
 
+    def test_mixed_precision (self):
+        from mrh.my_pyscf.mcpdft.mcpdft import check_mixed_precision
+        mc_list = mcp[0] + mcp[1]
+        err = check_mixed_precision (mc_list)
+        for mc, e in zip (mc_list, err):
+            with self.subTest (symm=mc.mol.symmetry, nroots=len (e)):
+                self.assertFalse (mc.otfnal.mixed_precision)
+                self.assertLess (np.amax (np.abs (e)), 1e-6)
+
 if __name__ == "__main__":
     print("Full Tests for MC-PDFT energy API")
     unittest.main()
@@ -0,0 +1,96 @@
+import io
+import numpy as np
+from pyscf import gto, scf, lib
+from mrh.my_pyscf import mcpdft
+from mrh.my_pyscf.dft import openmolcas_grids, gen_grid
+import unittest
+
+h2o = scf.RHF (gto.M (atom = 'O 0 0 0; H 0 0.757 0.587; H 0 -0.757 0.587',
+    basis = '6-31g', output='/dev/null', verbose=0)).run ()
+
+def tearDownModule():
+    global h2o
+    h2o.mol.stdout.close ()
+    del h2o
+
+def ta_loop (n, chg):
+    # Reference: the original, loop-based radial grid
+    r = np.empty (n)
+    dr = np.empty (n)
+    alpha = openmolcas_grids.om_ta_alpha[chg-1]
+    step = 2.0 / (n+1)
+    ln2 = alpha / np.log (2)
+    for i in range (n):
+        x = (i+1)*step - 1
+        r[i] = -ln2*(1+x)**.6 * np.log ((1-x)/2)
+        dr[i] = step * ln2*(1+x)**.6 *(-.6/(1+x)*np.log ((1-x)/2)+1/(1-x))
+    return r[::-1], dr[::-1]
+
+class KnownValues(unittest.TestCase):
+
+    def test_radial (self):
+        for chg in (1, 8, 26):
+            r_ref, dr_ref = ta_loop (99, chg)
+            r, dr = openmolcas_grids.om_treutler_ahlrichs (99, chg)
+            with self.subTest (chg=chg):
+                self.assertAlmostEqual (np.amax (np.abs (r-r_ref)), 0, 12)
+                self.assertAlmostEqual (np.amax (np.abs (dr-dr_ref)), 0, 12)
+
+    def test_prune (self):
+        mc = mcpdft.CASSCF (h2o, 'tPBE', 4, 4,
+            grids_attr=openmolcas_grids.quasi_ultrafine).run ()
+        mc1 = mcpdft.CASSCF (h2o, 'tPBE', 4, 4,
+            grids_attr=openmolcas_grids.quasi_ultrafine_pruned)
+        e1 = mc1.compute_pdft_energy_(mo_coeff=mc.mo_coeff, ci=mc.ci)[0]
+        # 22% fewer points for an energy change of a few 1e-12
+        self.assertLess (mc1.otfnal.grids.weights.size,
+                         0.8*mc.otfnal.grids.weights.size)
+        self.assertAlmostEqual (e1, mc.e_tot, 10)
+
+    def test_template_cache (self):
+        gen_grid.clear_templates ()
+        mc = mcpdft.CASSCF (h2o, 'tPBE', 4, 4,
+            grids_attr=openmolcas_grids.quasi_ultrafine)
+        grids = mc.otfnal.grids
+        tab0 = grids.gen_atomic_grids (h2o.mol, grids.atom_grid,
+            grids.radi_method, grids.level, grids.prune)
+        mol1 = gto.M (atom = 'O 0 0 0; H 0 0 0.97', spin=1, basis='6-31g',
+            output='/dev/null', verbose=0)
+        tab1 = grids.gen_atomic_grids (mol1, grids.atom_grid,
+            grids.radi_method, grids.level, grids.prune)
+        mol1.stdout.close ()
+        for symb in ('O', 'H'):
+            self.assertIs (tab1[symb][0], tab0[symb][0])
+            self.assertIs (tab1[symb][1], tab0[symb][1])
+        # Least recently used first out
+        mol = h2o.mol.copy ()
+        mol2 = gto.M (atom = 'N 0 0 0; N 0 0 1.1', basis='6-31g', verbose=0)
+        for m in (mol, mol2):
+            m.stdout, m.verbose = io.StringIO (), lib.logger.DEBUG
+        with lib.temporary_env (gen_grid, MAX_TEMPLATES=2):
+            grids.gen_atomic_grids (mol2, grids.atom_grid, grids.radi_method,
+                grids.level, grids.prune)
+            self.assertEqual (len (gen_grid._templates), 2)
+            self.assertIn ('Evicted atomic grid template of H',
+                           mol2.stdout.getvalue ())
+            tab2 = grids.gen_atomic_grids (mol, grids.atom_grid,
+                grids.radi_method, grids.level, grids.prune)
+            self.assertEqual (len (gen_grid._templates), 2)
+            self.assertIs (tab2['O'][0], tab0['O'][0])
+            self.assertIsNot (tab2['H'][0], tab0['H'][0])
+            out = mol.stdout.getvalue ()
+            self.assertIn ('Rebuilding evicted atomic grid templates of H',
+                           out)
+            self.assertIn ('Evicted atomic grid template of N', out)
+        # The templates of one molecule are kept even if there are more of
+        # them than MAX_TEMPLATES
+        with lib.temporary_env (gen_grid, MAX_TEMPLATES=1):
+            for i in range (2):
+                tab3 = grids.gen_atomic_grids (h2o.mol, grids.atom_grid,
+                    grids.radi_method, grids.level, grids.prune)
+                self.assertEqual (len (gen_grid._templates), 2)
+                self.assertIs (tab3['H'][0], tab2['H'][0])
+
+if __name__ == "__main__":
+    print("Full Tests for OpenMolcas-compatible grids")
+    unittest.main()
@@ -178,6 +178,19 @@ class KnownValues(unittest.TestCase):
                         Pi_test[1:4] += np.einsum ('gi,dgi->dg', dPi[0], mo[1:4]) / 2
                         self.assertAlmostEqual (lib.fp (Pi_test), lib.fp (Pi_ref[:4]), 10)
 
+    def test_grid_ao2mo_float32 (self):
+        mc = mcpdft.CASSCF (lih, 'tLDA,VWN3', 2, 2,
+            grids_attr={'atom_grid':(2,14)})
+        ot, ni = mc.otfnal, mc.otfnal._numint
+        nao = mc.mo_coeff.shape[0]
+        for ao, mask, weight, coords in ni.block_loop (ot.mol, ot.grids, nao, 1, 2000):
+            mo_ref = _grid_ao2mo (ot.mol, ao, mc.mo_coeff, non0tab=mask)
+            mo_test = _grid_ao2mo (ot.mol, ao, mc.mo_coeff, non0tab=mask,
+                dtype=np.float32)
+            self.assertEqual (mo_test.dtype, np.float32)
+            self.assertEqual (mo_test.shape, mo_ref.shape)
+            self.assertTrue (np.all (mo_test == mo_ref.astype (np.float32)))
+
     def test_otpd_orbital_deriv (self):
         for mol, mf in zip (('H2', 'LiH'), (h2, lih)):
             for state, nel in zip (('Singlet', 'Triplet'), (2, (2,0))):
@@ -0,0 +1,124 @@
+import numpy as np
+import tempfile
+from pyscf import gto, scf, lib
+from mrh.my_pyscf import mcpdft
+from mrh.my_pyscf.mcpdft import pdft_veff, _dms
+from mrh.my_pyscf.mcpdft import chkfile as pdft_chk
+import unittest
+
+lih = scf.RHF (gto.M (atom = 'Li 0 0 0; H 1.5 0 0', basis = 'sto-3g',
+    output='/dev/null', verbose=0)).run ()
+
+def tearDownModule():
+    global lih
+    lih.mol.stdout.close ()
+    del lih
+
+def no_veff (*args, **kwargs):
+    raise AssertionError ('effective potential recomputed')
+
+class KnownValues(unittest.TestCase):
+
+    def test_mcpdft_restart (self):
+        with tempfile.NamedTemporaryFile () as chk:
+            mc = mcpdft.CASSCF (lih, 'tPBE', 2, 2).run ()
+            mc.dump_pdft_chk (chk.name)
+            dip_ref = mc.dip_moment ()
+            de_ref = mc.nuc_grad_method ().kernel ()
+            e_decomp_ref = mc.get_energy_decomposition (split_x_c=False)
+            mc1 = mcpdft.CASSCF (lih, 'tPBE', 2, 2).load_pdft_chk (chk.name)
+            self.assertEqual (mc1.e_tot, mc.e_tot)
+            self.assertEqual (mc1.e_ot, mc.e_ot)
+            with lib.temporary_env (pdft_veff, kernel=no_veff):
+                dip = mc1.dip_moment ()
+                de = mc1.nuc_grad_method ().kernel ()
+                e_decomp = mc1.get_energy_decomposition (split_x_c=False)
+            self.assertAlmostEqual (lib.fp (dip), lib.fp (dip_ref), 12)
+            self.assertAlmostEqual (lib.fp (de), lib.fp (de_ref), 12)
+            for e, e_ref in zip (e_decomp, e_decomp_ref):
+                self.assertAlmostEqual (e, e_ref, 12)
+
+    def test_mspdft_restart (self):
+        with tempfile.NamedTemporaryFile () as chk:
+            mc = mcpdft.CASSCF (lih, 'tPBE', 2, 2).multi_state (
+                [.5,.5]).run ()
+            mc.dump_pdft_chk (chk.name)
+            de_ref = mc.nuc_grad_method ().kernel (state=1)
+            mc1 = mcpdft.CASSCF (lih, 'tPBE', 2, 2).multi_state (
+                [.5,.5]).load_pdft_chk (chk.name)
+            self.assertAlmostEqual (lib.fp (mc1.e_states),
+                                    lib.fp (mc.e_states), 12)
+            self.assertAlmostEqual (lib.fp (mc1.si), lib.fp (mc.si), 12)
+            self.assertAlmostEqual (lib.fp (mc1.get_heff_offdiag ()),
+                                    lib.fp (mc.get_heff_offdiag ()), 12)
+            with lib.temporary_env (pdft_veff, kernel=no_veff):
+                de = mc1.nuc_grad_method ().kernel (state=1)
+            self.assertAlmostEqual (lib.fp (de), lib.fp (de_ref), 12)
+
+    def test_stale_chkfile (self):
+        with tempfile.NamedTemporaryFile () as chk:
+            mc = mcpdft.CASSCF (lih, 'tPBE', 2, 2).run ()
+            mc.dump_pdft_chk (chk.name)
+            v1_ref = mc.get_pdft_veff (incl_coul=True, paaa_only=True)[0]
+            mo = mc.mo_coeff.copy ()
+            mo[:,[0,1]] = mo[:,[1,0]]
+            # Different orbitals: neither read nor written
+            v1 = mc.get_pdft_veff (mo=mo, incl_coul=True, paaa_only=True)[0]
+            self.assertGreater (np.amax (np.abs (v1-v1_ref)), 1e-4)
+            v1 = mc.get_pdft_veff (incl_coul=True, paaa_only=True)[0]
+            self.assertAlmostEqual (lib.fp (v1), lib.fp (v1_ref), 12)
+
+    def test_stale_grids (self):
+        with tempfile.NamedTemporaryFile () as chk:
+            mc = mcpdft.CASSCF (lih, 'tPBE', 2, 2).run ()
+            mc.dump_pdft_chk (chk.name)
+            states = [0]
+            self.assertTrue (pdft_chk.is_current (mc, chk.name, mc.mo_coeff,
+                                                  mc.ci, states))
+            for label, grids_attr in (('level', {'level': 1}),
+                                      ('prune', {'prune': None})):
+                mc1 = mcpdft.CASSCF (lih, 'tPBE', 2, 2,
+                    grids_attr=grids_attr).load_pdft_chk (chk.name)
+                with self.subTest (label):
+                    self.assertFalse (pdft_chk.is_current (mc1, chk.name,
+                        mc1.mo_coeff, mc1.ci, states))
+
+    def test_veff_memmap (self):
+        # A veff2 in memory maps is written in blocks, and read back in
+        # blocks into a memory map or into memory depending on max_memory
+        with tempfile.NamedTemporaryFile () as chk:
+            mc = mcpdft.CASSCF (lih, 'tPBE', 2, 2).run ()
+            mc.dump_pdft_chk (chk.name)
+            dm1s = np.asarray (mc.make_rdm1s ())
+            cascm2 = _dms.dm2_cumulant (mc.make_one_casdm2 (mc.ci),
+                                        mc.make_one_casdm1s (mc.ci))
+            veff1, veff2 = pdft_veff.kernel (mc.otfnal, dm1s, cascm2,
+                mc.mo_coeff, mc.ncore, mc.ncas, max_memory=1e-4,
+                paaa_only=True, veff2_method='memmap')
+            self.assertGreater (len (list (veff2._blocks ())), 1)
+            pdft_chk.dump_veff (mc, chk.name, 0, veff1, veff2)
+            for max_memory, method in ((mc.max_memory, 'incore'),
+                                       (1e-4, 'memmap')):
+                with lib.temporary_env (mc, max_memory=max_memory):
+                    veff1_test, veff2_test = pdft_chk.load_veff (mc,
+                        chk.name, 0, mc.mo_coeff)
+                with self.subTest (method):
+                    self.assertEqual (veff2_test.method, method)
+                    self.assertEqual (isinstance (veff2_test.ppaa, np.memmap),
+                                      method == 'memmap')
+                    self.assertAlmostEqual (lib.fp (veff1_test),
+                                            lib.fp (veff1), 12)
+                for k in ('ppaa', 'papa', 'vhf_c', 'j_pc', 'k_pc'):
+                    with self.subTest (method, k=k):
+                        self.assertAlmostEqual (
+                            lib.fp (getattr (veff2_test, k)),
+                            lib.fp (getattr (veff2, k)), 12)
+                with self.subTest (method, k='get_vhf_a'):
+                    casdm1 = sum (mc.make_one_casdm1s (mc.ci))
+                    self.assertAlmostEqual (
+                        lib.fp (veff2_test.get_vhf_a (casdm1)),
+                        lib.fp (veff2.get_vhf_a (casdm1)), 12)
+
+if __name__ == "__main__":
+    print("Full Tests for MC-PDFT checkpoint files")
+    unittest.main()
@@ -69,6 +69,39 @@ class KnownValues(unittest.TestCase):
                     with self.subTest (mol=mol, state=state, fnal=fnal):
                         case (self, mc, mol, state, fnal)
 
+    def test_block_cache (self):
+        mc = mcpdft.CASSCF (lih, 'tPBE', 2, 2, grids_level=1).run ()
+        hop_ref = EotOrbitalHessianOperator (mc, incl_d2rho=True)
+        x = 2*np.random.rand (*hop_ref.g_orb.shape) - 1
+        x[hop_ref.g_orb==0] = 0
+        x *= 1e-3 / linalg.norm (x)
+        dg_ref, de_ref = hop_ref (x)
+        for max_cache_memory in (None, 0):
+            hop = EotOrbitalHessianOperator (mc, incl_d2rho=True, cache=True,
+                max_cache_memory=max_cache_memory)
+            for i in range (2):
+                with self.subTest (max_cache_memory=max_cache_memory, sweep=i):
+                    dg_test, de_test = hop (x)
+                    self.assertAlmostEqual (de_test, de_ref, 12)
+                    self.assertAlmostEqual (lib.fp (dg_test), lib.fp (dg_ref),
+                        12)
+
+    def test_multi_vector (self):
+        for fnal in ('tLDA,VWN3', 'ftPBE'):
+            mc = mcpdft.CASSCF (lih, fnal, 2, 2, grids_level=1).run ()
+            hop = EotOrbitalHessianOperator (mc, incl_d2rho=True)
+            x = 2*np.random.rand (3, *hop.g_orb.shape) - 1
+            x[:,hop.g_orb==0] = 0
+            x *= 1e-3 / linalg.norm (x, axis=1)[:,None]
+            dg_test, de_test = hop (x)
+            self.assertEqual (dg_test.shape, x.shape)
+            for i, xi in enumerate (x):
+                with self.subTest (fnal=fnal, vec=i):
+                    dg_ref, de_ref = hop (xi)
+                    self.assertAlmostEqual (de_test[i], de_ref, 12)
+                    self.assertAlmostEqual (lib.fp (dg_test[i]),
+                        lib.fp (dg_ref), 12)
+
 
 if __name__ == "__main__":
     print("Full Tests for MC-PDFT second fnal derivatives")
@@ -112,7 +112,45 @@ class KnownValues(unittest.TestCase):
                                            term=term):
                             self.assertAlmostEqual (lib.fp (test),
                                                     lib.fp (ref), delta=1e-4)
-                        
+
+    def test_veff2_memmap (self):
+        mc = mcpdft.CASSCF (lih, 'tPBE', 2, 2, grids_level=1).run ()
+        ncore, ncas = mc.ncore, mc.ncas
+        nocc, nmo = ncore + ncas, mc.mo_coeff.shape[1]
+        casdm1 = mc.fcisolver.make_rdm1 (mc.ci, ncas, mc.nelecas)
+        dm1s = np.asarray (mc.make_rdm1s ())
+        casdm1s = np.asarray (mc.fcisolver.make_rdm1s (mc.ci, ncas, mc.nelecas))
+        casdm2 = mc.fcisolver.make_rdm2 (mc.ci, ncas, mc.nelecas)
+        cascm2 = casdm2 - np.multiply.outer (casdm1, casdm1)
+        cascm2 += np.einsum ('sij,skl->ilkj', casdm1s, casdm1s)
+        v2 = {}
+        for method in ('incore', 'memmap'):
+            v2[method] = pdft_veff.kernel (mc.otfnal, dm1s, cascm2,
+                mc.mo_coeff, ncore, ncas, veff2_method=method)[1]
+        # One MO of the first index of papa at a time
+        v2['memmap_blocked'] = pdft_veff.kernel (mc.otfnal, dm1s, cascm2,
+            mc.mo_coeff, ncore, ncas, veff2_method='memmap',
+            max_memory=1e-4)[1]
+        self.assertIsInstance (v2['memmap'].ppaa, np.memmap)
+        paaa_ref = np.stack ([v2['incore'].ppaa[i][ncore:nocc]
+                              for i in range (nmo)], axis=0)
+        vhf_a_ref = 0.5 * np.stack ([np.tensordot (v2['incore'].ppaa[i],
+            casdm1, axes=2) for i in range (nmo)], axis=0)
+        for method, v in v2.items ():
+            with self.subTest (method=method):
+                self.assertAlmostEqual (lib.fp (v.papa),
+                    lib.fp (v2['incore'].papa), 12)
+                self.assertAlmostEqual (lib.fp (v.ppaa),
+                    lib.fp (v2['incore'].ppaa), 12)
+                self.assertAlmostEqual (lib.fp (v.get_paaa ()),
+                    lib.fp (paaa_ref), 12)
+                self.assertAlmostEqual (lib.fp (v.get_vhf_a (casdm1)),
+                    lib.fp (vhf_a_ref), 12)
+        with lib.temporary_env (v2['memmap'], max_memory=1e-4):
+            self.assertEqual (len (list (v2['memmap']._blocks ())), nmo)
+            self.assertAlmostEqual (lib.fp (v2['memmap'].get_vhf_a (casdm1)),
+                lib.fp (vhf_a_ref), 12)
+
 
 if __name__ == "__main__":
     print("Full Tests for MC-PDFT first fnal derivatives")
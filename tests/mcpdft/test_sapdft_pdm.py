@@ -64,7 +64,24 @@ class KnownValues(unittest.TestCase):
                 dm_test = mc.dip_moment(unit='Debye', origin="Coord_center",state=i)
                 for dmt,dmr in zip(dm_test,dm_ref[i]):
                     self.assertAlmostEqual(dmt, dmr, None, message, delta)
-        
+
+    def test_kernel_batch (self):
+        from mrh.my_pyscf.prop.dip_moment.mcpdft import ElectricDipole
+        mol = gto.M (atom = geom_h2o, basis = '6-31g', symmetry='c2v',
+                     output='/dev/null', verbose=0)
+        mc = get_h2o (mol, 3)
+        dm_test = ElectricDipole (mc).kernel_batch ([0,1,2])
+        for i in range (3):
+            dm_ref = ElectricDipole (mc).kernel (state=i)
+            with self.subTest (state=i):
+                self.assertAlmostEqual (np.amax (np.abs (dm_test[i]-dm_ref)),
+                                        0, 5)
+        # Without a previous solution, the warm start costs nothing
+        def Aop (x): raise AssertionError ('Aop called by _warm_start')
+        x0 = np.ones (3)
+        self.assertIs (ElectricDipole (mc)._warm_start (x0, x0, Aop), x0)
+        mol.stdout.close ()
+
 if __name__ == "__main__":
     print("Test for SA-PDFT permanent dipole moments")
     unittest.main()
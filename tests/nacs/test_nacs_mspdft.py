@@ -0,0 +1,52 @@
+import numpy as np
+from pyscf import gto, scf, lib
+from mrh.my_pyscf import mcpdft
+from mrh.my_pyscf.grad.mspdft_nacs import NonAdiabaticCouplings
+import unittest
+
+def setUpModule():
+    global mol, mc
+    mol = gto.M (atom = 'Li 0 0 0; H 0 0 1.5', basis = 'sto-3g',
+                 output = '/dev/null', verbose = 0)
+    mf = scf.RHF (mol).run ()
+    mc = mcpdft.CASSCF (mf, 'ftLDA,VWN3', 2, 2, grids_level=1)
+    mc.fix_spin_(ss=0, shift=1)
+    mc = mc.multi_state ([1.0/3,]*3, 'cms').run (conv_tol=1e-10)
+
+def tearDownModule():
+    global mol, mc
+    mol.stdout.close ()
+    del mol, mc
+
+class KnownValues(unittest.TestCase):
+
+    def test_kernel_batch (self):
+        pairs = [(0,1), (0,2), (1,2), (1,0)]
+        mc_nacs = NonAdiabaticCouplings (mc)
+        for use_etfs in (False, True):
+            for mult_ediff in (False, True):
+                nac_batch = mc_nacs.kernel_batch (pairs, use_etfs=use_etfs,
+                                                  mult_ediff=mult_ediff)
+                for pair, nac_test in zip (pairs, nac_batch):
+                    nac_ref = mc_nacs.kernel (state=pair, use_etfs=use_etfs,
+                                              mult_ediff=mult_ediff)
+                    with self.subTest (state=pair, use_etfs=use_etfs,
+                                       mult_ediff=mult_ediff):
+                        self.assertLess (np.amax (np.abs (nac_test-nac_ref)),
+                                         1e-6)
+
+    def test_Aop_block (self):
+        mc_grad = mc.nuc_grad_method ()
+        Aop, Aop_block, Adiag = mc_grad._get_Aop_Adiag ()
+        x = 2*np.random.rand (mc_grad.nlag, 3) - 1
+        x[mc_grad.ngorb+mc_grad.nci:,0] = 0 # no IS component
+        for sweep in range (2): # the diabatizer response is computed once
+            Ax_test = Aop_block (x)
+            for i, xi in enumerate (x.T):
+                with self.subTest (sweep=sweep, col=i):
+                    self.assertAlmostEqual (lib.fp (Ax_test[:,i]),
+                                            lib.fp (Aop (xi)), 9)
+
+if __name__ == "__main__":
+    print("Full Tests for batched MS-PDFT NACs")
+    unittest.main()
@@ -0,0 +1,93 @@
+import numpy as np
+from itertools import product
+from mrh.my_pyscf.tools.cg import cg_coeff, cg_prod, cg_prod_vec
+import unittest
+try:
+    from sympy import Rational
+    from sympy.physics.quantum.cg import CG
+except ImportError:
+    CG = None
+
+def cg_ref (j2a, m2a, j2b, m2b, j2c, m2c):
+    h = lambda x: Rational (x, 2)
+    return float (CG (h (j2a), h (m2a), h (j2b), h (m2b), h (j2c),
+                      h (m2c)).doit ())
+
+def gen_jpol (jmag):
+    # All allowed couplings jpol of jmag from left to right (twice j)
+    if len (jmag) == 1:
+        yield [jmag[0],]
+        return
+    for jpol in gen_jpol (jmag[:-1]):
+        j2a, j2b = sum (jpol), jmag[-1]
+        for j2c in range (abs (j2a-j2b), j2a+j2b+1, 2):
+            yield jpol + [j2c-j2a,]
+
+def cg_prod_ref (jmag, jpol, mpol):
+    # Direct product of the Clebsch-Gordan coefficients of each coupling
+    coeff = 1.0
+    j2a, m2a = jpol[0], mpol[0]
+    for j2b, dj, m2b in zip (jmag[1:], jpol[1:], mpol[1:]):
+        coeff *= cg_coeff (j2a, m2a, j2b, m2b, j2a+dj, m2a+m2b)
+        j2a, m2a = j2a+dj, m2a+m2b
+    return coeff
+
+@unittest.skipIf (CG is None, 'sympy not available')
+class KnownValues(unittest.TestCase):
+
+    def test_cg_coeff (self):
+        # All couplings up to j = 5/2 (j2 = 5), with every m
+        for j2a, j2b in product (range (6), repeat=2):
+            for j2c in range (abs (j2a-j2b), j2a+j2b+1, 2):
+                for m2a, m2b in product (range (-j2a, j2a+1, 2),
+                                         range (-j2b, j2b+1, 2)):
+                    m2c = m2a + m2b
+                    if abs (m2c) > j2c: continue
+                    with self.subTest (j2=(j2a,j2b,j2c), m2=(m2a,m2b,m2c)):
+                        self.assertAlmostEqual (cg_coeff (j2a, m2a, j2b, m2b,
+                            j2c, m2c), cg_ref (j2a, m2a, j2b, m2b, j2c, m2c),
+                            12)
+
+    def test_cg_coeff_large_j (self):
+        # Exact arithmetic: no cancellation error at large j
+        for args in ((20, 2, 18, -4, 16, -2), (31, 5, 29, -3, 30, 2),
+                     (40, 0, 40, 0, 40, 0), (40, 0, 40, 0, 38, 0)):
+            with self.subTest (args=args):
+                self.assertAlmostEqual (cg_coeff (*args), cg_ref (*args), 12)
+
+    def test_selection_rules (self):
+        for args in ((1, 1, 1, 1, 2, 0), # m
+                     (1, 1, 1, 1, 1, 2), # parity of j
+                     (2, 0, 2, 0, 6, 0), # triangle
+                     (2, 1, 2, 1, 2, 2), # parity of m
+                     (2, 4, 2, -2, 2, 2)): # |m| > j
+            with self.subTest (args=args):
+                self.assertEqual (cg_coeff (*args), 0.0)
+
+    def test_cg_prod (self):
+        for jmag in ([1,1,1], [2,2,2], [1,2,3], [4,4], [2,1,2,1]):
+            for jpol in gen_jpol (jmag):
+                jtot = sum (jpol)
+                for mtot in range (-jtot, jtot+1, 2):
+                    mpol_list, coeffs = cg_prod_vec (jmag, jpol, mtot)
+                    test = {tuple (m): c for m, c in zip (mpol_list, coeffs)}
+                    with self.subTest (jmag=jmag, jpol=jpol, mtot=mtot):
+                        self.assertEqual (len (test), len (mpol_list))
+                        self.assertTrue (all (sum (m) == mtot for m in test))
+                        # lexical order of mpol
+                        self.assertEqual (list (test.keys ()),
+                                          sorted (test.keys ()))
+                        self.assertAlmostEqual (np.dot (coeffs, coeffs), 1.0,
+                                                12)
+                    for mpol in product (*[range (-j, j+1, 2) for j in jmag]):
+                        if sum (mpol) != mtot: continue
+                        ref = cg_prod_ref (jmag, jpol, mpol)
+                        with self.subTest (jmag=jmag, jpol=jpol, mpol=mpol):
+                            self.assertAlmostEqual (test.get (mpol, 0.0), ref,
+                                                    12)
+                            self.assertAlmostEqual (cg_prod (jmag, jpol,
+                                                    mpol), ref, 12)
+
+if __name__ == "__main__":
+    print("Full Tests for Clebsch-Gordan coefficients")
+    unittest.main()
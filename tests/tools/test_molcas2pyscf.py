@@ -0,0 +1,128 @@
+import os, tempfile
+import numpy as np
+import h5py
+from scipy import linalg
+from pyscf import gto, lib
+from mrh.my_pyscf.tools import molcas2pyscf
+import unittest
+
+xyz = '''O  0.000000  0.000000  0.000000
+         H  0.000000  0.757000  0.587000
+         H  0.000000 -0.757000  0.587000'''
+
+def get_basids (mol):
+    # (center, n, l, m) of each PySCF AO in the OpenMolcas conventions
+    basids = []
+    nshl = {}
+    for ib in range (mol.nbas):
+        ia, l = mol.bas_atom (ib), mol.bas_angular (ib)
+        for k in range (mol.bas_nctr (ib)):
+            n = nshl[(ia,l)] = nshl.get ((ia,l), 0) + 1
+            if l == 1: ms = (1, -1, 0) # (x,y,z) is (y,z,x) in Molcas
+            else: ms = range (-l, l+1)
+            basids.extend ([[ia+1, n, l, m] for m in ms])
+    return np.asarray (basids)
+
+def search_ao_permutation (mol, basids):
+    # The permutation as it was found before get_ao_permutation
+    idx_ao = []
+    for (c, n, l, m) in basids:
+        c -= 1
+        n += l
+        if l == 1:
+            m = m - 2 if m > 0 else m + 1
+        idx_ao.append (mol.search_ao_nr (c, l, m, n))
+    return np.argsort (np.asarray (idx_ao))
+
+def write_h5 (fname, mol, seed):
+    '''Synthetic OpenMolcas h5 file for mol, with the AOs in a random order
+    and random orbitals; returns the PySCF-ordered MOs, sorted as
+    get_mo_from_h5 sorts them'''
+    rng = np.random.default_rng (seed)
+    nao = mol.nao_nr ()
+    basids = get_basids (mol)
+    perm = rng.permutation (nao) # Molcas AO i is PySCF AO perm[i]
+    mo_energy = rng.random (nao) - 0.5
+    mo_occ = 2.0 * (mo_energy < 0)
+    with h5py.File (fname, 'w') as f:
+        if mol.symmetry:
+            # SOs of the irreps in reverse order; orbitals rotate within them
+            symm_orb = mol.symm_orb[::-1]
+            usymm = np.concatenate (symm_orb, axis=1)
+            coeff = [linalg.qr (rng.random ((c.shape[1],)*2))[0]
+                     for c in symm_orb]
+            mo_coeff = usymm @ linalg.block_diag (*coeff)
+            desym = np.zeros ((nao,nao))
+            desym[:,np.argsort (perm)] = usymm.T
+            f['DESYM_BASIS_FUNCTION_IDS'] = basids[perm]
+            f['DESYM_MATRIX'] = desym.ravel ()
+            f['MO_VECTORS'] = np.concatenate ([c.T.ravel () for c in coeff])
+        else:
+            mo_coeff = linalg.qr (rng.random ((nao,nao)))[0]
+            f['BASIS_FUNCTION_IDS'] = basids[perm]
+            f['MO_VECTORS'] = mo_coeff[perm].T.ravel ()
+        f['MO_ENERGIES'] = mo_energy
+        f['MO_OCCUPATIONS'] = mo_occ
+    return mo_coeff[:,np.argsort (mo_energy)]
+
+def setUpModule():
+    global mol_nosym, mol_sym, tmpdir
+    mol_nosym = gto.M (atom = xyz, basis = 'cc-pvdz', output='/dev/null',
+        verbose=0)
+    mol_sym = gto.M (atom = xyz, basis = 'cc-pvdz', symmetry=True,
+        output='/dev/null', verbose=0)
+    tmpdir = tempfile.TemporaryDirectory ()
+
+def tearDownModule():
+    global mol_nosym, mol_sym, tmpdir
+    mol_nosym.stdout.close ()
+    mol_sym.stdout.close ()
+    tmpdir.cleanup ()
+    del mol_nosym, mol_sym, tmpdir
+
+class KnownValues(unittest.TestCase):
+
+    def test_ao_permutation (self):
+        basids = get_basids (mol_nosym)
+        perm = np.random.default_rng (0).permutation (len (basids))
+        for label, b in (('pyscf order', basids), ('shuffled', basids[perm])):
+            idx_ref = search_ao_permutation (mol_nosym, b)
+            idx_test = molcas2pyscf.get_ao_permutation (mol_nosym, b)
+            with self.subTest (label):
+                self.assertTrue (np.all (idx_test == idx_ref))
+        b = basids.copy ()
+        b[-1,1] += 1
+        with self.assertRaises (RuntimeError):
+            molcas2pyscf.get_ao_permutation (mol_nosym, b)
+
+    def test_get_mo_from_h5 (self):
+        for mol in (mol_nosym, mol_sym):
+            fname = os.path.join (tmpdir.name, 'mo{}.h5'.format (
+                int (mol.symmetry)))
+            mo_ref = write_h5 (fname, mol, 1)
+            for mo_slice in (None, slice (3,8), [0,4,2]):
+                mo_test = molcas2pyscf.get_mo_from_h5 (mol, fname,
+                    mo_slice=mo_slice)
+                ref = mo_ref if mo_slice is None else mo_ref[:,mo_slice]
+                with self.subTest (symmetry=mol.symmetry,
+                                   mo_slice=str (mo_slice)):
+                    self.assertEqual (mo_test.shape, ref.shape)
+                    self.assertAlmostEqual (lib.fp (mo_test), lib.fp (ref), 12)
+
+    def test_get_mo_from_h5_batch (self):
+        # The third file shuffles the AOs differently from the first two
+        for mol in (mol_nosym, mol_sym):
+            fnames, mo_ref = [], []
+            for seed in (2, 2, 3):
+                fnames.append (os.path.join (tmpdir.name,
+                    'batch{}{}.h5'.format (int (mol.symmetry), len (fnames))))
+                mo_ref.append (write_h5 (fnames[-1], mol, seed)[:,1:6])
+            mo_test = molcas2pyscf.get_mo_from_h5_batch (mol, fnames,
+                mo_slice=slice (1,6))
+            for i, (test, ref) in enumerate (zip (mo_test, mo_ref)):
+                with self.subTest (symmetry=mol.symmetry, file=i):
+                    self.assertAlmostEqual (lib.fp (test), lib.fp (ref), 12)
+
+if __name__ == "__main__":
+    print("Full Tests for OpenMolcas h5 MO import")
+    unittest.main()
@@ -0,0 +1,134 @@
+import os, tempfile
+import numpy as np
+from mrh.util import molcas_io
+import unittest
+
+# A small synthetic OpenMolcas logfile: two RASSCF-MCPDFT-ALASKA cycles,
+# separated by a module that isn't parsed
+def module (name, lines, stop=True):
+    out = ['()()()', '', '              &' + name, ''] + lines
+    if stop: out.append ('--- Stop Module: {} at Mon Jan  1 00:00:00 2024 '
+                         '/rc=_RC_ALL_IS_WELL_ ---'.format (name.lower ()))
+    return out
+
+def rasscf (e_states):
+    return module ('RASSCF', ['  Blah blah', '',
+        '      Final state energy(ies):', '      ------------------------', '']
+        + ['::    RASSCF root number  {} Total energy:    {:.8f}'.format (
+            i+1, e) for i, e in enumerate (e_states)] + ['', '  More text'])
+
+def mcpdft (e_states):
+    return module ('MCPDFT', ['      Total MC-PDFT energy for state  {}    '
+        '   {:.8f}'.format (i+1, e) for i, e in enumerate (e_states)])
+
+def alaska (grad):
+    lines = [' *              Molecular gradients               *']
+    lines += [' *' + 48*' ' + '*',] * 7
+    lines += [' {:<8s} {:16.8f} {:16.8f} {:16.8f}'.format (
+        'X{}'.format (i+1), *g) for i, g in enumerate (grad)]
+    lines += [' ' + 60*'-', '']
+    return module ('ALASKA', lines)
+
+e_rasscf = [[-100.1, -99.9], [-100.2, -99.8]]
+e_mcpdft = [-101.1, -100.9, -101.2, -100.8]
+angrad = [np.arange (9).reshape (3,3) * 0.01 - 0.04,
+          np.arange (9).reshape (3,3)[::-1] * 0.02 - 0.05]
+
+def get_log ():
+    lines = ['Header of the log', ''] + module ('GATEWAY', ['  stuff'])
+    for i in range (2):
+        lines += rasscf (e_rasscf[i])
+        lines += mcpdft (e_mcpdft[2*i:2*i+2])
+        lines += alaska (angrad[i])
+        lines += module ('SLAPAF', ['  Molecular gradients'], stop=False)
+    return '\n'.join (lines) + '\n'
+
+def setUpModule():
+    global tmpdir, fname, fname_empty
+    tmpdir = tempfile.TemporaryDirectory ()
+    fname = os.path.join (tmpdir.name, 'test.log')
+    fname_empty = os.path.join (tmpdir.name, 'empty.log')
+    with open (fname, 'w') as f: f.write (get_log ())
+    with open (fname_empty, 'w') as f: pass
+
+def tearDownModule():
+    global tmpdir, fname, fname_empty
+    tmpdir.cleanup ()
+    del tmpdir, fname, fname_empty
+
+class KnownValues(unittest.TestCase):
+
+    def test_index (self):
+        with open (fname, 'rb') as f: buf = f.read ()
+        index = molcas_io.index_molcas_logfile (buf)
+        modnames = [m for m, start, stop in index]
+        self.assertEqual (modnames, ['&GATEWAY'] + 2*['&RASSCF', '&MCPDFT',
+            '&ALASKA', '&SLAPAF'])
+        for m, start, stop in index:
+            with self.subTest (module=m, start=start):
+                self.assertLess (start, stop)
+                if m == '&RASSCF':
+                    self.assertTrue (buf[stop:].startswith (
+                        b'--- Stop Module: rasscf'))
+
+    def test_read_molcas_logfile (self):
+        data = molcas_io.read_molcas_logfile (fname)
+        self.assertEqual (sorted (data.keys ()),
+                          ['angrad', 'e_mcpdft', 'e_rasscf'])
+        self.assertEqual (data['e_rasscf'], e_rasscf)
+        self.assertEqual (data['e_mcpdft'], e_mcpdft)
+        self.assertEqual (len (data['angrad']), 2)
+        for test, ref in zip (data['angrad'], angrad):
+            self.assertTrue (np.allclose (test, ref, atol=1e-8))
+        self.assertEqual (molcas_io.read_molcas_logfile (fname_empty), {})
+
+    def test_read_module (self):
+        # The line-by-line interface, driven as the old read_molcas_logfile
+        ref = molcas_io.read_molcas_logfile (fname)
+        for mode in ('r', 'rb'):
+            data = {}
+            marker = '()()()' if mode == 'r' else b'()()()'
+            with open (fname, mode) as f:
+                for line in f:
+                    if line.startswith (marker):
+                        line = f.readline ()
+                        modname = f.readline ().strip ()
+                        if mode == 'rb': modname = modname.decode ()
+                        if modname in molcas_io.read_module:
+                            molcas_io.read_module[modname] (f, data)
+            with self.subTest (mode=mode):
+                self.assertEqual (sorted (data.keys ()), sorted (ref.keys ()))
+                self.assertEqual (data['e_rasscf'], ref['e_rasscf'])
+                self.assertEqual (data['e_mcpdft'], ref['e_mcpdft'])
+                for test, r in zip (data['angrad'], ref['angrad']):
+                    self.assertTrue (np.all (test == r))
+        found = []
+        with open (fname, 'r') as f:
+            with self.assertWarns (DeprecationWarning):
+                molcas_io._read_module_(f, '--- Stop Module: gateway',
+                    [lambda g, line: found.append (line)], ['  stuff'])
+        self.assertEqual (found, ['  stuff\n'])
+
+    def test_summarize (self):
+        fnames = [fname, fname_empty, fname]
+        outfile = os.path.join (tmpdir.name, 'summary.npz')
+        for nproc in (1, 2):
+            summary = molcas_io.summarize_molcas_logfiles (fnames,
+                outfile=outfile, nproc=nproc)
+            saved = np.load (outfile)
+            with self.subTest (nproc=nproc):
+                self.assertEqual (list (summary['fnames']), fnames)
+                self.assertTrue (np.allclose (summary['e_rasscf'],
+                    2*sum (e_rasscf, [])))
+                self.assertEqual (list (summary['e_rasscf_size']), [2,]*4)
+                self.assertEqual (list (summary['e_rasscf_file']),
+                    [0,0,2,2])
+                self.assertEqual (list (summary['angrad_size']), [9,]*4)
+                self.assertTrue (np.allclose (summary['angrad'],
+                    np.concatenate ([g.ravel () for g in 2*angrad])))
+                for key in summary:
+                    self.assertTrue (np.all (saved[key] == summary[key]))
+
+if __name__ == "__main__":
+    print("Full Tests for OpenMolcas logfile parsing")
+    unittest.main()
@@ -0,0 +1,75 @@
+import numpy as np
+from pyscf import gto, scf, lib
+from pyscf.hessian import thermo
+from pyscf.lib import param
+from mrh.my_pyscf import mcpdft
+from mrh.my_pyscf.vibration import numeric
+import unittest
+
+def setUpModule():
+    global mol, mf, hess_ref, freq_ref
+    mol = gto.M (atom = 'O 0 0 0; H 0 0.757 0.587; H 0 -0.757 0.587',
+                 basis = '6-31g', output = '/dev/null', verbose = 0)
+    mf = scf.RHF (mol).set (conv_tol=1e-12).run ()
+    hess_ref = mf.Hessian ().kernel ()
+    freq_ref = thermo.harmonic_analysis (mol, hess_ref)['freq_wavenumber']
+
+def tearDownModule():
+    global mol, mf, hess_ref, freq_ref
+    mol.stdout.close ()
+    del mol, mf, hess_ref, freq_ref
+
+class KnownValues(unittest.TestCase):
+
+    def test_hessian (self):
+        for nproc in (1, 2):
+            hess = numeric.Hessian (mf.nuc_grad_method (), nproc=nproc)
+            de = hess.kernel ()
+            with self.subTest ('hessian', nproc=nproc):
+                self.assertLess (np.amax (np.abs (de - hess_ref)), 5e-5)
+            with self.subTest ('frequencies', nproc=nproc):
+                self.assertEqual (len (hess.freq), len (freq_ref))
+                for f, f_ref in zip (hess.freq, freq_ref):
+                    self.assertAlmostEqual (f, f_ref, delta=0.1)
+                self.assertEqual (hess.modes.shape, (3, mol.natm, 3))
+
+    def test_harmonic_analysis (self):
+        freq, modes = numeric.harmonic_analysis (mol, hess_ref)
+        for f, f_ref in zip (freq, freq_ref):
+            self.assertAlmostEqual (f, f_ref, delta=0.01)
+        # Normal modes are normalized Cartesian displacements
+        nrm = np.einsum ('iax,iax->i', modes, modes)
+        self.assertAlmostEqual (lib.fp (nrm), lib.fp (np.ones (3)), 9)
+
+    def test_mspdft_scanner (self):
+        # The bond force constant of each CMS-PDFT state of LiH from the
+        # warm-started gradient scanner against the difference of cold-start
+        # gradients at the displaced geometries
+        def get_grad (r):
+            mol = gto.M (atom = 'Li 0 0 0; H {} 0 0'.format (r),
+                         basis = 'sto3g', output = '/dev/null', verbose = 0)
+            mc = mcpdft.CASSCF (scf.RHF (mol).run (), 'ftLDA,VWN3', 2, 2,
+                                grids_level=1)
+            mc.fix_spin_(ss=0)
+            mc = mc.multi_state ([0.5,0.5], 'cms').run (conv_tol=1e-10)
+            mc_grad = mc.nuc_grad_method ()
+            mc_grad.conv_rtol = 1e-10
+            return mol, mc_grad
+        r, h = 1.5, numeric.STEPSIZE_DEFAULT
+        mc_grad = get_grad (r)[1]
+        mc_grad_p, mc_grad_m = get_grad (r+h)[1], get_grad (r-h)[1]
+        for state in (0, 1):
+            hess = numeric.Hessian (mc_grad, state=state)
+            de = hess.kernel ()
+            k_ref = (mc_grad_p.kernel (state=state)[1,0]
+                     - mc_grad_m.kernel (state=state)[1,0])
+            k_ref *= param.BOHR / (2*h)
+            with self.subTest (state=state):
+                self.assertAlmostEqual (de[1,1,0,0], k_ref, delta=1e-5)
+                self.assertLess (np.amax (np.abs (de[0,0] + de[0,1])), 1e-4)
+                self.assertEqual (len (hess.freq), 1)
+        for g in (mc_grad, mc_grad_p, mc_grad_m): g.mol.stdout.close ()
+
+if __name__ == "__main__":
+    print("Full Tests for semi-numerical Hessians")
+    unittest.main()
@@ -1,59 +1,179 @@
 import numpy as np
+import re, mmap, os, warnings
+from concurrent.futures import ProcessPoolExecutor
+
+# Indexed parser: the file is memory-mapped, the start and stop of every
+# module are located once, and each module's data is extracted from its own
+# byte range. Flags are located with bytes.find (which runs at memchr speed,
+# unlike a Python loop over lines or a multiline regex) and only the lines
+# around them are parsed, with compiled regexes.
+
+_re_lastfield = re.compile (rb'(\S+)\s*$')
+_re_fields = re.compile (rb'\S+')
+
+def _find_lines (buf, flag, start, stop):
+    ''' Offsets of the lines of buf[start:stop] that start with flag '''
+    if start == 0 and buf[:len (flag)] == flag:
+        yield 0
+    flag = b'\n' + flag
+    pos = buf.find (flag, max (start-1, 0), stop)
+    while pos >= 0:
+        yield pos + 1
+        pos = buf.find (flag, pos + 1, stop)
+
+def _next_line (buf, pos, nskip=1):
+    ''' Offset of the nskip-th line after the one containing pos '''
+    for i in range (nskip):
+        pos = buf.find (b'\n', pos)
+        if pos < 0: return len (buf)
+        pos += 1
+    return pos
+
+def _getline (buf, pos):
+    end = buf.find (b'\n', pos)
+    if end < 0: end = len (buf)
+    return buf[pos:end], end + 1
+
+def _scan_rasscf (buf, start, stop, data):
+    e = data.setdefault ('e_rasscf', [])
+    flag_root = b'::    RASSCF root number'
+    for pos in _find_lines (buf, b'      Final state energy(ies):', start, stop):
+        pos = _next_line (buf, pos, 3)
+        e_states = []
+        while buf[pos:pos+len (flag_root)] == flag_root:
+            line, pos = _getline (buf, pos)
+            e_states.append (float (_re_lastfield.search (line).group (1)))
+        e.append (e_states)
+
+def _scan_mcpdft (buf, start, stop, data):
+    e = data.setdefault ('e_mcpdft', [])
+    for pos in _find_lines (buf, b'      Total MC-PDFT energy for state', start,
+                            stop):
+        line = _getline (buf, pos)[0]
+        e.append (float (_re_lastfield.search (line).group (1)))
+
+def _scan_alaska (buf, start, stop, data):
+    g = data.setdefault ('angrad', [])
+    flag = b' *              Molecular gradients               *'
+    for pos in _find_lines (buf, flag, start, stop):
+        pos = _next_line (buf, pos, 8)
+        end = buf.find (b'\n ---', pos - 1)
+        if end < 0: end = len (buf)
+        rows = [_re_fields.findall (line)[1:]
+                for line in buf[pos:end+1].splitlines ()]
+        g.append (np.array (rows, dtype=float))
+
+scan_module = {'&ALASKA': (_scan_alaska, b'alaska'),
+               '&RASSCF': (_scan_rasscf, b'rasscf'),
+               '&MCPDFT': (_scan_mcpdft, b'mcpdft')}
+
+# Line-by-line interface: f is an open logfile positioned just after the name
+# line of a module, and the module is read up to and including its
+# "--- Stop Module" line. Kept for callers that walk the file themselves;
+# read_molcas_logfile does not use it.
 
 def _read_module_(f, stopline, proc_fn, proc_flags):
+    warnings.warn ('_read_module_ is deprecated; use read_molcas_logfile or '
+                   'the scan_module scanners', DeprecationWarning, stacklevel=2)
     line = ''
     while not line.startswith (stopline):
         line = f.readline ()
+        if not line: break
         for _fn, _flag in zip (proc_fn, proc_flags):
             if line.startswith (_flag): _fn (f, line)
 
+def _read_to_stop (f, stopline):
+    ''' Read lines from f up to and including the one starting with stopline
+    (or to the end of the file) and return them as bytes '''
+    lines = []
+    line = f.readline ()
+    while line:
+        if isinstance (line, str): line = line.encode ()
+        lines.append (line)
+        if line.startswith (stopline): break
+        line = f.readline ()
+    return b''.join (lines)
+
+def _read_with_scanner_(f, data, modname):
+    scanner, name = scan_module[modname]
+    buf = _read_to_stop (f, b'--- Stop Module: ' + name)
+    scanner (buf, 0, len (buf), data)
+
 def read_rasscf_(f, data):
-    if 'e_rasscf' not in data.keys ():
-        data['e_rasscf'] = []
-    flag_energy = '      Final state energy(ies):'
-    def read_energy (g, line):
-        e_states = []
-        for i in range (3): line = g.readline ()
-        while line.startswith ('::    RASSCF root number'):
-            e_states.append (float (line.split ()[-1]))
-            line = g.readline ()
-        data['e_rasscf'].append (e_states)
-    _read_module_(f, '--- Stop Module: rasscf', [read_energy,], [flag_energy,])
+    _read_with_scanner_(f, data, '&RASSCF')
 
 def read_mcpdft_(f, data):
-    if 'e_mcpdft' not in data.keys ():
-        data['e_mcpdft'] = []
-    flag_energy = '      Total MC-PDFT energy for state'
-    def read_energy (g, line):
-        data['e_mcpdft'].append (float (line.split ()[-1]))
-    _read_module_(f, '--- Stop Module: mcpdft', [read_energy,], [flag_energy,])
+    _read_with_scanner_(f, data, '&MCPDFT')
 
 def read_alaska_(f, data):
-    if 'angrad' not in data.keys ():
-        data['angrad'] = []
-    flag_grad = ' *              Molecular gradients               *'
-    def read_grad (g, line):
-        grad = []
-        for i in range (8): line = g.readline ()
-        while not line.startswith (' ---'):
-            words = line.split ()
-            grad.append ([float (w) for w in words[1:]])
-            line = f.readline ()
-        data['angrad'].append (np.array (grad))
-    _read_module_(f, '--- Stop Module: alaska', [read_grad,], [flag_grad,])
-
+    _read_with_scanner_(f, data, '&ALASKA')
 
 read_module = {'&ALASKA': read_alaska_,
                '&RASSCF': read_rasscf_,
                '&MCPDFT': read_mcpdft_}
+
+def index_molcas_logfile (buf):
+    ''' List of (module name, start, stop) byte offsets of all modules in
+    the contents buf (bytes or mmap) of an OpenMolcas logfile. stop is the
+    offset of the module's "--- Stop Module" line, or of the next module if
+    there is none. '''
+    index = []
+    starts = list (_find_lines (buf, b'()()()', 0, len (buf)))
+    pos = 0
+    for marker in starts:
+        if marker < pos: continue
+        modname, start = _getline (buf, _next_line (buf, marker, 2))
+        modname = modname.strip ().decode ()
+        stop = -1
+        if modname in scan_module:
+            stopline = b'\n--- Stop Module: ' + scan_module[modname][1]
+            stop = buf.find (stopline, start)
+            if stop >= 0: stop += 1
+        if stop < 0:
+            nxt = [m for m in starts if m > start]
+            stop = nxt[0] if len (nxt) else len (buf)
+        index.append ((modname, start, stop))
+        pos = stop
+    return index
+
 def read_molcas_logfile (fname):
     data = {}
-    with open (fname, 'r') as f:
-        for line in f:
-            if line.startswith ('()()()'):
-                line = f.readline ()
-                modname = f.readline ().strip ()
-                if modname in read_module.keys ():
-                    read_module[modname] (f, data)
+    if os.path.getsize (fname) == 0: return data
+    with open (fname, 'rb') as f:
+        with mmap.mmap (f.fileno (), 0, access=mmap.ACCESS_READ) as buf:
+            for modname, start, stop in index_molcas_logfile (buf):
+                if modname in scan_module:
+                    scan_module[modname][0] (buf, start, stop, data)
     return data
 
+def summarize_molcas_logfiles (fnames, outfile=None, nproc=1):
+    ''' Parse many OpenMolcas logfiles (in nproc processes) into a columnar
+    summary. For each quantity key (e.g., 'e_rasscf', 'angrad') of
+    read_molcas_logfile, the summary holds three flat arrays over all
+    records of all files:
+        key : the flattened values
+        key_size : the number of values of each record
+        key_file : the index into 'fnames' of the file of each record
+    The summary is also saved to outfile with np.savez if provided. '''
+    fnames = [str (fname) for fname in fnames]
+    if nproc > 1 and len (fnames) > 1:
+        with ProcessPoolExecutor (max_workers=nproc) as pool:
+            results = list (pool.map (read_molcas_logfile, fnames,
+                chunksize=max (1, len (fnames) // (4*nproc))))
+    else:
+        results = [read_molcas_logfile (fname) for fname in fnames]
+    summary = {'fnames': np.asarray (fnames)}
+    keys = sorted (set (key for data in results for key in data))
+    for key in keys:
+        vals, size, ifile = [], [], []
+        for i, data in enumerate (results):
+            for rec in data.get (key, []):
+                rec = np.ravel (rec).astype (float)
+                vals.append (rec)
+                size.append (rec.size)
+                ifile.append (i)
+        summary[key] = np.concatenate (vals) if vals else np.zeros (0)
+        summary[key+'_size'] = np.asarray (size, dtype=int)
+        summary[key+'_file'] = np.asarray (ifile, dtype=int)
+    if outfile is not None: np.savez (outfile, **summary)
+    return summary